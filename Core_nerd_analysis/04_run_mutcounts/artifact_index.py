@@ -0,0 +1,245 @@
+"""
+artifact_index.py
+Index of the mut_count artifacts (per-read histograms and profiles) in nerd.sqlite.
+
+`parse_per_read_hist` in SFig3_MutsPerRead/muts_per_read.ipynb finds the
+histograms of an fmod run by trying the stored `probe_fmod_runs.output_dir`
+(a cluster path) and its variants below the pipeline / repository roots, one
+`Path.exists()` per candidate and run. This script scans
+mut_count/mut_count___cfg-*/artifacts/* once and writes one row per sample
+directory and valtype to the `mutcount_artifacts` table:
+
+    fmod_run_id         probe_fmod_runs.id whose output_dir ends in the same
+                        mut_count/<run>/artifacts/<sample> (NULL if none)
+    run, sample_name, valtype
+    rel_dir             <run>/artifacts/<sample>
+    hist_path           per_read_histogram.txt (modrate) / .txtga (modrateGA)
+    profile_path        <sample>_<sample>_profile.txt / .txtga
+                        (paths relative to the database directory when below it)
+    mut0, mut1, mut2    fraction of reads with 0 / 1 / 2 mutations
+    n_bins              number of histogram bins
+    hist_mtime_ns, hist_size, profile_mtime_ns, profile_size
+
+Reruns only re-read histograms whose mtime or size changed, drop rows of
+files that are gone, and re-resolve fmod_run_id, so per-read QC over all
+samples is one join:
+
+    SELECT r.id, s.sample_name, a.mut0, a.mut1, a.mut2
+    FROM probe_fmod_runs r
+    JOIN sequencing_samples s ON s.id = r.s_id
+    JOIN mutcount_artifacts a ON a.fmod_run_id = r.id AND a.valtype = 'modrate'
+
+Usage:
+    python Core_nerd_analysis/04_run_mutcounts/artifact_index.py \\
+        --db Core_nerd_analysis/nerd.sqlite \\
+        --mut-count Core_nerd_analysis/04_run_mutcounts/mut_count
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sqlite3
+import time
+from pathlib import Path, PurePath
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from profile_ingest import VALTYPES
+
+
+ARTIFACT_TABLE = "mutcount_artifacts"
+HIST_NAME = "per_read_histogram"
+BINS = (0, 1, 2)
+
+STAT_FIELDS = ("hist_mtime_ns", "hist_size", "profile_mtime_ns", "profile_size")
+FIELDS = (
+    "run", "sample_name", "valtype", "rel_dir", "hist_path", "profile_path",
+    *(f"mut{b}" for b in BINS), "n_bins", *STAT_FIELDS,
+)
+
+CREATE_SQL = f"""
+CREATE TABLE IF NOT EXISTS {ARTIFACT_TABLE} (
+    id               INTEGER PRIMARY KEY,
+    fmod_run_id      INTEGER,
+    run              TEXT NOT NULL,
+    sample_name      TEXT NOT NULL,
+    valtype          TEXT NOT NULL,
+    rel_dir          TEXT NOT NULL,
+    hist_path        TEXT,
+    profile_path     TEXT,
+    mut0             REAL,
+    mut1             REAL,
+    mut2             REAL,
+    n_bins           INTEGER,
+    hist_mtime_ns    INTEGER,
+    hist_size        INTEGER,
+    profile_mtime_ns INTEGER,
+    profile_size     INTEGER,
+    UNIQUE (rel_dir, valtype)
+)
+"""
+INDEX_SQL = (
+    f"CREATE INDEX IF NOT EXISTS idx_{ARTIFACT_TABLE}_fmod_run ON {ARTIFACT_TABLE} (fmod_run_id, valtype)",
+    f"CREATE INDEX IF NOT EXISTS idx_{ARTIFACT_TABLE}_sample ON {ARTIFACT_TABLE} (sample_name, valtype)",
+)
+
+
+# ------------------------------------------------------------------------
+# Scanning
+# ------------------------------------------------------------------------
+def _stat(entry: Optional[os.DirEntry]) -> Tuple[Optional[int], Optional[int]]:
+    if entry is None:
+        return None, None
+    st = entry.stat()
+    return st.st_mtime_ns, st.st_size
+
+
+def scan(mut_count_dir: str | Path) -> Iterator[Dict[str, object]]:
+    """One record (paths + stat, no parsing) per artifacts/<sample> directory and valtype."""
+    root = Path(mut_count_dir)
+    for run in sorted(p for p in root.glob("mut_count___cfg-*") if p.is_dir()):
+        artifacts = run / "artifacts"
+        if not artifacts.is_dir():
+            continue
+        for sample_dir in sorted(p for p in artifacts.iterdir() if p.is_dir()):
+            entries = {e.name: e for e in os.scandir(sample_dir) if e.is_file()}
+            profile = f"{sample_dir.name}_{sample_dir.name}_profile"
+            for suffix, valtype in VALTYPES.items():
+                hist, prof = entries.get(HIST_NAME + suffix), entries.get(profile + suffix)
+                if hist is None and prof is None:
+                    continue
+                (hist_mtime, hist_size), (prof_mtime, prof_size) = _stat(hist), _stat(prof)
+                yield {
+                    "run": run.name,
+                    "sample_name": sample_dir.name,
+                    "valtype": valtype,
+                    "rel_dir": f"{run.name}/artifacts/{sample_dir.name}",
+                    "hist_file": Path(hist.path) if hist else None,
+                    "profile_file": Path(prof.path) if prof else None,
+                    "hist_mtime_ns": hist_mtime,
+                    "hist_size": hist_size,
+                    "profile_mtime_ns": prof_mtime,
+                    "profile_size": prof_size,
+                }
+
+
+def read_bins(path: str | Path) -> Tuple[List[float], int]:
+    """Frequencies of BINS (0 if absent) and the number of bins of one per-read histogram."""
+    freq: Dict[int, float] = {}
+    with open(path) as fh:
+        header = fh.readline().rstrip("\r\n").split("\t")
+        i_bin, i_freq = header.index("bin_left"), header.index("frequency")
+        for line in fh:
+            fields = line.rstrip("\r\n").split("\t")
+            if len(fields) > max(i_bin, i_freq):
+                freq[int(float(fields[i_bin]))] = float(fields[i_freq])
+    return [freq.get(b, 0.0) for b in BINS], len(freq)
+
+
+def _rel(path: Optional[Path], base: Path) -> Optional[str]:
+    if path is None:
+        return None
+    path = path.resolve()
+    try:
+        return path.relative_to(base).as_posix()
+    except ValueError:
+        return str(path)
+
+
+def output_dir_key(output_dir: str) -> Optional[str]:
+    """<run>/artifacts/<sample> part of a stored output_dir (after the last `mut_count`)."""
+    parts = PurePath(output_dir.replace("\\", "/")).parts
+    if "mut_count" not in parts:
+        return None
+    last = max(i for i, part in enumerate(parts) if part == "mut_count")
+    return "/".join(parts[last + 1:]) or None
+
+
+# ------------------------------------------------------------------------
+# nerd.sqlite
+# ------------------------------------------------------------------------
+def _fmod_run_ids(conn: sqlite3.Connection) -> Dict[str, int]:
+    """rel_dir -> probe_fmod_runs.id (lowest id if several runs share a directory)."""
+    has_table = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'probe_fmod_runs'"
+    ).fetchone()
+    if not has_table:
+        return {}
+    out: Dict[str, int] = {}
+    for run_id, output_dir in conn.execute("SELECT id, output_dir FROM probe_fmod_runs ORDER BY id DESC"):
+        key = output_dir_key(output_dir) if output_dir else None
+        if key is not None:
+            out[key] = run_id
+    return out
+
+
+def update_index(db_path: str | Path, mut_count_dir: str | Path, full: bool = False) -> Dict[str, int]:
+    """Bring mutcount_artifacts up to date with mut_count_dir; returns row counts."""
+    db_path = Path(db_path)
+    base = db_path.resolve().parent
+    conn = sqlite3.connect(str(db_path))
+    try:
+        with conn:
+            conn.execute(CREATE_SQL)
+            for sql in INDEX_SQL:
+                conn.execute(sql)
+            known = {
+                (row[0], row[1]): row[2:]
+                for row in conn.execute(f"SELECT rel_dir, valtype, {', '.join(STAT_FIELDS)} FROM {ARTIFACT_TABLE}")
+            }
+            run_ids = _fmod_run_ids(conn)
+
+            seen, changed = set(), []
+            for rec in scan(mut_count_dir):
+                key = (rec["rel_dir"], rec["valtype"])
+                seen.add(key)
+                if not full and known.get(key) == tuple(rec[f] for f in STAT_FIELDS):
+                    continue
+                bins, n_bins = read_bins(rec["hist_file"]) if rec["hist_file"] else ([None] * len(BINS), None)
+                rec.update({f"mut{b}": v for b, v in zip(BINS, bins)}, n_bins=n_bins)
+                rec["hist_path"] = _rel(rec.pop("hist_file"), base)
+                rec["profile_path"] = _rel(rec.pop("profile_file"), base)
+                changed.append(tuple(rec[f] for f in FIELDS))
+
+            gone = [key for key in known if key not in seen]
+            conn.executemany(f"DELETE FROM {ARTIFACT_TABLE} WHERE rel_dir = ? AND valtype = ?", gone)
+            conn.executemany(
+                f"INSERT INTO {ARTIFACT_TABLE} ({', '.join(FIELDS)}) VALUES ({', '.join('?' * len(FIELDS))}) "
+                f"ON CONFLICT (rel_dir, valtype) DO UPDATE SET "
+                + ", ".join(f"{f} = excluded.{f}" for f in FIELDS if f not in ("rel_dir", "valtype")),
+                changed,
+            )
+            conn.execute(f"UPDATE {ARTIFACT_TABLE} SET fmod_run_id = NULL")
+            conn.executemany(
+                f"UPDATE {ARTIFACT_TABLE} SET fmod_run_id = ? WHERE rel_dir = ?",
+                [(run_id, key) for key, run_id in run_ids.items()],
+            )
+            linked = conn.execute(f"SELECT COUNT(*) FROM {ARTIFACT_TABLE} WHERE fmod_run_id IS NOT NULL").fetchone()[0]
+            total = conn.execute(f"SELECT COUNT(*) FROM {ARTIFACT_TABLE}").fetchone()[0]
+    finally:
+        conn.close()
+    return {"rows": total, "updated": len(changed), "removed": len(gone), "linked": linked}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Index mut_count per-read histograms / profiles in nerd.sqlite.")
+    ap.add_argument("--db", required=True, type=Path, help="Path to nerd.sqlite")
+    ap.add_argument("--mut-count", type=Path, default=Path(__file__).resolve().parent / "mut_count",
+                    help="Directory with the mut_count___cfg-* runs")
+    ap.add_argument("--full", action="store_true", help="Re-read every histogram, not only changed ones")
+    args = ap.parse_args()
+
+    if not args.db.exists():
+        ap.error(f"Database not found: {args.db}")
+    if not args.mut_count.is_dir():
+        ap.error(f"Not a directory: {args.mut_count}")
+    t0 = time.perf_counter()
+    counts = update_index(args.db, args.mut_count, full=args.full)
+    print(
+        f"{ARTIFACT_TABLE}: {counts['rows']} rows ({counts['updated']} updated, {counts['removed']} removed, "
+        f"{counts['linked']} linked to probe_fmod_runs) in {time.perf_counter() - t0:.1f} s"
+    )
+
+
+if __name__ == "__main__":
+    main()
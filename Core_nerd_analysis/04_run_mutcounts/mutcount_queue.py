@@ -0,0 +1,431 @@
+"""
+mutcount_queue.py
+Local work queue for the ShapeMapper runs of `nerd run mut_count`.
+
+make_mutcount_and_submit.sh submits one sbatch job per reaction group
+(CPUS=4, MEM=8G, TIME=4:00:00) and every job runs the ShapeMapper samples of
+its group one after the other. This script schedules the individual samples
+of all groups in reaction_groups.txt on one machine instead:
+
+    - every sample is one ShapeMapper call with --nproc `n_proc` (config
+      `params.n_proc`, or --threads-per-sample); --cores // n_proc samples
+      run at the same time, largest FASTQ input first
+    - a sample is skipped when both profiles
+      (artifacts/<sample>/<sample>_<sample>_profile.txt / .txtga) exist and
+      have one row per target nucleotide, so a rerun (or a rerun after a new
+      sequencing run was added to the sample sheet) only queues what is
+      missing or incomplete
+    - every finished sample appends a row (status, runtime, input MB, MB/s)
+      to mut_count/queue_log.tsv; the parent thread is the only writer
+
+Samples come from a sample sheet (TSV: reaction_group, sample_name, r1, r2,
+target, run_dir), since `nerd` resolves reaction groups to samples in its
+own database. `--sheet-from-logs` writes the sheet for the existing runs
+from the run-level command.log files (FASTQ paths, target FASTA) and the
+slurm logs (reaction group -> mut_count___cfg-<hash>). Rows without run_dir
+(e.g. the samples of a new sequencing run) go to the group's existing run
+directory from the slurm logs, the one nerd and profile_ingest.py read for
+that group; a group without one needs run_dir in the sheet.
+
+ShapeMapper arguments follow the logged commands (`--amplicon --dms --N7
+--bypass_filters --per-read-histograms`); every sample also gets its own
+--temp directory and --log file, since concurrent runs in one run directory
+would otherwise share shapemapper_temp/. The sample's console output goes to
+artifacts/<sample>/command.log. Loading the profiles into nerd.sqlite is
+left to `nerd` / profile_ingest.py.
+
+Usage:
+    # one-time: sample sheet of the existing runs
+    python Core_nerd_analysis/04_run_mutcounts/mutcount_queue.py \\
+        Core_nerd_analysis/04_run_mutcounts/reaction_groups.txt \\
+        --sheet-from-logs Core_nerd_analysis/04_run_mutcounts/samples.tsv
+
+    python Core_nerd_analysis/04_run_mutcounts/mutcount_queue.py \\
+        Core_nerd_analysis/04_run_mutcounts/reaction_groups.txt \\
+        --samples Core_nerd_analysis/04_run_mutcounts/samples.tsv --cores 32
+
+`--bin` replaces the configured ShapeMapper binary (e.g. with a fake one for
+testing; tests/test_mutcount_queue.py), `--dry-run` only lists the queued commands.
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import os
+import re
+import shlex
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import yaml
+
+
+_HERE = Path(__file__).resolve().parent
+
+SHEET_FIELDS = ("reaction_group", "sample_name", "r1", "r2", "target", "run_dir")
+LOG_FIELDS = (
+    "reaction_group", "sample_name", "run_dir", "status", "returncode",
+    "started", "runtime_s", "n_proc", "input_mb", "mb_per_s",
+)
+QUEUE_LOG = "queue_log.tsv"
+
+# config params -> ShapeMapper flags (as in the command.log of the existing runs)
+PARAM_FLAGS = {
+    "amplicon": ["--amplicon"],
+    "dms_mode": ["--dms"],
+    "output_N7": ["--N7", "--bypass_filters"],
+    "per_read_histograms": ["--per-read-histograms"],
+}
+
+
+@dataclass
+class SampleJob:
+    reaction_group: str
+    sample_name: str
+    r1: str
+    r2: str
+    target: str
+    run_dir: Path
+    command: List[str] = field(default_factory=list)
+    n_proc: int = 1
+
+    @property
+    def out_dir(self) -> Path:
+        return self.run_dir / "artifacts" / self.sample_name
+
+    def profile(self, suffix: str) -> Path:
+        return self.out_dir / f"{self.sample_name}_{self.sample_name}_profile{suffix}"
+
+    @property
+    def input_bytes(self) -> int:
+        return sum(os.path.getsize(p) for p in (self.r1, self.r2) if p and os.path.exists(p))
+
+
+# ------------------------------------------------------------------------
+# Config and sample sheet
+# ------------------------------------------------------------------------
+def read_groups(path: str | Path) -> List[str]:
+    """Reaction groups, one per line (sorted and unique, as `sort -u` in the sbatch script)."""
+    with open(path) as fh:
+        return sorted({line.strip() for line in fh if line.strip()})
+
+
+def load_config(path: str | Path) -> Dict[str, Any]:
+    """The `mut_count` section of a 04_run_mutcounts config."""
+    with open(path) as fh:
+        cfg = yaml.safe_load(fh)
+    if "mut_count" not in cfg:
+        raise ValueError(f"{path}: no mut_count section")
+    return cfg["mut_count"]
+
+
+def group_config(group: str, configs_dir: Path, template: Optional[Path] = None) -> Dict[str, Any]:
+    """configs/mutcount_<group>.yaml, written from `template` (RXNGROUP -> group) if given."""
+    path = configs_dir / f"mutcount_{group}.yaml"
+    if template is not None:
+        configs_dir.mkdir(parents=True, exist_ok=True)
+        path.write_text(template.read_text().replace("RXNGROUP", group))
+    if not path.exists():
+        raise FileNotFoundError(f"No config for reaction group {group}: {path}")
+    return load_config(path)
+
+
+def read_sheet(path: str | Path) -> List[Dict[str, str]]:
+    with open(path, newline="") as fh:
+        rows = list(csv.DictReader(fh, delimiter="\t"))
+    missing = [f for f in SHEET_FIELDS[:-1] if rows and f not in rows[0]]
+    if missing:
+        raise ValueError(f"{path}: missing sample sheet columns {missing}")
+    return rows
+
+
+def write_tsv(path: str | Path, rows: Sequence[Dict[str, Any]], fields: Sequence[str], append: bool = False) -> None:
+    path = Path(path)
+    new = not (append and path.exists())
+    with open(path, "a" if append else "w", newline="") as fh:
+        writer = csv.DictWriter(fh, fieldnames=list(fields), delimiter="\t", extrasaction="ignore")
+        if new:
+            writer.writeheader()
+        writer.writerows(rows)
+
+
+# ------------------------------------------------------------------------
+# Sample sheet of the existing runs
+# ------------------------------------------------------------------------
+_SECTION = re.compile(r"^# (\d+) - (.+)$")
+
+
+def parse_command_log(path: str | Path) -> List[Dict[str, str]]:
+    """Samples (FASTQ inputs, target sequence) of a run-level nerd command.log."""
+    samples: List[Dict[str, str]] = []
+    section = None
+    cur: Dict[str, Any] = {}
+    with open(path, errors="replace") as fh:
+        for line in fh:
+            line = line.rstrip("\n")
+            m = _SECTION.match(line)
+            if m:
+                section = m.group(1)
+                if section == "3":
+                    cur = {"fastq": [], "target": ""}
+                    samples.append(cur)
+                continue
+            if line.startswith("#####") or not cur:
+                continue
+            if section == "3" and line.split() and line.split()[-1].endswith((".fastq.gz", ".fastq", ".fq.gz", ".fq")):
+                cur["fastq"].append(line.split()[-1])
+            elif section == "4":
+                if line.startswith(">"):
+                    cur["sample_name"] = line[1:].strip()
+                elif line.strip():
+                    cur["target"] += line.strip()
+    out = []
+    for s in samples:
+        r1 = next((p for p in s["fastq"] if "_R1" in Path(p).name), s["fastq"][0] if s["fastq"] else "")
+        r2 = next((p for p in s["fastq"] if "_R2" in Path(p).name), "")
+        if s.get("sample_name"):
+            out.append({"sample_name": s["sample_name"], "r1": r1, "r2": r2, "target": s["target"]})
+    return out
+
+
+def group_run_dirs(slurm_logs: Path, mut_count_dir: Path) -> Dict[str, str]:
+    """Reaction group -> mut_count___cfg-<hash> from the slurm logs (latest job that names an existing run)."""
+    runs = {p.name[-7:]: p.name for p in mut_count_dir.glob("mut_count___cfg-*")}
+    found: Dict[str, tuple] = {}
+    for path in slurm_logs.glob("mutcount_*.out"):
+        m = re.match(r"mutcount_(.+)\.(\d+)\.out$", path.name)
+        if not m:
+            continue
+        text = re.sub(r"\s+", "", path.read_text(errors="replace"))
+        hashes = re.findall(r"mut_count___cfg-([0-9a-f]{7})", text) + re.findall(r"cfg=([0-9a-f]{7})", text)
+        hit = next((runs[h] for h in hashes if h in runs), None)
+        job = int(m.group(2))
+        if hit and job > found.get(m.group(1), (-1, None))[0]:
+            found[m.group(1)] = (job, hit)
+    return {group: run for group, (_job, run) in found.items()}
+
+
+def sheet_from_logs(groups: Sequence[str], mut_count_dir: Path, slurm_logs: Path) -> List[Dict[str, str]]:
+    run_dirs = group_run_dirs(slurm_logs, mut_count_dir)
+    rows = []
+    for group in groups:
+        run = run_dirs.get(group)
+        if run is None:
+            print(f"[sheet] no run directory found for reaction group {group}")
+            continue
+        for sample in parse_command_log(mut_count_dir / run / "command.log"):
+            rows.append({"reaction_group": group, **sample, "run_dir": run})
+    return rows
+
+
+# ------------------------------------------------------------------------
+# Jobs
+# ------------------------------------------------------------------------
+def resolve_binary(binary: str) -> str:
+    """Absolute path of a relative executable path (ShapeMapper runs with cwd=run_dir); PATH names unchanged."""
+    if os.sep in binary and not os.path.isabs(binary):
+        return str(Path(binary).resolve())
+    return binary
+
+
+def shapemapper_command(job: SampleJob, binary: str, params: Dict[str, Any]) -> List[str]:
+    """ShapeMapper argv (run from job.run_dir)."""
+    out = f"artifacts/{job.sample_name}"
+    cmd = [
+        binary, "--name", job.sample_name, "--target", f"{out}/target.fa", "--out", out,
+        "--temp", f"{out}/shapemapper_temp", "--log", f"{out}/{job.sample_name}_shapemapper_log.txt",
+        "--nproc", str(job.n_proc), "--modified", "--R1", job.r1,
+    ]
+    if job.r2:
+        cmd += ["--R2", job.r2]
+    for key, flags in PARAM_FLAGS.items():
+        if params.get(key):
+            cmd += flags
+    return cmd
+
+
+def profile_rows(path: Path) -> Optional[int]:
+    """Data rows of a profile file, or None if it is missing or has no profile header."""
+    try:
+        with open(path) as fh:
+            if not fh.readline().startswith("Nucleotide\t"):
+                return None
+            return sum(1 for line in fh if line.strip())
+    except OSError:
+        return None
+
+
+def is_complete(job: SampleJob) -> bool:
+    """Both profiles present with one row per target nucleotide (any rows if the target is unknown)."""
+    for suffix in (".txt", ".txtga"):
+        n = profile_rows(job.profile(suffix))
+        if n is None or n == 0 or (job.target and n != len(job.target)):
+            return False
+    return True
+
+
+def build_jobs(
+    groups: Sequence[str],
+    sheet: Sequence[Dict[str, str]],
+    configs_dir: Path,
+    mut_count_dir: Path,
+    template: Optional[Path] = None,
+    binary: Optional[str] = None,
+    threads_per_sample: Optional[int] = None,
+    run_dirs: Optional[Dict[str, str]] = None,
+) -> List[SampleJob]:
+    """
+    One SampleJob per sheet row of `groups`. Rows without run_dir use the group's
+    run directory in `run_dirs` (group_run_dirs); ValueError if there is none.
+    """
+    by_group: Dict[str, List[Dict[str, str]]] = {}
+    for row in sheet:
+        by_group.setdefault(row["reaction_group"], []).append(row)
+    run_dirs = run_dirs or {}
+    unplaced = sorted({
+        g for g in groups for row in by_group.get(g, []) if not row.get("run_dir") and g not in run_dirs
+    })
+    if unplaced:
+        raise ValueError(
+            f"No run directory for reaction group(s) {', '.join(unplaced)}: add run_dir to the sample sheet "
+            f"(no mut_count___cfg-* run of these groups in the slurm logs)"
+        )
+    jobs = []
+    for group in groups:
+        if group not in by_group:
+            print(f"[queue] reaction group {group} has no samples in the sheet")
+            continue
+        cfg = group_config(group, configs_dir, template)
+        params = cfg.get("params") or {}
+        exe = resolve_binary(binary or (cfg.get("tool") or {}).get("bin") or "shapemapper")
+        for row in by_group[group]:
+            job = SampleJob(
+                reaction_group=group,
+                sample_name=row["sample_name"],
+                r1=row["r1"],
+                r2=row.get("r2") or "",
+                target=(row.get("target") or "").strip(),
+                run_dir=mut_count_dir / (row.get("run_dir") or run_dirs[group]),
+                n_proc=int(threads_per_sample or params.get("n_proc") or 1),
+            )
+            job.command = shapemapper_command(job, exe, params)
+            jobs.append(job)
+    return jobs
+
+
+def run_sample(job: SampleJob) -> Dict[str, Any]:
+    """Run ShapeMapper for one sample; returns its queue_log row."""
+    job.out_dir.mkdir(parents=True, exist_ok=True)
+    if job.target:
+        (job.out_dir / "target.fa").write_text(f">{job.sample_name}\n{job.target}\n")
+    started = time.time()
+    t0 = time.perf_counter()
+    with open(job.out_dir / "command.log", "w") as log:
+        log.write(f"Command: {shlex.join(job.command)}\n")
+        log.flush()
+        try:
+            rc = subprocess.run(job.command, cwd=job.run_dir, stdout=log, stderr=subprocess.STDOUT).returncode
+        except OSError as exc:
+            log.write(f"{exc}\n")
+            rc = -1
+    runtime = time.perf_counter() - t0
+    input_mb = job.input_bytes / 1e6
+    status = "done" if rc == 0 and is_complete(job) else "failed"
+    return {
+        "reaction_group": job.reaction_group,
+        "sample_name": job.sample_name,
+        "run_dir": job.run_dir.name,
+        "status": status,
+        "returncode": rc,
+        "started": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started)),
+        "runtime_s": round(runtime, 2),
+        "n_proc": job.n_proc,
+        "input_mb": round(input_mb, 2),
+        "mb_per_s": round(input_mb / runtime, 3) if runtime > 0 else None,
+    }
+
+
+def run_queue(jobs: Sequence[SampleJob], workers: int, log_path: Path) -> List[Dict[str, Any]]:
+    """Run jobs on `workers` threads (largest input first); append each result to log_path."""
+    results = []
+    ordered = sorted(jobs, key=lambda j: j.input_bytes, reverse=True)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(run_sample, job): job for job in ordered}
+        for i, fut in enumerate(as_completed(futures), 1):
+            row = fut.result()
+            results.append(row)
+            write_tsv(log_path, [row], LOG_FIELDS, append=True)
+            print(
+                f"[{i}/{len(ordered)}] {row['sample_name']}: {row['status']} "
+                f"({row['runtime_s']:.1f} s, {row['input_mb']:.1f} MB)"
+            )
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Run the ShapeMapper samples of mut_count reaction groups on a local queue.")
+    ap.add_argument("groups", type=Path, help="Reaction groups, one per line (reaction_groups.txt)")
+    ap.add_argument("--samples", type=Path, help="Sample sheet (TSV: reaction_group, sample_name, r1, r2, target, run_dir)")
+    ap.add_argument("--sheet-from-logs", type=Path, metavar="OUT",
+                    help="Write the sample sheet of the existing runs (command.log + slurm logs) and exit")
+    ap.add_argument("--configs", type=Path, default=_HERE / "configs", help="Directory with mutcount_<group>.yaml")
+    ap.add_argument("--template", type=Path, help="Write configs from this template (RXNGROUP -> group) first")
+    ap.add_argument("--mut-count", type=Path, default=_HERE / "mut_count", help="Directory with the run directories")
+    ap.add_argument("--slurm-logs", type=Path, default=_HERE / "slurm_logs")
+    ap.add_argument("--cores", type=int, default=os.cpu_count() or 1, help="Cores to pack samples onto")
+    ap.add_argument("--threads-per-sample", type=int, help="ShapeMapper --nproc (default: config params.n_proc)")
+    ap.add_argument("--bin", help="ShapeMapper executable (overrides the config's tool.bin)")
+    ap.add_argument("--force", action="store_true", help="Rerun complete samples too")
+    ap.add_argument("--dry-run", action="store_true", help="List the queued samples and commands only")
+    args = ap.parse_args()
+
+    groups = read_groups(args.groups)
+    if args.sheet_from_logs is not None:
+        rows = sheet_from_logs(groups, args.mut_count, args.slurm_logs)
+        write_tsv(args.sheet_from_logs, rows, SHEET_FIELDS)
+        print(f"Wrote {len(rows)} samples of {len({r['reaction_group'] for r in rows})} groups to {args.sheet_from_logs}")
+        return
+    if args.samples is None:
+        ap.error("--samples is required (or write one with --sheet-from-logs)")
+
+    sheet = read_sheet(args.samples)
+    run_dirs = group_run_dirs(args.slurm_logs, args.mut_count) if any(not r.get("run_dir") for r in sheet) else {}
+    try:
+        jobs = build_jobs(
+            groups, sheet, args.configs, args.mut_count, template=args.template,
+            binary=args.bin,
+            threads_per_sample=args.threads_per_sample, run_dirs=run_dirs,
+        )
+    except ValueError as exc:
+        ap.error(str(exc))
+    queued = jobs if args.force else [j for j in jobs if not is_complete(j)]
+    n_proc = max((j.n_proc for j in queued or jobs), default=1)
+    workers = max(1, args.cores // n_proc)
+    print(f"{len(jobs)} samples, {len(jobs) - len(queued)} complete, {len(queued)} queued "
+          f"on {workers} worker(s) x {n_proc} thread(s)")
+    if args.dry_run:
+        for job in queued:
+            print(f"[{job.run_dir.name}] {shlex.join(job.command)}")
+        return
+    if not queued:
+        return
+
+    t0 = time.perf_counter()
+    results = run_queue(queued, workers, args.mut_count / QUEUE_LOG)
+    wall = time.perf_counter() - t0
+    done = [r for r in results if r["status"] == "done"]
+    busy = sum(r["runtime_s"] for r in results)
+    print(f"{len(done)}/{len(results)} samples done in {wall:.1f} s wall "
+          f"({busy:.1f} s summed, {sum(r['input_mb'] for r in done) / wall:.2f} MB/s); log: {args.mut_count / QUEUE_LOG}")
+    failed = [r["sample_name"] for r in results if r["status"] != "done"]
+    if failed:
+        raise SystemExit(f"Failed samples (see artifacts/<sample>/command.log): {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
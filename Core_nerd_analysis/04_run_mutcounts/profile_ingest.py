@@ -0,0 +1,392 @@
+"""
+profile_ingest.py
+Columnar store (and nerd.sqlite table) for the ShapeMapper profiles of the mut_count runs.
+
+Every mut_count___cfg-<hash> run keeps one wide TSV per sample and valtype:
+
+    artifacts/<sample>/<sample>_<sample>_profile.txt     modrate
+    artifacts/<sample>/<sample>_<sample>_profile.txtga   modrateGA
+
+(Nucleotide, Sequence, {Modified,Untreated,Denatured}_{mutations,read_depth,
+effective_depth,rate,...}, Reactivity_profile, ...). Recomputing fmod values or
+QC from these re-tokenizes every file with pandas. This script streams each
+file once into one .npz with one typed array per column, concatenated over
+all profiles (one chunk per sample and valtype):
+
+    run, sample_name, valtype, path     (n_profiles,)
+    offsets                             (n_profiles + 1,) chunk bounds
+    Nucleotide                          int32
+    Sequence                            S1 (case kept: lower case = excluded)
+    *_mutations, *_depth                int32, -1 if the column is missing
+    *_rate, *_profile, *_stderr, ...    float32, NaN if missing
+    columns                             stored profile columns in file order
+    has_column                          (n_profiles, n_columns) column present in the file
+
+Columns are the union over all files (newer ShapeMapper runs add
+Norm_profile / Norm_stderr). The store is written uncompressed by default, so
+`ProfileStore` memory-maps the columns it is asked for straight from the
+archive and never reads the others; `--compress` writes a deflated store
+instead (about 10x smaller; columns are then decompressed on first use).
+
+With `--db` the same rows are bulk-loaded into the `mutcount_profiles`
+table of nerd.sqlite in a single transaction (rows of the ingested samples
+are replaced).
+
+Usage:
+    python Core_nerd_analysis/04_run_mutcounts/profile_ingest.py \\
+        --mut-count Core_nerd_analysis/04_run_mutcounts/mut_count \\
+        --out Core_nerd_analysis/04_run_mutcounts/mutcount_profiles.npz \\
+        --db Core_nerd_analysis/nerd.sqlite
+
+    from profile_ingest import ProfileStore
+
+    store = ProfileStore('mutcount_profiles.npz')
+    df = store.frame(['Modified_mutations', 'Modified_effective_depth'], valtype='modrate')
+    chunk = store.sample('001-HIV-C30U-25c-a-1-p', 'modrateGA')
+"""
+
+from __future__ import annotations
+
+import argparse
+import sqlite3
+import time
+import zipfile
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+STORE_VERSION = 1
+PROFILE_TABLE = "mutcount_profiles"
+
+# File suffix -> valtype (as in probe_fmod_values / the per-read histograms)
+VALTYPES = {".txt": "modrate", ".txtga": "modrateGA"}
+KEY_FIELDS = ("run", "sample_name", "valtype", "path")
+INT_MISSING = -1
+
+
+def column_dtype(name: str) -> np.dtype:
+    """Storage dtype of one profile column."""
+    if name == "Nucleotide":
+        return np.dtype(np.int32)
+    if name == "Sequence":
+        return np.dtype("S1")
+    if name.endswith(("_mutations", "_depth")):
+        return np.dtype(np.int32)
+    return np.dtype(np.float32)
+
+
+def _missing(dtype: np.dtype):
+    if dtype.kind == "i":
+        return INT_MISSING
+    if dtype.kind == "S":
+        return b"N"
+    return np.nan
+
+
+# ------------------------------------------------------------------------
+# Discovery and parsing
+# ------------------------------------------------------------------------
+def find_profiles(mut_count_dir: str | Path) -> List[Tuple[str, str, str, Path]]:
+    """(run, sample_name, valtype, path) of every profile below a mut_count directory."""
+    found = []
+    for path in sorted(Path(mut_count_dir).glob("*/artifacts/*/*_profile.txt*")):
+        valtype = VALTYPES.get(path.suffix)
+        if valtype is None:
+            continue
+        sample_dir = path.parent
+        found.append((sample_dir.parent.parent.name, sample_dir.name, valtype, path))
+    return found
+
+
+def read_profile(path: str | Path) -> Dict[str, np.ndarray]:
+    """One profile TSV as {column: typed array}."""
+    with open(path, newline="") as fh:
+        header = fh.readline().rstrip("\r\n").split("\t")
+        rows = [line.rstrip("\r\n").split("\t") for line in fh if line.strip()]
+    if not rows:
+        return {name: np.zeros(0, dtype=column_dtype(name)) for name in header}
+    columns = list(zip(*rows))
+    if len(columns) != len(header):
+        raise ValueError(f"{path}: {len(header)} header fields but {len(columns)} data columns")
+    out: Dict[str, np.ndarray] = {}
+    for name, values in zip(header, columns):
+        dtype = column_dtype(name)
+        if dtype.kind == "S":
+            out[name] = np.array(values, dtype=dtype)
+        elif dtype.kind == "i":
+            raw = np.array(values, dtype=np.float64)
+            out[name] = np.where(np.isnan(raw), INT_MISSING, raw).astype(dtype)
+        else:
+            out[name] = np.array(values, dtype=np.float64).astype(dtype)
+    return out
+
+
+# ------------------------------------------------------------------------
+# Writing
+# ------------------------------------------------------------------------
+def build_store(profiles: Sequence[Tuple[str, str, str, Path]]) -> Dict[str, np.ndarray]:
+    """Parse all profiles (each file once) into the store arrays."""
+    chunks: List[Dict[str, np.ndarray]] = []
+    columns: List[str] = []
+    for _run, _sample, _valtype, path in profiles:
+        chunk = read_profile(path)
+        chunks.append(chunk)
+        columns.extend(c for c in chunk if c not in columns)
+
+    lengths = [len(next(iter(c.values()))) if c else 0 for c in chunks]
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    arrays: Dict[str, np.ndarray] = {}
+    for name in columns:
+        dtype = column_dtype(name)
+        col = np.full(int(offsets[-1]), _missing(dtype), dtype=dtype)
+        for i, chunk in enumerate(chunks):
+            if name in chunk:
+                col[offsets[i]:offsets[i + 1]] = chunk[name]
+        arrays[name] = col
+
+    for i, field in enumerate(KEY_FIELDS):
+        arrays[field] = np.array([str(p[i]) for p in profiles], dtype=str)
+    arrays.update(
+        version=np.array(STORE_VERSION),
+        columns=np.array(columns, dtype=str),
+        has_column=np.array([[c in chunk for c in columns] for chunk in chunks], dtype=bool).reshape(len(chunks), len(columns)),
+        offsets=offsets,
+    )
+    return arrays
+
+
+def write_store(path: str | Path, arrays: Dict[str, np.ndarray], compress: bool = False) -> Path:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    (np.savez_compressed if compress else np.savez)(path, **arrays)
+    return path
+
+
+# ------------------------------------------------------------------------
+# Reading
+# ------------------------------------------------------------------------
+def _mmap_member(path: Path, info: zipfile.ZipInfo) -> Optional[np.ndarray]:
+    """Memory-map one stored (uncompressed) .npy member of an .npz, or None."""
+    if info.compress_type != zipfile.ZIP_STORED:
+        return None
+    with open(path, "rb") as fh:
+        fh.seek(info.header_offset)
+        local = fh.read(30)
+        if local[:4] != b"PK\x03\x04":
+            return None
+        name_len = int.from_bytes(local[26:28], "little")
+        extra_len = int.from_bytes(local[28:30], "little")
+        fh.seek(info.header_offset + 30 + name_len + extra_len)
+        version = np.lib.format.read_magic(fh)
+        read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+        shape, fortran, dtype = read_header(fh)
+        if dtype.hasobject:
+            return None
+        offset = fh.tell()
+    if int(np.prod(shape)) == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape, order="F" if fortran else "C")
+
+
+class ProfileStore:
+    """
+    Read-only view of a profile store. Columns are memory-mapped (uncompressed
+    store) or decompressed (`--compress`) on first use and cached.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self._npz = np.load(self.path, allow_pickle=False)
+        with zipfile.ZipFile(self.path) as zf:
+            self._members = {Path(i.filename).stem: i for i in zf.infolist()}
+        self._cache: Dict[str, np.ndarray] = {}
+        version = int(self.field("version"))
+        if version > STORE_VERSION:
+            raise ValueError(f"{self.path}: profile store version {version} is newer than this reader ({STORE_VERSION})")
+        self.columns: List[str] = self.field("columns").tolist()
+        self.offsets: np.ndarray = np.asarray(self.field("offsets"))
+        self.index = pd.DataFrame({f: self.field(f) for f in KEY_FIELDS})
+        self.index["length"] = np.diff(self.offsets)
+        self._row = {key: i for i, key in enumerate(self.index[["run", "sample_name", "valtype"]].itertuples(index=False, name=None))}
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def field(self, name: str) -> np.ndarray:
+        """One stored array (see the module docstring for the layout)."""
+        if name not in self._cache:
+            arr = _mmap_member(self.path, self._members[name]) if name in self._members else None
+            self._cache[name] = self._npz[name] if arr is None else arr
+        return self._cache[name]
+
+    def rows(
+        self,
+        samples: Optional[Sequence[str] | str] = None,
+        valtype: Optional[str] = None,
+    ) -> np.ndarray:
+        """Profile (chunk) indices, optionally restricted to samples / valtype."""
+        mask = np.ones(len(self), dtype=bool)
+        if samples is not None:
+            mask &= self.index["sample_name"].isin([samples] if isinstance(samples, str) else samples).to_numpy()
+        if valtype is not None:
+            mask &= (self.index["valtype"] == valtype).to_numpy()
+        return np.flatnonzero(mask)
+
+    def _take(self, name: str, rows: np.ndarray) -> np.ndarray:
+        col = self.field(name)
+        if len(rows) == len(self):
+            return np.asarray(col)
+        return np.concatenate([col[self.offsets[i]:self.offsets[i + 1]] for i in rows]) if len(rows) else col[:0]
+
+    def frame(
+        self,
+        columns: Optional[Iterable[str]] = None,
+        samples: Optional[Sequence[str] | str] = None,
+        valtype: Optional[str] = None,
+    ) -> pd.DataFrame:
+        """Long table (one row per nucleotide) of the requested columns."""
+        columns = self.columns if columns is None else list(columns)
+        unknown = [c for c in columns if c not in self.columns]
+        if unknown:
+            raise KeyError(f"Unknown profile columns: {unknown}")
+        rows = self.rows(samples, valtype)
+        lengths = self.index["length"].to_numpy()[rows]
+        out = {f: np.repeat(self.index[f].to_numpy()[rows], lengths) for f in ("run", "sample_name", "valtype")}
+        for name in dict.fromkeys(["Nucleotide", *columns]):
+            out[name] = self._take(name, rows)
+        return pd.DataFrame(out)
+
+    def sample(
+        self,
+        sample_name: str,
+        valtype: str = "modrate",
+        columns: Optional[Iterable[str]] = None,
+        run: Optional[str] = None,
+    ) -> pd.DataFrame:
+        """
+        One profile as the original wide table (missing columns dropped).
+
+        `run` (the mut_count___cfg-<hash> directory) is required only when the
+        sample was counted in more than one run.
+        """
+        if run is None:
+            runs = [r for r, s, v in self._row if s == sample_name and v == valtype]
+            if len(runs) > 1:
+                raise KeyError(f"{sample_name} {valtype} is in several runs ({sorted(runs)}); pass run=")
+            run = runs[0] if runs else None
+        i = self._row[(run, sample_name, valtype)]
+        lo, hi = self.offsets[i], self.offsets[i + 1]
+        present = dict(zip(self.columns, self.field("has_column")[i]))
+        columns = self.columns if columns is None else list(dict.fromkeys(["Nucleotide", *columns]))
+        df = pd.DataFrame({c: np.asarray(self.field(c)[lo:hi]) for c in columns if present[c]})
+        if "Sequence" in df:
+            df["Sequence"] = df["Sequence"].str.decode("ascii")
+        return df
+
+
+# ------------------------------------------------------------------------
+# nerd.sqlite
+# ------------------------------------------------------------------------
+def _sql_name(column: str) -> str:
+    return column.lower()
+
+
+def ensure_table(conn: sqlite3.Connection, columns: Sequence[str]) -> None:
+    """Create mutcount_profiles (and add profile columns it does not have yet)."""
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {PROFILE_TABLE} (
+            id          INTEGER PRIMARY KEY,
+            run         TEXT NOT NULL,
+            sample_name TEXT NOT NULL,
+            valtype     TEXT NOT NULL,
+            nucleotide  INTEGER NOT NULL,
+            sequence    TEXT
+        )
+        """
+    )
+    # the first key index left out run, so one sample counted in two runs collided
+    conn.execute(f"DROP INDEX IF EXISTS idx_{PROFILE_TABLE}_key")
+    conn.execute(
+        f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{PROFILE_TABLE}_run_key "
+        f"ON {PROFILE_TABLE} (run, sample_name, valtype, nucleotide)"
+    )
+    have = {row[1] for row in conn.execute(f"PRAGMA table_info({PROFILE_TABLE})")}
+    for col in columns:
+        name = _sql_name(col)
+        if name not in have:
+            sql_type = "INTEGER" if column_dtype(col).kind == "i" else "REAL"
+            conn.execute(f"ALTER TABLE {PROFILE_TABLE} ADD COLUMN {name} {sql_type}")
+
+
+def _db_rows(store: ProfileStore, value_columns: Sequence[str]) -> Iterator[tuple]:
+    cols = [np.asarray(store.field(c)) for c in value_columns]
+    kinds = [column_dtype(c).kind for c in value_columns]
+    nts = np.asarray(store.field("Nucleotide"))
+    seq = np.asarray(store.field("Sequence")) if "Sequence" in store.columns else None
+    for i, (run, sample, valtype) in enumerate(store.index[["run", "sample_name", "valtype"]].itertuples(index=False)):
+        lo, hi = int(store.offsets[i]), int(store.offsets[i + 1])
+        values = []
+        for col, kind in zip(cols, kinds):
+            chunk = col[lo:hi].astype(object)
+            chunk[(col[lo:hi] == INT_MISSING) if kind == "i" else np.isnan(col[lo:hi])] = None
+            values.append(chunk)
+        bases = seq[lo:hi].astype(str) if seq is not None else [None] * (hi - lo)
+        for j in range(hi - lo):
+            yield (run, sample, valtype, int(nts[lo + j]), bases[j], *(v[j] for v in values))
+
+
+def load_db(store: ProfileStore, db_path: str | Path) -> int:
+    """Replace the rows of the stored run x sample x valtype profiles in mutcount_profiles (one transaction)."""
+    value_columns = [c for c in store.columns if c not in ("Nucleotide", "Sequence")]
+    fields = ["run", "sample_name", "valtype", "nucleotide", "sequence", *map(_sql_name, value_columns)]
+    keys = list(store.index[["run", "sample_name", "valtype"]].itertuples(index=False, name=None))
+    conn = sqlite3.connect(str(db_path))
+    try:
+        with conn:
+            ensure_table(conn, value_columns)
+            conn.executemany(f"DELETE FROM {PROFILE_TABLE} WHERE run = ? AND sample_name = ? AND valtype = ?", keys)
+            cur = conn.executemany(
+                f"INSERT INTO {PROFILE_TABLE} ({', '.join(fields)}) VALUES ({', '.join('?' * len(fields))})",
+                _db_rows(store, value_columns),
+            )
+            n = cur.rowcount
+    finally:
+        conn.close()
+    return n
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Ingest ShapeMapper profile / .txtga files into a columnar store.")
+    ap.add_argument("--mut-count", type=Path, default=Path(__file__).resolve().parent / "mut_count",
+                    help="Directory with the mut_count___cfg-* runs")
+    ap.add_argument("--out", type=Path, help="Output .npz (default: mutcount_profiles.npz next to --mut-count)")
+    ap.add_argument("--compress", action="store_true", help="Deflate the store (not memory-mappable)")
+    ap.add_argument("--db", type=Path, help="Also bulk-load into this nerd.sqlite")
+    args = ap.parse_args()
+
+    if args.db is not None and not args.db.exists():
+        ap.error(f"Database not found: {args.db}")
+    profiles = find_profiles(args.mut_count)
+    if not profiles:
+        ap.error(f"No *_profile.txt / .txtga files below {args.mut_count}")
+    out = args.out or args.mut_count.parent / "mutcount_profiles.npz"
+
+    t0 = time.perf_counter()
+    arrays = build_store(profiles)
+    write_store(out, arrays, compress=args.compress)
+    n_nt = int(arrays["offsets"][-1])
+    print(f"Wrote {len(profiles)} profiles ({n_nt} rows, {len(arrays['columns'])} columns) "
+          f"to {out} in {time.perf_counter() - t0:.1f} s")
+
+    if args.db is not None:
+        t0 = time.perf_counter()
+        n = load_db(ProfileStore(out), args.db)
+        print(f"Loaded {n} rows into {PROFILE_TABLE} of {args.db} in {time.perf_counter() - t0:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1086 @@
+"""
+batch_lm_engine.py
+Vectorized batch engine (`engine: batch_lm`) for the probe time-course fits.
+
+Fits the same model and rounds as the `python_baseline` engine of
+`nerd run probe_timecourse`:
+
+    fmod(t) = 1 - exp(-kappa * (1 - exp(-kdeg * t))) + fmod0
+
+with parameters in log space (log_kappa is stored as `log_kobs`, as nerd does).
+
+    round1_free         every nucleotide, (log_kappa, log_kdeg, log_fmod0) free
+    round2_global       selected nucleotides (engine_options.global_selection /
+                        global_filters on round1), one shared log_kdeg per
+                        rg_id x valtype, per-site log_kappa / log_fmod0
+    round3_constrained  every nucleotide, log_kdeg fixed to the round2 value
+
+Instead of one lmfit minimization per nucleotide, every nucleotide of an
+rg_id x valtype is stacked into padded (n_sites, n_times) arrays and all of them
+are solved together by one Levenberg-Marquardt loop with analytic Jacobians and
+batched 3x3 / 2x2 normal equations. In round2 the shared log_kdeg couples the
+sites; the normal matrix is block-arrow shaped (2x2 block per site plus one
+shared row/column), which is solved exactly through its Schur complement, so
+the global fit costs about as much as the per-site fits.
+
+Results go to the same tables nerd writes (`probe_tc_fit_runs`,
+`probe_tc_fit_params`; the wide table in Figure_analysis/Utilities/nerd_db.py
+follows through its triggers) plus a long CSV in the run directory.
+`--compare` checks the new parameters against the fits already in the database
+(e.g. from `python_baseline`) before anything is overwritten.
+
+Every stored run also gets an input fingerprint (probe_tc_fit_inputs). With
+`--incremental` (or `incremental: true`) a rerun refits only the units whose
+inputs changed. Adding one `outliers:` entry refits that site's round1 and
+the rg_id's round2_global; round3 is keyed on the site's own inputs and the
+shared log_kdeg value, so only that site's round3 is refit when the shared
+kdeg comes out the same (the site is outside the global selection), and every
+round3 of the rg_id x valtype when it moves (they all use it). Changing
+`global_filters` refits round2, reuses round1 and refits round3 where kdeg changed.
+
+Select the engine in a 05_probe_tc_kinetics config with `engine: batch_lm`
+(or pass `--engine batch_lm` to run it on an existing config).
+
+Usage:
+    python Core_nerd_analysis/05_probe_tc_kinetics/batch_lm_engine.py \\
+        --config Core_nerd_analysis/05_probe_tc_kinetics/configs/config_4U_wt.yaml \\
+        --db Core_nerd_analysis/nerd.sqlite --engine batch_lm --compare --dry-run
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import sqlite3
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import yaml
+
+
+ENGINE_NAME = "batch_lm"
+# Part of every input fingerprint; bump when the same inputs would fit differently
+ENGINE_VERSION = "batch_lm/1"
+ROUNDS = ("round1_free", "round2_global", "round3_constrained")
+
+# engine_options.global_selection -> bases used for the shared kdeg
+GLOBAL_SELECTION_BASES = {
+    "ac_only": ("A", "C"),
+    "acg_only": ("A", "C", "G"),
+    "all": ("A", "C", "G", "U", "T"),
+}
+
+# Keeps exp() finite for wild LM trial steps; far outside any physical rate
+LOG_PARAM_CLIP = 50.0
+# A fit whose damping runs away (no downhill step even at lam > 1e10) only
+# counts as converged if it sits at a stationary point: every Jacobian column
+# is orthogonal to the residuals up to this cosine (MINPACK's gtol test)
+GTOL = 1e-6
+
+PARAM_COLUMNS = ("log_kobs", "log_kdeg", "log_fmod0")
+
+
+# ------------------------------------------------------------------------
+# Model and analytic Jacobian
+# ------------------------------------------------------------------------
+def fmod_model(t: np.ndarray, log_kappa: Any, log_kdeg: Any, log_fmod0: Any) -> np.ndarray:
+    """fmod(t) for (broadcastable) log-space parameters."""
+    kappa = np.exp(np.clip(log_kappa, -LOG_PARAM_CLIP, LOG_PARAM_CLIP))
+    kdeg = np.exp(np.clip(log_kdeg, -LOG_PARAM_CLIP, LOG_PARAM_CLIP))
+    fmod0 = np.exp(np.clip(log_fmod0, -LOG_PARAM_CLIP, LOG_PARAM_CLIP))
+    return 1.0 - np.exp(-kappa * (1.0 - np.exp(-kdeg * t))) + fmod0
+
+
+def _model_and_jacobian(t: np.ndarray, p: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    fmod and d fmod / d (log_kappa, log_kdeg, log_fmod0) for stacked sites.
+
+    t : (n, m) time points, p : (n, 3) log-space parameters.
+    Returns f : (n, m) and J : (n, m, 3).
+    """
+    p = np.clip(p, -LOG_PARAM_CLIP, LOG_PARAM_CLIP)
+    kappa = np.exp(p[:, 0:1])
+    kdeg = np.exp(p[:, 1:2])
+    fmod0 = np.exp(p[:, 2:3])
+
+    decay = np.exp(-kdeg * t)
+    u = 1.0 - decay
+    e = np.exp(-kappa * u)
+
+    f = 1.0 - e + fmod0
+    J = np.empty(t.shape + (3,))
+    J[..., 0] = e * kappa * u
+    J[..., 1] = e * kappa * kdeg * t * decay
+    J[..., 2] = fmod0
+    return f, J
+
+
+# ------------------------------------------------------------------------
+# Stacked data
+# ------------------------------------------------------------------------
+@dataclass
+class SiteBatch:
+    """Time courses of many sites, padded to a common length (mask marks real points)."""
+
+    nt_ids: np.ndarray  # (n,)
+    bases: np.ndarray  # (n,) upper-case base letters
+    t: np.ndarray  # (n, m)
+    y: np.ndarray  # (n, m)
+    mask: np.ndarray  # (n, m) 1.0 for observed points, 0.0 for padding
+
+    @property
+    def n_points(self) -> np.ndarray:
+        return self.mask.sum(axis=1)
+
+    def subset(self, idx: np.ndarray) -> "SiteBatch":
+        return SiteBatch(self.nt_ids[idx], self.bases[idx], self.t[idx], self.y[idx], self.mask[idx])
+
+
+def stack_sites(df: pd.DataFrame, min_points: int = 3) -> SiteBatch:
+    """
+    Stack a long (nt_id, base, reaction_time, fmod_val) frame into a SiteBatch.
+
+    Sites with fewer than `min_points` observations are left out.
+    """
+    df = df.dropna(subset=["fmod_val", "reaction_time"])
+    counts = df.groupby("nt_id")["fmod_val"].transform("size")
+    df = df[counts >= min_points].sort_values(["nt_id", "reaction_time"], kind="stable")
+    if df.empty:
+        empty = np.zeros((0, 0))
+        return SiteBatch(np.zeros(0, dtype=int), np.zeros(0, dtype=object), empty, empty, empty)
+
+    nt_ids, row = np.unique(df["nt_id"].to_numpy(), return_inverse=True)
+    col = df.groupby("nt_id").cumcount().to_numpy()
+    shape = (len(nt_ids), int(col.max()) + 1)
+
+    t = np.zeros(shape)
+    y = np.zeros(shape)
+    mask = np.zeros(shape)
+    t[row, col] = df["reaction_time"].to_numpy(dtype=float)
+    y[row, col] = df["fmod_val"].to_numpy(dtype=float)
+    mask[row, col] = 1.0
+
+    bases = df.groupby("nt_id")["base"].first().reindex(nt_ids).str.upper().to_numpy()
+    return SiteBatch(nt_ids, bases, t, y, mask)
+
+
+def initial_guess(batch: SiteBatch, log_kdeg: Optional[float] = None) -> np.ndarray:
+    """
+    Starting (log_kappa, log_kdeg, log_fmod0) per site from the data itself.
+
+    fmod0 from the earliest points, kappa from the plateau above fmod0, and
+    kdeg from the time the curve reaches half of its rise (unless given).
+    """
+    big = np.where(batch.mask > 0, batch.t, np.inf)
+    first = np.argmin(big, axis=1)
+    rows = np.arange(len(first))
+    fmod0 = np.clip(batch.y[rows, first], 1e-5, None)
+
+    y_max = np.max(np.where(batch.mask > 0, batch.y, -np.inf), axis=1)
+    rise = np.clip(y_max - fmod0, 1e-4, 0.99)
+    kappa = -np.log1p(-rise)
+
+    if log_kdeg is None:
+        above = (batch.mask > 0) & (batch.y - fmod0[:, None] >= 0.5 * rise[:, None]) & (batch.t > 0)
+        t_half = np.min(np.where(above, batch.t, np.inf), axis=1)
+        t_pos = np.where(batch.mask > 0, batch.t, 0.0).max(axis=1)
+        t_half = np.where(np.isfinite(t_half), t_half, np.maximum(t_pos, 1.0))
+        kdeg_guess = np.log(2.0) / np.maximum(t_half, 1.0)
+    else:
+        kdeg_guess = np.full(len(rows), np.exp(log_kdeg))
+
+    return np.column_stack([np.log(kappa), np.log(kdeg_guess), np.log(fmod0)])
+
+
+# ------------------------------------------------------------------------
+# Batched Levenberg-Marquardt
+# ------------------------------------------------------------------------
+@dataclass
+class BatchFit:
+    """Per-site result of a batched fit (log-space parameters, lmfit-style stderr)."""
+
+    params: np.ndarray  # (n, 3)
+    stderr: np.ndarray  # (n, 3), NaN for fixed parameters
+    r2: np.ndarray  # (n,)
+    chisqr: np.ndarray  # (n,)
+    nfev: np.ndarray  # (n,)
+    success: np.ndarray  # (n,) bool
+
+
+def _r2(batch: SiteBatch, resid: np.ndarray) -> np.ndarray:
+    n = np.maximum(batch.n_points, 1)
+    y_mean = (batch.y * batch.mask).sum(axis=1) / n
+    ss_tot = (((batch.y - y_mean[:, None]) * batch.mask) ** 2).sum(axis=1)
+    ss_res = (resid**2).sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(ss_tot > 0, 1.0 - ss_res / ss_tot, np.nan)
+
+
+def _stderr(JtJ: np.ndarray, chisqr: np.ndarray, dof: np.ndarray) -> np.ndarray:
+    """sqrt(diag(inv(JtJ)) * chisqr / dof) per site, as lmfit scales the covariance."""
+    k = JtJ.shape[-1]
+    out = np.full(JtJ.shape[:-1], np.nan)
+    ok = (dof > 0) & (np.linalg.matrix_rank(JtJ) == k) if len(JtJ) else np.zeros(0, dtype=bool)
+    if ok.any():
+        cov = np.linalg.inv(JtJ[ok]) * (chisqr[ok] / dof[ok])[:, None, None]
+        out[ok] = np.sqrt(np.clip(np.diagonal(cov, axis1=1, axis2=2), 0.0, None))
+    return out
+
+
+def _stationary(J: np.ndarray, r: np.ndarray) -> np.ndarray:
+    """Per site: max |cos(J_j, r)| <= GTOL, for J (n, m, k) and residuals r (n, m)."""
+    g = np.abs(np.einsum("nmi,nm->ni", J, r))
+    norm = np.sqrt((J**2).sum(axis=1)) * np.sqrt((r**2).sum(axis=1))[:, None]
+    cos = np.where(norm > 0, g / np.where(norm > 0, norm, 1.0), 0.0)
+    return cos.max(axis=1) <= GTOL
+
+
+def lm_fit_sites(
+    batch: SiteBatch,
+    p0: np.ndarray,
+    free: Sequence[bool] = (True, True, True),
+    max_iter: int = 200,
+    ftol: float = 1e-10,
+    xtol: float = 1e-10,
+) -> BatchFit:
+    """
+    Fit every site of `batch` independently, all at once.
+
+    Each site has its own damping factor and convergence state; converged sites
+    drop out of the working set. Parameters with `free[j] == False` stay at p0.
+    """
+    free_idx = np.flatnonzero(free)
+    k = len(free_idx)
+    n = len(batch.nt_ids)
+    p = np.array(p0, dtype=float, copy=True)
+    lam = np.full(n, 1e-3)
+    nfev = np.ones(n, dtype=int)
+    done = np.zeros(n, dtype=bool)
+    success = np.zeros(n, dtype=bool)
+    eye = np.eye(k)
+
+    f, J = _model_and_jacobian(batch.t, p)
+    r = (f - batch.y) * batch.mask
+    Jf = J[..., free_idx] * batch.mask[..., None]
+    cost = (r**2).sum(axis=1)
+
+    for _ in range(max_iter):
+        act = np.flatnonzero(~done)
+        if act.size == 0:
+            break
+        JtJ = np.einsum("nmi,nmj->nij", Jf[act], Jf[act])
+        g = np.einsum("nmi,nm->ni", Jf[act], r[act])
+        diag = np.diagonal(JtJ, axis1=1, axis2=2)
+        damped = JtJ + lam[act, None, None] * (diag[:, :, None] * eye + 1e-12 * eye)
+        step = -np.linalg.solve(damped, g[..., None])[..., 0]
+
+        trial = p[act].copy()
+        trial[:, free_idx] = np.clip(trial[:, free_idx] + step, -LOG_PARAM_CLIP, LOG_PARAM_CLIP)
+        f_t, J_t = _model_and_jacobian(batch.t[act], trial)
+        r_t = (f_t - batch.y[act]) * batch.mask[act]
+        cost_t = (r_t**2).sum(axis=1)
+        nfev[act] += 1
+
+        better = cost_t < cost[act]
+        acc = act[better]
+        rel_drop = (cost[acc] - cost_t[better]) / np.maximum(cost[acc], 1e-300)
+        small_step = np.all(
+            np.abs(step[better]) <= xtol * (np.abs(p[acc][:, free_idx]) + xtol), axis=1
+        )
+
+        p[acc] = trial[better]
+        r[acc] = r_t[better]
+        Jf[acc] = J_t[better][..., free_idx] * batch.mask[acc][..., None]
+        cost[acc] = cost_t[better]
+        lam[acc] = np.maximum(lam[acc] / 10.0, 1e-12)
+
+        conv = (rel_drop <= ftol) | small_step
+        done[acc[conv]] = True
+        success[acc[conv]] = True
+
+        rej = act[~better]
+        lam[rej] *= 10.0
+        # no downhill step even with heavy damping: converged only if the site
+        # is at a minimum up to round-off, failed (runaway) otherwise
+        stuck = rej[lam[rej] > 1e10]
+        done[stuck] = True
+        success[stuck] = _stationary(Jf[stuck], r[stuck])
+
+    JtJ = np.einsum("nmi,nmj->nij", Jf, Jf)
+    dof = batch.n_points - k
+    stderr = np.full(p.shape, np.nan)
+    stderr[:, free_idx] = _stderr(JtJ, cost, dof)
+    return BatchFit(p, stderr, _r2(batch, r), cost, nfev, success)
+
+
+@dataclass
+class GlobalFit:
+    """Shared log_kdeg plus per-site (log_kappa, log_fmod0) from round2_global."""
+
+    log_kdeg: float
+    log_kdeg_err: float
+    sites: BatchFit  # params[:, 1] == log_kdeg for every site
+    r2: float
+    success: bool
+
+
+def lm_fit_shared_kdeg(
+    batch: SiteBatch,
+    p0: np.ndarray,
+    log_kdeg0: float,
+    max_iter: int = 200,
+    ftol: float = 1e-10,
+    xtol: float = 1e-10,
+) -> GlobalFit:
+    """
+    Fit per-site (log_kappa, log_fmod0) with one log_kdeg shared by all sites.
+
+    The damped normal equations have a block-arrow structure
+        [A_1          B_1] [d_1]   [g_1]
+        [     ...     ...] [...] = -[...]
+        [          A_n B_n] [d_n]   [g_n]
+        [B_1' ... B_n'  D ] [d_b]   [g_b]
+    with 2x2 blocks A_i; d_b comes from the scalar Schur complement
+    S = D - sum B_i' A_i^-1 B_i, then every d_i from its own 2x2 solve.
+    """
+    n = len(batch.nt_ids)
+    p = np.array(p0, dtype=float, copy=True)
+    p[:, 1] = log_kdeg0
+    lam = 1e-3
+    nfev = 1
+    eye = np.eye(2)
+    success = False
+
+    def _linearize(params):
+        f, J = _model_and_jacobian(batch.t, params)
+        r = (f - batch.y) * batch.mask
+        J = J * batch.mask[..., None]
+        return r, J, float((r**2).sum())
+
+    r, J, cost = _linearize(p)
+    for _ in range(max_iter):
+        Jl, Jb = J[..., [0, 2]], J[..., 1]
+        A = np.einsum("nmi,nmj->nij", Jl, Jl)
+        B = np.einsum("nmi,nm->ni", Jl, Jb)
+        D = float((Jb**2).sum())
+        g_l = np.einsum("nmi,nm->ni", Jl, r)
+        g_b = float((Jb * r).sum())
+
+        diag = np.diagonal(A, axis1=1, axis2=2)
+        A_d = A + lam * (diag[:, :, None] * eye + 1e-12 * eye)
+        D_d = D * (1.0 + lam) + 1e-12
+        X = np.linalg.solve(A_d, B[..., None])[..., 0]  # A_i^-1 B_i
+        Y = np.linalg.solve(A_d, g_l[..., None])[..., 0]  # A_i^-1 g_i
+        S = D_d - np.einsum("ni,ni->", B, X)
+        d_b = (-g_b + np.einsum("ni,ni->", B, Y)) / S
+        d_l = -Y - X * d_b
+
+        trial = p.copy()
+        trial[:, [0, 2]] += d_l
+        trial[:, 1] += d_b
+        np.clip(trial, -LOG_PARAM_CLIP, LOG_PARAM_CLIP, out=trial)
+        r_t, J_t, cost_t = _linearize(trial)
+        nfev += 1
+
+        if cost_t < cost:
+            rel_drop = (cost - cost_t) / max(cost, 1e-300)
+            step = np.concatenate([d_l.ravel(), [d_b]])
+            ref = np.concatenate([p[:, [0, 2]].ravel(), [p[0, 1]]])
+            p, r, J, cost = trial, r_t, J_t, cost_t
+            lam = max(lam / 10.0, 1e-12)
+            if rel_drop <= ftol or np.all(np.abs(step) <= xtol * (np.abs(ref) + xtol)):
+                success = True
+                break
+        else:
+            lam *= 10.0
+            if lam > 1e10:
+                # per-site (log_kappa, log_fmod0) columns, then the shared log_kdeg column
+                success = bool(
+                    _stationary(J[..., [0, 2]], r).all()
+                    and _stationary(J[..., 1].reshape(1, -1, 1), r.reshape(1, -1))[0]
+                )
+                break
+
+    # Covariance from the undamped block-arrow matrix, scaled by chisqr / dof
+    Jl, Jb = J[..., [0, 2]], J[..., 1]
+    A = np.einsum("nmi,nmj->nij", Jl, Jl)
+    B = np.einsum("nmi,nm->ni", Jl, Jb)
+    D = float((Jb**2).sum())
+    n_obs = float(batch.mask.sum())
+    dof = n_obs - (2 * n + 1)
+    stderr = np.full(p.shape, np.nan)
+    log_kdeg_err = np.nan
+    try:
+        A_inv = np.linalg.pinv(A)  # sites with fmod0 -> 0 have a null direction
+        X = np.einsum("nij,nj->ni", A_inv, B)
+        S = D - np.einsum("ni,ni->", B, X)
+        if dof > 0 and S > 0:
+            s2 = cost / dof
+            log_kdeg_err = float(np.sqrt(s2 / S))
+            var_l = np.diagonal(A_inv, axis1=1, axis2=2) + X**2 / S
+            stderr[:, [0, 2]] = np.sqrt(np.clip(var_l * s2, 0.0, None))
+            stderr[:, 1] = log_kdeg_err
+    except np.linalg.LinAlgError:
+        pass
+
+    y_mean = (batch.y * batch.mask).sum() / max(n_obs, 1.0)
+    ss_tot = float((((batch.y - y_mean) * batch.mask) ** 2).sum())
+    r2 = 1.0 - cost / ss_tot if ss_tot > 0 else np.nan
+    chisqr = (r**2).sum(axis=1)
+    sites = BatchFit(p, stderr, _r2(batch, r), chisqr, np.full(n, nfev), np.full(n, success))
+    return GlobalFit(float(p[0, 1]), log_kdeg_err, sites, r2, success)
+
+
+# ------------------------------------------------------------------------
+# Rounds for one rg_id x valtype
+# ------------------------------------------------------------------------
+def select_global_sites(
+    batch: SiteBatch,
+    round1: BatchFit,
+    selection: str = "ac_only",
+    filters: Optional[Dict[str, Any]] = None,
+) -> np.ndarray:
+    """Indices of the sites that enter round2_global."""
+    if selection not in GLOBAL_SELECTION_BASES:
+        raise ValueError(f"Unknown global_selection {selection!r}; use one of {sorted(GLOBAL_SELECTION_BASES)}")
+    filters = dict(filters or {})
+    r2_threshold = filters.pop("r2_threshold", None)
+    if filters:
+        raise ValueError(f"Unsupported global_filters for {ENGINE_NAME}: {sorted(filters)}")
+
+    keep = np.isin(batch.bases, GLOBAL_SELECTION_BASES[selection]) & round1.success
+    keep &= np.all(np.isfinite(round1.params), axis=1)
+    if r2_threshold is not None:
+        keep &= np.nan_to_num(round1.r2, nan=-np.inf) >= float(r2_threshold)
+    return np.flatnonzero(keep)
+
+
+def _param_rows(
+    fit_kind: str,
+    nt_ids: Iterable[Any],
+    params: np.ndarray,
+    stderr: np.ndarray,
+    r2: np.ndarray,
+    n_points: np.ndarray,
+    columns: Sequence[int] = (0, 1, 2),
+    fingerprints: Optional[Sequence[str]] = None,
+    success: Optional[np.ndarray] = None,
+) -> List[Dict[str, Any]]:
+    rows = []
+    for i, nt_id in enumerate(nt_ids):
+        row: Dict[str, Any] = {"nt_id": nt_id, "fit_kind": fit_kind}
+        for j in columns:
+            name = PARAM_COLUMNS[j]
+            row[name] = params[i, j]
+            row[f"{name}_err"] = stderr[i, j]
+            row[name[len("log_"):]] = np.exp(params[i, j])
+        row["diag:r2"] = r2[i]
+        row["diag:n_points"] = n_points[i]
+        if success is not None:
+            row["diag:success"] = float(bool(success[i]))
+        if fingerprints is not None:
+            row["fingerprint"] = fingerprints[i]
+        rows.append(row)
+    return rows
+
+
+def _digest(*parts: Any) -> str:
+    h = hashlib.sha1()
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else json.dumps(part, sort_keys=True, default=str).encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def site_fingerprints(df: pd.DataFrame, nt_ids: np.ndarray, salt: Any) -> np.ndarray:
+    """
+    round1 input fingerprint per site, aligned with `nt_ids`.
+
+    Covers the site's (sample, reaction_time, fmod_val) points after outlier
+    removal, so adding an outlier entry only changes the sites it touches.
+    """
+    sort_cols = ["nt_id", "reaction_time"] + (["sample_name"] if "sample_name" in df else [])
+    df = df.sort_values(sort_cols, kind="stable")
+    out = {}
+    for nt_id, g in df.groupby("nt_id", sort=False):
+        samples = "\x1f".join(g["sample_name"].astype(str)) if "sample_name" in g else ""
+        out[nt_id] = _digest(
+            salt,
+            samples,
+            g["reaction_time"].to_numpy(dtype=float).tobytes(),
+            g["fmod_val"].to_numpy(dtype=float).tobytes(),
+        )
+    return np.array([out[nt_id] for nt_id in nt_ids], dtype=object)
+
+
+def _reusable(rec: Optional[Dict[str, Any]], fingerprint: str, names: Sequence[str]) -> bool:
+    return (
+        rec is not None
+        and rec.get("fingerprint") == fingerprint
+        and all(rec.get(n) is not None and np.isfinite(rec[n]) for n in names)
+    )
+
+
+def fit_rg_valtype(
+    df: pd.DataFrame,
+    rounds: Sequence[str] = ROUNDS,
+    min_points: int = 3,
+    engine_options: Optional[Dict[str, Any]] = None,
+    stored: Optional[pd.DataFrame] = None,
+) -> Tuple[pd.DataFrame, int]:
+    """
+    Run the requested rounds for the time courses of one rg_id x valtype.
+
+    Returns one row per fit run (nt_id is None for the shared round2 kdeg)
+    with the fitted log parameters, their errors, exp() values, diagnostics and
+    the run's input `fingerprint`, plus the number of reused runs.
+
+    With `stored` (this rg_id x valtype's runs from fetch_stored_fits), only
+    units whose fingerprint changed are refit:
+        round1_free         site inputs (points after outlier removal)
+        round2_global       engine options + every site's round1 fingerprint
+        round3_constrained  site's round1 fingerprint + the round2 log_kdeg (and error) it uses
+    The other units are taken from `stored` and not returned.
+
+    When the round2_global fit does not converge (diag:success 0 on its kdeg
+    row), round3_constrained is skipped with a warning and its stored runs
+    are deleted rather than constrained by that kdeg. Stored runs of
+    sites that no longer have data come back as rows with action 'delete'.
+    """
+    opts = dict(engine_options or {})
+    unknown = set(rounds) - set(ROUNDS)
+    if unknown:
+        raise ValueError(f"Unknown rounds: {sorted(unknown)}")
+    if "round3_constrained" in rounds and "round2_global" not in rounds:
+        raise ValueError("round3_constrained needs round2_global for its kdeg")
+
+    df = df.dropna(subset=["fmod_val", "reaction_time"])
+    batch = stack_sites(df, min_points=min_points)
+    prev: Dict[Tuple[str, Optional[int]], Dict[str, Any]] = {}
+    if stored is not None:
+        for rec in stored.to_dict("records"):
+            nt_id = None if pd.isna(rec["nt_id"]) else int(rec["nt_id"])
+            prev[(rec["fit_kind"], nt_id)] = rec
+
+    rows: List[Dict[str, Any]] = []
+    present = {int(n) for n in batch.nt_ids}
+    for fit_kind, nt_id in prev:
+        if fit_kind in rounds and nt_id is not None and nt_id not in present:
+            rows.append({"nt_id": nt_id, "fit_kind": fit_kind, "action": "delete"})
+    if len(batch.nt_ids) == 0:
+        return pd.DataFrame(rows), 0
+
+    n_reused = 0
+    fp1 = site_fingerprints(df, batch.nt_ids, [ENGINE_VERSION, min_points, opts.get("initial_log_kdeg")])
+
+    # round1: reuse stored fits of unchanged sites, refit the rest
+    n = len(batch.nt_ids)
+    round1 = BatchFit(
+        initial_guess(batch, opts.get("initial_log_kdeg")), np.full((n, 3), np.nan), np.full(n, np.nan),
+        np.full(n, np.nan), np.zeros(n, dtype=int), np.zeros(n, dtype=bool),
+    )
+    refit = np.ones(n, dtype=bool)
+    for i, nt_id in enumerate(batch.nt_ids):
+        rec = prev.get(("round1_free", int(nt_id)))
+        # runs without diag:success predate the flag and are refit
+        if _reusable(rec, fp1[i], [*PARAM_COLUMNS, "diag:success"]):
+            round1.params[i] = [rec[c] for c in PARAM_COLUMNS]
+            round1.stderr[i] = [rec.get(f"{c}_err", np.nan) for c in PARAM_COLUMNS]
+            round1.r2[i] = rec.get("diag:r2", np.nan)
+            round1.success[i] = bool(rec["diag:success"])
+            refit[i] = False
+    idx = np.flatnonzero(refit)
+    if idx.size:
+        fit = lm_fit_sites(batch.subset(idx), round1.params[idx])
+        for field in ("params", "stderr", "r2", "chisqr", "nfev", "success"):
+            getattr(round1, field)[idx] = getattr(fit, field)
+    if "round1_free" in rounds:
+        n_reused += n - idx.size
+        rows += _param_rows(
+            "round1_free", batch.nt_ids[idx], round1.params[idx], round1.stderr[idx], round1.r2[idx],
+            batch.n_points[idx], fingerprints=fp1[idx], success=round1.success[idx],
+        )
+
+    if "round2_global" in rounds:
+        selection = opts.get("global_selection", "ac_only")
+        fp2 = _digest(
+            ENGINE_VERSION, "round2_global", selection, opts.get("global_filters"), opts.get("initial_log_kdeg"),
+            sorted(zip((int(x) for x in batch.nt_ids), fp1)),
+        )
+        rec = prev.get(("round2_global", None))
+        if _reusable(rec, fp2, ("log_kdeg", "diag:success")):
+            log_kdeg, log_kdeg_err = rec["log_kdeg"], rec.get("log_kdeg_err", np.nan)
+            glob_ok = bool(rec["diag:success"])
+            n_reused += sum(1 for fit_kind, _ in prev if fit_kind == "round2_global")
+        else:
+            sel = select_global_sites(batch, round1, selection, opts.get("global_filters"))
+            if sel.size == 0:
+                raise ValueError("No sites pass the round2_global selection; relax global_filters")
+            sub = batch.subset(sel)
+            log_kdeg0 = opts.get("initial_log_kdeg", float(np.median(round1.params[sel, 1])))
+            glob = lm_fit_shared_kdeg(sub, round1.params[sel], log_kdeg0)
+            log_kdeg, log_kdeg_err, glob_ok = glob.log_kdeg, glob.log_kdeg_err, glob.success
+            rows += _param_rows(
+                "round2_global", sub.nt_ids, glob.sites.params, glob.sites.stderr, glob.sites.r2,
+                sub.n_points, columns=(0, 2), fingerprints=[fp2] * len(sel), success=glob.sites.success,
+            )
+            rows.append({
+                "nt_id": None,
+                "fit_kind": "round2_global",
+                "log_kdeg": glob.log_kdeg,
+                "log_kdeg_err": glob.log_kdeg_err,
+                "kdeg": np.exp(glob.log_kdeg),
+                "diag:r2": glob.r2,
+                "diag:n_sites": len(sel),
+                "diag:n_points": sub.n_points.sum(),
+                "diag:success": float(glob.success),
+                "fingerprint": fp2,
+            })
+            selected = {int(x) for x in sub.nt_ids}
+            for fit_kind, nt_id in prev:
+                if fit_kind == "round2_global" and nt_id is not None and nt_id in present and nt_id not in selected:
+                    rows.append({"nt_id": nt_id, "fit_kind": fit_kind, "action": "delete"})
+
+        if "round3_constrained" in rounds and not glob_ok:
+            where = " ".join(f"{k}={df[k].iloc[0]}" for k in ("rg_id", "valtype") if k in df)
+            print(f"[WARN] {where}: round2_global did not converge; round3_constrained skipped", file=sys.stderr)
+            # nt_id None clears the whole group when not incremental
+            rows.append({"nt_id": None, "fit_kind": "round3_constrained", "action": "delete"})
+            for fit_kind, nt_id in prev:
+                if fit_kind == "round3_constrained" and nt_id in present:
+                    rows.append({"nt_id": nt_id, "fit_kind": fit_kind, "action": "delete"})
+        elif "round3_constrained" in rounds:
+            # the shared kdeg value, not fp2: a round2 refit that reproduces the
+            # same kdeg leaves the other sites' round3 inputs unchanged
+            kdeg_key = [float(log_kdeg), None if pd.isna(log_kdeg_err) else float(log_kdeg_err)]
+            fp3 = np.array([_digest(f, "round3_constrained", kdeg_key) for f in fp1], dtype=object)
+            refit3 = np.array([
+                not _reusable(prev.get(("round3_constrained", int(nt_id))), fp3[i], PARAM_COLUMNS)
+                for i, nt_id in enumerate(batch.nt_ids)
+            ], dtype=bool)
+            idx3 = np.flatnonzero(refit3)
+            n_reused += n - idx3.size
+            if idx3.size:
+                p0 = round1.params[idx3].copy()
+                p0[:, 1] = log_kdeg
+                round3 = lm_fit_sites(batch.subset(idx3), p0, free=(True, False, True))
+                round3.stderr[:, 1] = log_kdeg_err
+                rows += _param_rows(
+                    "round3_constrained", batch.nt_ids[idx3], round3.params, round3.stderr, round3.r2,
+                    batch.n_points[idx3], fingerprints=fp3[idx3], success=round3.success,
+                )
+
+    out = pd.DataFrame(rows)
+    if not out.empty:
+        out["action"] = out.get("action", pd.Series(index=out.index, dtype=object)).fillna("fit")
+    return out, n_reused
+
+
+# ------------------------------------------------------------------------
+# Config, data and database I/O
+# ------------------------------------------------------------------------
+def load_config(path: str | Path) -> Dict[str, Any]:
+    """The `probe_timecourse` section of a 05_probe_tc_kinetics config."""
+    with open(path) as fh:
+        cfg = yaml.safe_load(fh)
+    if "probe_timecourse" not in cfg:
+        raise ValueError(f"{path}: no probe_timecourse section")
+    return cfg["probe_timecourse"]
+
+
+def config_hash(section: Dict[str, Any]) -> str:
+    """Short hash of a config section, used for the run directory name."""
+    blob = json.dumps(section, sort_keys=True, default=str).encode()
+    return hashlib.sha1(blob).hexdigest()[:7]
+
+
+def parse_outliers(entries: Optional[Iterable[str]]) -> pd.DataFrame:
+    """`rg_id:sample_name:site_base:valtype` config entries as a frame."""
+    records = []
+    for entry in entries or []:
+        rg_id, sample_name, site_base, valtype = str(entry).rsplit("#", 1)[0].strip().split(":")
+        records.append((int(rg_id), sample_name, site_base, valtype))
+    return pd.DataFrame(records, columns=["rg_id", "sample_name", "site_base", "valtype"])
+
+
+def _placeholders(prefix: str, values: Sequence[Any], params: Dict[str, Any]) -> str:
+    names = []
+    for i, v in enumerate(values):
+        params[f"{prefix}_{i}"] = v
+        names.append(f":{prefix}_{i}")
+    return ", ".join(names)
+
+
+def fetch_timecourses(
+    conn: sqlite3.Connection,
+    rg_ids: Sequence[int],
+    valtypes: Sequence[str],
+    done_by: Optional[str] = None,
+    nt_ids: Optional[Sequence[int]] = None,
+    outliers: Optional[pd.DataFrame] = None,
+    rt_protocol: Optional[str | Sequence[str]] = None,
+) -> pd.DataFrame:
+    """
+    Every usable fmod value of the requested reaction groups, outliers removed.
+
+    `done_by` / `rt_protocol` restrict the reactions as the config keys of the
+    same name do for python_baseline.
+    """
+    params: Dict[str, Any] = {}
+    where = [
+        f"pr.rg_id IN ({_placeholders('rg', list(rg_ids), params)})",
+        f"fv.valtype IN ({_placeholders('vt', list(valtypes), params)})",
+        "s.to_drop != 1",
+        "fv.outlier != 1",
+        "fv.fmod_val IS NOT NULL",
+    ]
+    if done_by is not None:
+        params["done_by"] = done_by
+        where.append("pr.done_by = :done_by")
+    if rt_protocol is not None:
+        protocols = [rt_protocol] if isinstance(rt_protocol, str) else list(rt_protocol)
+        where.append(f"pr.rt_protocol IN ({_placeholders('rt', protocols, params)})")
+    if nt_ids:
+        where.append(f"fv.nt_id IN ({_placeholders('nt', list(nt_ids), params)})")
+
+    sql = f"""
+        SELECT
+            pr.rg_id,
+            fv.nt_id,
+            mn.base,
+            mn.site || '_' || UPPER(mn.base) AS site_base,
+            fv.valtype,
+            s.sample_name,
+            pr.reaction_time,
+            fv.fmod_val
+        FROM probe_reactions pr
+        JOIN probe_fmod_values fv ON fv.rxn_id = pr.id
+        JOIN meta_nucleotides mn ON mn.id = fv.nt_id
+        JOIN sequencing_samples s ON s.id = pr.s_id
+        WHERE {' AND '.join(where)}
+    """
+    df = pd.read_sql_query(sql, conn, params=params)
+    if outliers is not None and not outliers.empty:
+        hit = df.merge(outliers.assign(_drop=True), how="left", on=list(outliers.columns))["_drop"]
+        df = df[hit.isna().to_numpy()]
+    return df
+
+
+FINGERPRINT_TABLE = "probe_tc_fit_inputs"
+
+_FINGERPRINT_DDL = f"""
+    CREATE TABLE IF NOT EXISTS {FINGERPRINT_TABLE} (
+        fit_run_id  INTEGER PRIMARY KEY,
+        fingerprint TEXT NOT NULL,
+        engine      TEXT NOT NULL
+    );
+    -- run ids can be reused after nerd deletes runs; never let a stale
+    -- fingerprint vouch for a different run
+    CREATE TRIGGER IF NOT EXISTS trg_{FINGERPRINT_TABLE}_run_del
+    AFTER DELETE ON probe_tc_fit_runs
+    BEGIN
+        DELETE FROM {FINGERPRINT_TABLE} WHERE fit_run_id = OLD.id;
+    END;
+"""
+
+
+def ensure_fingerprint_table(conn: sqlite3.Connection) -> None:
+    """Create probe_tc_fit_inputs (input fingerprint per fit run) if needed."""
+    conn.executescript(_FINGERPRINT_DDL)
+
+
+def fetch_stored_fits(
+    conn: sqlite3.Connection, rg_ids: Sequence[int], valtypes: Sequence[str]
+) -> pd.DataFrame:
+    """
+    Stored fit runs with their parameters (one row per run) and input fingerprint.
+
+    `fingerprint` is None for runs written by other engines or before
+    fingerprints existed, so those are always refit.
+    """
+    params: Dict[str, Any] = {}
+    has_fp = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FINGERPRINT_TABLE,)
+    ).fetchone() is not None
+    fp_join = f"LEFT JOIN {FINGERPRINT_TABLE} i ON i.fit_run_id = r.id" if has_fp else ""
+    sql = f"""
+        SELECT
+            r.id AS fit_run_id, r.rg_id, r.nt_id, r.valtype, r.fit_kind,
+            {'i.fingerprint' if has_fp else 'NULL'} AS fingerprint,
+            p.param_name, p.param_numeric
+        FROM probe_tc_fit_runs r
+        JOIN probe_tc_fit_params p ON p.fit_run_id = r.id
+        {fp_join}
+        WHERE r.rg_id IN ({_placeholders('rg', list(rg_ids), params)})
+        AND r.valtype IN ({_placeholders('vt', list(valtypes), params)})
+    """
+    long = pd.read_sql_query(sql, conn, params=params)
+    keys = ["fit_run_id", "rg_id", "nt_id", "valtype", "fit_kind"]
+    if long.empty:
+        return pd.DataFrame(columns=keys + ["fingerprint"])
+    wide = long.pivot_table(index="fit_run_id", columns="param_name", values="param_numeric", aggfunc="first")
+    runs = long.drop_duplicates("fit_run_id").set_index("fit_run_id")[keys[1:] + ["fingerprint"]]
+    return runs.join(wide).reset_index()
+
+
+def fit_config(
+    conn: sqlite3.Connection,
+    cfg: Dict[str, Any],
+    rg_ids: Optional[Sequence[int]] = None,
+    incremental: bool = False,
+) -> Tuple[pd.DataFrame, Dict[str, float]]:
+    """
+    Fit every rg_id x valtype of a probe_timecourse config section (or only `rg_ids`).
+
+    With `incremental`, only units whose input fingerprints changed since the
+    stored fits are refit (see fit_rg_valtype); write the result with
+    write_results(..., incremental=True).
+    """
+    valtypes = cfg.get("valtype", ["modrate"])
+    valtypes = [valtypes] if isinstance(valtypes, str) else list(valtypes)
+    rounds = cfg.get("rounds", list(ROUNDS))
+    opts = cfg.get("engine_options") or {}
+    rg_ids = cfg["rg_ids"] if rg_ids is None else rg_ids
+
+    t0 = time.perf_counter()
+    data = fetch_timecourses(
+        conn,
+        rg_ids,
+        valtypes,
+        done_by=cfg.get("done_by"),
+        nt_ids=cfg.get("nt_ids"),
+        outliers=parse_outliers(cfg.get("outliers")),
+        rt_protocol=cfg.get("rt_protocol"),
+    )
+    stored = fetch_stored_fits(conn, rg_ids, valtypes) if incremental else None
+    t_load = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    frames = []
+    n_reused = 0
+    for (rg_id, valtype), group in data.groupby(["rg_id", "valtype"], sort=True):
+        prev = None
+        if stored is not None:
+            prev = stored[(stored["rg_id"] == rg_id) & (stored["valtype"] == valtype)]
+        fits, reused = fit_rg_valtype(
+            group, rounds, min_points=int(cfg.get("min_points", 3)), engine_options=opts, stored=prev
+        )
+        n_reused += reused
+        if not fits.empty:
+            frames.append(fits.assign(rg_id=int(rg_id), valtype=valtype))
+    t_fit = time.perf_counter() - t0
+
+    results = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    if not results.empty:
+        results["nt_id"] = results["nt_id"].astype("Int64")
+    n_fits = int((results["action"] == "fit").sum()) if not results.empty else 0
+    timings = {
+        "load_s": t_load,
+        "fit_s": t_fit,
+        "n_fits": n_fits,
+        "n_reused": n_reused,
+        "fits_per_s": n_fits / t_fit if t_fit > 0 else float("nan"),
+    }
+    return results, timings
+
+
+def _param_columns(results: pd.DataFrame) -> List[str]:
+    skip = ("rg_id", "nt_id", "valtype", "fit_kind", "fingerprint", "action")
+    return [c for c in results.columns if c not in skip]
+
+
+def _fitted(results: pd.DataFrame) -> pd.DataFrame:
+    return results[results["action"] == "fit"] if "action" in results else results
+
+
+def compare_to_db(
+    conn: sqlite3.Connection, results: pd.DataFrame, atol: float = 1e-2
+) -> pd.DataFrame:
+    """
+    Compare fitted log parameters with the fit runs already in the database.
+
+    Reads probe_tc_fit_params_wide (see nerd_db.py) for the same rg_id x
+    valtype x fit_kind. Returns per fit_kind / parameter: matched fits, max and
+    median absolute difference, and the fraction within `atol` (log units).
+    """
+    params: Dict[str, Any] = {}
+    sql = f"""
+        SELECT rg_id, nt_id, valtype, fit_kind, log_kobs, log_kdeg, log_fmod0
+        FROM probe_tc_fit_params_wide
+        WHERE rg_id IN ({_placeholders('rg', sorted(results['rg_id'].unique().tolist()), params)})
+    """
+    base = pd.read_sql_query(sql, conn, params=params)
+    keys = ["rg_id", "nt_id", "valtype", "fit_kind"]
+    new = _fitted(results)[keys + list(PARAM_COLUMNS)].copy()
+    for frame in (new, base):
+        frame["nt_id"] = frame["nt_id"].astype("Int64")
+    merged = new.merge(base, on=keys, suffixes=("", "_db"))
+
+    rows = []
+    for fit_kind, group in merged.groupby("fit_kind"):
+        for name in PARAM_COLUMNS:
+            diff = (group[name] - group[f"{name}_db"]).abs().dropna()
+            if diff.empty:
+                continue
+            rows.append({
+                "fit_kind": fit_kind,
+                "param": name,
+                "n": len(diff),
+                "max_abs_diff": diff.max(),
+                "median_abs_diff": diff.median(),
+                "frac_within_tol": (diff <= atol).mean(),
+            })
+    return pd.DataFrame(rows)
+
+
+def write_results(
+    conn: sqlite3.Connection, results: pd.DataFrame, overwrite: bool = True, incremental: bool = False
+) -> int:
+    """
+    Store fit runs in probe_tc_fit_runs / probe_tc_fit_params in one transaction.
+
+    By default existing runs of the same rg_id x valtype x fit_kind are
+    replaced when `overwrite` is set and left alone (nothing written for that
+    group) otherwise. With `incremental` (results of fit_config(...,
+    incremental=True)) only the runs with the same rg_id x nt_id x valtype x
+    fit_kind are replaced, and rows with action 'delete' remove stale runs.
+    Input fingerprints go to probe_tc_fit_inputs. Returns the number of fit
+    runs written.
+    """
+    ensure_fingerprint_table(conn)
+    if results.empty:
+        return 0
+    run_cols = {row[1] for row in conn.execute("PRAGMA table_info(probe_tc_fit_runs)")}
+    extra = {"engine": ENGINE_NAME} if "engine" in run_cols else {}
+    run_fields = ["rg_id", "nt_id", "valtype", "fit_kind", *extra]
+    insert_run = f"INSERT INTO probe_tc_fit_runs ({', '.join(run_fields)}) VALUES ({', '.join('?' * len(run_fields))})"
+    value_cols = _param_columns(results)
+    same_group = "SELECT id FROM probe_tc_fit_runs WHERE rg_id = ? AND valtype = ? AND fit_kind = ?"
+    same_run = "SELECT id FROM probe_tc_fit_runs WHERE rg_id = ? AND nt_id IS ? AND valtype = ? AND fit_kind = ?"
+
+    n_runs = 0
+    with conn:
+        for (rg_id, valtype, fit_kind), group in results.groupby(["rg_id", "valtype", "fit_kind"]):
+            key = (int(rg_id), valtype, fit_kind)
+            if not incremental and conn.execute(same_group, key).fetchone() is not None:
+                if not overwrite:
+                    print(f"[skip] rg_id={rg_id} {valtype} {fit_kind}: fits exist (overwrite: false)")
+                    continue
+                conn.execute(f"DELETE FROM probe_tc_fit_params WHERE fit_run_id IN ({same_group})", key)
+                conn.execute(f"DELETE FROM probe_tc_fit_runs WHERE id IN ({same_group})", key)
+
+            param_rows = []
+            fingerprint_rows = []
+            for rec in group.to_dict("records"):
+                nt_id = None if pd.isna(rec["nt_id"]) else int(rec["nt_id"])
+                if incremental:
+                    run_key = (int(rg_id), nt_id, valtype, fit_kind)
+                    conn.execute(f"DELETE FROM probe_tc_fit_params WHERE fit_run_id IN ({same_run})", run_key)
+                    conn.execute(f"DELETE FROM probe_tc_fit_runs WHERE id IN ({same_run})", run_key)
+                if rec.get("action", "fit") == "delete":
+                    continue
+                cur = conn.execute(insert_run, (int(rg_id), nt_id, valtype, fit_kind, *extra.values()))
+                for name in value_cols:
+                    value = rec.get(name)
+                    if value is not None and not pd.isna(value):
+                        param_rows.append((cur.lastrowid, name, float(value)))
+                if isinstance(rec.get("fingerprint"), str):
+                    fingerprint_rows.append((cur.lastrowid, rec["fingerprint"], ENGINE_VERSION))
+                n_runs += 1
+            conn.executemany(
+                "INSERT INTO probe_tc_fit_params (fit_run_id, param_name, param_numeric) VALUES (?, ?, ?)",
+                param_rows,
+            )
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {FINGERPRINT_TABLE} (fit_run_id, fingerprint, engine) VALUES (?, ?, ?)",
+                fingerprint_rows,
+            )
+    return n_runs
+
+
+def select_engine(config_path: Path, cfg: Dict[str, Any], engine: Optional[str] = None) -> Dict[str, Any]:
+    """Config section with engine set to batch_lm; exits if the config (or override) selects another engine."""
+    engine = engine or cfg.get("engine")
+    if engine != ENGINE_NAME:
+        sys.exit(
+            f"{config_path} selects engine {engine!r}; run it with `nerd run probe_timecourse`, "
+            f"or pass --engine {ENGINE_NAME}"
+        )
+    return {**cfg, "engine": ENGINE_NAME}
+
+
+def incremental_mode(cfg: Dict[str, Any], requested: bool = False) -> bool:
+    """Whether to refit only changed units (`--incremental` or `incremental: true` in the config)."""
+    incremental = bool(requested or cfg.get("incremental", False))
+    if incremental and not cfg.get("overwrite", False):
+        raise ValueError("Incremental refits replace stored runs; set overwrite: true")
+    return incremental
+
+
+def run_dir_for(config_path: Path, cfg: Dict[str, Any]) -> Path:
+    """probe_timecourse/<engine>___cfg-<hash> next to the configs directory."""
+    return config_path.resolve().parent.parent / "probe_timecourse" / f"{ENGINE_NAME}___cfg-{config_hash(cfg)}"
+
+
+def write_run_dir(
+    out_dir: Path, config_path: Path, cfg: Dict[str, Any], results: pd.DataFrame, timings: Dict[str, Any]
+) -> Path:
+    """Write fit_params.csv (long: one row per run x parameter) and run_info.json."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    results = _fitted(results)
+    long = results.melt(
+        id_vars=["rg_id", "nt_id", "valtype", "fit_kind"],
+        value_vars=_param_columns(results),
+        var_name="param_name",
+        value_name="param_numeric",
+    ).dropna(subset=["param_numeric"]) if not results.empty else results
+    long.to_csv(out_dir / "fit_params.csv", index=False)
+    with open(out_dir / "run_info.json", "w") as fh:
+        json.dump({"config": str(config_path), "probe_timecourse": cfg, "timings": timings}, fh, indent=2, default=str)
+    return out_dir
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Batched LM engine for 05_probe_tc_kinetics configs.")
+    ap.add_argument("--config", type=Path, required=True, help="probe_timecourse config (YAML)")
+    ap.add_argument("--db", type=Path, required=True, help="Path to nerd.sqlite")
+    ap.add_argument("--engine", help=f"Override the config's engine (this script runs '{ENGINE_NAME}')")
+    ap.add_argument("--out-dir", type=Path, help="Run directory (default: probe_timecourse/batch_lm___cfg-<hash>)")
+    ap.add_argument("--compare", action="store_true", help="Compare with the fits already in the database")
+    ap.add_argument("--tol", type=float, default=1e-2, help="Tolerance for --compare, in log units")
+    ap.add_argument("--dry-run", action="store_true", help="Do not write fits to the database")
+    ap.add_argument("--incremental", action="store_true", help="Refit only units whose inputs changed")
+    args = ap.parse_args()
+
+    assert args.db.exists(), f"DB not found: {args.db}"
+    cfg = select_engine(args.config, load_config(args.config), args.engine)
+    incremental = incremental_mode(cfg, args.incremental)
+
+    conn = sqlite3.connect(str(args.db))
+    results, timings = fit_config(conn, cfg, incremental=incremental)
+    print(
+        f"{timings['n_fits']} fit runs in {timings['fit_s']:.2f} s "
+        f"({timings['fits_per_s']:.0f} fits/s; {timings['n_reused']} reused; data load {timings['load_s']:.2f} s)"
+    )
+
+    if args.compare and not results.empty:
+        report = compare_to_db(conn, results, atol=args.tol)
+        print(report.to_string(index=False) if not report.empty else "No matching fits in the database")
+
+    out_dir = write_run_dir(args.out_dir or run_dir_for(args.config, cfg), args.config, cfg, results, timings)
+    print(f"Wrote {out_dir}")
+
+    if not args.dry_run and not results.empty:
+        n = write_results(conn, results, overwrite=bool(cfg.get("overwrite", False)), incremental=incremental)
+        print(f"Stored {n} fit runs in {args.db}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+batch_runner.py
+Run many 05_probe_tc_kinetics configs with the batch_lm engine on a local process pool.
+
+Every (config, rg_id) pair is one unit of work: its rounds depend on each other
+(round2_global needs round1, round3_constrained needs the round2 kdeg) but not
+on any other rg_id, so each unit runs all of its rounds in one worker. Units go
+onto one shared pool queue across all configs; an rg_id that appears in more
+than one config is run for the next config only after the previous result has
+been written, so the last config listed wins, as with sequential runs.
+
+Workers only read nerd.sqlite (read-only connection per process). All writes go
+through the parent process, one unit per transaction, so workers never wait on
+the SQLite write lock. A unit whose fit or write fails is reported (`error` in
+the timing table, non-zero exit) without stopping the other units.
+
+Usage:
+    python Core_nerd_analysis/05_probe_tc_kinetics/batch_runner.py \\
+        --db Core_nerd_analysis/nerd.sqlite --engine batch_lm --workers 8 \\
+        [configs/config_4U_wt.yaml configs/config_HIV_wt.yaml ...] [--timings timings.csv]
+
+Without config arguments every config in configs/ is run.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+import batch_lm_engine as engine
+
+
+CONFIG_DIR = Path(__file__).resolve().parent / "configs"
+
+# Per-process read-only connection, opened by the pool initializer
+_WORKER_CONN: Optional[sqlite3.Connection] = None
+
+
+def _init_worker(db_path: str) -> None:
+    global _WORKER_CONN
+    _WORKER_CONN = sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True)
+
+
+def _fit_unit(cfg: Dict[str, Any], rg_id: int, incremental: bool) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """Worker: all rounds of one rg_id of one config."""
+    started = time.time()
+    results, timings = engine.fit_config(_WORKER_CONN, cfg, rg_ids=[rg_id], incremental=incremental)
+    timings.update(pid=os.getpid(), started=started, finished=time.time())
+    return results, timings
+
+
+def _load_configs(paths: List[Path], engine_override: Optional[str]) -> List[Tuple[Path, Dict[str, Any]]]:
+    configs = []
+    for path in paths:
+        cfg = engine.select_engine(path, engine.load_config(path), engine_override)
+        configs.append((path, cfg))
+    return configs
+
+
+def run_batch(
+    configs: List[Tuple[Path, Dict[str, Any]]],
+    db_path: Path,
+    workers: int,
+    dry_run: bool = False,
+    incremental: bool = False,
+) -> pd.DataFrame:
+    """
+    Fit every rg_id of every config on `workers` processes.
+
+    With `incremental` (or `incremental: true` in a config) only units whose
+    input fingerprints changed are refit and written.
+
+    Returns one timing row per (config, rg_id): n_fits, queue / load / fit /
+    write seconds and the worker pid.
+    """
+    # rg_id -> units in config order; only the head of each queue is in flight
+    chains: Dict[int, Deque[Tuple[int, int]]] = defaultdict(deque)
+    for ci, (_, cfg) in enumerate(configs):
+        for rg_id in dict.fromkeys(int(r) for r in cfg["rg_ids"]):
+            chains[rg_id].append((ci, rg_id))
+
+    per_config: Dict[int, List[pd.DataFrame]] = defaultdict(list)
+    incremental_by_config = [engine.incremental_mode(cfg, incremental) for _, cfg in configs]
+    remaining = {ci: len(set(cfg["rg_ids"])) for ci, (_, cfg) in enumerate(configs)}
+    rows: List[Dict[str, Any]] = []
+    failed = 0
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(str(db_path),)) as pool:
+        writer = None if dry_run else sqlite3.connect(str(db_path), timeout=60.0)
+        in_flight: Dict[Future, Tuple[int, int, float]] = {}
+
+        def submit(ci: int, rg_id: int) -> None:
+            submitted = time.time()
+            fut = pool.submit(_fit_unit, configs[ci][1], rg_id, incremental_by_config[ci])
+            in_flight[fut] = (ci, rg_id, submitted)
+
+        for chain in chains.values():
+            submit(*chain[0])
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for fut in done:
+                ci, rg_id, submitted = in_flight.pop(fut)
+                path, cfg = configs[ci]
+                row: Dict[str, Any] = {"config": path.name, "rg_id": rg_id}
+                try:
+                    results, timings = fut.result()
+                except Exception as exc:  # keep the other units going; report at the end
+                    failed += 1
+                    row["error"] = f"{type(exc).__name__}: {exc}"
+                    print(f"[FAIL] {path.name} rg_id={rg_id}: {row['error']}", file=sys.stderr)
+                    results, timings = pd.DataFrame(), {}
+                else:
+                    t0 = time.perf_counter()
+                    if writer is not None and not results.empty:
+                        try:
+                            engine.write_results(
+                                writer, results, overwrite=bool(cfg.get("overwrite", False)),
+                                incremental=incremental_by_config[ci],
+                            )
+                        except Exception as exc:  # the unit's transaction is rolled back; other units still write
+                            failed += 1
+                            row["error"] = f"write: {type(exc).__name__}: {exc}"
+                            print(f"[FAIL] {path.name} rg_id={rg_id}: {row['error']}", file=sys.stderr)
+                    row.update(
+                        n_fits=timings["n_fits"],
+                        n_reused=timings["n_reused"],
+                        queue_s=timings["started"] - submitted,
+                        load_s=timings["load_s"],
+                        fit_s=timings["fit_s"],
+                        write_s=time.perf_counter() - t0,
+                        pid=timings["pid"],
+                    )
+                    if "error" not in row:
+                        print(
+                            f"[done] {path.name} rg_id={rg_id}: {timings['n_fits']} fits "
+                            f"({timings['n_reused']} reused) in {timings['fit_s']:.2f} s (pid {timings['pid']})"
+                        )
+                rows.append(row)
+
+                per_config[ci].append(results)
+                remaining[ci] -= 1
+                if remaining[ci] == 0:
+                    frames = [f for f in per_config.pop(ci) if not f.empty]
+                    merged = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+                    info = {"n_fits": len(merged), "units": int(len(set(cfg["rg_ids"])))}
+                    engine.write_run_dir(engine.run_dir_for(path, cfg), path, cfg, merged, info)
+
+                chain = chains[rg_id]
+                chain.popleft()
+                if chain:
+                    submit(*chain[0])
+
+        if writer is not None:
+            writer.close()
+
+    report = pd.DataFrame(rows)
+    report.attrs["failed"] = failed
+    return report
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Run 05_probe_tc_kinetics configs with batch_lm on a process pool.")
+    ap.add_argument("configs", nargs="*", type=Path, help="Config files (default: every configs/*.yaml)")
+    ap.add_argument("--db", type=Path, required=True, help="Path to nerd.sqlite")
+    ap.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes (default: all cores)")
+    ap.add_argument("--engine", help=f"Override the configs' engine (this runner uses '{engine.ENGINE_NAME}')")
+    ap.add_argument("--dry-run", action="store_true", help="Fit and write run directories, but not the database")
+    ap.add_argument("--timings", type=Path, help="Write the per-rg_id timing table to this CSV")
+    ap.add_argument("--incremental", action="store_true", help="Refit only units whose inputs changed")
+    args = ap.parse_args()
+
+    assert args.db.exists(), f"DB not found: {args.db}"
+    paths = args.configs or sorted(CONFIG_DIR.glob("*.yaml"))
+    configs = _load_configs(paths, args.engine)
+
+    t0 = time.perf_counter()
+    report = run_batch(configs, args.db, args.workers, dry_run=args.dry_run, incremental=args.incremental)
+    wall = time.perf_counter() - t0
+
+    ok = report[report.get("error", pd.Series(index=report.index, dtype=object)).isna()]
+    busy = ok["load_s"].sum() + ok["fit_s"].sum() if not ok.empty else 0.0
+    print()
+    if not ok.empty:
+        print(ok.groupby("config")[["n_fits", "n_reused", "load_s", "fit_s", "write_s"]].sum().to_string())
+        slowest = ok.sort_values("fit_s", ascending=False).head(5)
+        print("\nSlowest rg_ids:")
+        print(slowest[["config", "rg_id", "n_fits", "queue_s", "load_s", "fit_s", "write_s"]].to_string(index=False))
+    print(
+        f"\nWall clock {wall:.1f} s for {len(report)} units on {args.workers} workers "
+        f"(worker time {busy:.1f} s, {busy / wall if wall > 0 else 0:.1f}x)"
+    )
+    if args.timings:
+        report.to_csv(args.timings, index=False)
+        print(f"Wrote {args.timings}")
+    if report.attrs["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,792 @@
+"""
+global_melt_engine.py
+Stacked global two-state melt fitter (`engine: global_melt`) for the
+06_probe_tempgrad_fit `mode: two_state_melt` configs.
+
+Same model as `melt_fit` / `safe_frac` in the 2state_melt notebooks, on
+x = 1/T (K^-1) and y = ln(kobs) = log_kappa + log_kdeg of the round3 fits:
+
+    fracf(x) = 1 / (1 + exp(-(dH_fold / R) * (1 / Tm_K - x)))
+    y(x)     = (1 - fracf) * (upper_m * x + upper_b) + fracf * (lower_m * x + lower_b)
+
+Instead of one `lmfit.Model(melt_fit)` fit per site, every site of every group
+(engine_options.group_by, e.g. buffer x base) is stacked into one least-squares
+problem:
+
+    model: global_kadd   one (upper_m, upper_b) per group, shared by its sites
+    model: free_kadd     one (upper_m, upper_b) per site (independent fits)
+
+with per-site lower_m, lower_b, dH_fold and Tm. The residuals and the
+analytic Jacobian are built on flat per-point arrays; the Jacobian is kept as
+its non-zeros (6 per point: 4 site + 2 group parameters), so the normal matrix
+is block-arrow shaped and every Levenberg-Marquardt step is solved exactly
+through per-group 2x2 Schur complements and batched 4x4 site solves. Hundreds
+of sites across constructs are fitted in one call without loops over sites.
+Standard errors follow lmfit (inverse normal matrix scaled by the reduced
+chi-square of the group).
+
+`engine_options.upper_baseline` fixes the upper baselines to the Arrhenius
+ln(kadd) fit instead (slope = -Ea/R, intercept = lnA + ln[probe], as
+`get_lnkaddP0_slope_int` in the notebooks):
+
+    upper_baseline:
+      arrhenius_csv: ../../Figure_analysis/Figure2_ProbeKinetics/Add_Arrhenius/Arrhenius_fit_params_4U_AC.csv
+      group: melted_agg_A
+      probe_conc: 0.015852692
+
+`seed_from_fit: <fit_name>` starts from the per-site parameters of an earlier
+global_melt run with that fit_name (e.g. the free_kadd fit, so run
+2state_kobs_free_A.yaml before 2state_kobs_global_A.yaml). Without such a run
+the fit warns and starts from the default initial guess.
+
+Select the engine in a config with `engine: global_melt` (or pass
+`--engine global_melt` to run it on an existing two_state_melt config).
+
+Usage:
+    python Core_nerd_analysis/06_probe_tempgrad_fit/global_melt_engine.py \\
+        --config Core_nerd_analysis/06_probe_tempgrad_fit/2state_kobs_global_A.yaml \\
+        --db Core_nerd_analysis/nerd.sqlite --engine global_melt
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import sqlite3
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import yaml
+
+_REPO_ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(_REPO_ROOT))
+
+from Figure_analysis.Utilities.setup_env import R_KCAL  # noqa: E402
+
+
+ENGINE_NAME = "global_melt"
+MODELS = ("global_kadd", "free_kadd")
+
+KELVIN = 273.15
+CLIP_LOGK = 50.0
+EPS_FRAC = 1e-12  # safe_frac of the notebooks
+
+SITE_KEYS = ("construct", "nt_id")
+SITE_PARAMS = ("lower_m", "lower_b", "dH_fold", "Tm")
+SHARED_PARAMS = ("upper_m", "upper_b")
+
+# Defaults of fit_meltcurve in the notebooks
+DEFAULT_TM = 42.0
+DEFAULT_TM_BOUNDS = (0.0, 60.0)
+DEFAULT_DH_FOLD = -60.0
+
+# Gradient test of a fit that stalls at the damping cap, as in batch_lm_engine
+GTOL = 1e-6
+
+
+# ------------------------------------------------------------------------
+# Model
+# ------------------------------------------------------------------------
+def melt_curve(x: np.ndarray, upper_m: Any, upper_b: Any, lower_m: Any, lower_b: Any, dH_fold: Any, Tm: Any) -> np.ndarray:
+    """
+    Two-state melt curve; the notebooks' `melt_fit` with `safe_frac` (x = 1/T in K^-1,
+    Tm in °C, dH_fold in kcal/mol). Also the `melt_fit` model of fit_store.
+    """
+    logk = np.clip((dH_fold / R_KCAL) * (1.0 / (Tm + KELVIN) - x), -CLIP_LOGK, CLIP_LOGK)
+    fracf = 1.0 / (1.0 + np.exp(-logk))
+    fracu = np.clip(1.0 - fracf, EPS_FRAC, 1.0 - EPS_FRAC)
+    fracf = np.clip(fracf, EPS_FRAC, 1.0 - EPS_FRAC)
+    return fracu * (upper_m * x + upper_b) + fracf * (lower_m * x + lower_b)
+
+
+@dataclass
+class MeltStack:
+    """
+    Flat per-point arrays of all sites of a fit.
+
+    `site` / `group` index every point into `sites` / `groups`; `site_group`
+    maps every site to its group (its upper baseline).
+    """
+
+    sites: pd.DataFrame
+    groups: pd.DataFrame
+    x: np.ndarray
+    y: np.ndarray
+    sigma: np.ndarray
+    site: np.ndarray
+    group: np.ndarray
+    site_group: np.ndarray
+
+    @property
+    def n_sites(self) -> int:
+        return len(self.sites)
+
+    @property
+    def n_groups(self) -> int:
+        return len(self.groups)
+
+
+def stack_sites(
+    df: pd.DataFrame,
+    group_by: Sequence[str],
+    model: str = "global_kadd",
+    weighted: bool = False,
+    min_points: int = 5,
+    site_keys: Sequence[str] = SITE_KEYS,
+) -> MeltStack:
+    """
+    Stack the per-rg_id points of every site (`site_keys`: construct x nt_id).
+
+    Sites with fewer than `min_points` temperatures are dropped. With
+    `model: free_kadd` every site is its own group.
+    """
+    if model not in MODELS:
+        raise ValueError(f"Unknown two_state_melt model {model!r}; expected one of {MODELS}")
+    site_keys = list(site_keys)
+    df = df.dropna(subset=["x", "y"])
+    df = df[df.groupby(site_keys)["x"].transform("size") >= min_points]
+    if weighted:
+        df = df[np.isfinite(df["y_err"]) & (df["y_err"] > 0)]
+    df = df.sort_values(site_keys + ["x"]).reset_index(drop=True)
+
+    group_keys = list(group_by) if model == "global_kadd" else list(group_by) + site_keys
+    site_codes = df.groupby(site_keys, sort=False, dropna=False).ngroup().to_numpy()
+    group_codes = df.groupby(group_keys, sort=False, dropna=False).ngroup().to_numpy()
+    first = np.unique(site_codes, return_index=True)[1]
+    site_cols = [c for c in dict.fromkeys([*site_keys, "site", "base", "site_base", *group_by]) if c in df]
+    sites_df = df[site_cols].iloc[first].reset_index(drop=True)
+    sites_df["n_points"] = np.bincount(site_codes, minlength=len(sites_df))
+    groups_df = df[list(dict.fromkeys(group_keys))].iloc[np.unique(group_codes, return_index=True)[1]]
+
+    return MeltStack(
+        sites=sites_df,
+        groups=groups_df.reset_index(drop=True),
+        x=df["x"].to_numpy(float),
+        y=df["y"].to_numpy(float),
+        sigma=df["y_err"].to_numpy(float) if weighted else np.ones(len(df)),
+        site=site_codes,
+        group=group_codes,
+        site_group=group_codes[first],
+    )
+
+
+def _linear_fit(x: np.ndarray, y: np.ndarray, codes: np.ndarray, n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Least-squares (slope, intercept) of y on x for every code at once."""
+    count = np.bincount(codes, minlength=n).astype(float)
+    sx, sy = np.bincount(codes, x, n), np.bincount(codes, y, n)
+    sxx, sxy = np.bincount(codes, x * x, n), np.bincount(codes, x * y, n)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slope = (count * sxy - sx * sy) / (count * sxx - sx * sx)
+    slope = np.where(np.isfinite(slope), slope, 0.0)
+    intercept = (sy - slope * sx) / np.maximum(count, 1.0)
+    return slope, intercept
+
+
+def initial_guess(stack: MeltStack, n_edge: int = 3) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Per-site (lower_m, lower_b, dH_fold, Tm) and per-group (upper_m, upper_b) starts.
+
+    As in `fit_meltcurve`: the upper baseline is a line through the `n_edge`
+    hottest points (pooled over the sites of a group), the lower baseline a
+    line through each site's `n_edge` coldest points.
+    """
+    rank = pd.Series(stack.x).groupby(stack.site).rank(method="first").to_numpy()
+    n_pts = np.bincount(stack.site)[stack.site]
+    hot = rank <= n_edge
+    cold = rank > n_pts - n_edge
+    upper = _linear_fit(stack.x[hot], stack.y[hot], stack.group[hot], stack.n_groups)
+    lower = _linear_fit(stack.x[cold], stack.y[cold], stack.site[cold], stack.n_sites)
+    site_p = np.column_stack([
+        lower[0], lower[1], np.full(stack.n_sites, DEFAULT_DH_FOLD), np.full(stack.n_sites, DEFAULT_TM),
+    ])
+    return site_p, np.column_stack(upper)
+
+
+def _model_and_jacobian(
+    stack: MeltStack, site_p: np.ndarray, upper: np.ndarray, pts: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Model values and the Jacobian at the points `pts`.
+
+    Each point depends on 4 parameters of its site and 2 of its group, so the
+    stacked Jacobian is stored as its non-zeros: column j < 4 is the derivative
+    by SITE_PARAMS[j] of the point's site, columns 4-5 by SHARED_PARAMS of its group.
+    """
+    lm, lb, dh, tm = site_p[stack.site[pts]].T
+    um, ub = upper[stack.group[pts]].T
+    x = stack.x[pts]
+
+    tm_k = tm + KELVIN
+    logk = (dh / R_KCAL) * (1.0 / tm_k - x)
+    inside = np.abs(logk) < CLIP_LOGK
+    fracf = 1.0 / (1.0 + np.exp(-np.clip(logk, -CLIP_LOGK, CLIP_LOGK)))
+    fracu = 1.0 - fracf
+    base_u = um * x + ub
+    base_f = lm * x + lb
+    y = base_u + fracf * (base_f - base_u)
+
+    slope = np.where(inside, (base_f - base_u) * fracf * fracu, 0.0)
+    jac = np.column_stack([
+        fracf * x,                                   # lower_m
+        fracf,                                       # lower_b
+        slope * (1.0 / tm_k - x) / R_KCAL,           # dH_fold
+        -slope * dh / (R_KCAL * tm_k**2),            # Tm
+        fracu * x,                                   # upper_m
+        fracu,                                       # upper_b
+    ])
+    return y, jac
+
+
+def _site_points(stack: MeltStack, sites: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Point indices of `sites` (each site's points are contiguous) and the segment starts within them."""
+    counts = np.bincount(stack.site, minlength=stack.n_sites)
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    n = counts[sites]
+    starts = np.concatenate([[0], np.cumsum(n)[:-1]])
+    pts = np.arange(n.sum()) + np.repeat(offsets[sites] - starts, n)
+    return pts, starts
+
+
+def _normal_blocks(
+    stack: MeltStack, sites: np.ndarray, starts: np.ndarray, jac: np.ndarray, resid: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Blocks of J^T J and J^T r for `sites` (jac / resid: their points, in order).
+
+    J^T J is block-arrow shaped within each group: a 4x4 block A_s per site,
+    a 2x2 block C_g for the group's upper baseline and 4x2 couplings B_s.
+    """
+    js, ju = jac[:, :4], jac[:, 4:]
+    A = np.add.reduceat(js[:, :, None] * js[:, None, :], starts, axis=0)
+    B = np.add.reduceat(js[:, :, None] * ju[:, None, :], starts, axis=0)
+    g_s = np.add.reduceat(js * resid[:, None], starts, axis=0)
+    C = np.zeros((stack.n_groups, 2, 2))
+    g_u = np.zeros((stack.n_groups, 2))
+    site_group = stack.site_group[sites]
+    np.add.at(C, site_group, np.add.reduceat(ju[:, :, None] * ju[:, None, :], starts, axis=0))
+    np.add.at(g_u, site_group, np.add.reduceat(ju * resid[:, None], starts, axis=0))
+    return A, B, C, g_s, g_u
+
+
+def _block_arrow_solve(
+    site_group: np.ndarray, A: np.ndarray, B: np.ndarray, C: np.ndarray, g_s: np.ndarray, g_u: np.ndarray,
+    shared: bool,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Solve the (damped) block-arrow normal equations of every group at once.
+
+    The shared step comes from the 2x2 Schur complement of each group,
+    S_g = C_g - sum_s B_s^T A_s^-1 B_s; every site step then from its own 4x4 solve.
+    """
+    eye4 = 1e-12 * np.eye(4)
+    Y = np.linalg.solve(A + eye4, g_s[..., None])[..., 0]
+    if not shared:
+        return -Y, np.zeros_like(g_u)
+    X = np.linalg.solve(A + eye4, B)
+    S = C + 1e-12 * np.eye(2)
+    rhs = -g_u
+    np.add.at(S, site_group, -np.swapaxes(B, 1, 2) @ X)
+    np.add.at(rhs, site_group, np.einsum("nji,nj->ni", B, Y))
+    d_u = np.linalg.solve(S, rhs[..., None])[..., 0]
+    d_s = -Y - np.einsum("nij,nj->ni", X, d_u[site_group])
+    return d_s, d_u
+
+
+def _block_arrow_cov(
+    site_group: np.ndarray, A: np.ndarray, B: np.ndarray, C: np.ndarray, shared: bool
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Per-site 4x4 and per-group 2x2 diagonal blocks of inv(J^T J), through the
+    same Schur complement:
+
+        cov_g = S_g^-1,   cov_s = A_s^-1 + A_s^-1 B_s S_g^-1 B_s^T A_s^-1
+    """
+    A_inv = np.linalg.pinv(A, hermitian=True)  # sites with an unidentifiable transition
+    if not shared:
+        return A_inv, np.full(C.shape, np.nan)
+    AiB = A_inv @ B
+    S = C.copy()
+    np.add.at(S, site_group, -np.swapaxes(B, 1, 2) @ AiB)
+    S_inv = np.linalg.pinv(S, hermitian=True)
+    cov_site = A_inv + AiB @ S_inv[site_group] @ np.swapaxes(AiB, 1, 2)
+    return cov_site, S_inv
+
+
+def _stationary_units(
+    unit_of_site: np.ndarray, n_u: int, A: np.ndarray, C: np.ndarray, g_s: np.ndarray, g_u: np.ndarray,
+    cost: np.ndarray, free_s: np.ndarray, shared: bool,
+) -> np.ndarray:
+    """
+    Per unit: max |cos(J_j, r)| <= GTOL over its free parameters, from the
+    normal blocks of its sites (`unit_of_site` aligned with A / g_s).
+
+    `free_s` masks site parameters held at a bound (Tm clipped to tm_bounds).
+    """
+    r_norm = np.sqrt(cost)
+    cos_max = np.zeros(n_u)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        norm = np.sqrt(np.diagonal(A, axis1=1, axis2=2)) * r_norm[unit_of_site, None]
+        cos = np.where(free_s & (norm > 0), np.abs(g_s) / norm, 0.0)
+        np.maximum.at(cos_max, unit_of_site, cos.max(axis=1))
+        if shared:
+            norm = np.sqrt(np.diagonal(C, axis1=1, axis2=2)) * r_norm[:, None]
+            cos_max = np.maximum(cos_max, np.where(norm > 0, np.abs(g_u) / norm, 0.0).max(axis=1))
+    return cos_max <= GTOL
+
+
+@dataclass
+class MeltFit:
+    """Global melt fit result; `sites` / `groups` hold parameters and lmfit-style errors."""
+
+    sites: pd.DataFrame
+    groups: pd.DataFrame
+    chisqr: float
+    nfev: int
+    success: bool
+
+
+def fit_global_melt(
+    stack: MeltStack,
+    site_p0: Optional[np.ndarray] = None,
+    upper_p0: Optional[np.ndarray] = None,
+    upper_fixed: Optional[Tuple[float, float]] = None,
+    tm_bounds: Tuple[float, float] = DEFAULT_TM_BOUNDS,
+    max_iter: int = 500,
+    ftol: float = 1e-10,
+    xtol: float = 1e-10,
+) -> MeltFit:
+    """
+    Fit every site of `stack` in one stacked Levenberg-Marquardt problem.
+
+    Groups do not share parameters, so each group keeps its own damping factor
+    and convergence state (with `free_kadd` or fixed upper baselines every
+    site does); converged ones drop out of the working set. `upper_fixed` = (slope, intercept)
+    fixes all upper baselines (Arrhenius kadd), otherwise they are fitted per
+    group. Tm is kept within `tm_bounds` (°C), as in `fit_meltcurve`.
+    """
+    guess_site, guess_upper = initial_guess(stack)
+    site_p = guess_site if site_p0 is None else np.where(np.isfinite(site_p0), site_p0, guess_site)
+    site_p[:, 3] = np.clip(site_p[:, 3], *tm_bounds)
+    shared = upper_fixed is None
+    if shared:
+        upper = np.array(guess_upper if upper_p0 is None else upper_p0, dtype=float)
+    else:
+        upper = np.tile(np.asarray(upper_fixed, float), (stack.n_groups, 1))
+
+    # Independent units: a group when it shares an upper baseline, else every site
+    n_g = stack.n_groups
+    unit_of_site = stack.site_group if shared else np.arange(stack.n_sites)
+    unit_of_pt = unit_of_site[stack.site]
+    n_u = int(unit_of_site.max()) + 1 if stack.n_sites else 0
+
+    w = 1.0 / stack.sigma
+    lam = np.full(n_u, 1e-3)
+    done = np.zeros(n_u, dtype=bool)
+    converged = np.zeros(n_u, dtype=bool)
+    eye4, eye2 = np.eye(4), np.eye(2)
+
+    def linearize(sp, up, pts):
+        y, jac = _model_and_jacobian(stack, sp, up, pts)
+        resid = (y - stack.y[pts]) * w[pts]
+        return resid, jac * w[pts, None], np.bincount(unit_of_pt[pts], resid**2, n_u)
+
+    all_sites = np.arange(stack.n_sites)
+    all_pts, all_starts = _site_points(stack, all_sites)
+    resid, jac, cost = linearize(site_p, upper, all_pts)
+    nfev = 1
+    for _ in range(max_iter):
+        if done.all():
+            break
+        act = np.flatnonzero(~done[unit_of_site])
+        pts, starts = _site_points(stack, act)
+        act_unit = unit_of_site[act]
+
+        A, B, C, g_s, g_u = _normal_blocks(stack, act, starts, jac[pts], resid[pts])
+        A_d = A + lam[act_unit, None, None] * np.diagonal(A, axis1=1, axis2=2)[:, :, None] * eye4
+        C_d = C + lam[:, None, None] * np.diagonal(C, axis1=1, axis2=2)[:, :, None] * eye2 if shared else C
+        d_s, d_u = _block_arrow_solve(stack.site_group[act], A_d, B, C_d, g_s, g_u, shared)
+
+        trial_s = site_p.copy()
+        trial_s[act] += d_s
+        trial_s[:, 3] = np.clip(trial_s[:, 3], *tm_bounds)
+        trial_u = upper + d_u
+        resid_t, jac_t, cost_t = linearize(trial_s, trial_u, pts)
+        nfev += 1
+
+        better = (cost_t < cost) & ~done
+        rel_drop = np.where(better, (cost - cost_t) / np.maximum(cost, 1e-300), np.inf)
+        step_max = np.zeros(n_u)
+        np.maximum.at(step_max, act_unit, np.max(np.abs(d_s) / (np.abs(site_p[act]) + xtol), axis=1))
+        if shared:
+            step_max = np.maximum(step_max, np.max(np.abs(d_u) / (np.abs(upper) + xtol), axis=1))
+
+        take_s = act[better[act_unit]]
+        take_pt = better[unit_of_pt[pts]]
+        site_p[take_s] = trial_s[take_s]
+        if shared:
+            upper[better] = trial_u[better]
+        resid[pts[take_pt]] = resid_t[take_pt]
+        jac[pts[take_pt]] = jac_t[take_pt]
+        cost[better] = cost_t[better]
+        lam[better] = np.maximum(lam[better] / 10.0, 1e-12)
+
+        conv = better & ((rel_drop <= ftol) | (step_max <= xtol))
+        rejected = ~better & ~done
+        lam[rejected] *= 10.0
+        # no downhill step even with heavy damping: converged only if the
+        # gradient vanishes there, otherwise the unit stops as failed
+        stuck = rejected & (lam > 1e10)
+        if stuck.any():
+            at_bound = np.isin(site_p[act, 3], tm_bounds)
+            free_s = np.ones((act.size, 4), dtype=bool)
+            free_s[:, 3] = ~at_bound
+            conv |= stuck & _stationary_units(act_unit, n_u, A, C, g_s, g_u, cost, free_s, shared)
+        done |= conv | stuck
+        converged |= conv
+
+    A, B, C, _, _ = _normal_blocks(stack, all_sites, all_starts, jac, resid)
+    cov_site, cov_upper = _block_arrow_cov(stack.site_group, A, B, C, shared)
+
+    # lmfit scales the covariance by the reduced chi-square of the fit (here: of the unit)
+    n_unit_pts = np.bincount(unit_of_pt, minlength=n_u)
+    n_unit_sites = np.bincount(unit_of_site, minlength=n_u)
+    n_group_pts = np.bincount(stack.group, minlength=n_g)
+    n_group_sites = np.bincount(stack.site_group, minlength=n_g)
+    group_cost = np.bincount(stack.group, resid**2, n_g)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        dof = n_unit_pts - 4 * n_unit_sites - (2 if shared else 0)
+        redchi = np.where(dof > 0, cost / dof, np.nan)
+        site_err = np.sqrt(np.diagonal(cov_site, axis1=1, axis2=2) * redchi[unit_of_site, None])
+        upper_err = np.sqrt(np.diagonal(cov_upper, axis1=1, axis2=2) * redchi[:, None]) if shared else cov_upper[:, 0]
+        group_dof = n_group_pts - 4 * n_group_sites - (2 if shared else 0)
+        group_redchi = np.where(group_dof > 0, group_cost / group_dof, np.nan)
+        y_fit = stack.y + resid / w
+        n_site_pts = np.bincount(stack.site, minlength=stack.n_sites)
+        y_mean = np.bincount(stack.site, stack.y, stack.n_sites) / n_site_pts
+        ss_tot = np.bincount(stack.site, (stack.y - y_mean[stack.site]) ** 2, stack.n_sites)
+        ss_res = np.bincount(stack.site, (y_fit - stack.y) ** 2, stack.n_sites)
+        r2 = np.where(ss_tot > 0, 1.0 - ss_res / ss_tot, np.nan)
+    group_success = np.bincount(stack.site_group, ~converged[unit_of_site], n_g) == 0
+
+    sites = stack.sites.copy()
+    sites["group_id"] = stack.site_group
+    for j, name in enumerate(SHARED_PARAMS):
+        sites[name] = upper[stack.site_group, j]
+        sites[f"{name}_err"] = upper_err[stack.site_group, j]
+    for j, name in enumerate(SITE_PARAMS):
+        sites[name] = site_p[:, j]
+        sites[f"{name}_err"] = site_err[:, j]
+    sites["r2"] = r2
+    sites["chisqr"] = np.bincount(stack.site, resid**2, stack.n_sites)
+
+    groups = stack.groups.copy()
+    groups["group_id"] = np.arange(n_g)
+    groups["n_sites"] = n_group_sites
+    groups["n_points"] = n_group_pts
+    for j, name in enumerate(SHARED_PARAMS):
+        groups[name] = upper[:, j]
+        groups[f"{name}_err"] = upper_err[:, j]
+    groups["chisqr"] = group_cost
+    groups["redchi"] = group_redchi
+    groups["success"] = group_success
+
+    return MeltFit(sites=sites, groups=groups, chisqr=float(cost.sum()), nfev=nfev, success=bool(converged.all()))
+
+
+# ------------------------------------------------------------------------
+# Config, data and run directory I/O
+# ------------------------------------------------------------------------
+def load_config(path: str | Path) -> Dict[str, Any]:
+    """The `tempgrad_fit` section of a 06_probe_tempgrad_fit config."""
+    with open(path) as fh:
+        cfg = yaml.safe_load(fh)
+    if "tempgrad_fit" not in cfg:
+        raise ValueError(f"{path}: no tempgrad_fit section")
+    section = cfg["tempgrad_fit"]
+    if section.get("mode") != "two_state_melt":
+        raise ValueError(f"{path}: mode {section.get('mode')!r} is not two_state_melt")
+    return section
+
+
+def config_hash(section: Dict[str, Any]) -> str:
+    """Short hash of a config section, used for the run directory name."""
+    blob = json.dumps(section, sort_keys=True, default=str).encode()
+    return hashlib.sha1(blob).hexdigest()[:7]
+
+
+def parse_outliers(entries: Optional[Iterable[str]]) -> Tuple[List[int], List[Tuple[int, int]]]:
+    """`rg_id:<rg_id>` and `rg_nt_id:<rg_id>:<nt_id>` config entries."""
+    rg_ids, rg_nt_ids = [], []
+    for entry in entries or []:
+        kind, *values = str(entry).split("#", 1)[0].strip().split(":")
+        if kind == "rg_id":
+            rg_ids.append(int(values[0]))
+        elif kind == "rg_nt_id":
+            rg_nt_ids.append((int(values[0]), int(values[1])))
+        else:
+            raise ValueError(f"Unknown outlier entry {entry!r}; expected rg_id:<id> or rg_nt_id:<rg_id>:<nt_id>")
+    return rg_ids, rg_nt_ids
+
+
+def _as_list(value: Any) -> Optional[List[Any]]:
+    if value is None:
+        return None
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+def _placeholders(prefix: str, values: Sequence[Any], params: Dict[str, Any]) -> str:
+    names = []
+    for i, v in enumerate(values):
+        params[f"{prefix}_{i}"] = v
+        names.append(f":{prefix}_{i}")
+    return ", ".join(names)
+
+
+# config filter -> SQL column
+_FILTER_COLUMNS = {
+    "construct": "mc.disp_name",
+    "buffer": "mb.name",
+    "probe": "pr.probe",
+    "rt_protocol": "pr.rt_protocol",
+    "valtype": "w.valtype",
+    "fit_kind": "w.fit_kind",
+}
+
+
+def fetch_melt_points(
+    conn: sqlite3.Connection,
+    filters: Dict[str, Any],
+    outliers: Optional[Iterable[str]] = None,
+    min_r2: Optional[float] = None,
+) -> pd.DataFrame:
+    """
+    One row per (rg_id, nt_id) time-course fit matching the config filters.
+
+    Adds x = 1/T (K^-1), y = ln(kobs) = log_kappa + log_kdeg and its
+    propagated error y_err, as `apply_2state` in the notebooks.
+    """
+    params: Dict[str, Any] = {}
+    where = ["w.nt_id IS NOT NULL", "w.log_kobs IS NOT NULL", "w.log_kdeg IS NOT NULL"]
+    filters = {"fit_kind": "round3_constrained", **(filters or {})}
+    for key, value in filters.items():
+        values = _as_list(value)
+        if key == "base":
+            where.append(f"UPPER(mn.base) IN ({_placeholders('base', [str(v).upper() for v in values], params)})")
+        elif key in _FILTER_COLUMNS:
+            where.append(f"{_FILTER_COLUMNS[key]} IN ({_placeholders(key, values, params)})")
+        else:
+            raise ValueError(f"Unsupported tempgrad_fit filter {key!r}")
+
+    sql = f"""
+        SELECT
+            mc.disp_name AS construct,
+            mb.name AS buffer,
+            pr.probe,
+            pr.rt_protocol,
+            w.rg_id,
+            w.nt_id,
+            mn.site,
+            UPPER(mn.base) AS base,
+            mn.site || '_' || UPPER(mn.base) AS site_base,
+            w.valtype,
+            pr.temperature,
+            pr.replicate,
+            w.log_kobs AS log_kappa,
+            w.log_kdeg,
+            w.log_kobs_err AS log_kappa_err,
+            w.log_kdeg_err,
+            w.diag_r2 AS r2
+        FROM probe_tc_fit_params_wide w
+        JOIN meta_nucleotides mn ON mn.id = w.nt_id
+        JOIN (
+            SELECT DISTINCT rg_id, construct_id, temperature, replicate, buffer_id, probe, rt_protocol
+            FROM probe_reactions
+        ) pr ON pr.rg_id = w.rg_id
+        JOIN meta_constructs mc ON mc.id = pr.construct_id
+        LEFT JOIN meta_buffers mb ON mb.id = pr.buffer_id
+        WHERE {' AND '.join(where)}
+    """
+    df = pd.read_sql_query(sql, conn, params=params)
+
+    drop_rg, drop_rg_nt = parse_outliers(outliers)
+    keep = ~df["rg_id"].isin(drop_rg)
+    if drop_rg_nt:
+        pairs = pd.MultiIndex.from_frame(df[["rg_id", "nt_id"]])
+        keep &= ~pairs.isin(drop_rg_nt)
+    if min_r2 is not None:
+        keep &= df["r2"] > min_r2
+    df = df[keep].reset_index(drop=True)
+
+    df["x"] = 1.0 / (df["temperature"] + KELVIN)
+    df["y"] = df["log_kappa"] + df["log_kdeg"]
+    df["y_err"] = np.sqrt(df["log_kappa_err"] ** 2 + df["log_kdeg_err"] ** 2)
+    return df
+
+
+def arrhenius_upper_baseline(csv_path: str | Path, group: str, probe_conc: float) -> Tuple[float, float]:
+    """(slope, intercept) of ln(kadd * [probe]) vs 1/T from an Arrhenius fit table (lnA, ea in kcal/mol)."""
+    table = pd.read_csv(csv_path)
+    rows = table[table["group"] == group]
+    if rows.empty:
+        raise ValueError(f"{csv_path}: no Arrhenius fit for group {group!r}")
+    row = rows.iloc[0]
+    return -row["ea"] / R_KCAL, row["lnA"] + np.log(probe_conc)
+
+
+def run_root_for(config_path: Path) -> Path:
+    """tempgrad_fit/ next to the 06_probe_tempgrad_fit configs."""
+    return config_path.resolve().parent / "tempgrad_fit"
+
+
+def run_dir_for(config_path: Path, cfg: Dict[str, Any]) -> Path:
+    """tempgrad_fit/<engine>___cfg-<hash>."""
+    return run_root_for(config_path) / f"{ENGINE_NAME}___cfg-{config_hash(cfg)}"
+
+
+def seed_params(run_root: Path, fit_name: str, stack: MeltStack) -> np.ndarray:
+    """Per-site starting parameters from the latest global_melt run named `fit_name` (NaN where missing)."""
+    runs = []
+    for info_path in run_root.glob(f"{ENGINE_NAME}___cfg-*/run_info.json"):
+        with open(info_path) as fh:
+            info = json.load(fh)
+        if info.get("tempgrad_fit", {}).get("fit_name") == fit_name:
+            runs.append((info_path.stat().st_mtime, info_path.parent / "melt_params.csv"))
+    if not runs:
+        raise FileNotFoundError(f"seed_from_fit: no {ENGINE_NAME} run of fit {fit_name!r} under {run_root}")
+    seed = pd.read_csv(max(runs)[1])
+    merged = stack.sites[["construct", "nt_id"]].merge(
+        seed[["construct", "nt_id", *SITE_PARAMS]], how="left", on=["construct", "nt_id"]
+    )
+    return merged[list(SITE_PARAMS)].to_numpy(float)
+
+
+def seed_for(cfg: Dict[str, Any], config_path: Path, stack: MeltStack) -> Optional[np.ndarray]:
+    """
+    Starting site parameters of a config section: its `seed_from_fit` run, or
+    None (initial_guess) when it has none or that run does not exist yet.
+    """
+    fit_name = (cfg.get("engine_options", {}) or {}).get("seed_from_fit")
+    if not fit_name:
+        return None
+    try:
+        return seed_params(run_root_for(config_path), fit_name, stack)
+    except FileNotFoundError as exc:
+        print(f"[WARN] {exc}; starting from the initial guess", file=sys.stderr)
+        return None
+
+
+def load_points(conn: sqlite3.Connection, cfg: Dict[str, Any]) -> pd.DataFrame:
+    """fetch_melt_points for a config section (filters, outliers, min_r2)."""
+    opts = cfg.get("engine_options", {}) or {}
+    return fetch_melt_points(
+        conn, cfg.get("filters", {}), outliers=opts.get("outliers", cfg.get("outliers")), min_r2=opts.get("min_r2")
+    )
+
+
+def stack_options(cfg: Dict[str, Any]) -> Dict[str, Any]:
+    """stack_sites keyword arguments of a config section."""
+    opts = cfg.get("engine_options", {}) or {}
+    return {
+        "group_by": list(opts.get("group_by", ["buffer", "base"])),
+        "model": cfg.get("model", "global_kadd"),
+        "weighted": bool(opts.get("weighted", False)),
+        "min_points": int(opts.get("min_points", 5)),
+    }
+
+
+def fit_options(cfg: Dict[str, Any], config_path: Path) -> Dict[str, Any]:
+    """fit_global_melt keyword arguments of a config section (fixed upper baseline, Tm bounds)."""
+    opts = cfg.get("engine_options", {}) or {}
+    upper_fixed = None
+    if opts.get("upper_baseline"):
+        ub = opts["upper_baseline"]
+        csv_path = Path(ub["arrhenius_csv"])
+        if not csv_path.is_absolute():
+            csv_path = config_path.resolve().parent / csv_path
+        upper_fixed = arrhenius_upper_baseline(csv_path, ub["group"], float(ub["probe_conc"]))
+    return {"upper_fixed": upper_fixed, "tm_bounds": tuple(opts.get("tm_bounds", DEFAULT_TM_BOUNDS))}
+
+
+def fit_config(
+    conn: sqlite3.Connection, cfg: Dict[str, Any], config_path: Path
+) -> Tuple[MeltFit, Dict[str, Any]]:
+    """Fit one two_state_melt config; returns the fit and a timing / size summary."""
+    t0 = time.perf_counter()
+    stack = stack_sites(load_points(conn, cfg), **stack_options(cfg))
+    if stack.n_sites == 0:
+        raise ValueError("No sites with enough temperatures match the config filters")
+    load_s = time.perf_counter() - t0
+
+    site_p0 = seed_for(cfg, config_path, stack)
+    t0 = time.perf_counter()
+    fit = fit_global_melt(stack, site_p0=site_p0, **fit_options(cfg, config_path))
+    fit_s = time.perf_counter() - t0
+    return fit, {
+        "n_sites": stack.n_sites,
+        "n_groups": stack.n_groups,
+        "n_points": len(stack.x),
+        "load_s": load_s,
+        "fit_s": fit_s,
+        "nfev": fit.nfev,
+        "success": fit.success,
+    }
+
+
+def select_engine(config_path: Path, cfg: Dict[str, Any], engine: Optional[str] = None) -> Dict[str, Any]:
+    """Config section with engine set to global_melt; exits if the config (or override) selects another engine."""
+    engine = engine or cfg.get("engine")
+    if engine != ENGINE_NAME:
+        sys.exit(
+            f"{config_path} selects engine {engine!r}; run it with `nerd run tempgrad_fit`, "
+            f"or pass --engine {ENGINE_NAME}"
+        )
+    return {**cfg, "engine": ENGINE_NAME}
+
+
+def write_run_dir(
+    out_dir: Path, config_path: Path, cfg: Dict[str, Any], fit: MeltFit, info: Dict[str, Any]
+) -> Path:
+    """Write melt_params.csv (one row per site), group_params.csv and run_info.json."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    fit.sites.to_csv(out_dir / "melt_params.csv", index=False)
+    fit.groups.to_csv(out_dir / "group_params.csv", index=False)
+    with open(out_dir / "run_info.json", "w") as fh:
+        json.dump({"config": str(config_path), "tempgrad_fit": cfg, "fit": info}, fh, indent=2, default=str)
+    return out_dir
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Stacked global two-state melt fits for 06_probe_tempgrad_fit configs.")
+    ap.add_argument("--config", type=Path, required=True, help="tempgrad_fit config (YAML, mode: two_state_melt)")
+    ap.add_argument("--db", type=Path, required=True, help="Path to nerd.sqlite")
+    ap.add_argument("--engine", help=f"Override the config's engine (this script runs '{ENGINE_NAME}')")
+    ap.add_argument("--out-dir", type=Path, help="Run directory (default: tempgrad_fit/global_melt___cfg-<hash>)")
+    args = ap.parse_args()
+
+    assert args.db.exists(), f"DB not found: {args.db}"
+    cfg = select_engine(args.config, load_config(args.config), args.engine)
+
+    conn = sqlite3.connect(f"{args.db.resolve().as_uri()}?mode=ro", uri=True)
+    fit, info = fit_config(conn, cfg, args.config)
+    conn.close()
+    print(
+        f"{info['n_sites']} sites in {info['n_groups']} groups ({info['n_points']} points): "
+        f"{info['nfev']} evaluations in {info['fit_s']:.2f} s (data load {info['load_s']:.2f} s)"
+    )
+    if not fit.success:
+        n_failed = int((~fit.groups["success"]).sum())
+        print(f"[WARN] {n_failed} of {info['n_groups']} groups did not converge", file=sys.stderr)
+    print(fit.groups.to_string(index=False))
+
+    out_dir = write_run_dir(args.out_dir or run_dir_for(args.config, cfg), args.config, cfg, fit, info)
+    print(f"Wrote {out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,660 @@
+"""
+resample_ci.py
+Resampling confidence intervals for ln(kobs), ΔG, ΔΔG, Tm and dH_fold.
+
+The figure notebooks report ΔG / ΔΔG (fourU_dG.csv, fourU_ddG.csv, the HIV
+`compute_ddG_vs_wt` tables, the P4P6 barplots) and melt Tm / dH_fold with
+errors propagated from single fits. This script resamples the data and refits
+instead:
+
+    method: bootstrap   every draw resamples the time points of each
+                        (rg_id, nt_id) time course and refits round3
+                        (log_kdeg fixed to the stored round2 value, batch_lm
+                        engine), then resamples the replicates / temperatures
+                        of every site. Time courses are filtered as the
+                        05_probe_tc_kinetics config that fits their rg_id
+                        (`outliers`, `done_by`, `rt_protocol`; configs from
+                        `timecourse_configs`, default every
+                        05_probe_tc_kinetics/configs/*.yaml, last one wins)
+    method: mc          parametric Monte Carlo: ln(kobs) of every time-course
+                        fit is drawn from N(ln_kobs, ln_kobs_err) of the
+                        stored fit; replicates are kept
+
+On top of the per-draw ln(kobs) values every job is re-evaluated:
+
+    dG     mean ln(kobs) over the replicates at `temperature`, then ΔG as
+           `calc_dG` in the notebooks (kobs = K / (K + 1) * kadd)
+    melt   a 06_probe_tempgrad_fit two_state_melt config refit by the stacked
+           global_melt engine (all draws in one solve, one group per draw);
+           Tm, dH_fold and, with `temperature`, ln(kobs) and ΔG from the curve.
+           The point fit starts from `seed_from_fit` as global_melt_engine does
+    ddG    per-draw differences of ΔG to `reference` (e.g. construct: hiv_wt),
+           paired on site number and the other key columns
+
+ln(kadd) at `temperature` comes from the aggregated Arrhenius fits (`key` of
+the fit store `arrhenius_fit`, see Figure_analysis/Utilities/fit_store.py)
+or a value / error per base; one ln(kadd)
+draw per base is shared by all sites of a draw, so ΔΔG is not inflated by
+the kadd uncertainty.
+
+Draws are split into chunks of `chunk_size`; every chunk gets its own child
+of np.random.SeedSequence(seed), so results do not depend on the number of
+workers. Chunks run on a local process pool and are stored as
+resample_ci/<label>___cfg-<hash>/chunks/chunk_<i>.npz as they finish; a
+rerun of the same config only computes missing chunks. Percentile intervals
+and the point estimates go to ci.csv and to the `resample_ci` table of
+nerd.sqlite (all rows of the label are replaced).
+
+Usage:
+    python Core_nerd_analysis/07_resample_ci/resample_ci.py \\
+        --config Core_nerd_analysis/07_resample_ci/configs/hiv_dG_25C.yaml \\
+        --db Core_nerd_analysis/nerd.sqlite --workers 8
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+import warnings
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import yaml
+
+_CORE_DIR = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(_CORE_DIR.parent), str(_CORE_DIR / "05_probe_tc_kinetics"), str(_CORE_DIR / "06_probe_tempgrad_fit")]
+
+import batch_lm_engine as tc_engine  # noqa: E402
+import global_melt_engine as melt_engine  # noqa: E402
+from batch_lm_engine import config_hash  # noqa: E402
+from Figure_analysis.Utilities.fit_store import FitStore  # noqa: E402
+
+
+METHODS = ("bootstrap", "mc")
+CI_TABLE = "resample_ci"
+KELVIN = melt_engine.KELVIN
+R_KCAL = melt_engine.R_KCAL
+TIMECOURSE_CONFIG_DIR = _CORE_DIR / "05_probe_tc_kinetics" / "configs"
+
+# Columns that identify one resampled value (missing ones are NULL)
+ITEM_COLUMNS = ("source", "quantity", "construct", "buffer", "site", "site_base", "nt_id", "valtype", "temperature")
+
+_CI_DDL = f"""
+CREATE TABLE IF NOT EXISTS {CI_TABLE} (
+    id            INTEGER PRIMARY KEY,
+    label         TEXT NOT NULL,
+    source        TEXT NOT NULL,
+    quantity      TEXT NOT NULL,
+    construct     TEXT,
+    ref_construct TEXT,
+    buffer        TEXT,
+    ref_buffer    TEXT,
+    site          INTEGER,
+    site_base     TEXT,
+    nt_id         INTEGER,
+    valtype       TEXT,
+    temperature   REAL,
+    method        TEXT NOT NULL,
+    n_draws       INTEGER NOT NULL,
+    n_valid       INTEGER NOT NULL,
+    seed          INTEGER,
+    ci_level      REAL NOT NULL,
+    estimate      REAL,
+    draw_median   REAL,
+    draw_std      REAL,
+    ci_low        REAL,
+    ci_high       REAL,
+    created_at    TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_{CI_TABLE}_label ON {CI_TABLE}(label, quantity);
+CREATE INDEX IF NOT EXISTS idx_{CI_TABLE}_site ON {CI_TABLE}(construct, site_base, quantity);
+"""
+
+
+def calc_dG(ln_kobs: Any, ln_kadd: Any, temperature: float) -> np.ndarray:
+    """ΔG (kcal/mol) from kobs = K / (K + 1) * kadd, as `calc_dG` in the notebooks (NaN where kobs >= kadd)."""
+    kkp1 = np.exp(np.asarray(ln_kobs, float) - ln_kadd)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        K = kkp1 / (1.0 - kkp1)
+        dG = -R_KCAL * (temperature + KELVIN) * np.log(K)
+    return np.where(kkp1 < 1.0, dG, np.nan)
+
+
+# ------------------------------------------------------------------------
+# Config
+# ------------------------------------------------------------------------
+def load_config(path: str | Path) -> Dict[str, Any]:
+    """The `resample_ci` section of a config."""
+    with open(path) as fh:
+        cfg = yaml.safe_load(fh)
+    if "resample_ci" not in cfg:
+        raise ValueError(f"{path}: no resample_ci section")
+    section = cfg["resample_ci"]
+    if section.get("method", "bootstrap") not in METHODS:
+        raise ValueError(f"{path}: method must be one of {METHODS}")
+    if not section.get("dG") and not section.get("melt"):
+        raise ValueError(f"{path}: nothing to resample (add a dG and/or melt job)")
+    return section
+
+
+def _resolve(path: str | Path, base_dir: Path) -> Path:
+    path = Path(path)
+    return path if path.is_absolute() else (base_dir / path).resolve()
+
+
+def resolve_lnkadd(spec: Optional[Dict[str, Any]], temperature: float, base_dir: Path) -> Dict[str, Tuple[float, float]]:
+    """
+    ln(kadd * [probe]) and its error per base at `temperature`.
+
+    Each base takes either `value` / `err`, or `arrhenius_fit` (fit store of
+    the linear fits of ln(kadd) vs 1/T) with the fit's `key` plus
+    `probe_conc`, evaluated as in the notebooks.
+    """
+    out = {}
+    stores: Dict[Path, FitStore] = {}
+    for base, entry in (spec or {}).items():
+        if "arrhenius_fit" in entry:
+            path = _resolve(entry["arrhenius_fit"], base_dir)
+            store = stores.setdefault(path, FitStore(path))
+            if entry.get("key") not in store:
+                raise ValueError(f"lnkadd {base}: no fit {entry.get('key')!r} in {path}")
+            fit = store[entry["key"]]
+            x = np.array([1.0 / (temperature + KELVIN)])
+            value = float(fit.eval(x)[0]) + np.log(float(entry["probe_conc"]))
+            err = float(np.atleast_1d(fit.eval_uncertainty(x))[0])
+        else:
+            value, err = float(entry["value"]), float(entry.get("err", 0.0))
+        out[str(base).upper()] = (value, err)
+    return out
+
+
+# ------------------------------------------------------------------------
+# Jobs and data
+# ------------------------------------------------------------------------
+@dataclass
+class MeltJob:
+    """One two_state_melt config: its points (with unit index) and point fit."""
+
+    name: str
+    points: pd.DataFrame
+    stack_opts: Dict[str, Any]
+    fit_opts: Dict[str, Any]
+    sites: pd.DataFrame  # point-fit rows (melt_engine.fit_global_melt)
+
+
+@dataclass
+class Payload:
+    """Everything a worker needs to compute chunks of draws."""
+
+    method: str
+    temperature: Optional[float]
+    lnkadd: Dict[str, Tuple[float, float]]
+    units: pd.DataFrame  # one row per (rg_id, nt_id, valtype) time-course fit
+    batch: Optional[tc_engine.SiteBatch] = None  # time courses of the units (bootstrap)
+    batch_p0: Optional[np.ndarray] = None
+    dG_points: Optional[pd.DataFrame] = None  # replicate rows, sorted by item
+    dG_items: Optional[pd.DataFrame] = None
+    melt_jobs: List[MeltJob] = field(default_factory=list)
+
+
+def _register_units(units: Dict[Tuple[int, int, str], int], df: pd.DataFrame) -> np.ndarray:
+    keys = zip(df["rg_id"].astype(int), df["nt_id"].astype(int), df["valtype"])
+    return np.array([units.setdefault(k, len(units)) for k in keys], dtype=int)
+
+
+def timecourse_sections(paths: Sequence[Path]) -> Dict[int, Dict[str, Any]]:
+    """rg_id -> probe_timecourse section of the config that fits it (the last config listed wins, as in batch_runner)."""
+    sections: Dict[int, Dict[str, Any]] = {}
+    for path in paths:
+        section = tc_engine.load_config(path)
+        for rg_id in section.get("rg_ids") or []:
+            sections[int(rg_id)] = section
+    return sections
+
+
+def fetch_unit_timecourses(
+    conn: sqlite3.Connection, units: pd.DataFrame, sections: Dict[int, Dict[str, Any]]
+) -> pd.DataFrame:
+    """Time courses of `units`, with each rg_id's fmod values filtered as its 05 config filters them."""
+    rg_ids = sorted(int(r) for r in units["rg_id"].unique())
+    missing = [r for r in rg_ids if r not in sections]
+    if missing:
+        raise ValueError(
+            f"bootstrap: no 05_probe_tc_kinetics config fits rg_id(s) {missing}; list it in timecourse_configs"
+        )
+    by_section: Dict[int, List[int]] = defaultdict(list)
+    for rg_id in rg_ids:
+        by_section[id(sections[rg_id])].append(rg_id)
+
+    frames = []
+    for group in by_section.values():
+        section = sections[group[0]]
+        sub = units[units["rg_id"].isin(group)]
+        frames.append(tc_engine.fetch_timecourses(
+            conn, group, sorted(sub["valtype"].unique()),
+            done_by=section.get("done_by"),
+            nt_ids=sorted(int(n) for n in sub["nt_id"].unique()),
+            outliers=tc_engine.parse_outliers(section.get("outliers")),
+            rt_protocol=section.get("rt_protocol"),
+        ))
+    return pd.concat(frames, ignore_index=True)
+
+
+def build_payload(conn: sqlite3.Connection, cfg: Dict[str, Any], config_path: Path) -> Payload:
+    """Load every job's time-course fits (and, for bootstrap, time courses) once."""
+    base_dir = config_path.resolve().parent
+    temperature = cfg.get("temperature")
+    lnkadd = {}
+    if temperature is not None:
+        lnkadd = resolve_lnkadd(cfg.get("lnkadd"), float(temperature), base_dir)
+        if cfg.get("ignore_lnkadd_err", False):
+            lnkadd = {b: (v, 0.0) for b, (v, _) in lnkadd.items()}
+
+    unit_index: Dict[Tuple[int, int, str], int] = {}
+    frames = []
+    payload = Payload(method=cfg.get("method", "bootstrap"), temperature=temperature, lnkadd=lnkadd, units=pd.DataFrame())
+
+    job = cfg.get("dG")
+    if job:
+        if temperature is None:
+            raise ValueError("The dG job needs `temperature`")
+        df = melt_engine.fetch_melt_points(conn, job.get("filters", {}), outliers=job.get("outliers"), min_r2=job.get("min_r2"))
+        df = df[np.isclose(df["temperature"], float(temperature))]
+        if job.get("site_bases"):
+            df = df[df["site_base"].isin([str(s).upper() for s in job["site_bases"]])]
+        df = df.dropna(subset=["y"]).copy()
+        keys = ["construct", "buffer", "site", "site_base", "valtype"]
+        df["unit"] = _register_units(unit_index, df)
+        df = df.sort_values(keys + ["rg_id"]).reset_index(drop=True)
+        df["item"] = df.groupby(keys, sort=False, dropna=False).ngroup()
+        payload.dG_points = df
+        items = df.groupby("item").agg(
+            **{k: (k, "first") for k in keys}, base=("base", "first"), n_replicates=("rg_id", "size"),
+        ).reset_index()
+        items["nt_id"] = df.groupby("item")["nt_id"].first().to_numpy()
+        payload.dG_items = items
+        frames.append(df)
+
+    for entry in cfg.get("melt") or []:
+        melt_path = _resolve(entry, base_dir)
+        mcfg = melt_engine.load_config(melt_path)
+        df = melt_engine.load_points(conn, mcfg).dropna(subset=["x", "y"]).copy()
+        df["unit"] = _register_units(unit_index, df)
+        stack_opts = melt_engine.stack_options(mcfg)
+        fit_opts = melt_engine.fit_options(mcfg, melt_path)
+        stack = melt_engine.stack_sites(df, **stack_opts)
+        point = melt_engine.fit_global_melt(stack, site_p0=melt_engine.seed_for(mcfg, melt_path, stack), **fit_opts)
+        keep = point.sites[list(melt_engine.SITE_KEYS)]
+        df = df.merge(keep, on=list(melt_engine.SITE_KEYS)).sort_values(list(melt_engine.SITE_KEYS) + ["x"])
+        payload.melt_jobs.append(MeltJob(
+            name=mcfg.get("fit_name", melt_path.stem), points=df.reset_index(drop=True),
+            stack_opts=stack_opts, fit_opts=fit_opts, sites=point.sites,
+        ))
+        frames.append(df)
+
+    cols = ["unit", "rg_id", "nt_id", "valtype", "log_kappa", "log_kdeg", "y", "y_err"]
+    units = pd.concat([f[cols] for f in frames]).drop_duplicates("unit").sort_values("unit").reset_index(drop=True)
+    payload.units = units
+
+    if payload.method == "bootstrap" and not units.empty:
+        if cfg.get("timecourse_configs"):
+            tc_paths = [_resolve(p, base_dir) for p in cfg["timecourse_configs"]]
+        else:
+            tc_paths = sorted(TIMECOURSE_CONFIG_DIR.glob("*.yaml"))
+        tc = fetch_unit_timecourses(conn, units, timecourse_sections(tc_paths))
+        tc = tc.merge(units[["unit", "rg_id", "nt_id", "valtype"]], on=["rg_id", "nt_id", "valtype"])
+        batch = tc_engine.stack_sites(tc.assign(nt_id=tc["unit"]), min_points=3)
+        if len(batch.nt_ids) == 0:
+            raise ValueError("bootstrap: no time courses with at least 3 points for the selected fits")
+        p0 = tc_engine.initial_guess(batch)
+        fitted = units.set_index("unit").loc[batch.nt_ids]
+        p0[:, 0] = fitted["log_kappa"].to_numpy()
+        p0[:, 1] = fitted["log_kdeg"].to_numpy()
+        payload.batch, payload.batch_p0 = batch, p0
+    return payload
+
+
+# ------------------------------------------------------------------------
+# Draws
+# ------------------------------------------------------------------------
+def _segment_resample(codes: np.ndarray, n_draws: int, rng: np.random.Generator) -> np.ndarray:
+    """(n_draws, n_rows) row indices, resampling with replacement within each run of equal (sorted) codes."""
+    counts = np.bincount(codes)
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    u = rng.random((n_draws, len(codes)))
+    return offsets[codes] + np.minimum((u * counts[codes]).astype(int), counts[codes] - 1)
+
+
+def ln_kobs_draws(payload: Payload, n_draws: int, rng: np.random.Generator) -> np.ndarray:
+    """(n_units, n_draws) ln(kobs) per time-course fit."""
+    units = payload.units
+    n_units = len(units)
+    if payload.method == "mc":
+        return units["y"].to_numpy()[:, None] + units["y_err"].fillna(0.0).to_numpy()[:, None] * rng.standard_normal(
+            (n_units, n_draws)
+        )
+
+    out = np.full((n_units, n_draws), np.nan)
+    batch = payload.batch
+    if batch is None or len(batch.nt_ids) == 0:
+        return out
+    n_b, m = batch.t.shape
+    n_pts = batch.n_points.astype(int)
+    # valid points fill the first n_pts columns of every row
+    u = rng.random((n_draws, n_b, m))
+    cols = np.minimum((u * n_pts[None, :, None]).astype(int), n_pts[None, :, None] - 1)
+    rows = np.arange(n_b)[None, :, None]
+    resampled = tc_engine.SiteBatch(
+        np.tile(batch.nt_ids, n_draws),
+        np.tile(batch.bases, n_draws),
+        batch.t[rows, cols].reshape(-1, m),
+        batch.y[rows, cols].reshape(-1, m),
+        np.tile(batch.mask, (n_draws, 1)),
+    )
+    fit = tc_engine.lm_fit_sites(resampled, np.tile(payload.batch_p0, (n_draws, 1)), free=(True, False, True))
+    ln_kobs = np.where(fit.success, fit.params[:, 0] + fit.params[:, 1], np.nan).reshape(n_draws, n_b)
+    out[batch.nt_ids.astype(int)] = ln_kobs.T
+    return out
+
+
+def _lnkadd_draws(payload: Payload, n_draws: int, rng: np.random.Generator) -> Dict[str, np.ndarray]:
+    return {b: v + e * rng.standard_normal(n_draws) for b, (v, e) in sorted(payload.lnkadd.items())}
+
+
+def _per_base_dG(ln_kobs: np.ndarray, bases: Sequence[str], lnkadd: Dict[str, Any], temperature: float) -> np.ndarray:
+    """ΔG for rows of `ln_kobs` ((n, n_draws) or (n,)); NaN for bases without ln(kadd)."""
+    out = np.full(ln_kobs.shape, np.nan)
+    bases = np.asarray([str(b).upper() for b in bases])
+    for base, value in lnkadd.items():
+        rows = bases == base
+        if rows.any():
+            out[rows] = calc_dG(ln_kobs[rows], value, temperature)
+    return out
+
+
+def run_chunk(payload: Payload, n_draws: int, seed: np.random.SeedSequence) -> Dict[str, np.ndarray]:
+    """All resampled quantities of `n_draws` draws: {key: (n_items, n_draws)}."""
+    rng = np.random.default_rng(seed)
+    lnkadd = _lnkadd_draws(payload, n_draws, rng)
+    draws = ln_kobs_draws(payload, n_draws, rng)
+    out: Dict[str, np.ndarray] = {}
+
+    if payload.dG_points is not None and not payload.dG_points.empty:
+        pts = payload.dG_points
+        item = pts["item"].to_numpy()
+        unit = pts["unit"].to_numpy()
+        if payload.method == "bootstrap":
+            rows = _segment_resample(item, n_draws, rng)  # replicates, with replacement
+        else:
+            rows = np.broadcast_to(np.arange(len(pts)), (n_draws, len(pts)))
+        values = draws[unit[rows], np.arange(n_draws)[:, None]]  # (n_draws, n_rows)
+        n_rep = np.bincount(item)
+        starts = np.concatenate([[0], np.cumsum(n_rep)[:-1]])
+        mean = np.add.reduceat(values, starts, axis=1).T / n_rep[:, None]
+        out["dG:ln_kobs"] = mean
+        out["dG:dG"] = _per_base_dG(
+            mean, payload.dG_items["base"], {b: v[None, :] for b, v in lnkadd.items()}, payload.temperature
+        )
+
+    for j, job in enumerate(payload.melt_jobs):
+        out.update({f"melt{j}:{k}": v for k, v in _melt_draws(payload, job, draws, lnkadd, n_draws, rng).items()})
+    return out
+
+
+def _melt_draws(
+    payload: Payload, job: MeltJob, draws: np.ndarray, lnkadd: Dict[str, np.ndarray], n_draws: int,
+    rng: np.random.Generator,
+) -> Dict[str, np.ndarray]:
+    """Refit one melt job for every draw in one stacked global_melt solve."""
+    pts = job.points
+    site_codes = pts.groupby(list(melt_engine.SITE_KEYS), sort=False).ngroup().to_numpy()
+    if payload.method == "bootstrap":
+        rows = _segment_resample(site_codes, n_draws, rng)  # temperatures / replicates of each site
+    else:
+        rows = np.broadcast_to(np.arange(len(pts)), (n_draws, len(pts)))
+    long = pts.iloc[rows.ravel()].reset_index(drop=True)
+    long["draw"] = np.repeat(np.arange(n_draws), len(pts))
+    long["y"] = draws[pts["unit"].to_numpy()[rows], np.arange(n_draws)[:, None]].ravel()
+
+    opts = dict(job.stack_opts)
+    opts["group_by"] = list(opts["group_by"]) + ["draw"]
+    stack = melt_engine.stack_sites(long, site_keys=("draw", *melt_engine.SITE_KEYS), **opts)
+    seed = stack.sites.merge(
+        job.sites[[*melt_engine.SITE_KEYS, *melt_engine.SITE_PARAMS]], how="left", on=list(melt_engine.SITE_KEYS)
+    )
+    fit = melt_engine.fit_global_melt(stack, site_p0=seed[list(melt_engine.SITE_PARAMS)].to_numpy(float), **job.fit_opts)
+
+    # back onto (point-fit site, draw)
+    index = job.sites[list(melt_engine.SITE_KEYS)].reset_index().rename(columns={"index": "row"})
+    where = fit.sites.merge(index, on=list(melt_engine.SITE_KEYS))
+    ok = where["r2"].notna().to_numpy()
+    r, d = where["row"].to_numpy()[ok], where["draw"].to_numpy()[ok]
+    out = {}
+    for name in ("Tm", "dH_fold"):
+        arr = np.full((len(job.sites), n_draws), np.nan)
+        arr[r, d] = where[name].to_numpy()[ok]
+        out[name] = arr
+    if payload.temperature is not None:
+        x = 1.0 / (payload.temperature + KELVIN)
+        curve = melt_engine.melt_curve(x, *(where[c].to_numpy()[ok] for c in ("upper_m", "upper_b", *melt_engine.SITE_PARAMS)))
+        arr = np.full((len(job.sites), n_draws), np.nan)
+        arr[r, d] = curve
+        out["ln_kobs"] = arr
+        out["dG"] = _per_base_dG(arr, job.sites["base"], {b: v[None, :] for b, v in lnkadd.items()}, payload.temperature)
+    return out
+
+
+_PAYLOAD: Optional[Payload] = None
+
+
+def _init_worker(payload: Payload) -> None:
+    global _PAYLOAD
+    _PAYLOAD = payload
+
+
+def _run_chunk_worker(n_draws: int, seed: np.random.SeedSequence) -> Tuple[Dict[str, np.ndarray], int]:
+    return run_chunk(_PAYLOAD, n_draws, seed), os.getpid()
+
+
+# ------------------------------------------------------------------------
+# Point estimates, items and intervals
+# ------------------------------------------------------------------------
+def point_estimates(payload: Payload) -> Dict[str, Tuple[pd.DataFrame, np.ndarray]]:
+    """{key: (items, estimates)} for every key run_chunk returns, from the unresampled data."""
+    out = {}
+    lnkadd = {b: v for b, (v, _) in payload.lnkadd.items()}
+    if payload.dG_items is not None and not payload.dG_items.empty:
+        items = payload.dG_items.assign(source="replicates", temperature=payload.temperature)
+        ln_kobs = payload.dG_points.groupby("item")["y"].mean().to_numpy()
+        out["dG:ln_kobs"] = (items.assign(quantity="ln_kobs"), ln_kobs)
+        out["dG:dG"] = (items.assign(quantity="dG"), _per_base_dG(ln_kobs, items["base"], lnkadd, payload.temperature))
+
+    for j, job in enumerate(payload.melt_jobs):
+        sites = job.sites.assign(source=job.name)
+        valtypes = job.points.groupby(list(melt_engine.SITE_KEYS))["valtype"].first()
+        sites["valtype"] = valtypes.reindex(pd.MultiIndex.from_frame(sites[list(melt_engine.SITE_KEYS)])).to_numpy()
+        for name in ("Tm", "dH_fold"):
+            out[f"melt{j}:{name}"] = (sites.assign(quantity=name), sites[name].to_numpy(float))
+        if payload.temperature is not None:
+            x = 1.0 / (payload.temperature + KELVIN)
+            curve = melt_engine.melt_curve(x, *(sites[c].to_numpy(float) for c in ("upper_m", "upper_b", *melt_engine.SITE_PARAMS)))
+            at_t = sites.assign(temperature=payload.temperature)
+            out[f"melt{j}:ln_kobs"] = (at_t.assign(quantity="ln_kobs"), curve)
+            out[f"melt{j}:dG"] = (at_t.assign(quantity="dG"), _per_base_dG(curve, sites["base"], lnkadd, payload.temperature))
+    return out
+
+
+def ddG_pairs(items: pd.DataFrame, reference: Dict[str, Any]) -> pd.DataFrame:
+    """
+    (row, ref_row) pairs of ΔG items to difference: same site number and same
+    values in the other key columns, with the `reference` column(s) set to the
+    reference value(s).
+    """
+    ref_cols = list(reference)
+    match = [c for c in ("construct", "buffer", "valtype") if c not in ref_cols and c in items] + ["site"]
+    items = items.reset_index(drop=True).assign(row=lambda d: d.index)
+    is_ref = np.logical_and.reduce([items[c] == v for c, v in reference.items()])
+    ref = items[is_ref][match + ref_cols + ["row"]].rename(columns={"row": "ref_row", **{c: f"ref_{c}" for c in ref_cols}})
+    return items[~is_ref].merge(ref, on=match)
+
+
+def summarize(items: pd.DataFrame, estimate: np.ndarray, draws: np.ndarray, ci_level: float) -> pd.DataFrame:
+    """Percentile interval, median, std and the number of finite draws per item."""
+    alpha = (1.0 - ci_level) / 2.0
+    out = items.copy()
+    out["estimate"] = estimate
+    out["n_valid"] = np.isfinite(draws).sum(axis=1)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # items without any finite draw
+        lo, med, hi = np.nanpercentile(draws, [100 * alpha, 50.0, 100 * (1 - alpha)], axis=1)
+        std = np.nanstd(draws, axis=1)
+    out["draw_median"], out["draw_std"], out["ci_low"], out["ci_high"] = med, std, lo, hi
+    return out
+
+
+def collect_intervals(
+    payload: Payload, cfg: Dict[str, Any], chunks: List[Dict[str, np.ndarray]]
+) -> pd.DataFrame:
+    """Intervals of every resampled quantity plus ΔΔG vs `reference`."""
+    ci_level = float(cfg.get("ci_level", 0.95))
+    points = point_estimates(payload)
+    frames = []
+    for key, (items, estimate) in points.items():
+        draws = np.hstack([c[key] for c in chunks])
+        frames.append(summarize(items, estimate, draws, ci_level))
+        if key.endswith(":dG") and cfg.get("reference"):
+            pairs = ddG_pairs(items, cfg["reference"])
+            if pairs.empty:
+                continue
+            row, ref_row = pairs["row"].to_numpy(), pairs["ref_row"].to_numpy()
+            ddG_items = pairs.drop(columns=["row", "ref_row"]).assign(quantity="ddG")
+            frames.append(summarize(ddG_items, estimate[row] - estimate[ref_row], draws[row] - draws[ref_row], ci_level))
+    out = pd.concat(frames, ignore_index=True)
+    cols = [c for c in (*ITEM_COLUMNS, "ref_construct", "ref_buffer") if c in out]
+    value_cols = ["estimate", "draw_median", "draw_std", "ci_low", "ci_high", "n_valid"]
+    return out[cols + value_cols]
+
+
+# ------------------------------------------------------------------------
+# Runs
+# ------------------------------------------------------------------------
+def chunk_plan(cfg: Dict[str, Any]) -> List[Tuple[int, np.random.SeedSequence]]:
+    """(n_draws, seed) per chunk; seeds are children of SeedSequence(seed), independent of the worker count."""
+    n_draws = int(cfg.get("n_draws", 1000))
+    size = int(cfg.get("chunk_size", 50))
+    n_chunks = -(-n_draws // size)
+    seeds = np.random.SeedSequence(int(cfg.get("seed", 0))).spawn(n_chunks)
+    return [(min(size, n_draws - i * size), s) for i, s in enumerate(seeds)]
+
+
+def run_dir_for(config_path: Path, cfg: Dict[str, Any]) -> Path:
+    """resample_ci/<label>___cfg-<hash> next to the configs directory."""
+    return config_path.resolve().parent.parent / "resample_ci" / f"{cfg['label']}___cfg-{config_hash(cfg)}"
+
+
+def run_chunks(
+    payload: Payload, cfg: Dict[str, Any], chunk_dir: Path, workers: int
+) -> Tuple[List[Dict[str, np.ndarray]], Dict[str, Any]]:
+    """Compute (or load) every chunk; each finished chunk is saved before the next is collected."""
+    chunk_dir.mkdir(parents=True, exist_ok=True)
+    plan = chunk_plan(cfg)
+    results: Dict[int, Dict[str, np.ndarray]] = {}
+    for i in range(len(plan)):
+        path = chunk_dir / f"chunk_{i:05d}.npz"
+        if path.exists():
+            with np.load(path) as data:
+                results[i] = {k: data[k] for k in data.files}
+    todo = [i for i in range(len(plan)) if i not in results]
+    print(f"{len(plan)} chunks of up to {plan[0][0]} draws: {len(results)} stored, {len(todo)} to compute")
+
+    t0 = time.perf_counter()
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(payload,)) as pool:
+            pending = {pool.submit(_run_chunk_worker, *plan[i]): i for i in todo}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    i = pending.pop(fut)
+                    arrays, pid = fut.result()
+                    np.savez(chunk_dir / f"chunk_{i:05d}.npz", **arrays)
+                    results[i] = arrays
+                    print(f"[done] chunk {i + 1}/{len(plan)} (pid {pid}, {time.perf_counter() - t0:.1f} s)")
+    info = {"n_chunks": len(plan), "computed": len(todo), "resample_s": time.perf_counter() - t0}
+    return [results[i] for i in range(len(plan))], info
+
+
+def ensure_ci_table(conn: sqlite3.Connection) -> None:
+    """Create the resample_ci table if needed."""
+    conn.executescript(_CI_DDL)
+
+
+def write_intervals(conn: sqlite3.Connection, cfg: Dict[str, Any], intervals: pd.DataFrame) -> int:
+    """Replace every resample_ci row of the config's label, in one transaction."""
+    ensure_ci_table(conn)
+    cols = [c for c in intervals.columns if c != "n_valid"] + ["n_valid"]
+    run = {
+        "label": cfg["label"],
+        "method": cfg.get("method", "bootstrap"),
+        "n_draws": int(cfg.get("n_draws", 1000)),
+        "seed": int(cfg.get("seed", 0)),
+        "ci_level": float(cfg.get("ci_level", 0.95)),
+    }
+    fields = list(run) + cols
+    rows = [
+        tuple(run.values()) + tuple(None if pd.isna(v) else (v.item() if hasattr(v, "item") else v) for v in rec)
+        for rec in intervals[cols].itertuples(index=False)
+    ]
+    with conn:
+        conn.execute(f"DELETE FROM {CI_TABLE} WHERE label = ?", (cfg["label"],))
+        conn.executemany(
+            f"INSERT INTO {CI_TABLE} ({', '.join(fields)}) VALUES ({', '.join('?' * len(fields))})", rows
+        )
+    return len(rows)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Bootstrap / Monte Carlo confidence intervals for ΔG, ΔΔG, Tm and dH.")
+    ap.add_argument("--config", type=Path, required=True, help="resample_ci config (YAML)")
+    ap.add_argument("--db", type=Path, required=True, help="Path to nerd.sqlite")
+    ap.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes (default: all cores)")
+    ap.add_argument("--out-dir", type=Path, help="Run directory (default: resample_ci/<label>___cfg-<hash>)")
+    ap.add_argument("--dry-run", action="store_true", help="Do not write the intervals to the database")
+    args = ap.parse_args()
+
+    assert args.db.exists(), f"DB not found: {args.db}"
+    cfg = load_config(args.config)
+    out_dir = args.out_dir or run_dir_for(args.config, cfg)
+
+    t0 = time.perf_counter()
+    conn = sqlite3.connect(f"{args.db.resolve().as_uri()}?mode=ro", uri=True)
+    payload = build_payload(conn, cfg, args.config)
+    conn.close()
+    load_s = time.perf_counter() - t0
+    print(f"{len(payload.units)} time-course fits, {len(payload.melt_jobs)} melt job(s) loaded in {load_s:.2f} s")
+
+    chunks, info = run_chunks(payload, cfg, out_dir / "chunks", args.workers)
+    intervals = collect_intervals(payload, cfg, chunks)
+    intervals.to_csv(out_dir / "ci.csv", index=False)
+    with open(out_dir / "run_info.json", "w") as fh:
+        json.dump({"config": str(args.config), "resample_ci": cfg, "load_s": load_s, **info}, fh, indent=2, default=str)
+    print(intervals.groupby(["source", "quantity"]).size().to_string())
+    print(f"Wrote {out_dir}")
+
+    if not args.dry_run:
+        conn = sqlite3.connect(str(args.db), timeout=60.0)
+        n = write_intervals(conn, cfg, intervals)
+        conn.close()
+        print(f"Stored {n} intervals in {args.db} ({CI_TABLE}, label {cfg['label']!r})")
+
+
+if __name__ == "__main__":
+    main()
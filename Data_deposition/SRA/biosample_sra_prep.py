@@ -4,21 +4,33 @@ Generate NCBI BioSample (Microbe.1.0-style) and SRA metadata files, plus fastq p
 manifests, grouped by probe_reaction_groups.rg_id.
 
 This combines the logic of biosample_prep.py and sra_prep.py so both are driven by
-a single SQL query.
+a single SQL query. The query streams one row per (sequencing sample, reaction),
+ordered by rg_id, and the files of each reaction group are written as soon as its
+rows are read.
+
+With --checksums, the size and MD5 of every R1/R2 fastq in the manifests are
+computed on a thread pool (chunked reads) and written to rg<id>_<label>_md5.tsv.
+Results are cached in <outdir>/fastq_checksums.sqlite by path, size and mtime, so
+only new or changed fastqs are hashed again. --checksums-only does this for the
+*_fastqs.txt manifests already in --outdir, without the database.
 
 Typical usage:
   python biosample_sra_prep.py \
     --db ../../Core_nerd_analysis/nerd.sqlite \
     --microbe-template ./templates/Microbe.1.0.tsv \
     --sra-template ./templates/SRA_metadata.txt \
-    --outdir to_upload
+    --outdir to_upload --checksums --workers 8
 """
 
 import argparse
 import csv
+import hashlib
+import itertools
+import os
 import sqlite3
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from typing import Iterator, Optional
 
 
 # --- constant description from your methods text (copied from sra_prep.py) ---
@@ -49,6 +61,10 @@ ORGANISM_MAP = {
 #   - BioSample (Microbe.1.0-style TSV)
 #   - SRA run metadata (tab-delimited template)
 #   - fastq path manifests
+# A (sample, reaction) pair is kept if any fmod run of the sample has values for
+# the reaction. The EXISTS probe stops at the first matching probe_fmod_values
+# row (QUERY_INDEXES), instead of joining every nucleotide x valtype row and
+# collapsing the duplicates with GROUP BY.
 COMBINED_SQL = """
 SELECT
     -- sequencing sample + run fields (needed for SRA + fastqs)
@@ -75,22 +91,35 @@ SELECT
     prg.rg_id           AS rg_id,
     prg.rg_label        AS rg_label
 
-FROM probe_fmod_values      AS pfv
-JOIN probe_fmod_runs        AS pfr ON pfv.fmod_run_id = pfr.id
-JOIN sequencing_samples     AS ss  ON pfr.s_id        = ss.id
+FROM sequencing_samples     AS ss
 JOIN sequencing_runs        AS sr  ON ss.seqrun_id    = sr.id
-JOIN probe_reactions        AS pr  ON pfv.rxn_id      = pr.id
+JOIN probe_reactions        AS pr  ON pr.s_id         = ss.id
 JOIN probe_reaction_groups  AS prg ON pr.rg_id        = prg.rg_id
 JOIN meta_constructs        AS mc  ON pr.construct_id = mc.id
 
 WHERE ss.to_drop = 0
-
--- pfv can create many duplicates; keep one row per (sample, reaction)
-GROUP BY ss.id, pr.id
+  AND EXISTS (
+      SELECT 1
+      FROM probe_fmod_runs   AS pfr
+      JOIN probe_fmod_values AS pfv ON pfv.fmod_run_id = pfr.id
+      WHERE pfr.s_id = ss.id
+        AND pfv.rxn_id = pr.id
+  )
 
 ORDER BY prg.rg_id, mc.family, ss.sample_name, pr.id
 """
 
+# Indexes behind the EXISTS probe (created if missing)
+QUERY_INDEXES = {
+    "idx_probe_fmod_values_run_rxn": ("probe_fmod_values", "fmod_run_id, rxn_id"),
+    "idx_probe_fmod_runs_s": ("probe_fmod_runs", "s_id"),
+    "idx_probe_reactions_s": ("probe_reactions", "s_id"),
+}
+
+CHECKSUM_CACHE = "fastq_checksums.sqlite"
+CHECKSUM_FIELDS = ["filename", "path", "size_bytes", "md5"]
+HASH_CHUNK = 8 * 1024 * 1024
+
 
 def get_connection(db_path: Path) -> sqlite3.Connection:
     conn = sqlite3.connect(str(db_path))
@@ -98,6 +127,12 @@ def get_connection(db_path: Path) -> sqlite3.Connection:
     return conn
 
 
+def ensure_query_indexes(conn: sqlite3.Connection) -> None:
+    with conn:
+        for name, (table, cols) in QUERY_INDEXES.items():
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({cols})")
+
+
 def join_fq(fq_dir, fname) -> str:
     if not fq_dir:
         return fname or ""
@@ -224,10 +259,14 @@ def read_sra_headers(template_path: Path) -> list[str]:
 
 # ---------- combined fetch ----------
 
-def fetch_rows(conn: sqlite3.Connection) -> list[dict]:
-    cur = conn.cursor()
-    cur.execute(COMBINED_SQL)
-    return [dict(r) for r in cur.fetchall()]
+def iter_groups(conn: sqlite3.Connection) -> Iterator[tuple[tuple, list[dict]]]:
+    """
+    Stream COMBINED_SQL as ((rg_id, rg_label), rows) per reaction group.
+    Only the rows of the current group are held in memory.
+    """
+    cur = conn.execute(COMBINED_SQL)
+    for key, rows in itertools.groupby(cur, key=lambda r: (r["rg_id"], r["rg_label"])):
+        yield key, [dict(r) for r in rows]
 
 
 def write_biosample_microbe_tsv(
@@ -375,14 +414,143 @@ def write_sra_tsv_and_fastq_manifest(
     return n_sra, len(fastq_paths)
 
 
+# ---------- fastq checksums ----------
+
+class ChecksumCache:
+    """
+    (size, md5) per fastq path in a small SQLite file, valid while the file's
+    size and mtime are unchanged. Only the calling thread reads or writes it.
+    """
+
+    def __init__(self, path: Path):
+        self.conn = sqlite3.connect(str(path))
+        with self.conn:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS fastq_checksums (
+                    path     TEXT PRIMARY KEY,
+                    size     INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    md5      TEXT NOT NULL
+                )
+                """
+            )
+
+    def get(self, path: str, st: os.stat_result) -> Optional[str]:
+        row = self.conn.execute(
+            "SELECT md5 FROM fastq_checksums WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (path, st.st_size, st.st_mtime_ns),
+        ).fetchone()
+        return row[0] if row else None
+
+    def put(self, path: str, st: os.stat_result, md5: str) -> None:
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO fastq_checksums (path, size, mtime_ns, md5) VALUES (?, ?, ?, ?)",
+                (path, st.st_size, st.st_mtime_ns, md5),
+            )
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def file_md5(path: str, chunk_size: int = HASH_CHUNK) -> str:
+    """MD5 of a file, read in chunks (hashlib releases the GIL while hashing)."""
+    h = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def read_manifest(path: Path) -> list[str]:
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def compute_checksums(paths: list[str], cache: ChecksumCache, workers: int = 4) -> dict[str, dict]:
+    """
+    {path: {"filename", "path", "size_bytes", "md5"}} for existing fastqs; cached
+    results are reused, the rest are hashed on `workers` threads.
+    Missing files are reported and left out.
+    """
+    results: dict[str, dict] = {}
+    todo: dict[str, os.stat_result] = {}
+    for p in dict.fromkeys(paths):
+        try:
+            st = os.stat(p)
+        except OSError:
+            print(f"  missing fastq: {p}")
+            continue
+        md5 = cache.get(p, st)
+        if md5 is None:
+            todo[p] = st
+        else:
+            results[p] = {"filename": Path(p).name, "path": p, "size_bytes": st.st_size, "md5": md5}
+
+    print(f"Checksums: {len(results)} cached, {len(todo)} to hash "
+          f"({sum(st.st_size for st in todo.values()) / 1e9:.2f} GB)")
+    if todo:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = {pool.submit(file_md5, p): p for p in todo}
+            for fut in as_completed(futures):
+                p = futures[fut]
+                try:
+                    md5 = fut.result()
+                except OSError as exc:
+                    print(f"  failed to hash {p}: {exc}")
+                    continue
+                st = todo[p]
+                cache.put(p, st, md5)
+                results[p] = {"filename": Path(p).name, "path": p, "size_bytes": st.st_size, "md5": md5}
+    return results
+
+
+def write_checksum_tsv(out_path: Path, manifest_paths: list[str], checksums: dict[str, dict]) -> int:
+    """One row per fastq of a manifest (in manifest order); returns the number of rows."""
+    rows = [checksums[p] for p in manifest_paths if p in checksums]
+    with open(out_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=CHECKSUM_FIELDS, delimiter="\t", lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(rows)
+    return len(rows)
+
+
+def checksum_manifests(manifests: list[Path], outdir: Path, workers: int) -> None:
+    """Write rg<id>_<label>_md5.tsv next to every rg<id>_<label>_fastqs.txt manifest."""
+    listed = {m: read_manifest(m) for m in manifests}
+    cache = ChecksumCache(outdir / CHECKSUM_CACHE)
+    try:
+        checksums = compute_checksums([p for ps in listed.values() for p in ps], cache, workers)
+    finally:
+        cache.close()
+    for manifest, paths in listed.items():
+        out = manifest.with_name(manifest.name.replace("_fastqs.txt", "_md5.tsv"))
+        n = write_checksum_tsv(out, paths, checksums)
+        print(f"  md5:      {out} ({n}/{len(paths)} fastqs)")
+
+
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--db", type=Path, required=True, help="Path to nerd.sqlite")
-    ap.add_argument("--microbe-template", type=Path, required=True, help="Path to templates/Microbe.1.0.tsv")
-    ap.add_argument("--sra-template", type=Path, required=True, help="Path to templates/SRA_metadata.txt")
+    ap.add_argument("--db", type=Path, help="Path to nerd.sqlite")
+    ap.add_argument("--microbe-template", type=Path, help="Path to templates/Microbe.1.0.tsv")
+    ap.add_argument("--sra-template", type=Path, help="Path to templates/SRA_metadata.txt")
     ap.add_argument("--outdir", type=Path, default=Path("to_upload"), help="Output directory")
+    ap.add_argument("--checksums", action="store_true", help="Also write size + MD5 of every manifest fastq")
+    ap.add_argument("--checksums-only", action="store_true",
+                    help="Only checksum the *_fastqs.txt manifests already in --outdir (no database)")
+    ap.add_argument("--workers", type=int, default=4, help="Threads for MD5 hashing")
     args = ap.parse_args()
 
+    if args.checksums_only:
+        manifests = sorted(args.outdir.glob("*_fastqs.txt"))
+        assert manifests, f"No *_fastqs.txt manifests in {args.outdir}"
+        checksum_manifests(manifests, args.outdir, args.workers)
+        return
+
+    for name in ("db", "microbe_template", "sra_template"):
+        if getattr(args, name) is None:
+            ap.error(f"--{name.replace('_', '-')} is required")
     assert args.db.exists(), f"DB not found: {args.db}"
     assert args.microbe_template.exists(), f"Microbe template not found: {args.microbe_template}"
     assert args.sra_template.exists(), f"SRA template not found: {args.sra_template}"
@@ -390,43 +558,45 @@ def main():
     args.outdir.mkdir(parents=True, exist_ok=True)
 
     conn = get_connection(args.db)
-    rows = fetch_rows(conn)
-    conn.close()
-
-    if not rows:
+    ensure_query_indexes(conn)
+
+    manifests = []
+    try:
+        for (rg_id, rg_label), group_rows in iter_groups(conn):
+            label_slug = slugify_label(rg_label)
+
+            biosample_path = args.outdir / f"rg{rg_id}_{label_slug}_BioSample.tsv"
+            sra_path       = args.outdir / f"rg{rg_id}_{label_slug}_SRA.txt"
+            fastqs_path    = args.outdir / f"rg{rg_id}_{label_slug}_fastqs.txt"
+
+            n_bio = write_biosample_microbe_tsv(
+                out_path=biosample_path,
+                microbe_template=args.microbe_template,
+                group_rows=group_rows,
+            )
+
+            n_sra, n_fq = write_sra_tsv_and_fastq_manifest(
+                out_sra_path=sra_path,
+                out_fastqs_path=fastqs_path,
+                sra_template=args.sra_template,
+                group_rows=group_rows,
+            )
+            manifests.append(fastqs_path)
+
+            print(f"rg_id={rg_id}  rows: biosample={n_bio}, sra={n_sra}, fastqs={n_fq}")
+            print(f"  BioSample: {biosample_path}")
+            print(f"  SRA:      {sra_path}")
+            print(f"  fastqs:   {fastqs_path}")
+    finally:
+        conn.close()
+
+    if not manifests:
         print("No rows found (after filtering ss.to_drop=0).")
         return
+    print(f"Found {len(manifests)} reaction groups.")
 
-    grouped = defaultdict(list)
-    for r in rows:
-        grouped[(r["rg_id"], r["rg_label"])].append(r)
-
-    print(f"Found {len(grouped)} reaction groups.")
-
-    for (rg_id, rg_label), group_rows in grouped.items():
-        label_slug = slugify_label(rg_label)
-
-        biosample_path = args.outdir / f"rg{rg_id}_{label_slug}_BioSample.tsv"
-        sra_path       = args.outdir / f"rg{rg_id}_{label_slug}_SRA.txt"
-        fastqs_path    = args.outdir / f"rg{rg_id}_{label_slug}_fastqs.txt"
-
-        n_bio = write_biosample_microbe_tsv(
-            out_path=biosample_path,
-            microbe_template=args.microbe_template,
-            group_rows=group_rows,
-        )
-
-        n_sra, n_fq = write_sra_tsv_and_fastq_manifest(
-            out_sra_path=sra_path,
-            out_fastqs_path=fastqs_path,
-            sra_template=args.sra_template,
-            group_rows=group_rows,
-        )
-
-        print(f"rg_id={rg_id}  rows: biosample={n_bio}, sra={n_sra}, fastqs={n_fq}")
-        print(f"  BioSample: {biosample_path}")
-        print(f"  SRA:      {sra_path}")
-        print(f"  fastqs:   {fastqs_path}")
+    if args.checksums:
+        checksum_manifests(manifests, args.outdir, args.workers)
 
 
 if __name__ == "__main__":
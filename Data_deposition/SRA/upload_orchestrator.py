@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Concurrent, resumable upload of the fastq manifests written by biosample_sra_prep.py.
+
+upload_ascp_sequential.sh (driven by run_all_aspera_uploads.sh) sends one file at
+a time with `ascp -l100m -k1` and only writes a summary at the end of each list.
+This script runs --jobs transfers at once and splits the --bandwidth budget
+(Mbps) evenly between them, so the total rate stays at what the sequential
+uploads used. Every file has a row in a state journal
+(<logdir>/upload_journal.sqlite: pending / running / done / failed / missing,
+attempts, exit code, seconds), written by the main thread only. A rerun skips
+files that are done with the same size and mtime; files left `running` by an
+interrupted run are sent again (ascp -k1 resumes partial transfers).
+
+Each rg<id>_<label>_fastqs.txt manifest goes to <remote-base>/rg<id>_<label>, as
+in run_all_aspera_uploads.sh. The transfer command is a template, so another
+tool (or a local copy for testing) can be used instead of ascp:
+
+    {src}          local fastq path
+    {remote}       remote directory (<remote-base>/<manifest>)
+    {dest}         <user-host>:<remote> (ascp destination)
+    {rate_mbps}    per-transfer bandwidth limit
+
+The command is run without a shell, one process per file.
+
+Typical usage:
+  python upload_orchestrator.py to_upload/*_fastqs.txt --jobs 4 --bandwidth 400
+
+  # offline check against a local directory
+  mkdir -p /tmp/ncbi/rg125_3
+  python upload_orchestrator.py to_upload/rg125_3_fastqs.txt --remote-base /tmp/ncbi \\
+    --command 'cp {src} {remote}/'
+"""
+
+import argparse
+import csv
+import os
+import shlex
+import sqlite3
+import subprocess
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Optional
+
+
+REMOTE_BASE = "uploads/edr.choi_gmail.com_DXDctDev"
+ASCP_COMMAND = "{ascp} -i {key} -QT -l{rate_mbps}m -k1 -d {src} {dest}"
+JOURNAL = "upload_journal.sqlite"
+
+
+# ---------- journal ----------
+
+class Journal:
+    """Per-file upload state, keyed by (local path, remote directory)."""
+
+    def __init__(self, path: Path):
+        self.conn = sqlite3.connect(str(path))
+        self.conn.row_factory = sqlite3.Row
+        with self.conn:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS uploads (
+                    path      TEXT NOT NULL,
+                    remote    TEXT NOT NULL,
+                    manifest  TEXT,
+                    size      INTEGER,
+                    mtime_ns  INTEGER,
+                    status    TEXT NOT NULL,
+                    attempts  INTEGER NOT NULL DEFAULT 0,
+                    exit_code INTEGER,
+                    started   TEXT,
+                    seconds   REAL,
+                    PRIMARY KEY (path, remote)
+                )
+                """
+            )
+
+    def get(self, path: str, remote: str) -> Optional[sqlite3.Row]:
+        return self.conn.execute(
+            "SELECT * FROM uploads WHERE path = ? AND remote = ?", (path, remote)
+        ).fetchone()
+
+    def set(self, path: str, remote: str, **fields) -> None:
+        cols = ", ".join(fields)
+        with self.conn:
+            self.conn.execute(
+                f"INSERT INTO uploads (path, remote, {cols}) VALUES (?, ?, {', '.join('?' * len(fields))}) "
+                f"ON CONFLICT (path, remote) DO UPDATE SET "
+                + ", ".join(f"{k} = excluded.{k}" for k in fields),
+                (path, remote, *fields.values()),
+            )
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+# ---------- planning ----------
+
+def read_manifest(path: Path) -> list[str]:
+    """Fastq paths of a manifest (blank lines and # comments skipped)."""
+    with open(path) as f:
+        return [s for s in (line.strip() for line in f) if s and not s.startswith("#")]
+
+
+def remote_for(manifest: Path, remote_base: str) -> str:
+    name = manifest.name
+    name = name[: -len("_fastqs.txt")] if name.endswith("_fastqs.txt") else manifest.stem
+    return f"{remote_base.rstrip('/')}/{name}"
+
+
+def plan(
+    manifests: list[Path], remote_base: str, journal: Journal, force: bool = False, record: bool = True
+) -> tuple[list[dict], int]:
+    """
+    Transfers still to do as dicts (path, remote, manifest, size, mtime_ns),
+    and the number of files skipped as already done.
+    Missing files are left out; with `record`, they are journaled as missing
+    and the transfers to do as pending.
+    """
+    todo, n_done = [], 0
+    for manifest in manifests:
+        remote = remote_for(manifest, remote_base)
+        for p in dict.fromkeys(read_manifest(manifest)):
+            try:
+                st = os.stat(p)
+            except OSError:
+                print(f"[WARN] Missing file (skipping): {p}")
+                if record:
+                    journal.set(p, remote, manifest=manifest.name, status="missing")
+                continue
+            row = journal.get(p, remote)
+            if (
+                not force and row is not None and row["status"] == "done"
+                and row["size"] == st.st_size and row["mtime_ns"] == st.st_mtime_ns
+            ):
+                n_done += 1
+                continue
+            job = {"path": p, "remote": remote, "manifest": manifest.name, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+            if record:
+                journal.set(p, remote, manifest=job["manifest"], size=job["size"], mtime_ns=job["mtime_ns"], status="pending")
+            todo.append(job)
+    return todo, n_done
+
+
+# ---------- transfers ----------
+
+def build_command(template: str, job: dict, rate_mbps: int, user_host: str) -> list[str]:
+    fields = {
+        "src": job["path"],
+        "remote": job["remote"],
+        "dest": f"{user_host}:{job['remote']}",
+        "rate_mbps": rate_mbps,
+        "ascp": os.environ.get("ASCP_BIN", "ascp"),
+        "key": os.environ.get("ASCP_KEY", str(Path.home() / ".aspera" / "aspera.openssh")),
+    }
+    return [token.format(**fields) for token in shlex.split(template)]
+
+
+def transfer(cmd: list[str], log_path: Path) -> tuple[int, float]:
+    """Run one transfer command; returns (exit code, seconds)."""
+    t0 = time.perf_counter()
+    with open(log_path, "a") as log:
+        log.write(f"$ {shlex.join(cmd)}\n")
+        log.flush()
+        try:
+            ec = subprocess.run(cmd, stdout=log, stderr=subprocess.STDOUT).returncode
+        except OSError as exc:
+            log.write(f"{exc}\n")
+            ec = 127
+    return ec, time.perf_counter() - t0
+
+
+def run_transfers(
+    todo: list[dict],
+    journal: Journal,
+    template: str,
+    jobs: int,
+    bandwidth_mbps: float,
+    user_host: str,
+    logdir: Path,
+    retries: int,
+) -> list[dict]:
+    """
+    Run `todo` on `jobs` threads, each limited to bandwidth_mbps / jobs; the
+    main thread updates the journal. Failed transfers are requeued up to
+    `retries` times. Returns one result per file.
+    """
+    jobs = max(1, min(jobs, len(todo)))
+    rate = max(1, int(bandwidth_mbps // jobs))
+    queue = sorted(todo, key=lambda j: j["size"], reverse=True)
+    attempts: dict[tuple, int] = {}
+    results = []
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        running = {}
+
+        def submit(job):
+            key = (job["path"], job["remote"])
+            attempts[key] = attempts.get(key, 0) + 1
+            prev = journal.get(*key)
+            journal.set(
+                *key, status="running", attempts=(prev["attempts"] if prev else 0) + 1,
+                started=time.strftime("%Y-%m-%d %H:%M:%S"),
+            )
+            cmd = build_command(template, job, rate, user_host)
+            log_path = logdir / f"{Path(job['remote']).name}__{Path(job['path']).name}.log"
+            running[pool.submit(transfer, cmd, log_path)] = job
+
+        while queue or running:
+            while queue and len(running) < jobs:
+                submit(queue.pop(0))
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                job = running.pop(fut)
+                ec, seconds = fut.result()
+                key = (job["path"], job["remote"])
+                status = "done" if ec == 0 else "failed"
+                journal.set(*key, status=status, exit_code=ec, seconds=round(seconds, 2))
+                mbps = job["size"] * 8 / 1e6 / seconds if seconds > 0 else float("nan")
+                if ec == 0:
+                    print(f"[OK]   {job['path']} ({job['size'] / 1e6:.1f} MB, {seconds:.1f} s, {mbps:.1f} Mbps)")
+                elif attempts[key] <= retries:
+                    print(f"[RETRY] exit {ec}: {job['path']}")
+                    queue.append(job)
+                    continue
+                else:
+                    print(f"[FAIL] Upload failed (exit {ec}): {job['path']}")
+                results.append({**job, "exit_code": ec, "status": status, "seconds": seconds, "mbps": mbps})
+    return results
+
+
+def write_summaries(journal: Journal, remotes: list[str], logdir: Path) -> None:
+    """
+    <logdir>/<remote dir>_summary.tsv per manifest from the journal, so files
+    finished by earlier runs are listed too (file, exit_code, status, attempts,
+    seconds, mbps).
+    """
+    for remote in remotes:
+        rows = journal.conn.execute("SELECT * FROM uploads WHERE remote = ? ORDER BY path", (remote,)).fetchall()
+        with open(logdir / f"{Path(remote).name}_summary.tsv", "w", newline="") as f:
+            w = csv.writer(f, delimiter="\t", lineterminator="\n")
+            w.writerow(["file", "exit_code", "status", "attempts", "seconds", "mbps"])
+            for r in rows:
+                mbps = r["size"] * 8 / 1e6 / r["seconds"] if r["size"] and r["seconds"] else None
+                w.writerow([
+                    r["path"], "NA" if r["exit_code"] is None else r["exit_code"], r["status"].upper(),
+                    r["attempts"], "" if r["seconds"] is None else f"{r['seconds']:.2f}",
+                    "" if mbps is None else f"{mbps:.2f}",
+                ])
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Concurrent, resumable upload of fastq manifests.")
+    ap.add_argument("manifests", nargs="*", type=Path, help="*_fastqs.txt manifests (default: to_upload/*_fastqs.txt)")
+    ap.add_argument("--remote-base", default=REMOTE_BASE, help="Remote upload folder; each manifest goes to a subfolder")
+    ap.add_argument("--user-host", default=os.environ.get("ASCP_USER_HOST", "subasp@upload.ncbi.nlm.nih.gov"))
+    ap.add_argument("--command", default=ASCP_COMMAND,
+                    help="Transfer command template ({src}, {remote}, {dest}, {rate_mbps}, {ascp}, {key})")
+    ap.add_argument("-j", "--jobs", type=int, default=4, help="Concurrent transfers")
+    ap.add_argument("--bandwidth", type=float, default=100, help="Total bandwidth budget in Mbps, split across --jobs")
+    ap.add_argument("--retries", type=int, default=1, help="Extra attempts per failed file")
+    ap.add_argument("--logdir", type=Path, default=Path(os.environ.get("LOGDIR", "ascp_logs")))
+    ap.add_argument("--force", action="store_true", help="Upload files the journal marks as done too")
+    ap.add_argument("--dry-run", action="store_true", help="Only list the pending transfers")
+    args = ap.parse_args()
+
+    manifests = args.manifests or sorted(Path("to_upload").glob("*_fastqs.txt"))
+    if not manifests:
+        ap.error("No manifests given and none found in to_upload/")
+    args.logdir.mkdir(parents=True, exist_ok=True)
+
+    journal = Journal(args.logdir / JOURNAL)
+    try:
+        todo, n_done = plan(manifests, args.remote_base, journal, force=args.force, record=not args.dry_run)
+        total_mb = sum(j["size"] for j in todo) / 1e6
+        print(f"[INFO] {len(manifests)} manifest(s): {len(todo)} file(s) to upload ({total_mb:.1f} MB), "
+              f"{n_done} already done; journal: {args.logdir / JOURNAL}")
+        if args.dry_run:
+            for job in todo:
+                print(shlex.join(build_command(args.command, job, max(1, int(args.bandwidth // max(1, args.jobs))), args.user_host)))
+            return
+        if not todo:
+            return
+
+        t0 = time.perf_counter()
+        results = run_transfers(
+            todo, journal, args.command, args.jobs, args.bandwidth, args.user_host, args.logdir, args.retries
+        )
+        wall = time.perf_counter() - t0
+        write_summaries(journal, sorted({remote_for(m, args.remote_base) for m in manifests}), args.logdir)
+    finally:
+        journal.close()
+
+    ok = [r for r in results if r["status"] == "done"]
+    sent_mb = sum(r["size"] for r in ok) / 1e6
+    busy = sum(r["seconds"] for r in results)
+    print(f"[INFO] Done: {len(ok)}/{len(results)} uploaded, {sent_mb:.1f} MB in {wall:.1f} s "
+          f"({sent_mb * 8 / wall if wall > 0 else float('nan'):.1f} Mbps aggregate, "
+          f"{busy / wall if wall > 0 else 0:.1f} transfers in flight on average)")
+    failed = [r["path"] for r in results if r["status"] != "done"]
+    if failed:
+        raise SystemExit(f"[FAIL] {len(failed)} file(s) failed; rerun to retry (see {args.logdir})")
+
+
+if __name__ == "__main__":
+    main()
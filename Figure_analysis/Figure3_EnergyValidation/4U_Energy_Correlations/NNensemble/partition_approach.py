@@ -4,13 +4,34 @@ adapted into a CLI. Computes the energetic penalty of forcing a nucleotide
 site to be unpaired using the partition function (ensemble-based approach).
 
 Need to make sure RNAstructure is installed and available in your PATH.
+
+Each partition-function run (the unconstrained sequence and one per A/C site)
+gets its own temporary directory for its constraint and .pfs files, so runs
+are independent: `--workers` runs them concurrently, and several invocations
+can share a working directory. Failed RNAstructure calls are retried
+(`--retries`); the CSV is written in sequence order.
+
+Several FASTAs and temperatures can be given at once (`-i a.fasta b.fasta
+-t 298.15 310.15`): all partition runs are scheduled on one pool, the
+unconstrained ensemble energy is computed once per (sequence, temperature),
+and the output is one long-form CSV (name, temperature, site, base,
+site_base, dG). Ensemble energies are stored in a SQLite cache keyed by
+sequence hash, constraint and temperature (`--cache`, default
+partition_cache.sqlite), so re-runs and overlapping sweeps only run what is
+missing.
 """
 
 import argparse
 import csv
+import hashlib
 import os
+import sqlite3
 import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
 
 
 def read_sequence(seq_path: Path) -> str:
@@ -64,35 +85,191 @@ def write_constraint(constraint_path: Path, position: int) -> None:
         constraint.write("-1 -1\n")
 
 
-def process_sequence(seq_path: Path, temperature: float, output_csv: Path) -> None:
-    """Compute DDG for all A/C nucleotides and write results to CSV."""
-    sequence = read_sequence(seq_path)
-    pfs_path = seq_path.with_suffix(seq_path.suffix + ".pfs")
-    constraint_path = Path("constraint.con")
+def position_energy(
+    seq_path: Path,
+    temperature: float,
+    position: Optional[int] = None,
+    retries: int = 2,
+    tmp_dir: Optional[Path] = None,
+) -> float:
+    """
+    Ensemble energy with `position` forced single stranded (None: unconstrained).
 
-    run_partition(seq_path, pfs_path, temperature)
-    base_energy = ensemble_energy(pfs_path)
+    Runs in a fresh temporary directory holding this run's constraint and .pfs
+    files; a failed `partition` / `EnsembleEnergy` call (non-zero exit or
+    unparsable output) is retried up to `retries` times.
+    """
+    attempt = 0
+    while True:
+        with tempfile.TemporaryDirectory(prefix=f"partition_{position or 'wt'}_", dir=tmp_dir) as work:
+            pfs_path = Path(work) / f"{seq_path.stem}.pfs"
+            constraint_path = None
+            if position is not None:
+                constraint_path = Path(work) / "constraint.con"
+                write_constraint(constraint_path, position)
+            try:
+                run_partition(seq_path, pfs_path, temperature, constraint_path)
+                return ensemble_energy(pfs_path)
+            except (subprocess.CalledProcessError, ValueError, IndexError) as exc:
+                attempt += 1
+                if attempt > retries:
+                    raise RuntimeError(f"RNAstructure failed for position {position} after {attempt} attempts") from exc
+                print(f"Retrying position {position} ({exc})")
+        time.sleep(0.5 * attempt)
 
-    with output_csv.open("w", newline="") as outwrite:
-        writer = csv.writer(outwrite)
-        writer.writerow(["site", "base", "dG"])
 
-        for nucposition, base in enumerate(sequence, start=1):
-            if base not in {"A", "C"}:
+class EnergyCache:
+    """Ensemble energies keyed by (sequence hash, constraint, temperature) in a SQLite file."""
+
+    def __init__(self, path: Optional[Path]):
+        self.conn = sqlite3.connect(str(path)) if path else None
+        if self.conn:
+            with self.conn:
+                self.conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS ensemble_energy (
+                        seq_hash    TEXT NOT NULL,
+                        constraint_key TEXT NOT NULL,
+                        temperature REAL NOT NULL,
+                        energy      REAL NOT NULL,
+                        created_at  TEXT DEFAULT CURRENT_TIMESTAMP,
+                        PRIMARY KEY (seq_hash, constraint_key, temperature)
+                    )
+                    """
+                )
+
+    def get(self, seq_hash: str, constraint: str, temperature: float) -> Optional[float]:
+        if not self.conn:
+            return None
+        row = self.conn.execute(
+            "SELECT energy FROM ensemble_energy WHERE seq_hash = ? AND constraint_key = ? AND temperature = ?",
+            (seq_hash, constraint, temperature),
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def put(self, seq_hash: str, constraint: str, temperature: float, energy: float) -> None:
+        if self.conn:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO ensemble_energy (seq_hash, constraint_key, temperature, energy) VALUES (?, ?, ?, ?)",
+                    (seq_hash, constraint, temperature, energy),
+                )
+
+    def close(self) -> None:
+        if self.conn:
+            self.conn.close()
+
+
+def sequence_hash(sequence: str) -> str:
+    """sha1 of the sequence (upper case, T as U), so renamed or reformatted FASTAs share cache entries."""
+    return hashlib.sha1(sequence.upper().replace("T", "U").encode()).hexdigest()
+
+
+def constraint_key(position: Optional[int]) -> str:
+    """Cache key of a constraint: '' (none) or SS:<position>."""
+    return "" if position is None else f"SS:{position}"
+
+
+def sweep(
+    seq_paths: Sequence[Path],
+    temperatures: Sequence[float],
+    workers: int = 1,
+    retries: int = 2,
+    tmp_dir: Optional[Path] = None,
+    cache: Optional[EnergyCache] = None,
+) -> List[Dict[str, object]]:
+    """
+    DDG of every A/C site of every sequence at every temperature, as long-form rows.
+
+    All missing (unconstrained and constrained) partition runs go to one pool;
+    runs shared by several inputs (same sequence and temperature) run once.
+    Energies are cached as they finish, so a failed sweep keeps its progress.
+    """
+    cache = cache or EnergyCache(None)
+    sequences = {Path(p): read_sequence(Path(p)) for p in seq_paths}
+    hashes = {p: sequence_hash(seq) for p, seq in sequences.items()}
+
+    energies: Dict[Tuple[str, str, float], float] = {}
+    todo: Dict[Tuple[str, str, float], Tuple[Path, float, Optional[int]]] = {}
+    for path, sequence in sequences.items():
+        positions = [None] + [i for i, base in enumerate(sequence, start=1) if base in {"A", "C"}]
+        for temperature in temperatures:
+            for position in positions:
+                key = (hashes[path], constraint_key(position), float(temperature))
+                if key in energies or key in todo:
+                    continue
+                cached = cache.get(*key)
+                if cached is not None:
+                    energies[key] = cached
+                else:
+                    todo[key] = (path, float(temperature), position)
+    print(f"{len(energies) + len(todo)} partition runs: {len(energies)} cached, {len(todo)} to run")
+
+    errors = []
+    # RNAstructure does the work in subprocesses, so threads are enough
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {
+            pool.submit(position_energy, path, temperature, position, retries, tmp_dir): key
+            for key, (path, temperature, position) in todo.items()
+        }
+        for fut in as_completed(futures):
+            key = futures[fut]
+            try:
+                energies[key] = fut.result()
+            except RuntimeError as exc:
+                errors.append(exc)
                 continue
+            cache.put(*key, energies[key])
+    if errors:
+        raise errors[0]
+
+    rows = []
+    for path, sequence in sequences.items():
+        for temperature in temperatures:
+            base_energy = energies[(hashes[path], "", float(temperature))]
+            for nucposition, base in enumerate(sequence, start=1):
+                if base not in {"A", "C"}:
+                    continue
+                constrained_energy = energies[(hashes[path], constraint_key(nucposition), float(temperature))]
+                rows.append({
+                    "name": path.stem,
+                    "seq_hash": hashes[path][:12],
+                    "temperature": float(temperature),
+                    "temperature_c": round(float(temperature) - 273.15, 2),
+                    "site": nucposition,
+                    "base": base,
+                    "site_base": f"{nucposition}_{base}",
+                    "dG": round(constrained_energy - base_energy, 2),
+                })
+    return rows
+
 
-            write_constraint(constraint_path, nucposition)
-            run_partition(seq_path, pfs_path, temperature, constraint_path)
-            constrained_energy = ensemble_energy(pfs_path)
-            ddg = constrained_energy - base_energy
+def process_sequence(
+    seq_path: Path,
+    temperature: float,
+    output_csv: Path,
+    workers: int = 1,
+    retries: int = 2,
+    tmp_dir: Optional[Path] = None,
+    cache: Optional[EnergyCache] = None,
+) -> None:
+    """Compute DDG for all A/C nucleotides (on `workers` concurrent RNAstructure runs) and write results to CSV."""
+    rows = sweep([seq_path], [temperature], workers=workers, retries=retries, tmp_dir=tmp_dir, cache=cache)
 
-            writer.writerow([nucposition, base, f"{ddg:.2f}"])
+    with output_csv.open("w", newline="") as outwrite:
+        writer = csv.writer(outwrite)
+        writer.writerow(["site", "base", "dG"])
+        for row in rows:
+            writer.writerow([row["site"], row["base"], f"{row['dG']:.2f}"])
 
-    if constraint_path.exists():
-        constraint_path.unlink()
-    
-    if pfs_path.exists():
-        pfs_path.unlink()
+
+def write_long_csv(rows: List[Dict[str, object]], output_csv: Path) -> None:
+    """One row per (sequence, temperature, site)."""
+    with output_csv.open("w", newline="") as outwrite:
+        writer = csv.DictWriter(outwrite, fieldnames=list(rows[0]) if rows else ["name"])
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({**row, "dG": f"{row['dG']:.2f}"})
 
 
 def main() -> None:
@@ -103,32 +280,78 @@ def main() -> None:
         "-i",
         "--input",
         required=True,
-        help="Input FASTA file",
+        nargs="+",
+        help="Input FASTA file(s)",
     )
     parser.add_argument(
         "-t",
         "--temperature",
         type=float,
         required=True,
-        help="Temperature (Kelvin) to pass to RNAstructure",
+        nargs="+",
+        help="Temperature(s) (Kelvin) to pass to RNAstructure",
     )
     parser.add_argument(
         "-o",
         "--output",
-        help="Output CSV file. Defaults to <input_basename>_ensemble.csv",
+        help="Output CSV file. Defaults to <input_basename>_ensemble.csv (one FASTA and temperature) "
+        "or ensemble_sweep.csv (long form)",
+        default=None,
+    )
+    parser.add_argument(
+        "--long",
+        action="store_true",
+        help="Write the long-form table even for one FASTA and temperature",
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Concurrent RNAstructure runs (default: all cores)",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=2,
+        help="Retries of a failed partition / EnsembleEnergy call (default: 2)",
+    )
+    parser.add_argument(
+        "--tmp-dir",
         default=None,
+        help="Parent of the per-run temporary directories (default: system temp dir)",
+    )
+    parser.add_argument(
+        "--cache",
+        default="partition_cache.sqlite",
+        help="SQLite cache of ensemble energies (default: partition_cache.sqlite)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not read or write the cache",
     )
     args = parser.parse_args()
 
-    seq_path = Path(args.input)
-    if not seq_path.exists():
-        raise FileNotFoundError(f"Input FASTA not found: {seq_path}")
-
-    output_csv = Path(args.output) if args.output else Path(
-        f"{seq_path.stem}_ensemble.csv"
-    )
+    seq_paths = [Path(p) for p in args.input]
+    for seq_path in seq_paths:
+        if not seq_path.exists():
+            raise FileNotFoundError(f"Input FASTA not found: {seq_path}")
 
-    process_sequence(seq_path, args.temperature, output_csv)
+    cache = EnergyCache(None if args.no_cache else Path(args.cache))
+    options = dict(workers=args.workers, retries=args.retries, tmp_dir=Path(args.tmp_dir) if args.tmp_dir else None, cache=cache)
+    try:
+        if len(seq_paths) == 1 and len(args.temperature) == 1 and not args.long:
+            output_csv = Path(args.output) if args.output else Path(
+                f"{seq_paths[0].stem}_ensemble.csv"
+            )
+            process_sequence(seq_paths[0].resolve(), args.temperature[0], output_csv, **options)
+        else:
+            output_csv = Path(args.output) if args.output else Path("ensemble_sweep.csv")
+            rows = sweep([p.resolve() for p in seq_paths], args.temperature, **options)
+            write_long_csv(rows, output_csv)
+    finally:
+        cache.close()
     print(f"Wrote results to {output_csv}")
 
 
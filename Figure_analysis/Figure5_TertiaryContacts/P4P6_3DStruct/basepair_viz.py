@@ -1,6 +1,103 @@
-from pymol import cmd
+"""
+basepair_viz.py
+PyMOL helpers for the P4P6 (1GID) base-pair / tertiary-contact views of Figure 5.
 
-def show_base_pair(res1, res2, res3=None, chain='A', show_stack = False):
+Interactively (`run basepair_viz.py` in PyMOL), `show_base_pair(res1, res2[, res3])`
+builds one view and `render_ray` writes it. The structure is loaded once, from
+the local cache next to this script (1gid.cif / 1gid.pdb; fetched into it only
+when missing), and each view only redefines the `bp` selection, the distance
+objects, the shown representations and the colors instead of reinitializing PyMOL.
+
+Batch mode renders a whole table of views in one headless PyMOL process. The
+table (TSV or CSV) has columns
+
+    res1, res2       residue numbers
+    res3             optional third residue
+    chain            chain ID (default A)
+    show_stack       1 / true to also show the stacked neighbours (res +- 1)
+    name             output name (default <res1>_<res2>[_<res3>])
+
+Each view is stored as a PyMOL scene, rendered to <out-dir>/<name>.png and,
+with --session, all scenes are saved to one .pse. Batch views keep their own
+H-bond objects (<name>_hbonds1..3) and labels, which later views only hide, so
+every scene recalls as rendered. --context shows chain A as a cartoon faded
+with `set_transparency_except` (Utilities/pymol_set_transparency.py) around the
+highlighted residues.
+
+Usage:
+    pymol -cq Figure_analysis/Figure5_TertiaryContacts/P4P6_3DStruct/basepair_viz.py -- \\
+        contacts.tsv --out-dir bp_views --session bp_views.pse
+    # or, with PyMOL importable from python:
+    python Figure_analysis/Figure5_TertiaryContacts/P4P6_3DStruct/basepair_viz.py contacts.tsv --out-dir bp_views
+"""
+
+import argparse
+import csv
+import sys
+import time
+from pathlib import Path
+
+from pymol import cmd, util
+
+# PyMOL's `run` (global namespace) sets __script__ rather than __file__
+_SCRIPT = Path(globals().get("__script__") or __file__).resolve()
+_REPO_ROOT = _SCRIPT.parents[3]
+sys.path.insert(0, str(_REPO_ROOT))
+
+from Figure_analysis.Utilities.pymol_set_transparency import set_transparency_except  # noqa: E402
+
+
+STRUCTURE_CACHE = _SCRIPT.parent
+PDB_ID = "1gid"
+BP_COLORS = ['skyblue', 'deepsalmon', 'gold']
+
+# Objects / selections created by show_base_pair, removed before the next view
+VIEW_OBJECTS = ("bp", "hbonds*", "stacking_sel", "N1_A", "N3_C")
+# H-bond objects kept per view in batch mode (<name>_hbonds1..3), disabled before the next view
+VIEW_HBONDS = "*_hbonds*"
+
+
+def load_structure(source=PDB_ID, cache_dir=STRUCTURE_CACHE):
+    """
+    Load a structure once and return its object name.
+
+    Args:
+        source (str or Path): PDB ID (looked up as <id>.cif / <id>.pdb in cache_dir,
+            fetched into cache_dir if neither exists) or a structure file path
+        cache_dir (str or Path): Local structure cache
+    """
+    path = Path(source)
+    if path.suffix:
+        name = path.stem
+    else:
+        name = str(source).lower()
+        cached = [Path(cache_dir) / f"{name}{ext}" for ext in (".cif", ".pdb")]
+        path = next((p for p in cached if p.exists()), None)
+
+    if name in cmd.get_names("objects"):
+        return name
+    if path is None:
+        cmd.fetch(name, name, path=str(cache_dir), type="cif")
+    else:
+        cmd.load(str(path), name)
+    return name
+
+
+def clear_view(obj=PDB_ID):
+    """
+    Hide everything (labels included), remove the selections and default
+    distances of the previous view, disable per-view distances and reset `obj`
+    to gray80 carbons colored by element.
+    """
+    for name in VIEW_OBJECTS:
+        cmd.delete(name)
+    cmd.disable(VIEW_HBONDS)
+    cmd.hide("everything", "all")
+    cmd.color("gray80", obj)
+    util.cnc(obj)
+
+
+def show_base_pair(res1, res2, res3=None, chain='A', show_stack = False, obj=None, hbonds="hbonds"):
     """
     Highlights up to 3 residues involved in base pairing in PyMOL.
 
@@ -9,37 +106,38 @@ def show_base_pair(res1, res2, res3=None, chain='A', show_stack = False):
         res2 (int or str): Second residue number
         res3 (int or str, optional): Optional third residue number
         chain (str): Chain ID (default = 'A')
+        obj (str, optional): Loaded structure object (default: load 1gid)
+        hbonds (str): Name prefix of the distance objects (<hbonds>1..3)
     """
 
-    cmd.delete(all)
-    cmd.reinitialize()
-    cmd.fetch("1gid")
-    
+    obj = obj or load_structure()
+    clear_view(obj)
 
     # Build selection string
     res_list = [str(res1), str(res2)]
     if res3 is not None:
         res_list.append(str(res3))
     res_str = "+".join(res_list)
-    selection = f"(resi {res_str} and chain {chain})"
+    selection = f"({obj} and resi {res_str} and chain {chain})"
     cmd.select("bp", selection)
 
-    # Display styles\
-    cmd.hide("everything", "all")
+    # Display styles
     cmd.show("sticks", "bp")
 
     # Color each base
-    colors = ['skyblue', 'deepsalmon', 'gold']
     for i, res in enumerate(res_list):
-        cmd.color(colors[i], f"resi {res} and chain {chain}")
+        cmd.color(BP_COLORS[i], f"{obj} and resi {res} and chain {chain}")
 
     # Optional: draw H-bonds between all pairs
     if len(res_list) >= 2:
-        cmd.dist("hbonds1", f"resi {res_list[0]} and chain {chain}", f"resi {res_list[1]} and chain {chain}", mode=2)
+        cmd.dist(f"{hbonds}1", f"{obj} and resi {res_list[0]} and chain {chain}",
+                 f"{obj} and resi {res_list[1]} and chain {chain}", mode=2)
     if len(res_list) == 3:
-        cmd.dist("hbonds2", f"resi {res_list[0]} and chain {chain}", f"resi {res_list[2]} and chain {chain}", mode=2)
-        cmd.dist("hbonds3", f"resi {res_list[1]} and chain {chain}", f"resi {res_list[2]} and chain {chain}", mode=2)
-    cmd.hide("labels", "hbonds*")
+        cmd.dist(f"{hbonds}2", f"{obj} and resi {res_list[0]} and chain {chain}",
+                 f"{obj} and resi {res_list[2]} and chain {chain}", mode=2)
+        cmd.dist(f"{hbonds}3", f"{obj} and resi {res_list[1]} and chain {chain}",
+                 f"{obj} and resi {res_list[2]} and chain {chain}", mode=2)
+    cmd.hide("labels", f"{hbonds}*")
     cmd.set("dash_width", 2)
 
 
@@ -54,7 +152,7 @@ def show_base_pair(res1, res2, res3=None, chain='A', show_stack = False):
             except ValueError:
                 continue
         stack_str = "+".join(stack_residues)
-        cmd.select("stacking_sel", f"chain {chain} and resi {stack_str}")
+        cmd.select("stacking_sel", f"{obj} and chain {chain} and resi {stack_str}")
         cmd.show("sticks", "stacking_sel")
         cmd.color("wheat", "stacking_sel")
 
@@ -62,7 +160,7 @@ def show_base_pair(res1, res2, res3=None, chain='A', show_stack = False):
     # Label with offset using C1' for cleaner placement
     cmd.set("label_position", [2.0, 1.0, 0.0])  # Adjust vector as needed
     for res in res_list:
-        cmd.label(f"resi {res} and chain {chain} and name O5'", f'"{res}"')
+        cmd.label(f"{obj} and resi {res} and chain {chain} and name O5'", f'"{res}"')
     # Final styling
     cmd.bg_color("white")
     cmd.orient("bp")
@@ -82,6 +180,16 @@ def highlight_base_atoms(chain='A'):
     cmd.color("cyan", "N3_C")
 
 
+def set_render_settings():
+    """Ray-tracing settings of render_ray (set once per session in batch mode)."""
+    cmd.bg_color("white")           # Ensure white background
+    cmd.set("ray_opaque_background", 0)  # Transparent background if desired
+    cmd.set("antialias", 2)
+    cmd.set("ray_trace_mode", 1)    # Smooth rendering
+    cmd.set("ray_trace_fog", 0)     # No fog for clarity
+    cmd.set("ambient", 0.5)         # Softer shading
+
+
 def render_ray(out="basepair_render.png", width=1200, height=900, dpi=300):
     """
     Renders the current PyMOL scene using ray tracing and saves it as a PNG.
@@ -92,13 +200,95 @@ def render_ray(out="basepair_render.png", width=1200, height=900, dpi=300):
         height (int): Height in pixels
         dpi (int): Dots per inch (for high-res figures)
     """
-    cmd.bg_color("white")           # Ensure white background
-    cmd.set("ray_opaque_background", 0)  # Transparent background if desired
-    cmd.set("antialias", 2)
-    cmd.set("ray_trace_mode", 1)    # Smooth rendering
-    cmd.set("ray_trace_fog", 0)     # No fog for clarity
-    cmd.set("ambient", 0.5)         # Softer shading
-
+    set_render_settings()
     cmd.ray(width, height)
     cmd.png(out, dpi=dpi)
-    print(f"Rendered image saved as {out}")
\ No newline at end of file
+    print(f"Rendered image saved as {out}")
+
+
+# ------------------------------------------------------------------------
+# Batch mode
+# ------------------------------------------------------------------------
+def read_views(path):
+    """One dict (res1, res2, res3, chain, show_stack, name) per row of a TSV / CSV view table."""
+    path = Path(path)
+    with open(path, newline="") as fh:
+        rows = list(csv.DictReader(fh, delimiter="," if path.suffix == ".csv" else "\t"))
+    views = []
+    for i, row in enumerate(rows, start=2):
+        row = {k.strip(): (v or "").strip() for k, v in row.items() if k}
+        if not row.get("res1") or not row.get("res2"):
+            raise ValueError(f"{path}:{i}: res1 and res2 are required")
+        res = [row["res1"], row["res2"]] + ([row["res3"]] if row.get("res3") else [])
+        views.append({
+            "res1": res[0], "res2": res[1], "res3": res[2] if len(res) == 3 else None,
+            "chain": row.get("chain") or "A",
+            "show_stack": row.get("show_stack", "").lower() in ("1", "true", "yes"),
+            "name": row.get("name") or "_".join(res),
+        })
+    names = [v["name"] for v in views]
+    dupes = sorted({n for n in names if names.count(n) > 1})
+    if dupes:
+        raise ValueError(f"{path}: duplicate view names {dupes}")
+    return views
+
+
+def render_views(views, out_dir, structure=PDB_ID, context=False, width=1200, height=900, dpi=300,
+                 session=None):
+    """Build, store as a scene and render every view on one loaded structure; returns the image paths."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    obj = load_structure(structure)
+    set_render_settings()
+    if context:
+        # nucleic-acid cartoons take the (by-element, orange) phosphorus color otherwise
+        cmd.set("cartoon_color", "gray80", obj)
+
+    written = []
+    for view in views:
+        t0 = time.perf_counter()
+        show_base_pair(view["res1"], view["res2"], view["res3"], chain=view["chain"], show_stack=view["show_stack"],
+                       obj=obj, hbonds=f"{view['name']}_hbonds")
+        res_list = [r for r in (view["res1"], view["res2"], view["res3"]) if r is not None]
+        if context:
+            cmd.show("cartoon", f"{obj} and chain A")
+            set_transparency_except(res_list, obj=obj)
+        cmd.scene(view["name"], "store")
+
+        out = out_dir / f"{view['name']}.png"
+        cmd.ray(width, height)
+        cmd.png(str(out), dpi=dpi)
+        written.append(out)
+        print(f"[{len(written)}/{len(views)}] {out} ({time.perf_counter() - t0:.1f} s)")
+
+    if session:
+        cmd.save(str(session))
+        print(f"Saved {len(views)} scenes to {session}")
+    return written
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Render a table of P4P6 base-pair views in one headless PyMOL session.")
+    ap.add_argument("views", type=Path, help="TSV / CSV with res1, res2[, res3][, chain][, show_stack][, name]")
+    ap.add_argument("--out-dir", type=Path, default=Path("."), help="Directory for the PNGs")
+    ap.add_argument("--structure", default=PDB_ID,
+                    help=f"PDB ID in the local cache ({STRUCTURE_CACHE}) or a structure file (default: {PDB_ID})")
+    ap.add_argument("--context", action="store_true",
+                    help="Show chain A as a faded cartoon around the highlighted residues")
+    ap.add_argument("--session", type=Path, help="Also save all views as scenes in this .pse")
+    ap.add_argument("--width", type=int, default=1200)
+    ap.add_argument("--height", type=int, default=900)
+    ap.add_argument("--dpi", type=int, default=300)
+    args = ap.parse_args(argv)
+
+    views = read_views(args.views)
+    t0 = time.perf_counter()
+    render_views(views, args.out_dir, structure=args.structure, context=args.context,
+                 width=args.width, height=args.height, dpi=args.dpi, session=args.session)
+    print(f"Rendered {len(views)} views in {time.perf_counter() - t0:.1f} s")
+
+
+# `pymol -cq basepair_viz.py -- ...` runs the script as __name__ == "pymol" with
+# sys.argv = [script, args]; `run basepair_viz.py` in a session only defines the functions
+if __name__ in ("__main__", "pymol") and Path(sys.argv[0]).name == _SCRIPT.name:
+    main()
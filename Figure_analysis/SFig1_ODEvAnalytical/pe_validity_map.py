@@ -0,0 +1,298 @@
+"""
+pe_validity_map.py
+Validity map of the pre-equilibrium (analytical) model against the full ODE.
+
+ode_v_analytical.ipynb compares `pe_model` with the ODE solution for six
+k_close timescales and five RNA concentrations. This script evaluates the
+residual pe_model - ODE over a dense grid of
+
+    K          R / U equilibrium constant
+    k_c        closing rate (s^-1); k_o = K * k_c
+    k_add      from `probing_ode.calc_kadd_from_eyring` at each `temperature` (eyring:
+               m, b), or given directly (values:)
+    k_deg      probe degradation rate (s^-1)
+    rna_conc   total RNA concentration (M)
+
+with the batched ODE engine in Figure_analysis/Utilities/probing_ode.py, so a
+construct's kinetic regime can be checked against the approximation without
+editing the notebook.
+
+The grid is flattened and split into chunks of `chunk_size` parameter sets;
+chunks run on a local process pool (each worker integrates its chunk with
+numba threads) and are stored as
+pe_validity_map/<label>___cfg-<hash>/chunks/chunk_<i>.npz as they finish, so
+an interrupted sweep resumes where it stopped. The run directory then holds
+
+    error_map.npz   the axes and, with the grid's shape (float32):
+                    max_abs_res   max over t of |pe_model - ODE|
+                    rel_res       max_abs_res / max over t of the ODE fmod
+                    end_res       pe_model - ODE at the last time point
+                    fmod_end      ODE fmod at the last time point
+                    success       ODE integration succeeded
+                    valid         max_abs_res <= tolerance
+    run_info.json   timing report (compile, per-chunk and total time, sets/s)
+
+Axes are lists or {logspace: [start, stop, num]} / {linspace: [start, stop, num]}.
+
+Usage:
+    python Figure_analysis/SFig1_ODEvAnalytical/pe_validity_map.py \\
+        --config Figure_analysis/SFig1_ODEvAnalytical/pe_validity_map.yaml --workers 8
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import yaml
+
+_REPO_ROOT = Path(__file__).resolve().parents[2]
+sys.path[:0] = [str(_REPO_ROOT), str(_REPO_ROOT / "Core_nerd_analysis" / "05_probe_tc_kinetics")]
+
+from Figure_analysis.Utilities import probing_ode  # noqa: E402
+from batch_lm_engine import config_hash  # noqa: E402
+
+
+AXES = ("K", "k_c", "k_add", "k_deg", "rna_conc")
+METRICS = ("max_abs_res", "rel_res", "end_res", "fmod_end", "success")
+KELVIN = 273.15
+
+
+# ------------------------------------------------------------------------
+# Config
+# ------------------------------------------------------------------------
+def load_config(path: str | Path) -> Dict[str, Any]:
+    """The `pe_validity_map` section of a config."""
+    with open(path) as fh:
+        cfg = yaml.safe_load(fh)
+    if "pe_validity_map" not in cfg:
+        raise ValueError(f"{path}: no pe_validity_map section")
+    section = cfg["pe_validity_map"]
+    missing = [a for a in AXES if a not in section.get("grid", {})]
+    if missing:
+        raise ValueError(f"{path}: grid is missing {missing}")
+    if section.get("method", "rosenbrock") not in probing_ode.METHODS:
+        raise ValueError(f"{path}: method must be one of {probing_ode.METHODS}")
+    return section
+
+
+def axis_values(spec: Any) -> np.ndarray:
+    """A list, a scalar, or {logspace / linspace: [start, stop, num]}."""
+    if isinstance(spec, dict):
+        (kind, args), = spec.items()
+        if kind not in ("logspace", "linspace"):
+            raise ValueError(f"unknown axis spacing {kind!r}")
+        start, stop, num = args
+        return getattr(np, kind)(float(start), float(stop), int(num))
+    return np.atleast_1d(np.asarray(spec, dtype=float))
+
+
+@dataclass
+class Grid:
+    """Axis values of the sweep; k_add carries the temperature it was computed at (NaN if given directly)."""
+
+    axes: Dict[str, np.ndarray]
+    temperature: np.ndarray
+    t: np.ndarray
+    probe_conc: float
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return tuple(len(self.axes[a]) for a in AXES)
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape))
+
+    def points(self, start: int, stop: int) -> Dict[str, np.ndarray]:
+        """Parameter values of the flattened grid points start..stop-1."""
+        idx = np.unravel_index(np.arange(start, stop), self.shape)
+        return {a: self.axes[a][i] for a, i in zip(AXES, idx)}
+
+
+def build_grid(cfg: Dict[str, Any]) -> Grid:
+    grid = cfg["grid"]
+    probe_conc = float(cfg.get("probe_conc", probing_ode.PROBE_CONC))
+    axes = {a: axis_values(grid[a]) for a in AXES if a != "k_add"}
+    k_add = grid["k_add"]
+    if isinstance(k_add, dict) and "eyring" in k_add:
+        temperature = axis_values(k_add["temperature"])
+        eyring = k_add["eyring"]
+        axes["k_add"] = probing_ode.calc_kadd_from_eyring(temperature + KELVIN, float(eyring["m"]), float(eyring["b"]), probe_conc)
+    else:
+        axes["k_add"] = axis_values(k_add.get("values") if isinstance(k_add, dict) else k_add)
+        temperature = np.full(len(axes["k_add"]), np.nan)
+    t = axis_values(cfg.get("times", {"linspace": [0, 20000, 25]}))
+    return Grid({a: axes[a] for a in AXES}, temperature, t, probe_conc)
+
+
+# ------------------------------------------------------------------------
+# Chunks
+# ------------------------------------------------------------------------
+def run_chunk(grid: Grid, start: int, stop: int, cfg: Dict[str, Any]) -> Dict[str, np.ndarray]:
+    """Residual metrics of the flattened grid points start..stop-1."""
+    p = grid.points(start, stop)
+    y_ode = probing_ode.fmod_batch(
+        grid.t, p["K"], p["k_c"], p["k_add"], p["k_deg"], rna_conc=p["rna_conc"], probe_conc=grid.probe_conc,
+        method=cfg.get("method", "rosenbrock"),
+        rtol=float(cfg.get("rtol", probing_ode.DEFAULT_RTOL)), atol=float(cfg.get("atol", probing_ode.DEFAULT_ATOL)),
+    )
+    y_pe = probing_ode.pe_model(grid.t, p["K"], p["k_add"], p["k_deg"], grid.probe_conc)
+    res = y_pe - y_ode
+    max_abs = np.max(np.abs(res), axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rel = max_abs / np.max(y_ode, axis=1)
+    return {
+        "max_abs_res": max_abs.astype(np.float32),
+        "rel_res": rel.astype(np.float32),
+        "end_res": res[:, -1].astype(np.float32),
+        "fmod_end": y_ode[:, -1].astype(np.float32),
+        "success": np.isfinite(y_ode).all(axis=1),
+    }
+
+
+_GRID: Optional[Grid] = None
+_CFG: Dict[str, Any] = {}
+
+
+def _init_worker(grid: Grid, cfg: Dict[str, Any], threads: int) -> None:
+    global _GRID, _CFG
+    import numba
+
+    _GRID, _CFG = grid, cfg
+    numba.set_num_threads(threads)
+    probing_ode.warmup(cfg.get("method", "rosenbrock"))
+
+
+def _run_chunk_worker(start: int, stop: int) -> Tuple[Dict[str, np.ndarray], float, int]:
+    t0 = time.perf_counter()
+    out = run_chunk(_GRID, start, stop, _CFG)
+    return out, time.perf_counter() - t0, os.getpid()
+
+
+def chunk_plan(grid: Grid, chunk_size: int) -> List[Tuple[int, int]]:
+    """(start, stop) of every chunk of the flattened grid."""
+    return [(s, min(s + chunk_size, grid.size)) for s in range(0, grid.size, chunk_size)]
+
+
+def run_dir_for(config_path: Path, cfg: Dict[str, Any]) -> Path:
+    """pe_validity_map/<label>___cfg-<hash> next to the config."""
+    return config_path.resolve().parent / "pe_validity_map" / f"{cfg['label']}___cfg-{config_hash(cfg)}"
+
+
+def run_chunks(
+    grid: Grid, cfg: Dict[str, Any], chunk_dir: Path, workers: int
+) -> Tuple[List[Dict[str, np.ndarray]], Dict[str, Any]]:
+    """Compute (or load) every chunk; each finished chunk is saved before the next is collected."""
+    chunk_dir.mkdir(parents=True, exist_ok=True)
+    plan = chunk_plan(grid, int(cfg.get("chunk_size", 2000)))
+    results: Dict[int, Dict[str, np.ndarray]] = {}
+    for i in range(len(plan)):
+        path = chunk_dir / f"chunk_{i:05d}.npz"
+        if path.exists():
+            with np.load(path) as data:
+                results[i] = {k: data[k] for k in data.files}
+    todo = [i for i in range(len(plan)) if i not in results]
+    print(f"{grid.size} parameter sets in {len(plan)} chunks: {len(results)} stored, {len(todo)} to compute")
+
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    chunk_times: List[Dict[str, Any]] = []
+    t0 = time.perf_counter()
+    if todo:
+        # spawn, not fork: the parent has already started numba's thread pool
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=ctx, initializer=_init_worker, initargs=(grid, cfg, threads)
+        ) as pool:
+            pending = {pool.submit(_run_chunk_worker, *plan[i]): i for i in todo}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    i = pending.pop(fut)
+                    arrays, seconds, pid = fut.result()
+                    np.savez(chunk_dir / f"chunk_{i:05d}.npz", **arrays)
+                    results[i] = arrays
+                    n = plan[i][1] - plan[i][0]
+                    chunk_times.append({"chunk": i, "n_sets": n, "seconds": seconds, "pid": pid})
+                    print(f"[done] chunk {i + 1}/{len(plan)} ({n} sets in {seconds:.2f} s, pid {pid})")
+    wall = time.perf_counter() - t0
+    computed = sum(c["n_sets"] for c in chunk_times)
+    info = {
+        "n_sets": grid.size,
+        "n_chunks": len(plan),
+        "computed_chunks": len(todo),
+        "workers": workers,
+        "threads_per_worker": threads,
+        "sweep_s": wall,
+        "sets_per_s": computed / wall if computed else None,
+        "chunk_s_median": float(np.median([c["seconds"] for c in chunk_times])) if chunk_times else None,
+        "chunks": sorted(chunk_times, key=lambda c: c["chunk"]),
+    }
+    return [results[i] for i in range(len(plan))], info
+
+
+# ------------------------------------------------------------------------
+# Output
+# ------------------------------------------------------------------------
+def assemble(grid: Grid, chunks: List[Dict[str, np.ndarray]], tolerance: float) -> Dict[str, np.ndarray]:
+    """Grid-shaped metric arrays plus the axes."""
+    out = {m: np.concatenate([c[m] for c in chunks]).reshape(grid.shape) for m in METRICS}
+    out["valid"] = out["success"] & (out["max_abs_res"] <= tolerance)
+    out.update({f"axis_{a}": v for a, v in grid.axes.items()})
+    out["axis_temperature"] = grid.temperature
+    out["t"] = grid.t
+    return out
+
+
+def summary(error_map: Dict[str, np.ndarray], axis: str = "k_c") -> str:
+    """Fraction of valid grid points and the worst residual along one axis."""
+    dim = AXES.index(axis)
+    other = tuple(i for i in range(len(AXES)) if i != dim)
+    frac = error_map["valid"].mean(axis=other)
+    worst = np.nanmax(np.where(error_map["success"], error_map["max_abs_res"], np.nan), axis=other)
+    lines = [f"{axis:>10}  valid  max |pe - ODE|"]
+    lines += [f"{v:10.3g}  {f:5.1%}  {w:.3g}" for v, f, w in zip(error_map[f"axis_{axis}"], frac, worst)]
+    return "\n".join(lines)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Pre-equilibrium model vs ODE residual over a parameter grid.")
+    ap.add_argument("--config", type=Path, required=True, help="pe_validity_map config (YAML)")
+    ap.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes (default: all cores)")
+    ap.add_argument("--out-dir", type=Path, help="Run directory (default: pe_validity_map/<label>___cfg-<hash>)")
+    args = ap.parse_args()
+
+    cfg = load_config(args.config)
+    out_dir = args.out_dir or run_dir_for(args.config, cfg)
+    grid = build_grid(cfg)
+    print(f"grid {dict(zip(AXES, grid.shape))}, {len(grid.t)} time points")
+
+    t0 = time.perf_counter()
+    probing_ode.warmup(cfg.get("method", "rosenbrock"))
+    compile_s = time.perf_counter() - t0
+
+    chunks, info = run_chunks(grid, cfg, out_dir / "chunks", args.workers)
+    tolerance = float(cfg.get("tolerance", 0.01))
+    error_map = assemble(grid, chunks, tolerance)
+    np.savez(out_dir / "error_map.npz", **error_map)
+    with open(out_dir / "run_info.json", "w") as fh:
+        json.dump(
+            {"config": str(args.config), "pe_validity_map": cfg, "compile_s": compile_s, "tolerance": tolerance,
+             "failed_sets": int((~error_map["success"]).sum()), **info},
+            fh, indent=2, default=str,
+        )
+    print(summary(error_map))
+    print(f"{error_map['valid'].mean():.1%} of the grid within |pe - ODE| <= {tolerance}; wrote {out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,493 @@
+"""
+ntp_ode_fit.py
+Global ODE fit of the NMR NTP adduction time courses (SFig8).
+
+`fit_ODE` / `fit_ODE_new` in NTP_ODE_fit.ipynb fit one NTP / temperature /
+replicate / peak at a time:
+
+    U + S -> M      k1 (k_add, M^-1 s^-1)
+    S -> Z          k2 (DMS hydrolysis, s^-1)
+
+with `solve_ivp` on a Python right-hand side and finite-difference gradients
+through `lmfit.minimize`. This script fits all <ntp>_peak_percentages
+datasets in one least-squares problem:
+
+    mode: global       ln k1 = ln k1(T_ref) + slope * (1/T - 1/T_ref) per NTP
+                       (Arrhenius; slope fixed at 0 for an NTP measured at
+                       one temperature), ln k2 = ln calc_khydr(T) + ln_khydr_scale
+                       with one shared scale
+    mode: independent  free ln k1, ln k2 per dataset, as the notebook
+
+--fix-khydr holds k2 at calc_khydr(T) in either mode (all_data_fitparams.csv
+was fit that way).
+
+Both modes write ln k1 / ln k2 of every dataset as a linear map of the fit
+parameters, so one residual / Jacobian routine serves them. The right-hand
+side is compiled with numba together with its forward sensitivity equations
+(d(U, S, M)/dk1, d(U, S, M)/dk2), integrated with an adaptive Dormand-Prince
+5(4) method (solve_ivp's default RK45) for all datasets in parallel, so the
+Jacobian handed to scipy's least_squares is exact instead of finite
+differences. Observed S data are scaled by `--s-factor` once, when loaded.
+
+Residuals are model - data for U, S and M (M), as in `fit_ODE`; parameter
+errors are sqrt(diag((J^T J)^-1) * redchi), as lmfit reports them. Parameters
+the data do not determine (non-finite or huge stderr, or a rate outside
+K_BOUNDS) are flagged in the `flag` column and reported.
+
+<temp>_<rep>_<peak>_raw.csv are the unnormalized integrals of the same spectra
+as <temp>_<rep>_<peak>.csv, so they are skipped unless --include-raw (fitting
+both would count every measurement twice); UTP only has a raw peak.
+
+Usage:
+    python Figure_analysis/SFig8_NmrAddValidation/peak_analysis/ntp_ode_fit.py --mode global
+    python Figure_analysis/SFig8_NmrAddValidation/peak_analysis/ntp_ode_fit.py --mode independent --ntps ATP CTP
+"""
+
+from __future__ import annotations
+
+import argparse
+import re
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from numba import njit, prange
+from scipy.optimize import least_squares
+
+_REPO_ROOT = Path(__file__).resolve().parents[3]
+sys.path.insert(0, str(_REPO_ROOT))
+
+from Figure_analysis.Utilities.fit_store import read_sav  # noqa: E402
+
+
+NTPS = ("ATP", "CTP", "GTP", "UTP")
+MODES = ("global", "independent")
+# Measured NTP and DMS concentrations (M), as in NTP_ODE_fit.ipynb
+NTP_CONC = {"ATP": 0.0080045, "CTP": 0.0073565, "GTP": 0.006252, "UTP": 0.007127}
+DMS_CONC = 0.01564
+KELVIN = 273.15
+T_REF = 37.0
+
+DATA_DIR = Path(__file__).resolve().parent.parent
+RTOL = 1e-8
+ATOL = 1e-14
+MAX_STEPS = 100_000
+# Rates (k1 in M^-1 s^-1, k2 in s^-1) outside these bounds, or ln-scale stderrs
+# above MAX_LN_STDERR, mark a parameter as not determined by the data
+K_BOUNDS = (1e-9, 1e3)
+MAX_LN_STDERR = 5.0
+
+_FILE_RE = re.compile(r"^(?P<temp>\d+)_(?P<rep>\d+)_(?P<peak>peak(?!DMS).+)\.csv$")
+
+
+# ------------------------------------------------------------------------
+# Data
+# ------------------------------------------------------------------------
+@dataclass
+class Datasets:
+    """Observed U, S, M of every dataset, padded to the longest time course."""
+
+    meta: pd.DataFrame  # ntp, temp, rep, peak, n_obs
+    t: np.ndarray  # (n, m)
+    obs: np.ndarray  # (n, m, 3)
+    n_obs: np.ndarray  # (n,)
+    y0: np.ndarray  # (n, 3)
+
+    def __len__(self) -> int:
+        return len(self.meta)
+
+
+def load_datasets(
+    data_dir: Path = DATA_DIR,
+    ntps: Sequence[str] = NTPS,
+    peaks: Optional[Sequence[str]] = None,
+    s_factor: float = 1.0,
+    include_raw: bool = False,
+) -> Datasets:
+    """
+    Every <ntp>_peak_percentages/<temp>_<rep>_<peak>.csv with its <temp>_<rep>_peakDMS.csv.
+
+    Only time points present in both files are kept (as `fit_ODE`); U = peak * [NTP],
+    S = DMS * [DMS] * s_factor, M = (1 - peak) * [NTP]. *_raw peaks are skipped
+    unless `include_raw` or listed in `peaks`.
+    """
+    rows, frames = [], []
+    for ntp in ntps:
+        folder = Path(data_dir) / f"{ntp}_peak_percentages"
+        n_before = len(rows)
+        for path in sorted(folder.glob("*.csv")):
+            match = _FILE_RE.match(path.name)
+            if not match or (peaks and match["peak"] not in peaks):
+                continue
+            if match["peak"].endswith("_raw") and not include_raw and not peaks:
+                continue
+            dms_path = folder / f"{match['temp']}_{match['rep']}_peakDMS.csv"
+            if not dms_path.exists():
+                continue
+            merged = pd.read_csv(path).merge(pd.read_csv(dms_path), on="time", suffixes=("", "_dms")).sort_values("time")
+            conc = NTP_CONC[ntp]
+            frames.append(np.column_stack([
+                merged["time"], merged["peak"] * conc, merged["peak_dms"] * DMS_CONC * s_factor, (1 - merged["peak"]) * conc,
+            ]))
+            rows.append({"ntp": ntp, "temp": float(match["temp"]), "rep": int(match["rep"]), "peak": match["peak"]})
+        if len(rows) == n_before:
+            print(f"Warning: no {ntp} datasets in {folder} (*_raw peaks are skipped unless include_raw)")
+    if not rows:
+        raise ValueError(f"no <ntp>_peak_percentages datasets for {list(ntps)} in {data_dir}")
+
+    n, m = len(frames), max(len(f) for f in frames)
+    t = np.zeros((n, m))
+    obs = np.full((n, m, 3), np.nan)
+    n_obs = np.array([len(f) for f in frames])
+    for i, f in enumerate(frames):
+        t[i, : len(f)] = f[:, 0]
+        t[i, len(f):] = f[-1, 0]
+        obs[i, : len(f)] = f[:, 1:]
+    meta = pd.DataFrame(rows).assign(n_obs=n_obs)
+    y0 = np.column_stack([meta["ntp"].map(NTP_CONC), np.full(n, DMS_CONC), np.zeros(n)])
+    return Datasets(meta, t, obs, n_obs, y0)
+
+
+def khydr_from_sav(path: Path) -> Callable[[Any], np.ndarray]:
+    """calc_khydr of the notebook: k2(T) from the Eyring fit ln(k / T) = slope / T + intercept in k_hydr.sav."""
+    params = read_sav(path)["params"]
+    slope, intercept = params["slope"]["value"], params["intercept"]["value"]
+
+    def calc_khydr(temp: Any) -> np.ndarray:
+        T = np.asarray(temp, dtype=float) + KELVIN
+        return np.exp(slope / T + intercept) * T
+
+    return calc_khydr
+
+
+# ------------------------------------------------------------------------
+# Compiled model with forward sensitivities
+# ------------------------------------------------------------------------
+# Dormand-Prince 5(4) tableau (autonomous system)
+_A21 = 1.0 / 5.0
+_A31, _A32 = 3.0 / 40.0, 9.0 / 40.0
+_A41, _A42, _A43 = 44.0 / 45.0, -56.0 / 15.0, 32.0 / 9.0
+_A51, _A52, _A53, _A54 = 19372.0 / 6561.0, -25360.0 / 2187.0, 64448.0 / 6561.0, -212.0 / 729.0
+_A61, _A62, _A63, _A64, _A65 = 9017.0 / 3168.0, -355.0 / 33.0, 46732.0 / 5247.0, 49.0 / 176.0, -5103.0 / 18656.0
+_B1, _B3, _B4, _B5, _B6 = 35.0 / 384.0, 500.0 / 1113.0, 125.0 / 192.0, -2187.0 / 6784.0, 11.0 / 84.0
+_E1, _E3, _E4, _E5, _E6, _E7 = (
+    71.0 / 57600.0, -71.0 / 16695.0, 71.0 / 1920.0, -17253.0 / 339200.0, 22.0 / 525.0, -1.0 / 40.0,
+)
+N_STATE = 9  # U, S, M, d(U, S, M)/dk1, d(U, S, M)/dk2
+
+
+@njit(cache=True, inline="always")
+def _rhs(y, k1, k2, du):
+    U, S = y[0], y[1]
+    add = k1 * U * S
+    du[0] = -add
+    du[1] = -add - k2 * S
+    du[2] = add
+    # ds/dt = J s + df/dk, J = [[-k1 S, -k1 U, 0], [-k1 S, -k1 U - k2, 0], [k1 S, k1 U, 0]]
+    for j in range(2):
+        a = y[3 + 3 * j]
+        b = y[4 + 3 * j]
+        jac_s = k1 * S * a + k1 * U * b
+        du[3 + 3 * j] = -jac_s
+        du[4 + 3 * j] = -jac_s - k2 * b
+        du[5 + 3 * j] = jac_s
+    du[3] -= U * S
+    du[4] -= U * S
+    du[5] += U * S
+    du[7] -= S
+
+
+@njit(cache=True)
+def _dopri5(y0, k1, k2, t_eval, n_eval, rtol, atol, max_steps, out):
+    """Integrate from t = 0, writing the state at t_eval[:n_eval] into out; False on failure."""
+    n = y0.shape[0]
+    y = y0.copy()
+    ynew = np.empty(n)
+    ytmp = np.empty(n)
+    f1 = np.empty(n)
+    f2 = np.empty(n)
+    f3 = np.empty(n)
+    f4 = np.empty(n)
+    f5 = np.empty(n)
+    f6 = np.empty(n)
+    f7 = np.empty(n)
+
+    _rhs(y, k1, k2, f1)
+    d0 = 0.0
+    d1 = 0.0
+    for i in range(n):
+        sc = atol + rtol * abs(y[i])
+        d0 += (y[i] / sc) ** 2
+        d1 += (f1[i] / sc) ** 2
+    d0 = np.sqrt(d0 / n)
+    d1 = np.sqrt(d1 / n)
+    h = 0.01 * d0 / d1 if d0 > 1e-5 and d1 > 1e-5 else 1e-6
+    h = min(h, max(t_eval[n_eval - 1], 1e-12))
+
+    t = 0.0
+    steps = 0
+    for k in range(n_eval):
+        t_out = t_eval[k]
+        while t < t_out:
+            if steps >= max_steps or h <= 1e-14 * max(abs(t), 1.0):
+                return False
+            steps += 1
+            last = t + h >= t_out
+            hs = t_out - t if last else h
+
+            for i in range(n):
+                ytmp[i] = y[i] + hs * _A21 * f1[i]
+            _rhs(ytmp, k1, k2, f2)
+            for i in range(n):
+                ytmp[i] = y[i] + hs * (_A31 * f1[i] + _A32 * f2[i])
+            _rhs(ytmp, k1, k2, f3)
+            for i in range(n):
+                ytmp[i] = y[i] + hs * (_A41 * f1[i] + _A42 * f2[i] + _A43 * f3[i])
+            _rhs(ytmp, k1, k2, f4)
+            for i in range(n):
+                ytmp[i] = y[i] + hs * (_A51 * f1[i] + _A52 * f2[i] + _A53 * f3[i] + _A54 * f4[i])
+            _rhs(ytmp, k1, k2, f5)
+            for i in range(n):
+                ytmp[i] = y[i] + hs * (_A61 * f1[i] + _A62 * f2[i] + _A63 * f3[i] + _A64 * f4[i] + _A65 * f5[i])
+            _rhs(ytmp, k1, k2, f6)
+            for i in range(n):
+                ynew[i] = y[i] + hs * (_B1 * f1[i] + _B3 * f3[i] + _B4 * f4[i] + _B5 * f5[i] + _B6 * f6[i])
+            _rhs(ynew, k1, k2, f7)
+
+            err = 0.0
+            for i in range(n):
+                e = hs * (_E1 * f1[i] + _E3 * f3[i] + _E4 * f4[i] + _E5 * f5[i] + _E6 * f6[i] + _E7 * f7[i])
+                sc = atol + rtol * max(abs(y[i]), abs(ynew[i]))
+                err += (e / sc) ** 2
+            err = np.sqrt(err / n)
+
+            fac = 5.0 if err == 0.0 else min(5.0, max(0.2, 0.9 * err ** -0.2))
+            if err <= 1.0:
+                t = t_out if last else t + hs
+                for i in range(n):
+                    y[i] = ynew[i]
+                    f1[i] = f7[i]  # first same as last
+                h = max(h, hs * fac) if last else hs * fac
+            else:
+                h = hs * fac
+        out[k, :] = y
+    return True
+
+
+@njit(cache=True, parallel=True)
+def _solve_batch(y0, k1, k2, t, n_obs, rtol, atol, max_steps, out, ok):
+    for d in prange(y0.shape[0]):
+        state = np.zeros(N_STATE)
+        state[:3] = y0[d]
+        ok[d] = _dopri5(state, k1[d], k2[d], t[d], n_obs[d], rtol, atol, max_steps, out[d])
+
+
+def solve(data: Datasets, k1: np.ndarray, k2: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(n, m, 9) states and sensitivities at the observed times of every dataset, and the success flags."""
+    out = np.full((len(data), data.t.shape[1], N_STATE), np.nan)
+    ok = np.zeros(len(data), dtype=np.bool_)
+    _solve_batch(
+        data.y0, np.ascontiguousarray(k1, dtype=float), np.ascontiguousarray(k2, dtype=float), data.t,
+        data.n_obs.astype(np.int64), RTOL, ATOL, MAX_STEPS, out, ok,
+    )
+    return out, ok
+
+
+# ------------------------------------------------------------------------
+# Parameterization: ln k1 = A1 @ theta + c1, ln k2 = A2 @ theta + c2
+# ------------------------------------------------------------------------
+@dataclass
+class Design:
+    names: List[str]
+    p0: np.ndarray
+    A1: np.ndarray  # (n_datasets, n_params)
+    c1: np.ndarray
+    A2: np.ndarray
+    c2: np.ndarray
+    per_dataset: bool = False
+
+    def rates(self, theta: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        return np.exp(self.A1 @ theta + self.c1), np.exp(self.A2 @ theta + self.c2)
+
+
+def build_design(data: Datasets, calc_khydr: Callable[[Any], np.ndarray], mode: str, fix_khydr: bool = False,
+                 k1_init: float = 0.003) -> Design:
+    meta = data.meta
+    n = len(meta)
+    ln_khydr = np.log(calc_khydr(meta["temp"].to_numpy()))
+    if mode == "independent":
+        labels = [f"[{r.ntp} {r.temp:g} {r.rep} {r.peak}]" for r in meta.itertuples()]
+        if fix_khydr:
+            return Design([f"ln_k1{lab}" for lab in labels], np.full(n, np.log(k1_init)), np.eye(n), np.zeros(n),
+                          np.zeros((n, n)), ln_khydr, per_dataset=True)
+        names = [f"{prefix}{lab}" for lab in labels for prefix in ("ln_k1", "ln_k2")]
+        A1 = np.zeros((n, 2 * n))
+        A2 = np.zeros((n, 2 * n))
+        A1[np.arange(n), 2 * np.arange(n)] = 1.0
+        A2[np.arange(n), 2 * np.arange(n) + 1] = 1.0
+        p0 = np.empty(2 * n)
+        p0[0::2], p0[1::2] = np.log(k1_init), ln_khydr
+        return Design(names, p0, A1, np.zeros(n), A2, np.zeros(n), per_dataset=True)
+
+    names, columns = [], []
+    x = 1.0 / (meta["temp"].to_numpy() + KELVIN) - 1.0 / (T_REF + KELVIN)
+    for ntp in meta["ntp"].unique():
+        rows = (meta["ntp"] == ntp).to_numpy()
+        temps = meta.loc[rows, "temp"].unique()
+        # one temperature: ln k1 at that temperature, no slope
+        names.append(f"ln_k1_{T_REF if len(temps) > 1 else temps[0]:g}C[{ntp}]")
+        columns.append(rows.astype(float))
+        if len(temps) > 1:
+            names.append(f"slope[{ntp}]")
+            columns.append(np.where(rows, x, 0.0))
+    A1 = np.column_stack(columns + ([np.zeros(n)] if not fix_khydr else []))
+    A2 = np.zeros_like(A1)
+    if not fix_khydr:
+        names.append("ln_khydr_scale")
+        A2[:, -1] = 1.0
+    p0 = np.array([np.log(k1_init) if name.startswith("ln_k1") else 0.0 for name in names])
+    return Design(names, p0, A1, np.zeros(n), A2, ln_khydr)
+
+
+# ------------------------------------------------------------------------
+# Fit
+# ------------------------------------------------------------------------
+def _mask(data: Datasets) -> np.ndarray:
+    return np.isfinite(data.obs)
+
+
+def residual_and_jacobian(theta: np.ndarray, data: Datasets, design: Design) -> Tuple[np.ndarray, np.ndarray]:
+    """Model - data over every finite observation, and its exact Jacobian w.r.t. theta."""
+    k1, k2 = design.rates(theta)
+    out, ok = solve(data, k1, k2)
+    mask = _mask(data)
+    res = (out[..., :3] - data.obs)[mask]
+    # d y / d theta = dy/dk1 * k1 * A1 + dy/dk2 * k2 * A2
+    dk1 = (k1[:, None] * design.A1)[:, None, None, :]
+    dk2 = (k2[:, None] * design.A2)[:, None, None, :]
+    jac = out[..., 3:6, None] * dk1 + out[..., 6:9, None] * dk2
+    jac = jac[mask]
+    if not ok.all():
+        res = np.nan_to_num(res, nan=1.0)
+        jac = np.nan_to_num(jac, nan=0.0, posinf=0.0, neginf=0.0)
+    return res, jac
+
+
+def flag_parameters(params: pd.DataFrame) -> pd.Series:
+    """'' for determined parameters, else why not: stderr (non-finite / > MAX_LN_STDERR on ln k) or bounds."""
+    ln_k = params["name"].str.startswith(("ln_k1", "ln_k2")).to_numpy()
+    value, stderr = params["value"].to_numpy(), params["stderr"].to_numpy()
+    bad_err = ~np.isfinite(stderr) | (ln_k & (stderr > MAX_LN_STDERR))
+    out_of_bounds = ln_k & ((value < np.log(K_BOUNDS[0])) | (value > np.log(K_BOUNDS[1])))
+    flags = np.where(bad_err & out_of_bounds, "stderr,bounds", np.where(bad_err, "stderr", np.where(out_of_bounds, "bounds", "")))
+    return pd.Series(flags, index=params.index)
+
+
+@dataclass
+class FitResult:
+    params: pd.DataFrame  # name, value, stderr
+    datasets: pd.DataFrame  # meta + k1, k1_err, k2, k2_err, rsq, redchi, lnkadd, 1/T
+    redchi: float
+    nfev: int
+    success: bool
+    seconds: float
+
+
+def fit(data: Datasets, design: Design) -> FitResult:
+    t0 = time.perf_counter()
+    cache: Dict[bytes, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def evaluate(theta):
+        key = theta.tobytes()
+        if key not in cache:
+            cache.clear()
+            cache[key] = residual_and_jacobian(theta, data, design)
+        return cache[key]
+
+    result = least_squares(
+        lambda th: evaluate(th)[0], design.p0, jac=lambda th: evaluate(th)[1], method="lm", x_scale="jac",
+        xtol=1e-12, ftol=1e-12, gtol=1e-12, max_nfev=2000,
+    )
+    theta = result.x
+    res, jac = residual_and_jacobian(theta, data, design)
+    redchi = float(res @ res / max(len(res) - len(theta), 1))
+
+    # per dataset: R^2 over U, S, M (as fit_ODE) and reduced chi-square
+    k1, k2 = design.rates(theta)
+    out, _ = solve(data, k1, k2)
+    mask = _mask(data)
+    n_par = ((design.A1 != 0) | (design.A2 != 0)).sum(axis=1)
+    rsq, redchi_d = [], []
+    for d in range(len(data)):
+        obs = data.obs[d][mask[d]]
+        r = (out[d, :, :3] - data.obs[d])[mask[d]]
+        ss_res = float(r @ r)
+        rsq.append(1.0 - ss_res / float(np.sum((obs - obs.mean()) ** 2)))
+        redchi_d.append(ss_res / max(len(r) - n_par[d], 1))
+    redchi_d = np.array(redchi_d)
+
+    # independent fits are scaled by their own redchi, as separate lmfit fits would be
+    if design.per_dataset:
+        owner = np.argmax((design.A1 != 0) | (design.A2 != 0), axis=0)
+        scale = np.sqrt(redchi_d[owner])
+    else:
+        scale = np.full(len(theta), np.sqrt(redchi))
+    try:
+        covar = np.linalg.inv(jac.T @ jac) * np.outer(scale, scale)
+    except np.linalg.LinAlgError:
+        covar = np.full((len(theta), len(theta)), np.nan)
+    params = pd.DataFrame({"name": design.names, "value": theta, "stderr": np.sqrt(np.diag(covar))})
+    params["flag"] = flag_parameters(params)
+    ln_k1_err = np.sqrt(np.einsum("ij,jk,ik->i", design.A1, covar, design.A1))
+    ln_k2_err = np.sqrt(np.einsum("ij,jk,ik->i", design.A2, covar, design.A2))
+    table = data.meta.assign(
+        k1=k1, k1_err=k1 * ln_k1_err, k2=k2, k2_err=k2 * ln_k2_err, rsq=rsq, redchi=redchi_d,
+        lnkadd=np.log(k1), **{"1/T": 1.0 / (data.meta["temp"] + KELVIN)},
+    )
+    return FitResult(params, table, redchi, int(result.nfev), bool(result.success), time.perf_counter() - t0)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Global ODE fit of the NMR NTP adduction time courses.")
+    ap.add_argument("--data-dir", type=Path, default=DATA_DIR, help="Folder with <ntp>_peak_percentages/ and k_hydr.sav")
+    ap.add_argument("--mode", choices=MODES, default="global")
+    ap.add_argument("--ntps", nargs="+", default=list(NTPS))
+    ap.add_argument("--peaks", nargs="+", help="Peaks to fit (e.g. peak8 peak6; default: all)")
+    ap.add_argument("--include-raw", action="store_true", help="Also fit the unnormalized *_raw peaks")
+    ap.add_argument("--s-factor", type=float, default=1.0, help="Scale of the observed DMS (S) data")
+    ap.add_argument("--fix-khydr", action="store_true", help="Hold k2 at calc_khydr(T)")
+    ap.add_argument("--out-dir", type=Path, help="Output folder (default: <data-dir>/ntp_ode_fit)")
+    args = ap.parse_args()
+
+    data = load_datasets(args.data_dir, args.ntps, args.peaks, args.s_factor, include_raw=args.include_raw)
+    calc_khydr = khydr_from_sav(args.data_dir / "k_hydr.sav")
+    design = build_design(data, calc_khydr, args.mode, fix_khydr=args.fix_khydr)
+    print(f"{len(data)} datasets, {int(_mask(data).sum())} residuals, {len(design.names)} parameters ({args.mode})")
+
+    t0 = time.perf_counter()
+    residual_and_jacobian(design.p0, data, design)
+    print(f"compiled / loaded kernels in {time.perf_counter() - t0:.2f} s")
+
+    result = fit(data, design)
+    print(f"{'converged' if result.success else 'NOT converged'} after {result.nfev} evaluations "
+          f"in {result.seconds:.2f} s, redchi {result.redchi:.3g}")
+    if args.mode == "global":
+        print(result.params.to_string(index=False))
+    flagged = result.params[result.params["flag"] != ""]
+    if len(flagged):
+        print(f"Warning: {len(flagged)} parameter(s) not determined by the data: "
+              + ", ".join(f"{r.name} ({r.flag})" for r in flagged.itertuples()))
+
+    out_dir = args.out_dir or args.data_dir / "ntp_ode_fit"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    result.params.to_csv(out_dir / f"{args.mode}_params.csv", index=False)
+    result.datasets.to_csv(out_dir / f"{args.mode}_fitparams.csv", index=False)
+    print(f"Wrote {out_dir}")
+
+
+if __name__ == "__main__":
+    main()
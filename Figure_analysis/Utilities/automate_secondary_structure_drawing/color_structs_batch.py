@@ -0,0 +1,353 @@
+"""
+color_structs_batch.py
+Headless batch renderer for the colored secondary structures (Figures 3-5).
+
+The color_structs notebooks (Figure3 4U_ColoredSecStruct, Figure4
+HIV_ColoredSecStruct, Figure5 P4P6_ColoredSecStruct) draw one structure at a
+time, with one `ax.scatter` and one `ax.annotate` per nucleotide
+(`iterrows()` over the RNApuzzler / reference coordinates). This script reads
+every coordinate file and value table of a config once and renders every
+
+    family x construct x temperature x coloring (dG, ddG, dG0, ...)
+
+panel in a pool of worker processes. Each panel is drawn with one
+PathCollection for the circles and one per base for the letters (the glyph is
+the marker, so letters stay centered at any size); face colors come from one
+colormap call over all sites and the letter colors from the vectorized
+`get_text_color`. Letters are therefore glyph outlines, not editable text.
+
+Config (`color_structs` section, paths relative to the repository root):
+
+    out_dir           output directory; panels go to
+                      <out_dir>/<family>/<construct>[_<temp>C]_<coloring>.<format>
+    format            pdf (default), svg or png
+    styles.<name>     figsize, marker_size, fontsize, fontweight, flip_y,
+                      text_offset (points), dpi, missing / missing_by_base
+                      ({face, edge, text} for sites without data)
+    families[]        name, style,
+                      constructs: {<construct>: {coords, sep, site_offset |
+                                   site_column | site_map}}
+                      tables[]: {path, sep, construct | construct_col,
+                                 temp | temp_col, site_col, values: [columns]}
+                      colorings: {<column>: {scale: [vmin, vmax], cmap, label}}
+
+`site_offset: 1` numbers the coordinate rows 1..n (4U), `site_map` maps the
+0-based row index to the construct's site numbers (HIV) and `site_column`
+reads them from the coordinate file (P4P6). Each rendered panel is listed in
+<out_dir>/panels.tsv.
+
+Usage:
+    python Figure_analysis/Utilities/automate_secondary_structure_drawing/color_structs_batch.py \\
+        --config Figure_analysis/Utilities/automate_secondary_structure_drawing/color_structs.yaml --workers 8
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import yaml
+
+_REPO_ROOT = Path(__file__).resolve().parents[3]
+sys.path.insert(0, str(_REPO_ROOT))
+
+from Figure_analysis.Utilities.setup_env import MPL_RCPARAMS  # noqa: E402
+
+
+# Rec. 709 luma weights, as in the notebooks' get_text_color
+LUMINANCE = np.array([0.2126, 0.7152, 0.0722])
+
+DEFAULT_STYLE = {
+    "figsize": [6, 6],
+    "marker_size": 300,
+    "fontsize": 12,
+    "fontweight": "bold",
+    "flip_y": False,
+    "text_offset": [0, 0],
+    "dpi": 300,
+    "missing": {"face": "0.9", "edge": None, "text": "gray"},
+    "missing_by_base": {},
+}
+DEFAULT_LABELS = {"dG": "ΔG (kcal/mol)", "ddG": "ΔΔG (kcal/mol)"}
+FORMATS = ("pdf", "svg", "png")
+
+
+# ------------------------------------------------------------------------
+# Colors
+# ------------------------------------------------------------------------
+def get_text_color(rgb: Any, threshold: float = 0.5) -> Any:
+    """'white' or 'black' by luminance, for one RGB(A) tuple or an (n, 3 | 4) array of them."""
+    rgb = np.asarray(rgb, dtype=float)
+    luminance = rgb[..., :3] @ LUMINANCE
+    out = np.where(luminance < threshold, "white", "black")
+    return str(out) if out.ndim == 0 else out
+
+
+def get_cmap(name: Optional[str]):
+    """Colormap by name: None / 'default' (the notebooks' black_blue_gold), 'PiBu' or any matplotlib name."""
+    import matplotlib
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import LinearSegmentedColormap
+
+    if name in (None, "default"):
+        return LinearSegmentedColormap.from_list("black_blue_gold", ["#0f4c5c", "#ecf39e", "#9a031e"])
+    if name == "PiBu":
+        # pink -> white -> blue, from the PiYG / RdBu end points (P4P6 ddG)
+        pink, blue = plt.get_cmap("PiYG")(0.0), plt.get_cmap("RdBu")(1.0)
+        return LinearSegmentedColormap.from_list("PinkWhiteBlue", [(0.0, pink), (0.5, (1, 1, 1, 1)), (1.0, blue)])
+    return matplotlib.colormaps[name]
+
+
+# ------------------------------------------------------------------------
+# Config and inputs
+# ------------------------------------------------------------------------
+def load_config(path: str | Path) -> Dict[str, Any]:
+    """The `color_structs` section of a config."""
+    with open(path) as fh:
+        cfg = yaml.safe_load(fh)
+    if "color_structs" not in cfg:
+        raise ValueError(f"{path}: no color_structs section")
+    section = cfg["color_structs"]
+    if section.get("format", "pdf") not in FORMATS:
+        raise ValueError(f"{path}: format must be one of {FORMATS}")
+    for fam in section.get("families", []):
+        if fam.get("style", "default") not in {"default", *section.get("styles", {})}:
+            raise ValueError(f"{path}: family {fam['name']} uses undefined style {fam['style']!r}")
+    return section
+
+
+def _path(p: str | Path) -> Path:
+    p = Path(p)
+    return p if p.is_absolute() else _REPO_ROOT / p
+
+
+def read_coords(spec: Dict[str, Any]) -> Dict[str, np.ndarray]:
+    """x, y, nt and site arrays of one coordinate file (RNApuzzler CSV or labeled reference TSV)."""
+    df = pd.read_csv(_path(spec["coords"]), sep=spec.get("sep", ","))
+    nt = df[spec.get("nt_column", "nt" if "nt" in df.columns else "nt_base")].astype(str).to_numpy()
+    if "site_column" in spec:
+        site = df[spec["site_column"]].to_numpy(dtype=float)
+    elif "site_map" in spec:
+        site_map = {int(k): v for k, v in spec["site_map"].items()}
+        site = np.array([site_map.get(i, np.nan) for i in range(len(df))], dtype=float)
+    else:
+        site = np.arange(len(df), dtype=float) + spec.get("site_offset", 1)
+    return {"x": df["x"].to_numpy(dtype=float), "y": df["y"].to_numpy(dtype=float), "nt": nt, "site": site}
+
+
+def read_values(spec: Dict[str, Any]) -> pd.DataFrame:
+    """Long table (construct, temp, site, coloring, value) of one value table."""
+    df = pd.read_csv(_path(spec["path"]), sep=spec.get("sep", ","))
+    out = pd.DataFrame({
+        "construct": df[spec["construct_col"]] if "construct_col" in spec else spec["construct"],
+        "temp": df[spec["temp_col"]].astype(float) if "temp_col" in spec else spec.get("temp", np.nan),
+        "site": df[spec.get("site_col", "site_num")].astype(float),
+    }, index=df.index)
+    return pd.concat(
+        [out.assign(coloring=col, value=df[col].astype(float)) for col in spec["values"]],
+        ignore_index=True,
+    )
+
+
+@dataclass
+class Panel:
+    family: str
+    construct: str
+    temp: Optional[float]
+    coloring: str
+    values: np.ndarray        # one value per coordinate row (NaN = no data)
+    style: Dict[str, Any]
+    scale: Tuple[float, float]
+    cmap: Optional[str]
+    label: str
+    out_file: Path
+
+    @property
+    def n_colored(self) -> int:
+        return int(np.isfinite(self.values).sum())
+
+
+def build_panels(cfg: Dict[str, Any], families: Optional[List[str]] = None
+                 ) -> Tuple[List[Panel], Dict[Tuple[str, str], Dict[str, np.ndarray]]]:
+    """Every panel of the config, plus the coordinates (read once) by (family, construct)."""
+    out_dir = _path(cfg.get("out_dir", "colored_structs"))
+    ext = cfg.get("format", "pdf")
+    styles = cfg.get("styles", {})
+    panels: List[Panel] = []
+    coords: Dict[Tuple[str, str], Dict[str, np.ndarray]] = {}
+    for fam in cfg.get("families", []):
+        name = fam["name"]
+        if families and name not in families:
+            continue
+        style = {**DEFAULT_STYLE, **styles.get(fam.get("style", "default"), {})}
+        for construct, spec in fam["constructs"].items():
+            coords[name, construct] = read_coords(spec)
+        values = pd.concat([read_values(t) for t in fam.get("tables", [])], ignore_index=True)
+        values = values[values["construct"].isin(fam["constructs"]) & values["coloring"].isin(fam["colorings"])]
+
+        for (construct, temp, coloring), grp in values.groupby(["construct", "temp", "coloring"], dropna=False, sort=True):
+            site = coords[name, construct]["site"]
+            by_site = pd.Series(grp["value"].to_numpy(), index=grp["site"].to_numpy())
+            by_site = by_site[~by_site.index.duplicated(keep="first")]
+            vec = by_site.reindex(site).to_numpy(dtype=float)
+            coloring_spec = fam["colorings"][coloring]
+            temp = None if pd.isna(temp) else float(temp)
+            stem = construct if temp is None else f"{construct}_{temp:g}C"
+            panels.append(Panel(
+                family=name, construct=construct, temp=temp, coloring=coloring, values=vec, style=style,
+                scale=tuple(coloring_spec.get("scale", (-1, 4))), cmap=coloring_spec.get("cmap"),
+                label=coloring_spec.get("label", DEFAULT_LABELS.get(coloring, coloring)),
+                out_file=out_dir / name / f"{stem}_{coloring}.{ext}",
+            ))
+    return panels, coords
+
+
+# ------------------------------------------------------------------------
+# Rendering (worker processes)
+# ------------------------------------------------------------------------
+_COORDS: Dict[Tuple[str, str], Dict[str, np.ndarray]] = {}
+_GLYPHS: Dict[Tuple[str, float, str, float, float], Any] = {}
+
+
+def _init_worker(coords: Dict[Tuple[str, str], Dict[str, np.ndarray]]) -> None:
+    import matplotlib
+    matplotlib.use("Agg")
+    matplotlib.rcParams.update(MPL_RCPARAMS)
+    _COORDS.update(coords)
+
+
+def _glyph(base: str, fontsize: float, fontweight: str, dx: float, dy: float):
+    """(marker path, marker size) drawing `base` at `fontsize` points, centered and shifted by (dx, dy) points."""
+    key = (base, fontsize, fontweight, dx, dy)
+    if key not in _GLYPHS:
+        from matplotlib.font_manager import FontProperties
+        from matplotlib.path import Path as MplPath
+        from matplotlib.textpath import TextPath
+
+        text = TextPath((0, 0), base, size=fontsize, prop=FontProperties(weight=fontweight))
+        lo, hi = text.vertices.min(axis=0), text.vertices.max(axis=0)
+        verts = text.vertices - (lo + hi) / 2 + (dx, dy)
+        # markers are scaled by their largest |vertex|: pad every glyph with the same
+        # two invisible MOVETO corners so all letters share one scale (1 unit = 1 point)
+        half = fontsize + abs(dx) + abs(dy)
+        verts = np.vstack([verts, [[-half, -half], [half, half]]])
+        codes = np.concatenate([text.codes, [MplPath.MOVETO, MplPath.MOVETO]])
+        _GLYPHS[key] = (MplPath(verts, codes), (2 * half) ** 2)
+    return _GLYPHS[key]
+
+
+def face_colors(panel: Panel, nt: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(n, 4) face / edge RGBA and text colors of every site of a panel."""
+    from matplotlib.colors import Normalize, to_rgba
+
+    cmap = get_cmap(panel.cmap)
+    has = np.isfinite(panel.values)
+    face = cmap(Normalize(*panel.scale)(np.where(has, panel.values, 0.0)))
+    edge = np.tile(to_rgba("black"), (len(nt), 1))
+    text = get_text_color(face).astype(object)
+
+    style = panel.style
+    missing = [(~has, style["missing"])]
+    missing += [(~has & (nt == base), spec) for base, spec in style["missing_by_base"].items()]
+    for mask, spec in missing:
+        face[mask] = to_rgba(spec["face"])
+        edge[mask] = to_rgba(spec["edge"]) if spec.get("edge") not in (None, "none") else face[mask]
+        text[mask] = spec["text"]
+    return face, edge, text
+
+
+def render_panel(panel: Panel) -> Tuple[str, float]:
+    """Draw and save one panel; returns (output file, seconds)."""
+    import matplotlib.pyplot as plt
+    from matplotlib import cm
+    from matplotlib.colors import Normalize
+
+    t0 = time.perf_counter()
+    xy = _COORDS[panel.family, panel.construct]
+    style = panel.style
+    x, y, nt = xy["x"], (-xy["y"] if style["flip_y"] else xy["y"]), xy["nt"]
+    face, edge, text = face_colors(panel, nt)
+
+    fig, ax = plt.subplots(figsize=style["figsize"])
+    ax.scatter(x, y, s=style["marker_size"], facecolors=face, edgecolors=edge, linewidths=1)
+    for base in np.unique(nt):
+        sel = nt == base
+        path, size = _glyph(base, style["fontsize"], style["fontweight"], *style["text_offset"])
+        ax.scatter(x[sel], y[sel], s=size, marker=path, c=list(text[sel]), linewidths=0)
+
+    ax.axis("equal")
+    ax.grid(False)
+    ax.axis("off")
+    sm = cm.ScalarMappable(cmap=get_cmap(panel.cmap), norm=Normalize(*panel.scale))
+    sm.set_array([])
+    fig.colorbar(sm, ax=ax, orientation="vertical", label=panel.label)
+
+    panel.out_file.parent.mkdir(parents=True, exist_ok=True)
+    fig.savefig(panel.out_file, dpi=style["dpi"], bbox_inches="tight")
+    plt.close(fig)
+    return str(panel.out_file), time.perf_counter() - t0
+
+
+def render_all(panels: List[Panel], coords: Dict[Tuple[str, str], Dict[str, np.ndarray]], workers: int
+               ) -> List[Tuple[str, float]]:
+    """Render every panel on `workers` processes (in-process for workers <= 1)."""
+    if workers <= 1:
+        _init_worker(coords)
+        return [render_panel(p) for p in panels]
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker,
+                             initargs=(coords,)) as pool:
+        return list(pool.map(render_panel, panels, chunksize=max(1, len(panels) // (4 * workers))))
+
+
+def write_manifest(panels: List[Panel], results: List[Tuple[str, float]], path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", newline="") as fh:
+        w = csv.writer(fh, delimiter="\t")
+        w.writerow(["family", "construct", "temp_C", "coloring", "n_sites", "n_colored", "seconds", "file"])
+        for p, (out_file, seconds) in zip(panels, results):
+            w.writerow([p.family, p.construct, "" if p.temp is None else p.temp, p.coloring, len(p.values),
+                        p.n_colored, f"{seconds:.3f}", os.path.relpath(out_file, path.parent)])
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Render every colored secondary structure panel of a config.")
+    ap.add_argument("--config", type=Path, required=True, help="color_structs config (YAML)")
+    ap.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes (default: all cores)")
+    ap.add_argument("--families", nargs="+", help="Only render these families")
+    ap.add_argument("--out-dir", type=Path, help="Override the config's out_dir")
+    ap.add_argument("--dry-run", action="store_true", help="List the panels without rendering")
+    args = ap.parse_args()
+
+    cfg = load_config(args.config)
+    if args.out_dir:
+        cfg["out_dir"] = str(args.out_dir.resolve())
+    t0 = time.perf_counter()
+    panels, coords = build_panels(cfg, args.families)
+    print(f"{len(panels)} panels over {len(coords)} structures (inputs read in {time.perf_counter() - t0:.2f} s)")
+    if args.dry_run:
+        for p in panels:
+            print(f"{p.family}\t{p.construct}\t{p.temp}\t{p.coloring}\t{p.n_colored}/{len(p.values)}\t{p.out_file}")
+        return
+    if not panels:
+        return
+
+    t0 = time.perf_counter()
+    results = render_all(panels, coords, min(args.workers, len(panels)))
+    out_dir = _path(cfg.get("out_dir", "colored_structs"))
+    write_manifest(panels, results, out_dir / "panels.tsv")
+    print(f"rendered {len(results)} panels in {time.perf_counter() - t0:.1f} s; wrote {out_dir}")
+
+
+if __name__ == "__main__":
+    main()
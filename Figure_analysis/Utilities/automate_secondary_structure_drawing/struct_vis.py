@@ -1,5 +1,6 @@
 import dash
-from dash import dcc, html, Input, Output
+from dash import dcc, html, Input, Output, Patch
+import numpy as np
 import pandas as pd
 import plotly.graph_objs as go
 
@@ -9,14 +10,27 @@ df_term = pd.read_csv('secondary_structure/terminated_ZTP.csv')
 df = pd.read_csv('rna_analysis_results.csv', header=None)
 df.columns = ['col1', 'col2', 'col3'] + [f'val_{i}' for i in range(df.shape[1] - 3)]
 
+# Precomputed lookups: (col1, col2, col3) -> float32 color vector (first row wins,
+# as before) and the dependent dropdown options, so callbacks never scan df.
+values = df.iloc[:, 3:].to_numpy(dtype=np.float32)
+color_index = {}
+for i, key in enumerate(zip(df['col1'], df['col2'], df['col3'])):
+    color_index.setdefault(key, values[i])
+
 col1_options = sorted(df['col1'].unique())
-col2_options = sorted(df['col2'].unique())
-col3_options = sorted(df['col3'].unique())
+col2_by_col1 = {k: sorted(g.unique()) for k, g in df.groupby('col1')['col2']}
+col3_by_col12 = {k: sorted(g.unique()) for k, g in df.groupby(['col1', 'col2'])['col3']}
+
+
+def as_options(values):
+    return [{'label': i, 'value': i} for i in values]
+
 
 def create_structure_plot(df_structure, title, color_vector=None):
+    """Structure figure; trace 0 carries the per-nt marker colors, trace 1 the nt letters."""
     marker_colors = color_vector if color_vector is not None else 'black'
 
-    backbone = go.Scatter(
+    backbone = go.Scattergl(
         x=df_structure['x'], y=df_structure['y'],
         mode='markers+lines',
         line=dict(color='black'),
@@ -24,33 +38,46 @@ def create_structure_plot(df_structure, title, color_vector=None):
             size=14,
             color=marker_colors,
             colorscale='Viridis',
-            showscale=bool(color_vector),
-            colorbar=dict(title='Value') if color_vector is not None else None
+            showscale=color_vector is not None,
+            colorbar=dict(title='Value'),
         ),
+        hoverinfo='skip',
         showlegend=False
     )
 
-    annotations = [
-        dict(
-            x=row['x'], y=row['y'],
-            text=row['nt'],
-            xanchor='center', yanchor='middle',
-            showarrow=False,
-            font=dict(color='white', size=12, family='monospace', weight='bold')
-        )
-        for _, row in df_structure.iterrows()
-    ]
+    letters = go.Scattergl(
+        x=df_structure['x'], y=df_structure['y'],
+        mode='text',
+        text=df_structure['nt'],
+        textposition='middle center',
+        textfont=dict(color='white', size=12, family='monospace', weight='bold'),
+        hoverinfo='skip',
+        showlegend=False
+    )
 
     layout = go.Layout(
         title=title,
-        annotations=annotations,
         xaxis=dict(visible=False),
         yaxis=dict(visible=False, scaleanchor='x', scaleratio=1),
         plot_bgcolor='white',
         margin=dict(l=10, r=10, t=40, b=10),
+        uirevision=title,
     )
 
-    return go.Figure(data=[backbone], layout=layout)
+    return go.Figure(data=[backbone, letters], layout=layout)
+
+
+def recolor(color_vector=None):
+    """Patch that only swaps the marker colors of a figure from create_structure_plot."""
+    patched = Patch()
+    patched['data'][0]['marker']['color'] = color_vector if color_vector is not None else 'black'
+    patched['data'][0]['marker']['showscale'] = color_vector is not None
+    return patched
+
+
+# Figures are built once per structure; updates only patch the colors
+fig_anti = create_structure_plot(df_anti, "ZTP Antiterminated")
+fig_term = create_structure_plot(df_term, "ZTP Terminated")
 
 # Initialize Dash app
 app = dash.Dash(__name__)
@@ -60,7 +87,7 @@ app.layout = html.Div([
     html.H1("ZTP Riboswitch Structures", style={'textAlign': 'center'}),
     html.Div([
         html.Label("Column 1"),
-        dcc.Dropdown(id='dropdown-col1', options=[{'label': i, 'value': i} for i in col1_options]),
+        dcc.Dropdown(id='dropdown-col1', options=as_options(col1_options)),
 
         html.Label("Column 2"),
         dcc.Dropdown(id='dropdown-col2'),
@@ -71,8 +98,8 @@ app.layout = html.Div([
 
     html.Br(),
     html.Div([
-        dcc.Graph(id='graph-anti', style={'width': '50%', 'display': 'inline-block'}),
-        dcc.Graph(id='graph-term', style={'width': '50%', 'display': 'inline-block'}),
+        dcc.Graph(id='graph-anti', figure=fig_anti, style={'width': '50%', 'display': 'inline-block'}),
+        dcc.Graph(id='graph-term', figure=fig_term, style={'width': '50%', 'display': 'inline-block'}),
     ])
 ])
 
@@ -81,10 +108,7 @@ app.layout = html.Div([
     Input('dropdown-col1', 'value')
 )
 def update_col2_options(selected_col1):
-    if selected_col1 is None:
-        return []
-    options = sorted(df[df['col1'] == selected_col1]['col2'].unique())
-    return [{'label': i, 'value': i} for i in options]
+    return as_options(col2_by_col1.get(selected_col1, []))
 
 @app.callback(
     Output('dropdown-col3', 'options'),
@@ -92,29 +116,21 @@ def update_col2_options(selected_col1):
     Input('dropdown-col2', 'value')
 )
 def update_col3_options(selected_col1, selected_col2):
-    if None in (selected_col1, selected_col2):
-        return []
-    subset = df[(df['col1'] == selected_col1) & (df['col2'] == selected_col2)]
-    return [{'label': i, 'value': i} for i in sorted(subset['col3'].unique())]
+    return as_options(col3_by_col12.get((selected_col1, selected_col2), []))
 
 @app.callback(
     Output('graph-anti', 'figure'),
     Output('graph-term', 'figure'),
     Input('dropdown-col1', 'value'),
     Input('dropdown-col2', 'value'),
-    Input('dropdown-col3', 'value')
+    Input('dropdown-col3', 'value'),
+    prevent_initial_call=True
 )
 def update_figures(val1, val2, val3):
-    if None in (val1, val2, val3):
-        return create_structure_plot(df_anti, "ZTP Antiterminated"), create_structure_plot(df_term, "ZTP Terminated")
-
-    row = df[(df['col1'] == val1) & (df['col2'] == val2) & (df['col3'] == val3)]
-    color_vector = row.iloc[0, 3:].astype(float).tolist() if not row.empty else None
-
-    return (
-        create_structure_plot(df_anti, "ZTP Antiterminated", color_vector),
-        create_structure_plot(df_term, "ZTP Terminated", color_vector)
-    )
+    color_vector = color_index.get((val1, val2, val3))
+    if color_vector is not None:
+        color_vector = color_vector.tolist()
+    return recolor(color_vector), recolor(color_vector)
 
 if __name__ == '__main__':
-    app.run(debug=True, port=7550)  # Use a different port
\ No newline at end of file
+    app.run(debug=True, port=7550)  # Use a different port
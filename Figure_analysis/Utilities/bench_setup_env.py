@@ -0,0 +1,101 @@
+"""
+bench_setup_env.py
+Import-time benchmark for setup_env.py.
+
+Each measurement runs in a fresh interpreter (cold start, as in batch notebook
+regeneration) and times:
+
+    lazy   : `from setup_env import *`
+    eager  : the same plus `setup_env.preload()` (the old import-everything cost)
+
+Usage:
+    python Figure_analysis/Utilities/bench_setup_env.py [--repeats 5] [--top 15]
+
+With --top N, also prints the N packages that take longest to import in the
+eager mode (from `python -X importtime`).
+"""
+
+from __future__ import annotations
+
+import argparse
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+UTILITIES_DIR = Path(__file__).resolve().parent
+
+SNIPPETS = {
+    "lazy": "from setup_env import *",
+    "eager": "from setup_env import *; import setup_env; setup_env.preload()",
+}
+
+_TIMED = (
+    "import time; t0 = time.perf_counter(); {snippet}; "
+    "print(time.perf_counter() - t0)"
+)
+
+
+def time_snippet(snippet: str, repeats: int) -> List[float]:
+    """Wall time (s) of `snippet` in `repeats` fresh interpreters."""
+    times = []
+    for _ in range(repeats):
+        out = subprocess.run(
+            [sys.executable, "-c", _TIMED.format(snippet=snippet)],
+            cwd=UTILITIES_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        times.append(float(out.stdout.strip().splitlines()[-1]))
+    return times
+
+
+def slowest_packages(snippet: str, top: int) -> List[Tuple[int, str]]:
+    """
+    (µs, package) for the `top` most expensive packages imported by `snippet`.
+
+    Uses the self time from `python -X importtime`, summed over each package's
+    modules: lazily executed packages (LazyLoader) only show up through their
+    submodules, so cumulative times of the top-level entries would undercount.
+    """
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", snippet],
+        cwd=UTILITIES_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    totals: Dict[str, int] = defaultdict(int)
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        totals[name.strip().split(".")[0]] += int(self_us)
+    return sorted(((us, pkg) for pkg, us in totals.items()), reverse=True)[:top]
+
+
+def main(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=5, help="Fresh interpreters per mode (default 5)")
+    parser.add_argument("--top", type=int, default=0, help="Also list the N slowest packages of the eager mode")
+    args = parser.parse_args(argv)
+
+    print(f"{'mode':<6} {'median [ms]':>12} {'min [ms]':>10} {'max [ms]':>10}")
+    for mode, snippet in SNIPPETS.items():
+        times = time_snippet(snippet, args.repeats)
+        print(
+            f"{mode:<6} {statistics.median(times) * 1e3:12.1f} "
+            f"{min(times) * 1e3:10.1f} {max(times) * 1e3:10.1f}"
+        )
+
+    if args.top:
+        print("\nSlowest packages (eager, import self time):")
+        for cumulative, name in slowest_packages(SNIPPETS["eager"], args.top):
+            print(f"  {cumulative / 1e3:10.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,509 @@
+"""
+fit_store.py
+Columnar store for lmfit fit results (replaces per-site `save_modelresult` .sav files).
+
+A .sav file is the JSON dump of one lmfit ModelResult, including the model
+function as a dill pickle; `load_modelresult` unpickles that code and refits
+nothing but re-evaluates the model, so loading is slow (one file and one
+function rebuild per site) and breaks when the pickled function refers to
+names of the notebook that wrote it (e.g. `sc`).
+
+A fit store is one uncompressed .npz with one array per field and one row per
+fit (key), so `np.load` reads only the fields that are asked for:
+
+    keys, model                         (n_fits,)
+    param_names                         (n_params,) union over all fits
+    value, stderr, min, max, init_value (n_fits, n_params), NaN if absent
+    vary, has_param                     (n_fits, n_params)
+    covar                               (n_fits, n_params, n_params), NaN if not varied
+    chisqr, redchi, rsquared, aic, bic, nfev, ndata, nvarys, success, method
+    data_offsets                        (n_fits + 1,) into the concatenated
+    x, y, weights, best_fit, residual   data arrays
+    data_hash                           sha1 of x / y / weights per fit
+
+Models are evaluated with the functions in MODEL_FUNCS (the notebooks'
+`melt_fit` two-state melt curve, i.e. global_melt_engine.melt_curve, and
+lmfit's `linear`), vectorized over fits;
+`eval_uncertainty` follows lmfit's (central differences at stderr * dscale,
+scaled by the Student t quantile).
+
+Usage:
+    # convert the .sav files of a directory to 2state_fit_results.npz next to it
+    python Figure_analysis/Utilities/fit_store.py Figure3_EnergyValidation/4U_2stateMelt/2state_fit_results
+
+    from Figure_analysis.Utilities.fit_store import FitStore
+
+    store = FitStore('2state_fit_results.npz')
+    params = store.params(fields=('value', 'stderr'))              # one row per fit
+    ln_kobs = store.eval(x=1 / (25 + 273.15), keys=['4U_wt_7_A'])  # (n_keys, n_x)
+    fit = store['4U_wt_7_A']                                       # .eval / .eval_uncertainty / .params
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import math
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+_REPO_ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(_REPO_ROOT / "Core_nerd_analysis" / "06_probe_tempgrad_fit"))
+
+from global_melt_engine import melt_curve  # noqa: E402
+
+
+STORE_VERSION = 1
+
+PARAM_FIELDS = ("value", "stderr", "min", "max", "init_value")
+SCALAR_FIELDS = ("chisqr", "redchi", "rsquared", "aic", "bic", "nfev", "ndata", "nvarys", "success")
+DATA_FIELDS = ("x", "y", "weights", "best_fit", "residual")
+
+
+# ------------------------------------------------------------------------
+# Models
+# ------------------------------------------------------------------------
+def linear(x, slope, intercept):
+    """lmfit.models.LinearModel."""
+    return slope * x + intercept
+
+
+# funcname in the .sav -> (function, parameter names in call order)
+MODEL_FUNCS: Dict[str, tuple[Callable[..., Any], tuple[str, ...]]] = {
+    "melt_fit": (melt_curve, ("upper_m", "upper_b", "lower_m", "lower_b", "dH_fold", "Tm")),
+    "linear": (linear, ("slope", "intercept")),
+}
+
+
+def data_hash(x: Any, y: Any, weights: Any = None) -> str:
+    """sha1 of the float64 bytes of x, y and weights; equal hashes mean the same fit input."""
+    h = hashlib.sha1()
+    for arr in (x, y, weights):
+        if arr is not None:
+            h.update(np.ascontiguousarray(arr, dtype=np.float64).tobytes())
+        h.update(b"|")
+    return h.hexdigest()
+
+
+# ------------------------------------------------------------------------
+# Reading fits (.sav files, in-memory ModelResults)
+# ------------------------------------------------------------------------
+def _decode(obj: Any) -> Any:
+    """Undo lmfit's JSON encoding (NDArray / PSeries / Dict / List / Tuple wrappers); callables are left as dicts."""
+    if isinstance(obj, dict):
+        cls = obj.get("__class__")
+        if cls == "NDArray":
+            return np.asarray(obj["value"], dtype=obj.get("__dtype__", "float64")).reshape(obj["__shape__"])
+        if cls in ("List", "Tuple"):
+            return [_decode(v) for v in obj["value"]]
+        if cls == "Dict":
+            return {k: _decode(v) for k, v in obj.items() if k != "__class__"}
+        if cls == "PSeries":
+            return np.asarray(list(json.loads(obj["value"]).values()), dtype=float)
+        return obj
+    if isinstance(obj, list):
+        return [_decode(v) for v in obj]
+    return obj
+
+
+def _model_name(model: Any) -> str:
+    """funcname of a decoded ModelResult `model` entry (lmfit >= 1.2 dict or older tuple state)."""
+    state = model[0] if isinstance(model, list) else model
+    if isinstance(state, dict):
+        return state.get("funcname") or state.get("name")
+    return state[0]
+
+
+def _float(value: Any) -> float:
+    return math.nan if value is None else float(value)
+
+
+def read_sav(path: str | Path) -> Dict[str, Any]:
+    """
+    One fit record from an lmfit .sav file, without lmfit and without unpickling the model.
+
+    Returns
+    -------
+    dict
+        model, params ({name: {value, stderr, vary, min, max, init_value}}),
+        var_names, covar (var_names order), the SCALAR_FIELDS, method, and
+        x, y, weights, best_fit, residual arrays.
+    """
+    with open(path) as fh:
+        raw = json.load(fh)
+    if raw.get("__class__") != "lmfit.ModelResult":
+        raise ValueError(f"{path}: not an lmfit ModelResult")
+
+    params = {}
+    saved = raw["params"]
+    entries = json.loads(saved)["params"] if isinstance(saved, str) else saved  # lmfit >= 1.2 / older
+    for entry in entries:
+        # (name, value, vary, expr, min, max, brute_step, stderr, correl, init_value, user_data)
+        name, value, vary, _, pmin, pmax = entry[:6]
+        params[name] = {
+            "value": _float(value),
+            "stderr": _float(entry[7]) if len(entry) > 7 else math.nan,
+            "vary": bool(vary),
+            "min": _float(pmin),
+            "max": _float(pmax),
+            "init_value": _float(entry[9]) if len(entry) > 9 else math.nan,
+        }
+
+    userkws = _decode(raw["userkws"])
+    y = np.asarray(_decode(raw["userargs"])[0], dtype=float)
+    weights = _decode(raw.get("weights"))
+    residual = np.asarray(_decode(raw["residual"]), dtype=float)
+    x = np.asarray(userkws["x"], dtype=float)
+    model = _model_name(_decode(raw["model"]))
+    if model in MODEL_FUNCS:
+        func, names = MODEL_FUNCS[model]
+        best_fit = func(x, *(params[n]["value"] for n in names))
+    else:
+        # the saved residual is (data - model) * weights; format 1 files store (model - data) * weights
+        sign = -1.0 if str(raw.get("__version__")) == "1" else 1.0
+        best_fit = y - sign * (residual / weights if weights is not None else residual)
+
+    record = {
+        "model": model,
+        "params": params,
+        "var_names": list(_decode(raw["var_names"])),
+        "covar": None if raw.get("covar") is None else np.asarray(_decode(raw["covar"]), dtype=float),
+        "method": raw.get("method") or "",
+        "x": x,
+        "y": y,
+        "weights": None if weights is None else np.asarray(weights, dtype=float),
+        "best_fit": best_fit,
+        "residual": residual,
+    }
+    for field in SCALAR_FIELDS:
+        record[field] = _float(raw.get(field))
+    return record
+
+
+def record_from_result(result: Any) -> Dict[str, Any]:
+    """The same record as `read_sav` from an lmfit ModelResult in memory (instead of save_modelresult)."""
+    params = {
+        name: {
+            "value": _float(p.value),
+            "stderr": _float(p.stderr),
+            "vary": bool(p.vary),
+            "min": _float(p.min),
+            "max": _float(p.max),
+            "init_value": _float(getattr(p, "init_value", None)),
+        }
+        for name, p in result.params.items()
+    }
+    record = {
+        "model": result.model._name,
+        "params": params,
+        "var_names": list(result.var_names),
+        "covar": None if result.covar is None else np.asarray(result.covar, dtype=float),
+        "method": result.method or "",
+        "x": np.asarray(result.userkws["x"], dtype=float),
+        "y": np.asarray(result.data, dtype=float),
+        "weights": None if result.weights is None else np.asarray(result.weights, dtype=float),
+        "best_fit": np.asarray(result.best_fit, dtype=float),
+        "residual": np.asarray(result.residual, dtype=float),
+    }
+    for field in SCALAR_FIELDS:
+        record[field] = _float(getattr(result, field, None))
+    return record
+
+
+# ------------------------------------------------------------------------
+# Writing
+# ------------------------------------------------------------------------
+def write_store(path: str | Path, records: Mapping[str, Dict[str, Any]]) -> Path:
+    """Write {key: record} (read_sav / record_from_result) as one fit store .npz."""
+    keys = list(records)
+    names = list(dict.fromkeys(n for rec in records.values() for n in rec["params"]))
+    col = {n: i for i, n in enumerate(names)}
+    n, p = len(keys), len(names)
+
+    arrays: Dict[str, np.ndarray] = {f: np.full((n, p), np.nan) for f in PARAM_FIELDS}
+    arrays["vary"] = np.zeros((n, p), dtype=bool)
+    arrays["has_param"] = np.zeros((n, p), dtype=bool)
+    arrays["covar"] = np.full((n, p, p), np.nan)
+    for f in SCALAR_FIELDS:
+        arrays[f] = np.full(n, np.nan)
+    data: Dict[str, List[np.ndarray]] = {f: [] for f in DATA_FIELDS}
+    offsets = [0]
+    hashes, models, methods = [], [], []
+
+    for i, key in enumerate(keys):
+        rec = records[key]
+        for name, par in rec["params"].items():
+            j = col[name]
+            arrays["has_param"][i, j] = True
+            arrays["vary"][i, j] = par["vary"]
+            for f in PARAM_FIELDS:
+                arrays[f][i, j] = par[f]
+        if rec["covar"] is not None:
+            idx = np.array([col[v] for v in rec["var_names"]], dtype=int)
+            arrays["covar"][i][np.ix_(idx, idx)] = rec["covar"]
+        for f in SCALAR_FIELDS:
+            arrays[f][i] = rec[f]
+        m = len(rec["x"])
+        for f in DATA_FIELDS:
+            data[f].append(np.full(m, np.nan) if rec[f] is None else np.asarray(rec[f], dtype=float))
+        offsets.append(offsets[-1] + m)
+        hashes.append(data_hash(rec["x"], rec["y"], rec["weights"]))
+        models.append(rec["model"])
+        methods.append(rec["method"])
+
+    for f in DATA_FIELDS:
+        arrays[f] = np.concatenate(data[f]) if keys else np.zeros(0)
+    arrays.update(
+        version=np.array(STORE_VERSION),
+        keys=np.array(keys, dtype=str),
+        param_names=np.array(names, dtype=str),
+        model=np.array(models, dtype=str),
+        method=np.array(methods, dtype=str),
+        data_hash=np.array(hashes, dtype=str),
+        data_offsets=np.array(offsets, dtype=np.int64),
+    )
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    np.savez(path, **arrays)
+    return path
+
+
+def convert_sav(sav_paths: Iterable[str | Path], out_path: str | Path) -> Path:
+    """Convert .sav files (keyed by file stem, e.g. 4U_wt_25_C) to one fit store."""
+    records = {Path(p).stem: read_sav(p) for p in sorted(Path(p) for p in sav_paths)}
+    if not records:
+        raise FileNotFoundError("No .sav files to convert")
+    return write_store(out_path, records)
+
+
+# ------------------------------------------------------------------------
+# Reading
+# ------------------------------------------------------------------------
+class FitStore:
+    """
+    Read-only view of a fit store. Fields are loaded on first use and cached,
+    so e.g. `params()` never touches the data arrays.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self._npz = np.load(self.path, allow_pickle=False)
+        self._cache: Dict[str, np.ndarray] = {}
+        version = int(self.field("version"))
+        if version > STORE_VERSION:
+            raise ValueError(f"{self.path}: fit store version {version} is newer than this reader ({STORE_VERSION})")
+        self.keys: List[str] = self.field("keys").tolist()
+        self.param_names: List[str] = self.field("param_names").tolist()
+        self._row = {k: i for i, k in enumerate(self.keys)}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._row
+
+    def __getitem__(self, key: str) -> "StoredFit":
+        return StoredFit(self, key)
+
+    def field(self, name: str) -> np.ndarray:
+        """One stored array (see the module docstring for the layout)."""
+        if name not in self._cache:
+            self._cache[name] = self._npz[name]
+        return self._cache[name]
+
+    def rows(self, keys: Optional[Sequence[str] | str] = None) -> np.ndarray:
+        """Row indices of `keys` (all fits if None)."""
+        if keys is None:
+            return np.arange(len(self.keys))
+        if isinstance(keys, str):
+            keys = [keys]
+        missing = [k for k in keys if k not in self._row]
+        if missing:
+            raise KeyError(f"{self.path.name}: no fits {missing}")
+        return np.array([self._row[k] for k in keys], dtype=int)
+
+    def params(
+        self,
+        keys: Optional[Sequence[str] | str] = None,
+        names: Optional[Sequence[str]] = None,
+        fields: Sequence[str] = ("value", "stderr"),
+    ) -> pd.DataFrame:
+        """
+        Parameters of many fits as one table.
+
+        Returns
+        -------
+        pd.DataFrame
+            One row per fit: key, model, then `<name>` for the value and
+            `<name>_<field>` for every other requested field.
+        """
+        rows = self.rows(keys)
+        names = list(names) if names is not None else self.param_names
+        cols = [self.param_names.index(n) for n in names]
+        out = pd.DataFrame({"key": self.field("keys")[rows], "model": self.field("model")[rows]})
+        for f in fields:
+            values = self.field(f)[np.ix_(rows, cols)]
+            for j, name in enumerate(names):
+                out[name if f == "value" else f"{name}_{f}"] = values[:, j]
+        return out
+
+    def scalars(self, keys: Optional[Sequence[str] | str] = None, fields: Sequence[str] = SCALAR_FIELDS) -> pd.DataFrame:
+        """Fit statistics (chisqr, redchi, rsquared, ...) and data_hash, one row per fit."""
+        rows = self.rows(keys)
+        out = pd.DataFrame({"key": self.field("keys")[rows]})
+        for f in fields:
+            out[f] = self.field(f)[rows]
+        out["data_hash"] = self.field("data_hash")[rows]
+        return out
+
+    def covar(self, keys: Optional[Sequence[str] | str] = None) -> np.ndarray:
+        """(n_keys, n_params, n_params) covariance in `param_names` order; NaN for fixed parameters."""
+        return self.field("covar")[self.rows(keys)]
+
+    def data(self, key: str) -> pd.DataFrame:
+        """x, y, weights, best_fit and residual of one fit."""
+        i = self.rows(key)[0]
+        lo, hi = self.field("data_offsets")[i : i + 2]
+        return pd.DataFrame({f: self.field(f)[lo:hi] for f in DATA_FIELDS})
+
+    def _model(self, rows: np.ndarray) -> tuple[Callable[..., Any], tuple[str, ...]]:
+        models = set(self.field("model")[rows].tolist())
+        if len(models) != 1:
+            raise ValueError(f"Evaluate fits of one model at a time, got {sorted(models)}")
+        model = models.pop()
+        if model not in MODEL_FUNCS:
+            raise KeyError(f"No function registered for model {model!r} (see fit_store.MODEL_FUNCS)")
+        return MODEL_FUNCS[model]
+
+    def _eval_rows(self, func, names, values: np.ndarray, x: np.ndarray) -> np.ndarray:
+        cols = [self.param_names.index(n) for n in names]
+        return func(x[None, :], *(values[:, j, None] for j in cols))
+
+    def eval(self, x: Any, keys: Optional[Sequence[str] | str] = None) -> np.ndarray:
+        """Best-fit curves at `x` for every key: (n_keys, n_x)."""
+        rows = self.rows(keys)
+        func, names = self._model(rows)
+        return self._eval_rows(func, names, self.field("value")[rows], np.atleast_1d(np.asarray(x, dtype=float)))
+
+    def eval_uncertainty(
+        self, x: Any, keys: Optional[Sequence[str] | str] = None, sigma: float = 1, dscale: float = 0.01
+    ) -> np.ndarray:
+        """
+        1-sigma (or `sigma`) confidence band of the curves at `x`: (n_keys, n_x).
+
+        Same as lmfit's ModelResult.eval_uncertainty: derivatives by central
+        differences at +/- stderr * dscale, propagated through the covariance
+        and scaled by the Student t quantile for ndata - nvarys dof. Fits with
+        a varied parameter without stderr get zeros, as in lmfit.
+        """
+        from scipy.special import erf
+        from scipy.stats import t
+
+        rows = self.rows(keys)
+        func, names = self._model(rows)
+        x = np.atleast_1d(np.asarray(x, dtype=float))
+        value = self.field("value")[rows]
+        stderr = self.field("stderr")[rows]
+        vary = self.field("vary")[rows]
+        pmin, pmax = self.field("min")[rows], self.field("max")[rows]
+        covar = np.nan_to_num(self.field("covar")[rows])
+
+        jac = np.zeros((len(rows), len(self.param_names), len(x)))
+        for j in np.flatnonzero(vary.any(axis=0)):
+            dval = np.where(vary[:, j], stderr[:, j] * dscale, 0.0)
+            step = np.where(dval != 0, dval, 1.0)
+            # lmfit clips the stepped parameter to its bounds but still divides by 2 * dval
+            up, down = value.copy(), value.copy()
+            up[:, j] = np.clip(value[:, j] + dval, pmin[:, j], pmax[:, j])
+            down[:, j] = np.clip(value[:, j] - dval, pmin[:, j], pmax[:, j])
+            diff = self._eval_rows(func, names, up, x) - self._eval_rows(func, names, down, x)
+            jac[:, j] = np.where((dval != 0)[:, None], diff / (2 * step[:, None]), 0.0)
+        df2 = np.einsum("nim,nij,njm->nm", jac, covar, jac)
+
+        prob = sigma if sigma < 1.0 else erf(sigma / np.sqrt(2))
+        dof = self.field("ndata")[rows] - self.field("nvarys")[rows]
+        scale = t.ppf((prob + 1) / 2.0, dof)
+        out = scale[:, None] * np.sqrt(np.maximum(df2, 0.0))
+        no_stderr = (vary & np.isnan(stderr)).any(axis=1)
+        out[no_stderr] = 0.0
+        return out
+
+
+class StoredFit:
+    """
+    One fit of a FitStore with the parts of the lmfit ModelResult interface the
+    notebooks use: params[name].value / .stderr, best_values, var_names, covar,
+    eval(x=...), eval_uncertainty(x=...), data / best_fit and the fit statistics.
+    """
+
+    def __init__(self, store: FitStore, key: str):
+        self.store = store
+        self.key = key
+        self._row = int(store.rows(key)[0])
+        row = self._row
+        has = store.field("has_param")[row]
+        self.params = {
+            name: SimpleNamespace(
+                name=name,
+                vary=bool(store.field("vary")[row, j]),
+                **{f: float(store.field(f)[row, j]) for f in PARAM_FIELDS},
+            )
+            for j, name in enumerate(store.param_names)
+            if has[j]
+        }
+        self.best_values = {name: p.value for name, p in self.params.items()}
+        self.var_names = [name for name, p in self.params.items() if p.vary]
+        self.model = str(store.field("model")[row])
+        self.data_hash = str(store.field("data_hash")[row])
+        for f in SCALAR_FIELDS:
+            setattr(self, f, store.field(f)[row].item())
+
+    @property
+    def covar(self) -> np.ndarray:
+        """Covariance in var_names order, as ModelResult.covar."""
+        idx = [self.store.param_names.index(n) for n in self.var_names]
+        return self.store.field("covar")[self._row][np.ix_(idx, idx)]
+
+    @property
+    def data(self) -> pd.DataFrame:
+        return self.store.data(self.key)
+
+    @property
+    def best_fit(self) -> np.ndarray:
+        return self.data["best_fit"].to_numpy()
+
+    def eval(self, x: Any) -> np.ndarray:
+        """Curve at `x`, shaped like `x` (a scalar x gives a scalar), as ModelResult.eval."""
+        return self.store.eval(x, keys=[self.key])[0].reshape(np.shape(x))
+
+    def eval_uncertainty(self, x: Any, sigma: float = 1, dscale: float = 0.01) -> np.ndarray:
+        """Confidence band at `x`, shaped like `x`, as ModelResult.eval_uncertainty."""
+        return self.store.eval_uncertainty(x, keys=[self.key], sigma=sigma, dscale=dscale)[0].reshape(np.shape(x))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Convert lmfit .sav fit results to a columnar fit store (.npz).")
+    ap.add_argument("sav", nargs="+", type=Path, help=".sav files or directories of .sav files")
+    ap.add_argument("--out", type=Path, help="Output .npz (default: <directory>.npz for a single directory)")
+    args = ap.parse_args()
+
+    paths: List[Path] = []
+    for p in args.sav:
+        paths.extend(sorted(p.glob("*.sav")) if p.is_dir() else [p])
+    out = args.out
+    if out is None:
+        if len(args.sav) != 1 or not args.sav[0].is_dir():
+            ap.error("--out is required unless converting a single directory")
+        out = args.sav[0].with_suffix(".npz")
+    convert_sav(paths, out)
+    print(f"Wrote {len(paths)} fits to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,428 @@
+"""
+nerd_db.py
+Maintenance helpers for Core_nerd_analysis/nerd.sqlite used by the figure notebooks.
+
+`migrate()` brings an existing database up to what the figure queries expect:
+a `site_base` column on meta_nucleotides ('18_A'-style, indexed), covering
+indexes for the fmod value / fit run lookups, and the wide fit-parameter table
+described below. `check_query_plans()` runs EXPLAIN QUERY PLAN over the
+canonical figure queries and reports any step that falls back to a full scan.
+
+`probe_tc_fit_params` stores one row per (fit_run_id, param_name). The notebooks
+need the parameters side by side (log_kobs, log_kdeg, log_fmod0, errors, r2), so
+this module maintains `probe_tc_fit_params_wide`: one row per fit run, keyed by
+(fit_run_id, rg_id, nt_id, valtype, fit_kind) and indexed for lookups. Triggers
+on `probe_tc_fit_params` / `probe_tc_fit_runs` keep it current whenever
+`nerd run probe_timecourse` writes new rounds, so figure queries become a single
+indexed read instead of a MAX(CASE ...) pivot.
+
+Usage:
+    python Figure_analysis/Utilities/nerd_db.py --db Core_nerd_analysis/nerd.sqlite [--check-plans]
+    # or
+    from Figure_analysis.Utilities.nerd_db import migrate, check_query_plans
+"""
+
+from __future__ import annotations
+
+import argparse
+import re
+import sqlite3
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+
+# ------------------------------------------------------------------------
+# Wide fit-parameter table
+# ------------------------------------------------------------------------
+FIT_PARAMS_WIDE_TABLE = "probe_tc_fit_params_wide"
+
+# wide column -> accepted param_name spellings in probe_tc_fit_params
+FIT_PARAM_COLUMNS: Dict[str, Tuple[str, ...]] = {
+    "log_kobs": ("log_kobs", "logkobs"),
+    "log_kdeg": ("log_kdeg", "logkdeg"),
+    "log_fmod0": ("log_fmod0", "logfmod0"),
+    "kobs": ("kobs",),
+    "kdeg": ("kdeg",),
+    "fmod0": ("fmod0",),
+    "log_kobs_err": ("log_kobs_err", "logkobs_err"),
+    "log_kdeg_err": ("log_kdeg_err", "logkdeg_err"),
+    "log_fmod0_err": ("log_fmod0_err", "logfmod0_err"),
+    "diag_r2": ("diag:r2",),
+}
+
+_KEY_COLUMNS = ("fit_run_id", "rg_id", "nt_id", "valtype", "fit_kind")
+
+
+def _pivot_select(where: str) -> str:
+    """Return the MAX(CASE ...) pivot of probe_tc_fit_params restricted by `where`."""
+    cases = []
+    for col, names in FIT_PARAM_COLUMNS.items():
+        quoted = ",".join(f"'{n}'" for n in names)
+        cases.append(
+            f"MAX(CASE WHEN p.param_name IN ({quoted}) THEN p.param_numeric END) AS {col}"
+        )
+    cases_sql = ",\n            ".join(cases)
+    return f"""
+        SELECT
+            r.id AS fit_run_id,
+            r.rg_id,
+            r.nt_id,
+            r.valtype,
+            r.fit_kind,
+            {cases_sql}
+        FROM probe_tc_fit_runs r
+        JOIN probe_tc_fit_params p ON p.fit_run_id = r.id
+        WHERE {where}
+        GROUP BY r.id
+    """
+
+
+def _wide_columns() -> str:
+    return ", ".join(_KEY_COLUMNS + tuple(FIT_PARAM_COLUMNS))
+
+
+def _create_wide_sql() -> list[str]:
+    value_cols = ",\n    ".join(f"{c} REAL" for c in FIT_PARAM_COLUMNS)
+    upsert = (
+        f"DELETE FROM {FIT_PARAMS_WIDE_TABLE} WHERE fit_run_id = {{run}};\n"
+        f"    INSERT INTO {FIT_PARAMS_WIDE_TABLE} ({_wide_columns()})\n"
+        f"    {_pivot_select('r.id = {run}')};"
+    )
+    return [
+        f"""
+        CREATE TABLE IF NOT EXISTS {FIT_PARAMS_WIDE_TABLE} (
+            fit_run_id INTEGER PRIMARY KEY,
+            rg_id      INTEGER,
+            nt_id      INTEGER,
+            valtype    TEXT,
+            fit_kind   TEXT,
+            {value_cols}
+        )
+        """,
+        f"""
+        CREATE INDEX IF NOT EXISTS idx_{FIT_PARAMS_WIDE_TABLE}_lookup
+        ON {FIT_PARAMS_WIDE_TABLE} (rg_id, nt_id, valtype, fit_kind)
+        """,
+        # Triggers recompute one fit run per write, so this index keeps them cheap
+        """
+        CREATE INDEX IF NOT EXISTS idx_probe_tc_fit_params_run
+        ON probe_tc_fit_params (fit_run_id, param_name)
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{FIT_PARAMS_WIDE_TABLE}_ins
+        AFTER INSERT ON probe_tc_fit_params
+        BEGIN
+            {upsert.format(run='NEW.fit_run_id')}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{FIT_PARAMS_WIDE_TABLE}_upd
+        AFTER UPDATE ON probe_tc_fit_params
+        BEGIN
+            {upsert.format(run='OLD.fit_run_id')}
+            {upsert.format(run='NEW.fit_run_id')}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{FIT_PARAMS_WIDE_TABLE}_del
+        AFTER DELETE ON probe_tc_fit_params
+        BEGIN
+            {upsert.format(run='OLD.fit_run_id')}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{FIT_PARAMS_WIDE_TABLE}_run_del
+        AFTER DELETE ON probe_tc_fit_runs
+        BEGIN
+            DELETE FROM {FIT_PARAMS_WIDE_TABLE} WHERE fit_run_id = OLD.id;
+        END
+        """,
+        # Re-keying a fit run (e.g. moving it to another rg_id) repivots it
+        # under its new key columns
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{FIT_PARAMS_WIDE_TABLE}_run_upd
+        AFTER UPDATE OF id, rg_id, nt_id, valtype, fit_kind ON probe_tc_fit_runs
+        BEGIN
+            DELETE FROM {FIT_PARAMS_WIDE_TABLE} WHERE fit_run_id = OLD.id;
+            {upsert.format(run='NEW.id')}
+        END
+        """,
+    ]
+
+
+def refresh_fit_params_wide(conn: sqlite3.Connection, rebuild: bool = False) -> int:
+    """
+    Bring `probe_tc_fit_params_wide` up to date with probe_tc_fit_params.
+
+    The triggers handle every write made after the table exists; this backfills
+    fit runs written before that (or by a copy of the database without the
+    triggers) and drops rows whose fit run has been removed.
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        Writable connection to nerd.sqlite.
+    rebuild : bool, default False
+        Drop and repivot every fit run instead of only the missing ones.
+
+    Returns
+    -------
+    int
+        Number of fit runs (re)pivoted.
+    """
+    with conn:
+        if rebuild:
+            conn.execute(f"DELETE FROM {FIT_PARAMS_WIDE_TABLE}")
+        conn.execute(
+            f"""
+            DELETE FROM {FIT_PARAMS_WIDE_TABLE}
+            WHERE fit_run_id NOT IN (SELECT id FROM probe_tc_fit_runs)
+            """
+        )
+        cur = conn.execute(
+            f"""
+            INSERT INTO {FIT_PARAMS_WIDE_TABLE} ({_wide_columns()})
+            {_pivot_select(f"r.id NOT IN (SELECT fit_run_id FROM {FIT_PARAMS_WIDE_TABLE})")}
+            """
+        )
+    return cur.rowcount
+
+
+def ensure_fit_params_wide(db_path: str | Path, rebuild: bool = False) -> int:
+    """
+    Create the wide fit-parameter table, its index and triggers if needed,
+    then backfill any fit runs that are not yet materialized.
+
+    Safe to call repeatedly; on an up-to-date database it only checks for
+    missing fit runs.
+
+    Returns
+    -------
+    int
+        Number of fit runs (re)pivoted.
+    """
+    conn = sqlite3.connect(str(db_path))
+    try:
+        with conn:
+            for stmt in _create_wide_sql():
+                conn.execute(stmt)
+        return refresh_fit_params_wide(conn, rebuild=rebuild)
+    finally:
+        conn.close()
+
+
+# ------------------------------------------------------------------------
+# Schema migration (site_base column + lookup indexes)
+# ------------------------------------------------------------------------
+SITE_BASE_EXPR = "site || '_' || UPPER(base)"
+
+LOOKUP_INDEXES: Dict[str, Tuple[str, str]] = {
+    "idx_meta_nucleotides_site_base": ("meta_nucleotides", "site_base"),
+    "idx_probe_fmod_values_rxn_nt_valtype": ("probe_fmod_values", "rxn_id, nt_id, valtype"),
+    "idx_probe_tc_fit_runs_rg_nt_kind_valtype": ("probe_tc_fit_runs", "rg_id, nt_id, fit_kind, valtype"),
+    "idx_probe_reactions_rg": ("probe_reactions", "rg_id"),
+}
+
+
+def _has_column(conn: sqlite3.Connection, table: str, column: str) -> bool:
+    # table_xinfo (unlike table_info) also lists generated columns
+    return any(row[1] == column for row in conn.execute(f"PRAGMA table_xinfo({table})"))
+
+
+def add_site_base_column(conn: sqlite3.Connection) -> bool:
+    """
+    Add `meta_nucleotides.site_base` (e.g. '18_A') as a generated column.
+
+    SQLite can only ALTER in VIRTUAL generated columns; the value is still
+    materialized in `idx_meta_nucleotides_site_base`, which is what makes
+    `mn.site_base = :site_base` an index lookup.
+
+    Returns
+    -------
+    bool
+        True if the column was added, False if it already existed.
+    """
+    if _has_column(conn, "meta_nucleotides", "site_base"):
+        return False
+    conn.execute(
+        f"""
+        ALTER TABLE meta_nucleotides
+        ADD COLUMN site_base TEXT GENERATED ALWAYS AS ({SITE_BASE_EXPR}) VIRTUAL
+        """
+    )
+    return True
+
+
+def migrate(db_path: str | Path, rebuild: bool = False) -> None:
+    """
+    Apply every figure-query migration to an existing nerd.sqlite. Idempotent.
+
+    Parameters
+    ----------
+    db_path : str or Path
+        Path to nerd.sqlite.
+    rebuild : bool, default False
+        Forwarded to `ensure_fit_params_wide`.
+    """
+    conn = sqlite3.connect(str(db_path))
+    try:
+        with conn:
+            if add_site_base_column(conn):
+                print("meta_nucleotides: added site_base column.")
+            for name, (table, cols) in LOOKUP_INDEXES.items():
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({cols})")
+            conn.execute("ANALYZE")
+    finally:
+        conn.close()
+
+    n = ensure_fit_params_wide(db_path, rebuild=rebuild)
+    print(f"{FIT_PARAMS_WIDE_TABLE}: {n} fit runs pivoted.")
+
+
+# ------------------------------------------------------------------------
+# Canonical figure queries + EXPLAIN QUERY PLAN check
+# ------------------------------------------------------------------------
+TIMECOURSE_SQL = """
+    SELECT
+        pr.rg_id,
+        pr.reaction_time,
+        pr.treated,
+        pr.temperature,
+        pr.replicate,
+        pr.buffer_id,
+        fv.fmod_val,
+        fv.valtype,
+        mn.site,
+        mn.base,
+        mn.site_base,
+        s.sample_name
+    FROM probe_reactions pr
+    JOIN probe_fmod_values fv ON fv.rxn_id = pr.id
+    JOIN meta_nucleotides mn ON mn.id = fv.nt_id
+    JOIN sequencing_samples s ON s.id = pr.s_id
+    WHERE pr.rg_id = :rg_id
+    AND mn.site_base = :site_base
+    AND fv.valtype = :valtype
+    AND s.to_drop != 1
+    AND fv.outlier != 1
+    ORDER BY pr.reaction_time
+"""
+
+TC_FIT_PARAMS_SQL = f"""
+    SELECT w.*
+    FROM {FIT_PARAMS_WIDE_TABLE} w
+    JOIN meta_nucleotides mn ON mn.id = w.nt_id
+    WHERE w.rg_id = :rg_id
+    AND mn.site_base = :site_base
+    AND w.fit_kind = 'round3_constrained'
+    AND w.valtype = :valtype
+"""
+
+TC_FIT_PARAMS_BY_CONSTRUCT_SQL = f"""
+    SELECT w.*, pr.temperature, pr.replicate
+    FROM {FIT_PARAMS_WIDE_TABLE} w
+    JOIN meta_nucleotides mn ON mn.id = w.nt_id
+    JOIN (
+        SELECT DISTINCT rg_id, construct_id, temperature, replicate
+        FROM probe_reactions
+    ) pr ON pr.rg_id = w.rg_id
+    JOIN meta_constructs mc ON mc.id = pr.construct_id
+    WHERE mc.disp_name = :construct
+    AND mn.site_base = :site_base
+    AND w.fit_kind = 'round3_constrained'
+    AND w.valtype = :valtype
+"""
+
+GLOBAL_KDEG_SQL = f"""
+    SELECT w.log_kdeg, w.log_kdeg_err
+    FROM {FIT_PARAMS_WIDE_TABLE} w
+    WHERE w.rg_id = :rg_id
+    AND w.fit_kind = 'round2_global'
+    AND w.log_kdeg IS NOT NULL
+"""
+
+CANONICAL_QUERIES: Dict[str, str] = {
+    "timecourse": TIMECOURSE_SQL,
+    "tc_fit_params": TC_FIT_PARAMS_SQL,
+    "tc_fit_params_by_construct": TC_FIT_PARAMS_BY_CONSTRUCT_SQL,
+    "global_kdeg": GLOBAL_KDEG_SQL,
+}
+
+# Tables too large to scan per call; meta_constructs / sequencing_samples are tiny
+_NO_SCAN_TABLES = (
+    "probe_fmod_values",
+    "probe_tc_fit_params",
+    "probe_tc_fit_runs",
+    FIT_PARAMS_WIDE_TABLE,
+    "meta_nucleotides",
+)
+
+
+def _scanned_tables(sql: str, plan_details: List[str]) -> List[str]:
+    """Map `SCAN <alias>` plan steps back to table names in `sql`."""
+    aliases = {t: t for t in _NO_SCAN_TABLES}
+    for table in _NO_SCAN_TABLES:
+        for alias in re.findall(rf"\b{table}\s+(?:AS\s+)?(\w+)", sql, flags=re.I):
+            aliases[alias] = table
+    hits = []
+    for detail in plan_details:
+        m = re.match(r"SCAN (\w+)", detail)
+        if m and m.group(1) in aliases:
+            hits.append(f"{aliases[m.group(1)]}: {detail}")
+    return hits
+
+
+def check_query_plans(conn: sqlite3.Connection) -> Dict[str, List[str]]:
+    """
+    EXPLAIN QUERY PLAN every canonical figure query.
+
+    Returns
+    -------
+    dict
+        query name -> list of full-scan steps on large tables (empty if the
+        query is fully indexed).
+    """
+    params = {"rg_id": 0, "site_base": "", "valtype": "", "construct": ""}
+    report = {}
+    for name, sql in CANONICAL_QUERIES.items():
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        report[name] = _scanned_tables(sql, [row[-1] for row in plan])
+    return report
+
+
+def main():
+    ap = argparse.ArgumentParser(
+        description="Migrate nerd.sqlite for the figure notebooks (site_base, indexes, wide fit table)."
+    )
+    ap.add_argument("--db", type=Path, required=True, help="Path to nerd.sqlite")
+    ap.add_argument("--rebuild", action="store_true", help="Repivot every fit run from scratch")
+    ap.add_argument(
+        "--check-plans",
+        action="store_true",
+        help="Fail if any canonical figure query needs a full table scan",
+    )
+    args = ap.parse_args()
+
+    assert args.db.exists(), f"DB not found: {args.db}"
+
+    migrate(args.db, rebuild=args.rebuild)
+
+    if args.check_plans:
+        conn = sqlite3.connect(str(args.db))
+        report = check_query_plans(conn)
+        conn.close()
+
+        failed = False
+        for name, scans in report.items():
+            status = "OK" if not scans else "FULL SCAN"
+            print(f"[{status}] {name}")
+            for detail in scans:
+                print(f"    {detail}")
+            failed = failed or bool(scans)
+        if failed:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+nerd_fetch.py
+Batched, read-only access to Core_nerd_analysis/nerd.sqlite for figure notebooks.
+
+The per-notebook helpers (`fetch_timecourse_data`, `fetch_tc_fit_params`,
+`fetch_global_kdeg`, ...) take one rg_id / site_base at a time and open a new
+connection per call. The functions here take lists of rg_ids x site_bases x
+valtypes (or constructs), run one set-based query over a single shared
+read-only connection, and return one tidy DataFrame to slice in pandas.
+
+Requires the migrations in nerd_db.py (`meta_nucleotides.site_base`, indexes,
+`probe_tc_fit_params_wide`).
+
+Usage:
+    from Figure_analysis.Utilities.nerd_fetch import fetch_tc_fit_params_many
+
+    fits = fetch_tc_fit_params_many(NERD_SQLITE, rg_ids=[79, 80], site_bases=["18_A", "9_C"])
+"""
+
+from __future__ import annotations
+
+import numbers
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+import pandas as pd
+
+
+# ------------------------------------------------------------------------
+# Shared read-only connection
+# ------------------------------------------------------------------------
+# nerd.sqlite is a few GB with all constructs loaded; let SQLite mmap it
+DEFAULT_MMAP_BYTES = 4 * 1024**3
+
+_CONNECTIONS: Dict[str, sqlite3.Connection] = {}
+
+
+def get_connection(db_path: str | Path, mmap_bytes: int = DEFAULT_MMAP_BYTES) -> sqlite3.Connection:
+    """
+    Return the shared read-only connection for `db_path`, opening it on first use.
+
+    The database is opened with `mode=ro`, so figure code can never modify it,
+    and with `PRAGMA mmap_size` so repeated reads are served from the page cache.
+    """
+    path = Path(db_path).expanduser().resolve()
+    key = str(path)
+    conn = _CONNECTIONS.get(key)
+    if conn is None:
+        if not path.exists():
+            raise FileNotFoundError(f"Database not found: {path}")
+        conn = sqlite3.connect(f"{path.as_uri()}?mode=ro", uri=True, check_same_thread=False)
+        conn.execute(f"PRAGMA mmap_size = {int(mmap_bytes)}")
+        _CONNECTIONS[key] = conn
+    return conn
+
+
+def close_connections() -> None:
+    """Close every shared connection (e.g. before rerunning `nerd` on the database)."""
+    for conn in _CONNECTIONS.values():
+        conn.close()
+    _CONNECTIONS.clear()
+
+
+def _in_clause(column: str, prefix: str, values: Optional[Iterable[Any]], params: Dict[str, Any]) -> str:
+    """
+    Return `column IN (:prefix_0, ...)` and add the bindings to `params`.
+
+    None means "no filter" and yields an always-true clause.
+    """
+    if values is None:
+        return "1 = 1"
+    values = list(dict.fromkeys(values))  # dedupe, keep order
+    if not values:
+        return "0 = 1"
+    names = []
+    for i, v in enumerate(values):
+        name = f"{prefix}_{i}"
+        params[name] = v
+        names.append(f":{name}")
+    return f"{column} IN ({', '.join(names)})"
+
+
+def _as_list(values: Any) -> Optional[List[Any]]:
+    if values is None:
+        return None
+    if isinstance(values, (str, numbers.Integral)):
+        values = [values]
+    # numpy integers (ids taken from arrays / frames) cannot be bound by sqlite3
+    return [int(v) if isinstance(v, numbers.Integral) else v for v in values]
+
+
+# ------------------------------------------------------------------------
+# Batched fetches
+# ------------------------------------------------------------------------
+def fetch_timecourse_many(
+    db_path: str | Path,
+    rg_ids: Iterable[int] | int,
+    site_bases: Iterable[str] | str | None = None,
+    valtypes: Iterable[str] | str = ("modrate",),
+    drop_outliers: bool = True,
+) -> pd.DataFrame:
+    """
+    Fetch time-course fmod values for every rg_id x site_base x valtype at once.
+
+    Parameters
+    ----------
+    db_path : str or Path
+        Path to nerd.sqlite.
+    rg_ids : int or list of int
+        Reaction group IDs.
+    site_bases : str or list of str, optional
+        Site and base combinations (e.g. '18_A', '25_C'); None for all sites.
+    valtypes : str or list of str, default ('modrate',)
+        Value types (e.g. 'modrate', 'GAmodrate').
+    drop_outliers : bool, default True
+        Exclude dropped samples and flagged outlier values, as the figure
+        notebooks do. If False, they are kept and can be filtered on the
+        `outlier` / `to_drop` columns.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per (reaction, nucleotide, valtype) with columns: rg_id,
+        reaction_time, treated, temperature, replicate, buffer_id, fmod_val,
+        valtype, site, base, site_base, sample_name, outlier, to_drop.
+    """
+    params: Dict[str, Any] = {}
+    where = [
+        _in_clause("pr.rg_id", "rg", _as_list(rg_ids), params),
+        _in_clause("mn.site_base", "sb", _as_list(site_bases), params),
+        _in_clause("fv.valtype", "vt", _as_list(valtypes), params),
+    ]
+    if drop_outliers:
+        where += ["s.to_drop != 1", "fv.outlier != 1"]
+
+    sql = f"""
+        SELECT
+            pr.rg_id,
+            pr.reaction_time,
+            pr.treated,
+            pr.temperature,
+            pr.replicate,
+            pr.buffer_id,
+            fv.fmod_val,
+            fv.valtype,
+            mn.site,
+            mn.base,
+            mn.site_base,
+            s.sample_name,
+            fv.outlier,
+            s.to_drop
+        FROM probe_reactions pr
+        JOIN probe_fmod_values fv ON fv.rxn_id = pr.id
+        JOIN meta_nucleotides mn ON mn.id = fv.nt_id
+        JOIN sequencing_samples s ON s.id = pr.s_id
+        WHERE {' AND '.join(where)}
+        ORDER BY pr.rg_id, mn.site, fv.valtype, pr.reaction_time
+    """
+    return pd.read_sql_query(sql, get_connection(db_path), params=params)
+
+
+def fetch_tc_fit_params_many(
+    db_path: str | Path,
+    rg_ids: Iterable[int] | int | None = None,
+    site_bases: Iterable[str] | str | None = None,
+    valtypes: Iterable[str] | str = ("modrate",),
+    constructs: Iterable[str] | str | None = None,
+    fit_kind: str = "round3_constrained",
+) -> pd.DataFrame:
+    """
+    Fetch fitted time-course parameters for many sites in one query.
+
+    Filter by rg_ids, by construct disp_name (all of the construct's rg_ids,
+    i.e. every temperature/replicate), or both.
+
+    Parameters
+    ----------
+    db_path : str or Path
+        Path to nerd.sqlite.
+    rg_ids : int or list of int, optional
+        Reaction group IDs; None for all.
+    site_bases : str or list of str, optional
+        Site and base combinations (e.g. '18_A', '25_C'); None for all sites.
+    valtypes : str or list of str, default ('modrate',)
+        Value types to include.
+    constructs : str or list of str, optional
+        Construct disp_names (e.g. '4U_wt'); None for all.
+    fit_kind : str, default 'round3_constrained'
+        Fit round to read.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per fit run with columns: construct, rg_id, temperature,
+        replicate, site, base, site_base, valtype, fit_kind, fit_run_id,
+        log_kobs, log_kdeg, log_fmod0, kobs, kdeg, fmod0, log_kobs_err,
+        log_kdeg_err, log_fmod0_err, diag_r2.
+    """
+    params: Dict[str, Any] = {"fit_kind": fit_kind}
+    where = [
+        "w.fit_kind = :fit_kind",
+        _in_clause("w.rg_id", "rg", _as_list(rg_ids), params),
+        _in_clause("mn.site_base", "sb", _as_list(site_bases), params),
+        _in_clause("w.valtype", "vt", _as_list(valtypes), params),
+        _in_clause("mc.disp_name", "mc", _as_list(constructs), params),
+    ]
+
+    sql = f"""
+        SELECT
+            mc.disp_name AS construct,
+            w.rg_id,
+            pr.temperature,
+            pr.replicate,
+            mn.site,
+            mn.base,
+            mn.site_base,
+            w.valtype,
+            w.fit_kind,
+            w.fit_run_id,
+            w.log_kobs,
+            w.log_kdeg,
+            w.log_fmod0,
+            w.kobs,
+            w.kdeg,
+            w.fmod0,
+            w.log_kobs_err,
+            w.log_kdeg_err,
+            w.log_fmod0_err,
+            w.diag_r2
+        FROM probe_tc_fit_params_wide w
+        JOIN meta_nucleotides mn ON mn.id = w.nt_id
+        JOIN (
+            SELECT DISTINCT rg_id, construct_id, temperature, replicate
+            FROM probe_reactions
+        ) pr ON pr.rg_id = w.rg_id
+        JOIN meta_constructs mc ON mc.id = pr.construct_id
+        WHERE {' AND '.join(where)}
+        ORDER BY mc.disp_name, pr.temperature, pr.replicate, mn.site, w.valtype
+    """
+    return pd.read_sql_query(sql, get_connection(db_path), params=params)
+
+
+def fetch_global_kdeg_many(db_path: str | Path, rg_ids: Iterable[int] | int) -> pd.DataFrame:
+    """
+    Fetch the round2_global kdeg (shared per rg_id) for many reaction groups.
+
+    Returns
+    -------
+    pd.DataFrame
+        Columns: rg_id, valtype, log_kdeg, log_kdeg_err.
+    """
+    params: Dict[str, Any] = {}
+    sql = f"""
+        SELECT
+            w.rg_id,
+            w.valtype,
+            w.log_kdeg,
+            w.log_kdeg_err
+        FROM probe_tc_fit_params_wide w
+        WHERE {_in_clause("w.rg_id", "rg", _as_list(rg_ids), params)}
+        AND w.fit_kind = 'round2_global'
+        AND w.log_kdeg IS NOT NULL
+        ORDER BY w.rg_id
+    """
+    return pd.read_sql_query(sql, get_connection(db_path), params=params)
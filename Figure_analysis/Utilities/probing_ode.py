@@ -0,0 +1,389 @@
+"""
+probing_ode.py
+Compiled, batched solver for the chemical probing kinetic scheme (SFig1).
+
+    U <-> R        k_o = K * k_c (opening), k_c (closing)
+    R + S -> M     k_add (M^-1 s^-1)
+    S -> Z         k_deg (s^-1)
+
+fmod(t) = M / (U + R + M).
+
+`ode_solution` in SFig1_ODEvAnalytical/ode_v_analytical.ipynb defined the
+right-hand side with `@cfunc(lsoda_sig)` inside the function, so numba
+recompiled it on every call. Here the right-hand side, its analytic Jacobian
+and the integrators are compiled once, on first use, with `cache=True`, so
+later sessions load the machine code from __pycache__ instead of compiling.
+
+`fmod_batch` integrates many (K, k_c, k_add, k_deg, RNA conc) parameter sets
+at once, in parallel over numba threads, and returns one (n_sets, n_times)
+array:
+
+    method="rosenbrock"  (default) 4th-order L-stable Rosenbrock method
+                         (Kaps-Rentrop / Shampine coefficients) with an
+                         embedded 3rd-order error estimate; uses the analytic
+                         Jacobian, so stiff sets (k_c up to 1e12 s^-1) take
+                         few steps
+    method="lsoda"       numbalsoda's LSODA on the same compiled right-hand
+                         side, as in the original notebook
+
+Usage:
+    from Figure_analysis.Utilities.probing_ode import fmod_batch, pe_model
+
+    t = np.linspace(0, 20000, 25)
+    k_c = np.array([1e12, 1e9, 1e6, 1e0, 1e-3, 1e-6])
+    y_ode = fmod_batch(t, K=0.5, k_c=k_c, k_add=kadd, k_deg=kdeg, rna_conc=1e-6)  # (6, 25)
+    y_pe = pe_model(t, 0.5, kadd, kdeg, PROBE_CONC)
+
+`calc_kadd_from_eyring` (k_add from an Eyring fit) is shared by the notebook
+and SFig1_ODEvAnalytical/pe_validity_map.py.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Optional, Tuple
+
+import numpy as np
+from numba import njit, prange
+
+
+SPECIES = ("U", "R", "S", "M", "Z")
+RATE_NAMES = ("k_o", "k_c", "k_add", "k_deg")
+N_SPECIES = len(SPECIES)
+
+# Probe concentration used in the SFig1 simulations (M)
+PROBE_CONC = 0.01584
+
+DEFAULT_RTOL = 1e-8
+DEFAULT_ATOL = 1e-10
+DEFAULT_MAX_STEPS = 200_000
+
+METHODS = ("rosenbrock", "lsoda")
+
+# Kaps-Rentrop 4(3) Rosenbrock coefficients with Shampine's parameters
+# (autonomous system, so the time-derivative terms vanish)
+_GAM = 1.0 / 2.0
+_A21 = 2.0
+_A31, _A32 = 48.0 / 25.0, 6.0 / 25.0
+_C21 = -8.0
+_C31, _C32 = 372.0 / 25.0, 12.0 / 5.0
+_C41, _C42, _C43 = -112.0 / 125.0, -54.0 / 125.0, -2.0 / 5.0
+_B1, _B2, _B3, _B4 = 19.0 / 9.0, 1.0 / 2.0, 25.0 / 108.0, 125.0 / 108.0
+_E1, _E2, _E3, _E4 = 17.0 / 54.0, 7.0 / 36.0, 0.0, 125.0 / 108.0
+
+
+# ------------------------------------------------------------------------
+# Model (compiled once, cached on disk)
+# ------------------------------------------------------------------------
+@njit(cache=True, inline="always")
+def _rhs(y, p, du):
+    open_close = p[0] * y[0] - p[1] * y[1]
+    add = p[2] * y[1] * y[2]
+    du[0] = -open_close
+    du[1] = open_close - add
+    du[2] = -add - p[3] * y[2]
+    du[3] = add
+    du[4] = p[3] * y[2]
+
+
+@njit(cache=True, inline="always")
+def _jac(y, p, J):
+    J[:, :] = 0.0
+    J[0, 0] = -p[0]
+    J[0, 1] = p[1]
+    J[1, 0] = p[0]
+    J[1, 1] = -p[1] - p[2] * y[2]
+    J[1, 2] = -p[2] * y[1]
+    J[2, 1] = -p[2] * y[2]
+    J[2, 2] = -p[2] * y[1] - p[3]
+    J[3, 1] = p[2] * y[2]
+    J[3, 2] = p[2] * y[1]
+    J[4, 2] = p[3]
+
+
+@njit(cache=True)
+def _lu_factor(A, piv):
+    """In-place LU decomposition with partial pivoting; False if singular."""
+    n = A.shape[0]
+    for k in range(n):
+        m = k
+        for i in range(k + 1, n):
+            if abs(A[i, k]) > abs(A[m, k]):
+                m = i
+        if A[m, k] == 0.0:
+            return False
+        piv[k] = m
+        if m != k:
+            for j in range(n):
+                A[k, j], A[m, j] = A[m, j], A[k, j]
+        for i in range(k + 1, n):
+            A[i, k] /= A[k, k]
+            for j in range(k + 1, n):
+                A[i, j] -= A[i, k] * A[k, j]
+    return True
+
+
+@njit(cache=True)
+def _lu_solve(A, piv, b):
+    """Solve in place for b with the factors from _lu_factor."""
+    n = A.shape[0]
+    for k in range(n):
+        m = piv[k]
+        if m != k:
+            b[k], b[m] = b[m], b[k]
+        for i in range(k + 1, n):
+            b[i] -= A[i, k] * b[k]
+    for i in range(n - 1, -1, -1):
+        for j in range(i + 1, n):
+            b[i] -= A[i, j] * b[j]
+        b[i] /= A[i, i]
+
+
+@njit(cache=True)
+def _rosenbrock(y0, p, t_eval, rtol, atol, max_steps, out):
+    """
+    Integrate one parameter set from t_eval[0], writing the state at every
+    t_eval into out (n_times, N_SPECIES). Returns False if the step budget
+    runs out or the step size underflows.
+    """
+    n = y0.shape[0]
+    y = y0.copy()
+    out[0, :] = y
+    ynew = np.empty(n)
+    ytmp = np.empty(n)
+    f = np.empty(n)
+    g1 = np.empty(n)
+    g2 = np.empty(n)
+    g3 = np.empty(n)
+    g4 = np.empty(n)
+    J = np.empty((n, n))
+    A = np.empty((n, n))
+    piv = np.empty(n, dtype=np.int64)
+
+    # initial step from the scaled size of y and f (Hairer & Wanner II.4)
+    _rhs(y, p, f)
+    d0 = 0.0
+    d1 = 0.0
+    for i in range(n):
+        sc = atol + rtol * abs(y[i])
+        d0 += (y[i] / sc) ** 2
+        d1 += (f[i] / sc) ** 2
+    d0 = np.sqrt(d0 / n)
+    d1 = np.sqrt(d1 / n)
+    h = 0.01 * d0 / d1 if d0 > 1e-5 and d1 > 1e-5 else 1e-6
+    span = t_eval[-1] - t_eval[0]
+    if span > 0.0:
+        h = min(h, span)
+
+    t = t_eval[0]
+    steps = 0
+    for k in range(1, t_eval.shape[0]):
+        t_out = t_eval[k]
+        while t < t_out:
+            if steps >= max_steps or h <= 1e-14 * max(abs(t), 1.0):
+                return False
+            steps += 1
+            last = t + h >= t_out
+            hs = t_out - t if last else h
+
+            _jac(y, p, J)
+            for i in range(n):
+                for j in range(n):
+                    A[i, j] = -J[i, j]
+                A[i, i] += 1.0 / (_GAM * hs)
+            if not _lu_factor(A, piv):
+                h *= 0.5
+                continue
+
+            _rhs(y, p, g1)
+            _lu_solve(A, piv, g1)
+
+            for i in range(n):
+                ytmp[i] = y[i] + _A21 * g1[i]
+            _rhs(ytmp, p, f)
+            for i in range(n):
+                g2[i] = f[i] + _C21 * g1[i] / hs
+            _lu_solve(A, piv, g2)
+
+            for i in range(n):
+                ytmp[i] = y[i] + _A31 * g1[i] + _A32 * g2[i]
+            _rhs(ytmp, p, f)
+            for i in range(n):
+                g3[i] = f[i] + (_C31 * g1[i] + _C32 * g2[i]) / hs
+            _lu_solve(A, piv, g3)
+            for i in range(n):
+                g4[i] = f[i] + (_C41 * g1[i] + _C42 * g2[i] + _C43 * g3[i]) / hs
+            _lu_solve(A, piv, g4)
+
+            err = 0.0
+            for i in range(n):
+                ynew[i] = y[i] + _B1 * g1[i] + _B2 * g2[i] + _B3 * g3[i] + _B4 * g4[i]
+                e = _E1 * g1[i] + _E2 * g2[i] + _E3 * g3[i] + _E4 * g4[i]
+                sc = atol + rtol * max(abs(y[i]), abs(ynew[i]))
+                err += (e / sc) ** 2
+            err = np.sqrt(err / n)
+
+            fac = 5.0 if err == 0.0 else min(5.0, max(0.2, 0.9 * err ** -0.25))
+            if err <= 1.0:
+                t = t_out if last else t + hs
+                for i in range(n):
+                    y[i] = ynew[i]
+                # a step cut short at an output time does not shrink the next one
+                h = max(h, hs * fac) if last else hs * fac
+            else:
+                h = hs * fac
+        out[k, :] = y
+    return True
+
+
+@njit(cache=True, parallel=True)
+def _rosenbrock_batch(y0, rates, t_eval, rtol, atol, max_steps, out, ok):
+    for i in prange(y0.shape[0]):
+        ok[i] = _rosenbrock(y0[i], rates[i], t_eval, rtol, atol, max_steps, out[i])
+
+
+_LSODA: Optional[Tuple[Any, Any]] = None
+
+
+def _lsoda_batch_kernel():
+    """Compile (or load from cache) the numbalsoda cfunc and its batch loop on first use."""
+    global _LSODA
+    if _LSODA is None:
+        from numba import cfunc
+        from numbalsoda import lsoda, lsoda_sig
+
+        @cfunc(lsoda_sig, cache=True)
+        def rhs_cfunc(t, y, du, p):
+            open_close = p[0] * y[0] - p[1] * y[1]
+            add = p[2] * y[1] * y[2]
+            du[0] = -open_close
+            du[1] = open_close - add
+            du[2] = -add - p[3] * y[2]
+            du[3] = add
+            du[4] = p[3] * y[2]
+
+        funcptr = rhs_cfunc.address
+
+        @njit(parallel=True)
+        def batch(y0, rates, t_eval, rtol, atol, max_steps, out, ok):
+            for i in prange(y0.shape[0]):
+                sol, success = lsoda(funcptr, y0[i], t_eval, rates[i], rtol=rtol, atol=atol, mxstep=max_steps)
+                out[i] = sol
+                ok[i] = success
+
+        _LSODA = (rhs_cfunc, batch)
+    return _LSODA[1]
+
+
+# ------------------------------------------------------------------------
+# Batched API
+# ------------------------------------------------------------------------
+def initial_state(K: Any, rna_conc: Any, probe_conc: Any = PROBE_CONC) -> np.ndarray:
+    """(n, 5) initial U, R, S, M, Z: RNA at the open / closed equilibrium R / U = K, no product."""
+    K, rna_conc, probe_conc = np.broadcast_arrays(
+        np.asarray(K, dtype=float), np.asarray(rna_conc, dtype=float), np.asarray(probe_conc, dtype=float)
+    )
+    U0 = rna_conc / (1.0 + K)
+    y0 = np.zeros(K.shape + (N_SPECIES,))
+    y0[..., 0] = U0
+    y0[..., 1] = K * U0
+    y0[..., 2] = probe_conc
+    return y0.reshape(-1, N_SPECIES)
+
+
+def rate_constants(K: Any, k_c: Any, k_add: Any, k_deg: Any) -> np.ndarray:
+    """(n, 4) rate vectors k_o, k_c, k_add, k_deg with k_o = K * k_c."""
+    K, k_c, k_add, k_deg = np.broadcast_arrays(*(np.asarray(v, dtype=float) for v in (K, k_c, k_add, k_deg)))
+    return np.stack([K * k_c, k_c, k_add, k_deg], axis=-1).reshape(-1, len(RATE_NAMES))
+
+
+def integrate_batch(
+    y0: np.ndarray,
+    rates: np.ndarray,
+    t: Any,
+    method: str = "rosenbrock",
+    rtol: float = DEFAULT_RTOL,
+    atol: float = DEFAULT_ATOL,
+    max_steps: int = DEFAULT_MAX_STEPS,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Integrate every row of y0 (n, 5) with the matching row of rates (n, 4).
+
+    Returns
+    -------
+    y : np.ndarray
+        (n, n_times, 5) concentrations at `t` (t[0] is the start time).
+    success : np.ndarray
+        (n,) bool; failed rows are NaN from the failure on.
+    """
+    if method not in METHODS:
+        raise ValueError(f"method must be one of {METHODS}")
+    y0 = np.ascontiguousarray(y0, dtype=float).reshape(-1, N_SPECIES)
+    rates = np.ascontiguousarray(rates, dtype=float).reshape(-1, len(RATE_NAMES))
+    if len(y0) != len(rates):
+        raise ValueError(f"{len(y0)} initial states for {len(rates)} rate vectors")
+    t = np.ascontiguousarray(np.atleast_1d(t), dtype=float)
+    if np.any(np.diff(t) < 0):
+        raise ValueError("t must be non-decreasing")
+
+    out = np.full((len(y0), len(t), N_SPECIES), np.nan)
+    ok = np.zeros(len(y0), dtype=np.bool_)
+    kernel = _rosenbrock_batch if method == "rosenbrock" else _lsoda_batch_kernel()
+    kernel(y0, rates, t, float(rtol), float(atol), int(max_steps), out, ok)
+    out[~ok] = np.where(np.isfinite(out[~ok]), out[~ok], np.nan)
+    return out, ok
+
+
+def fmod_from_species(y: np.ndarray) -> np.ndarray:
+    """M / (U + R + M) from (..., 5) concentrations."""
+    return y[..., 3] / (y[..., 0] + y[..., 1] + y[..., 3])
+
+
+def fmod_batch(
+    t: Any,
+    K: Any,
+    k_c: Any,
+    k_add: Any,
+    k_deg: Any,
+    rna_conc: Any = 1e-6,
+    probe_conc: Any = PROBE_CONC,
+    method: str = "rosenbrock",
+    rtol: float = DEFAULT_RTOL,
+    atol: float = DEFAULT_ATOL,
+    max_steps: int = DEFAULT_MAX_STEPS,
+) -> np.ndarray:
+    """
+    fmod trajectories for every parameter set.
+
+    K, k_c, k_add, k_deg, rna_conc and probe_conc broadcast against each other
+    (scalars or arrays of one shape); the result has that shape plus a trailing
+    time axis. Sets whose integration failed are NaN.
+    """
+    K, k_c, k_add, k_deg, rna_conc, probe_conc = np.broadcast_arrays(
+        *(np.asarray(v, dtype=float) for v in (K, k_c, k_add, k_deg, rna_conc, probe_conc))
+    )
+    y, ok = integrate_batch(
+        initial_state(K, rna_conc, probe_conc), rate_constants(K, k_c, k_add, k_deg), t,
+        method=method, rtol=rtol, atol=atol, max_steps=max_steps,
+    )
+    fmod = fmod_from_species(y)
+    fmod[~ok] = np.nan
+    return fmod.reshape(K.shape + (fmod.shape[-1],))
+
+
+def calc_kadd_from_eyring(temp: Any, m: float, b: float, S: float) -> np.ndarray:
+    """k_add (M^-1 s^-1) from the Eyring line ln(k / T) = m / T + b at temp (K), probe concentration S (M)."""
+    temp = np.asarray(temp, dtype=float)
+    eyring_y = m * (1 / temp) + b
+    return (np.exp(eyring_y) * temp) / S
+
+
+def pe_model(t: Any, K: Any, k_add: Any, k_deg: Any, S: Any = PROBE_CONC) -> np.ndarray:
+    """Pre-equilibrium (analytical) fmod: 1 - exp(-kappa (1 - exp(-k_deg t))), kappa = K/(K+1) k_add S / k_deg."""
+    kappa = (np.asarray(K) / (np.asarray(K) + 1.0)) * np.asarray(k_add) * np.asarray(S) / np.asarray(k_deg)
+    kappa = np.asarray(kappa)[..., None]
+    return 1.0 - np.exp(-kappa * (1.0 - np.exp(-np.asarray(k_deg)[..., None] * np.asarray(t, dtype=float))))
+
+
+def warmup(method: str = "rosenbrock") -> None:
+    """Compile (or load from the on-disk cache) the kernels for `method` up front."""
+    fmod_batch(np.array([0.0, 1.0]), 0.5, 1.0, 1.0, 1e-3, method=method)
@@ -1,10 +1,14 @@
-def set_transparency_except(res_list):
+from pymol import cmd
+
+
+def set_transparency_except(res_list, obj=None):
     """
     Set transparency to 0.7 for chain A except for specified residues (set to 0).
     If res_list is empty, reset all transparency in chain A to 0.
+    With obj, only chain A of that object is changed.
     """
 
-    chain_sel = "chain A"
+    chain_sel = f"{obj} and chain A" if obj else "chain A"
 
     # If empty → reset all to 0 for chain A
     if len(res_list) == 0:
@@ -23,7 +27,7 @@ def set_transparency_except(res_list):
 
     # 2. Set selected residues back to opacity (0)
     for r in res_list:
-        sel = f"chain A and resi {r}"
+        sel = f"{chain_sel} and resi {r}"
         cmd.set("transparency", 0, sel)
         cmd.set("cartoon_transparency", 0, sel)
         cmd.set("sphere_transparency", 0, sel)
@@ -0,0 +1,471 @@
+"""
+replicate_concordance.py
+All-pairs replicate concordance of ln(kobs) and fmod over every reaction group in nerd.sqlite.
+
+SFig5_fourUReproducibility/replicate.ipynb and SFig10_ReplicateReproducibility/replicate.ipynb
+pivot the rg_ids of each (temperature, construct, site) into rep1..rep4
+columns and plot one replicate pair at a time (`plot_replicate_correlation`);
+SFig15_P4P6Replicates fetches one rg_id at a time (`fetch_p4p6_replicate`).
+Here every value is pulled in one query per quantity and grouped by condition
+
+    construct, probe, rt_protocol, buffer, temperature, valtype
+
+(the rg_ids of a condition are its replicates). Each condition becomes one
+(items x replicates) matrix, NaN where a replicate has no value:
+
+    log_kobs   items = sites; round3 fits of probe_tc_fit_params_wide (backfilled
+               with nerd_db.ensure_fit_params_wide first), fits with
+               diag_r2 < --min-r2 dropped as in the notebooks
+    fmod       items = (site, reaction_time, probe_concentration, treated);
+               probe_fmod_values without outliers or dropped samples (as
+               nerd_fetch), mean over duplicate reactions of a group
+
+and the statistics of all replicate pairs come from a few matrix products
+over the pairwise-complete items:
+
+    n                       items measured in both replicates
+    pearson_r, r2           correlation (r2 = pearson_r ** 2, as in the notebooks)
+    slope, intercept        least-squares line of b on a (np.polyfit in the notebooks)
+    rmsd                    root mean square of b - a
+    mean_diff, sd_diff      Bland-Altman bias and SD of b - a;
+    loa_low, loa_high       limits of agreement mean_diff -+ 1.96 sd_diff
+    ba_slope                slope of b - a against (a + b) / 2 (proportional bias)
+
+Rows go to the `replicate_concordance` table of nerd.sqlite, one per
+condition and rg_id pair. `replicate_concordance_groups` keeps a fingerprint
+of each condition (rg_ids, value counts, latest fit / fmod run, the
+outlier / to_drop flags and the options), so a rerun only fetches and
+recomputes conditions that gained, lost, refit or reflagged a reaction
+group; QC of a new sequencing run is one call:
+
+    python Figure_analysis/Utilities/replicate_concordance.py --db Core_nerd_analysis/nerd.sqlite --seqrun-id 12
+
+Usage:
+    python Figure_analysis/Utilities/replicate_concordance.py --db Core_nerd_analysis/nerd.sqlite
+
+    from Figure_analysis.Utilities.replicate_concordance import read_concordance
+    pairs = read_concordance(NERD_SQLITE, construct="4U_wt", quantity="log_kobs")
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import sqlite3
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+_REPO_ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(_REPO_ROOT))
+
+from Figure_analysis.Utilities.nerd_db import FIT_PARAMS_WIDE_TABLE, ensure_fit_params_wide  # noqa: E402
+
+
+CONCORDANCE_TABLE = "replicate_concordance"
+GROUPS_TABLE = "replicate_concordance_groups"
+
+QUANTITIES = ("log_kobs", "fmod")
+GROUP_KEYS = ("quantity", "construct", "probe", "rt_protocol", "buffer", "temperature", "valtype")
+ITEM_KEYS = {
+    "log_kobs": ("nt_id",),
+    "fmod": ("nt_id", "reaction_time", "probe_concentration", "treated"),
+}
+STAT_COLUMNS = (
+    "n", "pearson_r", "r2", "slope", "intercept", "rmsd",
+    "mean_diff", "sd_diff", "loa_low", "loa_high", "ba_slope",
+)
+LOA_Z = 1.96
+
+_DDL = f"""
+CREATE TABLE IF NOT EXISTS {CONCORDANCE_TABLE} (
+    id            INTEGER PRIMARY KEY,
+    quantity      TEXT NOT NULL,
+    construct     TEXT,
+    probe         TEXT NOT NULL,
+    rt_protocol   TEXT NOT NULL,
+    buffer        TEXT NOT NULL,
+    temperature   REAL,
+    valtype       TEXT NOT NULL,
+    rg_id_a       INTEGER NOT NULL,
+    rg_id_b       INTEGER NOT NULL,
+    replicate_a   INTEGER,
+    replicate_b   INTEGER,
+    n             INTEGER NOT NULL,
+    pearson_r     REAL,
+    r2            REAL,
+    slope         REAL,
+    intercept     REAL,
+    rmsd          REAL,
+    mean_diff     REAL,
+    sd_diff       REAL,
+    loa_low       REAL,
+    loa_high      REAL,
+    ba_slope      REAL,
+    updated_at    TEXT DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (quantity, construct, probe, rt_protocol, buffer, temperature, valtype, rg_id_a, rg_id_b)
+);
+CREATE INDEX IF NOT EXISTS idx_{CONCORDANCE_TABLE}_rg_a ON {CONCORDANCE_TABLE}(rg_id_a);
+CREATE INDEX IF NOT EXISTS idx_{CONCORDANCE_TABLE}_rg_b ON {CONCORDANCE_TABLE}(rg_id_b);
+CREATE TABLE IF NOT EXISTS {GROUPS_TABLE} (
+    quantity      TEXT NOT NULL,
+    construct     TEXT,
+    probe         TEXT NOT NULL,
+    rt_protocol   TEXT NOT NULL,
+    buffer        TEXT NOT NULL,
+    temperature   REAL,
+    valtype       TEXT NOT NULL,
+    rg_ids        TEXT NOT NULL,
+    fingerprint   TEXT NOT NULL,
+    n_pairs       INTEGER NOT NULL,
+    updated_at    TEXT DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (quantity, construct, probe, rt_protocol, buffer, temperature, valtype)
+);
+"""
+
+# One row per reaction group (as in global_melt_engine.fetch_melt_points); NULL
+# probe / rt_protocol / buffer become ''. A NULL construct or temperature stays
+# NULL and is its own condition (grouped with dropna=False, deleted with IS)
+_RG_META = """
+    SELECT DISTINCT
+        pr.rg_id,
+        mc.disp_name AS construct,
+        COALESCE(pr.probe, '') AS probe,
+        COALESCE(pr.rt_protocol, '') AS rt_protocol,
+        COALESCE(mb.name, CAST(pr.buffer_id AS TEXT), '') AS buffer,
+        pr.temperature,
+        pr.replicate
+    FROM probe_reactions pr
+    JOIN meta_constructs mc ON mc.id = pr.construct_id
+    LEFT JOIN meta_buffers mb ON mb.id = pr.buffer_id
+"""
+
+_COMPOSITION_SQL = {
+    "log_kobs": f"""
+        SELECT g.construct, g.probe, g.rt_protocol, g.buffer, g.temperature, w.valtype,
+               w.rg_id, MIN(g.replicate) AS replicate, COUNT(*) AS n_values, MAX(w.fit_run_id) AS last_run
+        FROM {FIT_PARAMS_WIDE_TABLE} w
+        JOIN ({_RG_META}) g ON g.rg_id = w.rg_id
+        WHERE w.fit_kind = :fit_kind AND w.log_kobs IS NOT NULL
+        GROUP BY g.construct, g.probe, g.rt_protocol, g.buffer, g.temperature, w.valtype, w.rg_id
+    """,
+    "fmod": """
+        SELECT mc.disp_name AS construct,
+               COALESCE(pr.probe, '') AS probe,
+               COALESCE(pr.rt_protocol, '') AS rt_protocol,
+               COALESCE(mb.name, CAST(pr.buffer_id AS TEXT), '') AS buffer,
+               pr.temperature, fv.valtype,
+               pr.rg_id, MIN(pr.replicate) AS replicate,
+               SUM(CASE WHEN s.to_drop != 1 AND fv.outlier != 1 THEN 1 ELSE 0 END) AS n_values,
+               MAX(fv.fmod_run_id) AS last_run,
+               -- flag state, so (un)flagging outliers or dropping a sample changes the fingerprint
+               SUM(CASE WHEN fv.outlier = 1 THEN 1 ELSE 0 END) AS n_outlier,
+               SUM(CASE WHEN s.to_drop = 1 THEN 1 ELSE 0 END) AS n_dropped,
+               SUM(CASE WHEN s.to_drop != 1 AND fv.outlier != 1 THEN 0
+                        ELSE fv.rxn_id * 1000003 + fv.nt_id END) AS excluded_key
+        FROM probe_fmod_values fv
+        JOIN probe_reactions pr ON pr.id = fv.rxn_id
+        JOIN meta_constructs mc ON mc.id = pr.construct_id
+        JOIN sequencing_samples s ON s.id = pr.s_id
+        LEFT JOIN meta_buffers mb ON mb.id = pr.buffer_id
+        WHERE fv.fmod_val IS NOT NULL
+        GROUP BY 1, 2, 3, 4, 5, 6, 7
+    """,
+}
+
+_VALUES_SQL = {
+    "log_kobs": f"""
+        SELECT g.construct, g.probe, g.rt_protocol, g.buffer, g.temperature, w.valtype,
+               w.rg_id, w.nt_id, w.log_kobs AS value
+        FROM {FIT_PARAMS_WIDE_TABLE} w
+        JOIN ({_RG_META}) g ON g.rg_id = w.rg_id
+        WHERE w.fit_kind = :fit_kind AND w.log_kobs IS NOT NULL
+          AND (w.diag_r2 IS NULL OR w.diag_r2 >= :min_r2)
+          AND w.rg_id IN (SELECT rg_id FROM temp._concordance_rgs)
+    """,
+    "fmod": """
+        SELECT mc.disp_name AS construct,
+               COALESCE(pr.probe, '') AS probe,
+               COALESCE(pr.rt_protocol, '') AS rt_protocol,
+               COALESCE(mb.name, CAST(pr.buffer_id AS TEXT), '') AS buffer,
+               pr.temperature, fv.valtype,
+               pr.rg_id, fv.nt_id, pr.reaction_time, pr.probe_concentration, pr.treated,
+               AVG(fv.fmod_val) AS value
+        FROM probe_fmod_values fv
+        JOIN probe_reactions pr ON pr.id = fv.rxn_id
+        JOIN meta_constructs mc ON mc.id = pr.construct_id
+        JOIN sequencing_samples s ON s.id = pr.s_id
+        LEFT JOIN meta_buffers mb ON mb.id = pr.buffer_id
+        WHERE fv.fmod_val IS NOT NULL
+          AND s.to_drop != 1
+          AND fv.outlier != 1
+          AND pr.rg_id IN (SELECT rg_id FROM temp._concordance_rgs)
+        GROUP BY 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11
+    """,
+}
+
+
+# ------------------------------------------------------------------------
+# Statistics
+# ------------------------------------------------------------------------
+def pair_statistics(X: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Concordance statistics of every column pair of X (items x replicates, NaN =
+    missing), each an (r x r) array over the items present in both columns;
+    entry [a, b] describes b against a.
+    """
+    M = np.isfinite(X).astype(float)
+    X0 = np.where(M > 0, X, 0.0)
+    n = M.T @ M
+    S = X0.T @ M                # S[a, b]: sum of a over the items shared with b
+    SS = (X0 * X0).T @ M        # SS[a, b]: sum of a^2 over the same items
+    P = X0.T @ X0               # P[a, b]: sum of a * b
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sa, sb = S, S.T
+        cov = P - sa * sb / n
+        var_a = SS - sa * sa / n
+        var_b = SS.T - sb * sb / n
+        r = cov / np.sqrt(var_a * var_b)
+        slope = cov / var_a
+        intercept = (sb - slope * sa) / n
+
+        sum_d2 = SS.T + SS - 2 * P
+        mean_diff = (sb - sa) / n
+        sd_diff = np.sqrt(np.maximum(sum_d2 - n * mean_diff ** 2, 0.0) / (n - 1))
+        # d = b - a against m = (a + b) / 2
+        ba_slope = 0.5 * (var_b - var_a) / (0.25 * (var_a + var_b + 2 * cov))
+        stats = {
+            "n": n,
+            "pearson_r": r,
+            "r2": r ** 2,
+            "slope": slope,
+            "intercept": intercept,
+            "rmsd": np.sqrt(sum_d2 / n),
+            "mean_diff": mean_diff,
+            "sd_diff": sd_diff,
+            "loa_low": mean_diff - LOA_Z * sd_diff,
+            "loa_high": mean_diff + LOA_Z * sd_diff,
+            "ba_slope": ba_slope,
+        }
+    few = n < 2
+    for key in STAT_COLUMNS[1:]:
+        stats[key] = np.where(few | ~np.isfinite(stats[key]), np.nan, stats[key])
+    return stats
+
+
+def group_pairs(values: pd.DataFrame, item_keys: Sequence[str], replicates: Dict[int, Any]) -> pd.DataFrame:
+    """One row per rg_id pair (a < b) of one condition's values (columns rg_id, *item_keys, value)."""
+    # groupby / unstack rather than pivot_table, which drops items with a NULL key
+    X = values.groupby([*item_keys, "rg_id"], dropna=False)["value"].mean().unstack("rg_id")
+    rgs = X.columns.to_numpy()
+    if len(rgs) < 2:
+        return pd.DataFrame(columns=["rg_id_a", "rg_id_b", "replicate_a", "replicate_b", *STAT_COLUMNS])
+    stats = pair_statistics(X.to_numpy(dtype=float))
+    ia, ib = np.triu_indices(len(rgs), k=1)
+    out = pd.DataFrame({
+        "rg_id_a": rgs[ia].astype(int),
+        "rg_id_b": rgs[ib].astype(int),
+        "replicate_a": [replicates.get(int(r)) for r in rgs[ia]],
+        "replicate_b": [replicates.get(int(r)) for r in rgs[ib]],
+        **{k: stats[k][ia, ib] for k in STAT_COLUMNS},
+    })
+    out["n"] = out["n"].astype(int)
+    return out
+
+
+# ------------------------------------------------------------------------
+# nerd.sqlite
+# ------------------------------------------------------------------------
+def ensure_tables(conn: sqlite3.Connection) -> None:
+    """Create the concordance tables if needed."""
+    conn.executescript(_DDL)
+
+
+def _group_key(row: Any) -> Tuple:
+    """Condition key of a row / mapping, NaN (NULL construct or temperature) as None."""
+    return tuple(None if pd.isna(row[k]) else row[k] for k in GROUP_KEYS)
+
+
+def fingerprints(conn: sqlite3.Connection, quantity: str, options: Dict[str, Any]) -> pd.DataFrame:
+    """Per-condition rg_ids, replicate numbers and fingerprint of the current database."""
+    comp = pd.read_sql_query(_COMPOSITION_SQL[quantity], conn, params=options)
+    comp.insert(0, "quantity", quantity)
+    opts = json.dumps(options, sort_keys=True)
+    state = [c for c in comp.columns if c not in GROUP_KEYS and c != "replicate"]
+    rows = []
+    for key, grp in comp.sort_values("rg_id").groupby(list(GROUP_KEYS), sort=False, dropna=False):
+        blob = opts + "|" + ";".join(":".join(str(v) for v in r) for r in grp[state].itertuples(index=False))
+        rows.append((*_group_key(dict(zip(GROUP_KEYS, key))), ",".join(str(int(r)) for r in grp["rg_id"]),
+                     hashlib.sha1(blob.encode()).hexdigest()[:12],
+                     dict(zip(grp["rg_id"].astype(int), grp["replicate"]))))
+    return pd.DataFrame(rows, columns=[*GROUP_KEYS, "rg_ids", "fingerprint", "replicates"])
+
+
+def fetch_values(conn: sqlite3.Connection, quantity: str, rg_ids: Iterable[int], options: Dict[str, Any]
+                 ) -> pd.DataFrame:
+    """Every value of `quantity` of the given reaction groups, in one query."""
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS _concordance_rgs (rg_id INTEGER PRIMARY KEY)")
+    conn.execute("DELETE FROM temp._concordance_rgs")
+    conn.executemany("INSERT OR IGNORE INTO temp._concordance_rgs VALUES (?)", [(int(r),) for r in rg_ids])
+    df = pd.read_sql_query(_VALUES_SQL[quantity], conn, params=options)
+    df.insert(0, "quantity", quantity)
+    return df
+
+
+def update_concordance(db_path: str | Path, quantities: Sequence[str] = QUANTITIES,
+                       fit_kind: str = "round3_constrained", min_r2: float = 0.3, full: bool = False
+                       ) -> Dict[str, int]:
+    """
+    Bring replicate_concordance up to date with nerd.sqlite; returns counts.
+
+    Only conditions whose fingerprint changed (or all, with `full`) are fetched
+    and recomputed; conditions of `quantities` that no longer have values are removed.
+    """
+    if "log_kobs" in quantities:
+        ensure_fit_params_wide(db_path)
+    conn = sqlite3.connect(str(db_path), timeout=60.0)
+    counts = {"conditions": 0, "recomputed": 0, "removed": 0, "pairs": 0}
+    try:
+        ensure_tables(conn)
+        stored = {
+            _group_key(dict(zip(GROUP_KEYS, row[:-1]))): row[-1]
+            for row in conn.execute(f"SELECT {', '.join(GROUP_KEYS)}, fingerprint FROM {GROUPS_TABLE}")
+        }
+        current, changed, frames = set(), [], []
+        for quantity in quantities:
+            options = {"fit_kind": fit_kind, "min_r2": min_r2} if quantity == "log_kobs" else {}
+            fp = fingerprints(conn, quantity, options)
+            current.update(_group_key(row) for _, row in fp.iterrows())
+            todo = fp if full else fp[[stored.get(_group_key(row)) != row["fingerprint"] for _, row in fp.iterrows()]]
+            if todo.empty:
+                continue
+            rg_ids = sorted({int(r) for ids in todo["rg_ids"] for r in ids.split(",")})
+            values = fetch_values(conn, quantity, rg_ids, options)
+            by_group = {
+                _group_key(dict(zip(GROUP_KEYS, key))): grp
+                for key, grp in values.groupby(list(GROUP_KEYS), sort=False, dropna=False)
+            }
+            for _, row in todo.iterrows():
+                key = _group_key(row)
+                grp = by_group.get(key)
+                if grp is not None:
+                    grp = grp[grp["rg_id"].isin([int(r) for r in row["rg_ids"].split(",")])]
+                pairs = group_pairs(grp if grp is not None else values.iloc[:0], ITEM_KEYS[quantity],
+                                    row["replicates"])
+                for k, v in zip(GROUP_KEYS, key):
+                    pairs[k] = v
+                frames.append(pairs)
+                changed.append((key, row["rg_ids"], row["fingerprint"], len(pairs)))
+
+        gone = [key for key in stored if key[0] in quantities and key not in current]
+        where = " AND ".join(f"{k} IS ?" for k in GROUP_KEYS)
+        pairs = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        fields = [*GROUP_KEYS, "rg_id_a", "rg_id_b", "replicate_a", "replicate_b", *STAT_COLUMNS]
+        rows = [
+            tuple(None if pd.isna(v) else (v.item() if hasattr(v, "item") else v) for v in rec)
+            for rec in pairs[fields].itertuples(index=False)
+        ] if not pairs.empty else []
+        with conn:
+            for table in (CONCORDANCE_TABLE, GROUPS_TABLE):
+                conn.executemany(f"DELETE FROM {table} WHERE {where}", gone + [key for key, *_ in changed])
+            conn.executemany(
+                f"INSERT INTO {CONCORDANCE_TABLE} ({', '.join(fields)}) VALUES ({', '.join('?' * len(fields))})",
+                rows,
+            )
+            conn.executemany(
+                f"INSERT INTO {GROUPS_TABLE} ({', '.join(GROUP_KEYS)}, rg_ids, fingerprint, n_pairs) "
+                f"VALUES ({', '.join('?' * (len(GROUP_KEYS) + 3))})",
+                [(*key, rg_ids, fp, n) for key, rg_ids, fp, n in changed],
+            )
+        counts.update(conditions=len(current), recomputed=len(changed), removed=len(gone), pairs=len(rows))
+    finally:
+        conn.close()
+    return counts
+
+
+def seqrun_rg_ids(db_path: str | Path, seqrun_id: int) -> List[int]:
+    """rg_ids with at least one reaction sequenced in sequencing run `seqrun_id`."""
+    conn = sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        rows = conn.execute(
+            """
+            SELECT DISTINCT pr.rg_id
+            FROM probe_reactions pr
+            JOIN sequencing_samples ss ON ss.id = pr.s_id
+            WHERE ss.seqrun_id = ?
+            ORDER BY pr.rg_id
+            """,
+            (seqrun_id,),
+        ).fetchall()
+    finally:
+        conn.close()
+    return [r[0] for r in rows]
+
+
+def read_concordance(db_path: str | Path, rg_ids: Optional[Iterable[int]] = None, construct: Optional[str] = None,
+                     quantity: Optional[str] = None) -> pd.DataFrame:
+    """Stored replicate pairs, optionally only those involving `rg_ids` / of one construct / quantity."""
+    where, params = [], []
+    if rg_ids is not None:
+        rg_ids = [int(r) for r in rg_ids]
+        marks = ", ".join("?" * len(rg_ids))
+        where.append(f"(rg_id_a IN ({marks}) OR rg_id_b IN ({marks}))")
+        params += rg_ids + rg_ids
+    if construct is not None:
+        where.append("construct = ?")
+        params.append(construct)
+    if quantity is not None:
+        where.append("quantity = ?")
+        params.append(quantity)
+    conn = sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        return pd.read_sql_query(
+            f"SELECT * FROM {CONCORDANCE_TABLE} WHERE {' AND '.join(where) or '1 = 1'} "
+            f"ORDER BY {', '.join(GROUP_KEYS)}, rg_id_a, rg_id_b",
+            conn, params=params,
+        )
+    finally:
+        conn.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="All-pairs replicate concordance (r2, RMSD, Bland-Altman) in nerd.sqlite.")
+    ap.add_argument("--db", required=True, type=Path, help="Path to nerd.sqlite")
+    ap.add_argument("--quantities", nargs="+", choices=QUANTITIES, default=list(QUANTITIES))
+    ap.add_argument("--fit-kind", default="round3_constrained", help="Time-course fits for log_kobs")
+    ap.add_argument("--min-r2", type=float, default=0.3, help="Drop log_kobs fits with diag_r2 below this")
+    ap.add_argument("--full", action="store_true", help="Recompute every condition, not only changed ones")
+    report = ap.add_mutually_exclusive_group()
+    report.add_argument("--seqrun-id", type=int, help="Print the pairs of the reaction groups of this sequencing run")
+    report.add_argument("--rg-ids", type=int, nargs="+", help="Print the pairs involving these reaction groups")
+    args = ap.parse_args()
+
+    if not args.db.exists():
+        ap.error(f"Database not found: {args.db}")
+    t0 = time.perf_counter()
+    counts = update_concordance(args.db, args.quantities, fit_kind=args.fit_kind, min_r2=args.min_r2, full=args.full)
+    print(
+        f"{CONCORDANCE_TABLE}: {counts['conditions']} conditions, {counts['recomputed']} recomputed "
+        f"({counts['pairs']} replicate pairs), {counts['removed']} removed in {time.perf_counter() - t0:.1f} s"
+    )
+
+    rg_ids = seqrun_rg_ids(args.db, args.seqrun_id) if args.seqrun_id is not None else args.rg_ids
+    if rg_ids:
+        pairs = read_concordance(args.db, rg_ids=rg_ids)
+        if pairs.empty:
+            print(f"No replicate pairs for rg_ids {rg_ids}")
+            return
+        cols = ["quantity", "construct", "buffer", "temperature", "valtype", "rg_id_a", "rg_id_b",
+                "n", "r2", "rmsd", "mean_diff", "loa_low", "loa_high"]
+        with pd.option_context("display.max_rows", None, "display.width", 200, "display.float_format", "{:.3f}".format):
+            print(pairs.sort_values(["quantity", "r2"])[cols].to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
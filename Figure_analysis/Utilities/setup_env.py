@@ -6,6 +6,23 @@ Usage:
     import setup_env as env
     # or
     from setup_env import *
+
+Heavy libraries (pandas, matplotlib, seaborn, plotly, statsmodels, scipy,
+lmfit, sklearn, numba/numbalsoda, nupack) are imported on first use, not when
+this module is imported. `from setup_env import *` still binds every name in
+`__all__`:
+
+- top-level packages (`np`, `pd`, `mpl`, `sns`, `lmfit`) are real module
+  objects whose body runs on first attribute access (importlib.util.LazyLoader),
+  so numba and `isinstance(x, types.ModuleType)` see the actual module;
+- everything else (`plt`, `sm`, `Model`, `cfunc`, ...) is a deferred proxy that
+  imports its target on first call / attribute access and forwards to it.
+
+Optional libraries are still `None` when not installed (checked with
+importlib.util.find_spec, which does not import them). The matplotlib rcParams
+below are applied whenever matplotlib is first imported, by this module or by
+the notebook itself. Call `preload()` to import everything up front, and see
+bench_setup_env.py for an import-time benchmark.
 """
 
 # ------------------------------------------------------------------------
@@ -16,8 +33,13 @@ import os
 import json
 import math
 import sqlite3
+import sys
+import types
+import importlib
+import importlib.abc
+import importlib.util
 from pathlib import Path
-from typing import Any, Dict, Optional, Tuple, List
+from typing import Any, Callable, Dict, Optional, Tuple, List
 
 # ------------------------------------------------------------------------
 # GLOBAL CONFIG
@@ -26,100 +48,270 @@ from typing import Any, Dict, Optional, Tuple, List
 # Path to your main nerd database
 NERD_SQLITE = '../../../Core_nerd_analysis/nerd.sqlite'
 
+# Global plotting configuration (applied when matplotlib is imported)
+MPL_RCPARAMS = {
+    "font.size": 8,
+    "font.family": "sans-serif",
+    "font.sans-serif": ["Helvetica"],
+    "pdf.fonttype": 42,  # avoid Type 3 fonts in PDFs
+    "ps.fonttype": 42,
+}
+
+# scipy.constants.R and scipy.constants.calorie. Both are exact in SI
+# (R = N_A * k_B), so they do not need scipy to be imported. R_KCAL is the
+# gas constant used by the fit modules (fit_store, structure_bfactors,
+# global_melt_engine); import it from here.
+R = 6.02214076e23 * 1.380649e-23  # J / (mol K)
+calorie = 4.184  # J
+R_KCAL = R / calorie / 1000  # kcal / (mol K)
+
+
+# ------------------------------------------------------------------------
+# Lazy import machinery
+# ------------------------------------------------------------------------
+_UNSET = object()
+
+
+def _is_installed(name: str) -> bool:
+    """True if top-level package `name` can be imported (without importing it)."""
+    if name in sys.modules:
+        return True
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def _lazy_module(name: str):
+    """
+    Return module `name`, deferring execution of its body to first attribute access.
+
+    Falls back to a deferred proxy if the package is not installed, so the
+    ImportError is raised on first use rather than at `import setup_env`.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None or spec.loader is None:
+        return _Deferred(name, lambda: importlib.import_module(name))
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def _unwrap(value: Any) -> Any:
+    return value._resolve() if type(value) is _Deferred else value
+
+
+class _Deferred:
+    """
+    Stand-in for a module attribute or submodule that is imported on first use.
+
+    Calls, attribute access, isinstance checks and subclassing are forwarded to
+    the real object. Deferred objects passed as arguments are resolved first
+    (e.g. `cfunc(lsoda_sig)`).
+    """
+
+    __slots__ = ("_name", "_load", "_obj")
+
+    def __init__(self, name: str, load: Callable[[], Any]):
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_load", load)
+        object.__setattr__(self, "_obj", _UNSET)
+
+    def _resolve(self) -> Any:
+        obj = self._obj
+        if obj is _UNSET:
+            obj = self._load()
+            object.__setattr__(self, "_obj", obj)
+            globals()[self._name] = obj  # later `env.<name>` lookups skip the proxy
+        return obj
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._resolve(), attr)
+
+    def __setattr__(self, attr: str, value: Any) -> None:
+        setattr(self._resolve(), attr, value)
+
+    def __dir__(self) -> List[str]:
+        return dir(self._resolve())
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        args = tuple(_unwrap(a) for a in args)
+        kwargs = {k: _unwrap(v) for k, v in kwargs.items()}
+        return self._resolve()(*args, **kwargs)
+
+    def __instancecheck__(self, obj: Any) -> bool:
+        return isinstance(obj, self._resolve())
+
+    def __subclasscheck__(self, cls: type) -> bool:
+        return issubclass(cls, self._resolve())
+
+    def __mro_entries__(self, bases: Tuple[Any, ...]) -> Tuple[Any, ...]:
+        return (self._resolve(),)
+
+    def __repr__(self) -> str:
+        if self._obj is _UNSET:
+            return f"<deferred import of {self._name!r}>"
+        return repr(self._obj)
+
+
+def _submodule(name: str, module: str) -> _Deferred:
+    """Deferred `import <module> as <name>`."""
+    return _Deferred(name, lambda: importlib.import_module(module))
+
+
+def _from_import(name: str, module: str, attr: Optional[str] = None) -> _Deferred:
+    """Deferred `from <module> import <attr> as <name>`."""
+    return _Deferred(name, lambda: getattr(importlib.import_module(module), attr or name))
+
+
+def _optional(package: str, name: str, module: str, attr: Optional[str] = None) -> Optional[_Deferred]:
+    """Like _from_import, but None if `package` is not installed."""
+    if not _is_installed(package):
+        return None
+    return _from_import(name, module, attr)
+
+
+# ------------------------------------------------------------------------
+# matplotlib rcParams on first import
+# ------------------------------------------------------------------------
+def _configure_matplotlib(mpl_module) -> None:
+    mpl_module.rcParams.update(MPL_RCPARAMS)
+
+
+class _MatplotlibConfigHook(importlib.abc.MetaPathFinder):
+    """One-shot finder that applies MPL_RCPARAMS right after matplotlib executes."""
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname != "matplotlib":
+            return None
+        sys.meta_path.remove(self)
+        spec = importlib.util.find_spec(fullname)
+        if spec is None or spec.loader is None:
+            return spec
+        exec_module = spec.loader.exec_module
+
+        def exec_and_configure(module):
+            exec_module(module)
+            _configure_matplotlib(module)
+
+        spec.loader.exec_module = exec_and_configure
+        return spec
+
+
+if "matplotlib" in sys.modules:
+    _configure_matplotlib(sys.modules["matplotlib"])
+elif not any(isinstance(f, _MatplotlibConfigHook) for f in sys.meta_path):
+    sys.meta_path.insert(0, _MatplotlibConfigHook())
+
 
 # ------------------------------------------------------------------------
 # Core numerical / data libraries
 # ------------------------------------------------------------------------
-import numpy as np
-import pandas as pd
+np = _lazy_module("numpy")
+pd = _lazy_module("pandas")
 
 # ------------------------------------------------------------------------
 # Plotting libraries
 # ------------------------------------------------------------------------
-import matplotlib as mpl
-import matplotlib.pyplot as plt
-from matplotlib.ticker import FuncFormatter
-from matplotlib.lines import Line2D
-import matplotlib.cm as cm
-import matplotlib.colors as mcolors
-from matplotlib.colors import LinearSegmentedColormap
-from mpl_toolkits.axes_grid1.inset_locator import inset_axes
+mpl = _lazy_module("matplotlib")
+plt = _submodule("plt", "matplotlib.pyplot")
+FuncFormatter = _from_import("FuncFormatter", "matplotlib.ticker")
+Line2D = _from_import("Line2D", "matplotlib.lines")
+cm = _submodule("cm", "matplotlib.cm")
+mcolors = _submodule("mcolors", "matplotlib.colors")
+LinearSegmentedColormap = _from_import("LinearSegmentedColormap", "matplotlib.colors")
+inset_axes = _from_import("inset_axes", "mpl_toolkits.axes_grid1.inset_locator")
 
-import seaborn as sns
+sns = _lazy_module("seaborn")
 
 # Optional interactive plotting (used in SFig16)
-try:
-    import plotly.express as px
-except ImportError:
-    px = None  # Used in only a few notebooks
+px = _submodule("px", "plotly.express") if _is_installed("plotly") else None  # Used in only a few notebooks
 
 # ------------------------------------------------------------------------
 # Stats / modeling libraries
 # ------------------------------------------------------------------------
-import statsmodels.api as sm
-import statsmodels.formula.api as smf
+sm = _submodule("sm", "statsmodels.api")
+smf = _submodule("smf", "statsmodels.formula.api")
 
-from scipy import constants, stats
-import scipy.constants as sc
-from scipy.constants import R, calorie
-from scipy.integrate import solve_ivp
+constants = _submodule("constants", "scipy.constants")
+stats = _submodule("stats", "scipy.stats")
+sc = _submodule("sc", "scipy.constants")
+solve_ivp = _from_import("solve_ivp", "scipy.integrate")
 
 # ------------------------------------------------------------------------
 # lmfit
 # ------------------------------------------------------------------------
-import lmfit
-from lmfit.model import Model, save_modelresult, load_modelresult
-from lmfit.models import LinearModel, ExponentialModel
-from lmfit import minimize, Parameters, create_params, report_fit
+lmfit = _lazy_module("lmfit")
+Model = _from_import("Model", "lmfit.model")
+save_modelresult = _from_import("save_modelresult", "lmfit.model")
+load_modelresult = _from_import("load_modelresult", "lmfit.model")
+LinearModel = _from_import("LinearModel", "lmfit.models")
+ExponentialModel = _from_import("ExponentialModel", "lmfit.models")
+minimize = _from_import("minimize", "lmfit")
+Parameters = _from_import("Parameters", "lmfit")
+create_params = _from_import("create_params", "lmfit")
+report_fit = _from_import("report_fit", "lmfit")
 
 # ------------------------------------------------------------------------
 # Machine learning (sklearn)
 # ------------------------------------------------------------------------
-try:
-    from sklearn.tree import DecisionTreeClassifier
-    from sklearn.metrics import (
-        roc_curve,
-        auc,
-        precision_recall_curve,
-        precision_recall_fscore_support,
-    )
-    from scipy.stats import wilcoxon
-except ImportError:
-    DecisionTreeClassifier = None
-    roc_curve = auc = precision_recall_curve = precision_recall_fscore_support = None
-    wilcoxon = None
+DecisionTreeClassifier = _optional("sklearn", "DecisionTreeClassifier", "sklearn.tree")
+roc_curve = _optional("sklearn", "roc_curve", "sklearn.metrics")
+auc = _optional("sklearn", "auc", "sklearn.metrics")
+precision_recall_curve = _optional("sklearn", "precision_recall_curve", "sklearn.metrics")
+precision_recall_fscore_support = _optional("sklearn", "precision_recall_fscore_support", "sklearn.metrics")
+wilcoxon = _optional("sklearn", "wilcoxon", "scipy.stats")
 
 # ------------------------------------------------------------------------
 # ODE / numba / numbalsoda (SFig1)
 # ------------------------------------------------------------------------
-try:
-    from numba import cfunc, njit
-    from numbalsoda import lsoda, lsoda_sig
-except ImportError:
+if _is_installed("numba") and _is_installed("numbalsoda"):
+    cfunc = _from_import("cfunc", "numba")
+    njit = _from_import("njit", "numba")
+    lsoda = _from_import("lsoda", "numbalsoda")
+    lsoda_sig = _from_import("lsoda_sig", "numbalsoda")
+else:
     cfunc = njit = lsoda = lsoda_sig = None
 
 # ------------------------------------------------------------------------
 # NUPACK (construct design notebooks)
 # ------------------------------------------------------------------------
-try:
-    from nupack import *  # noqa: F401,F403
-    NUPACK_AVAILABLE = True
-except ImportError:
-    NUPACK_AVAILABLE = False
+# `from nupack import *` is replaced by the module __getattr__ below:
+# `env.Strand`, `env.Tube`, ... import nupack on first access.
+NUPACK_AVAILABLE = _is_installed("nupack")
 
-# ------------------------------------------------------------------------
-# Global plotting configuration
-# ------------------------------------------------------------------------
 
-mpl.rcParams.update(
-    {
-        "font.size": 8,
-        "font.family": "sans-serif",
-        "font.sans-serif": ["Helvetica"],
-        "pdf.fonttype": 42,  # avoid Type 3 fonts in PDFs
-        "ps.fonttype": 42,
-    }
-)
+def __getattr__(name: str) -> Any:
+    if NUPACK_AVAILABLE and not name.startswith("__"):
+        nupack = importlib.import_module("nupack")
+        if hasattr(nupack, name):
+            return getattr(nupack, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def preload(names: Optional[List[str]] = None) -> None:
+    """
+    Import the libraries behind `names` (default: all of `__all__`) now.
+
+    Useful before forking workers or when timing a cell should not include
+    import cost. Names whose library is not installed are skipped.
+    """
+    for name in names if names is not None else __all__:
+        obj = globals().get(name)
+        try:
+            if type(obj) is _Deferred:
+                obj._resolve()
+            elif isinstance(obj, types.ModuleType):
+                obj.__name__  # any attribute access runs a LazyLoader module body
+        except ImportError:
+            pass
+    if NUPACK_AVAILABLE and (names is None or "NUPACK_AVAILABLE" in names):
+        importlib.import_module("nupack")
 
 
 # ------------------------------------------------------------------------
@@ -161,6 +353,7 @@ __all__ = [
     "sc",
     "R",
     "calorie",
+    "R_KCAL",
     "solve_ivp",
     # lmfit
     "lmfit",
@@ -187,4 +380,4 @@ __all__ = [
     "lsoda_sig",
     # nupack flag
     "NUPACK_AVAILABLE",
-]
\ No newline at end of file
+]
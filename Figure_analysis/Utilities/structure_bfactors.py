@@ -0,0 +1,351 @@
+"""
+structure_bfactors.py
+Write per-residue values (dG, ddG, ...) for many conditions into the B-factor
+column of a PDB / mmCIF structure, for coloring by `spectrum b` in PyMOL.
+
+P4P6_3DStruct/preprocess_coloring_pdb_by_dG.ipynb computes dG per site
+(`calc_dG`, `keep_higher_r2`) for one condition and rewrites 1gid.pdb line by
+line into 1gid_with_dG.pdb. Here the structure is parsed once into an
+`AtomTable` (per-atom residue index and the text around the B-factor field of
+every atom record), sites are mapped to residues once (`site_index`), and each
+condition is one vector of per-residue values, so writing a condition is a
+gather plus string joins:
+
+    atoms = AtomTable.read("1gid.cif")
+    res = atoms.site_index(sites, chain="A")            # site -> residue row
+    for label, values in conditions.items():
+        atoms.write(f"1gid_{label}.cif", atoms.residue_values(res, values))
+
+Values come either from nerd.sqlite (`--db`: `probe_tc_fits_view`, one dG
+condition per construct x temperature x buffer, ddG against the reference
+given by --ddg-ref) or from a table with one column per condition (`--values`,
+e.g. P4P6_ColoredSecStruct/P4P6_dG.csv). Residues without a value get
+--missing (0.0, as in the notebook).
+
+Usage:
+    python Figure_analysis/Utilities/structure_bfactors.py \\
+        Figure_analysis/Figure5_TertiaryContacts/P4P6_3DStruct/1gid.cif \\
+        --db Core_nerd_analysis/nerd.sqlite --rg-ids 123 124 129 130 --ddg-ref buffer_id=2 \\
+        --out-dir Figure_analysis/Figure5_TertiaryContacts/P4P6_3DStruct/bfactor_colorings
+
+    python Figure_analysis/Utilities/structure_bfactors.py 1gid.pdb \\
+        --values ../P4P6_ColoredSecStruct/P4P6_dG.csv --site-col nt_site --columns dG0 dGMg ddG
+"""
+
+from __future__ import annotations
+
+import argparse
+import re
+import sqlite3
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+_REPO_ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(_REPO_ROOT))
+
+from Figure_analysis.Utilities.setup_env import R_KCAL  # noqa: E402
+
+
+KELVIN = 273.15
+
+CONDITION_KEYS = ("construct_name", "temperature", "buffer_id")
+
+# mmCIF tokens: quoted strings or whitespace-free words
+_CIF_TOKEN = re.compile(r"'[^']*'|\"[^\"]*\"|\S+")
+
+
+# ------------------------------------------------------------------------
+# Atom table
+# ------------------------------------------------------------------------
+class AtomTable:
+    """
+    Atom records of one PDB / mmCIF file, parsed once.
+
+    `residues` lists the (chain, resi, icode) keys in file order and
+    `res_idx[i]` is the residue row of atom i; `_head[i]` / `_tail[i]` are the
+    text before / after the B-factor field of atom i's line.
+    """
+
+    def __init__(self, path: Path, fmt: str, lines: List[str], atom_lines: np.ndarray,
+                 heads: List[str], tails: List[str], keys: List[Tuple[str, int, str]]):
+        self.path = path
+        self.fmt = fmt
+        self._lines = lines
+        self._atom_lines = atom_lines
+        self._head = heads
+        self._tail = tails
+        self.residues: List[Tuple[str, int, str]] = list(dict.fromkeys(keys))
+        lookup = {key: i for i, key in enumerate(self.residues)}
+        self.res_idx = np.fromiter((lookup[k] for k in keys), dtype=np.int32, count=len(keys))
+        self._lookup = lookup
+
+    @property
+    def n_atoms(self) -> int:
+        return len(self.res_idx)
+
+    @classmethod
+    def read(cls, path: str | Path) -> "AtomTable":
+        path = Path(path)
+        with open(path) as fh:
+            lines = fh.readlines()
+        if path.suffix.lower() in (".cif", ".mmcif"):
+            return cls(path, "cif", lines, *_parse_cif(lines, path))
+        return cls(path, "pdb", lines, *_parse_pdb(lines))
+
+    def site_index(self, sites: Iterable[int], chain: str = "A", offset: int = 0,
+                   site_map: Optional[Dict[int, Tuple[str, int]]] = None) -> np.ndarray:
+        """
+        Residue row of every site (-1 if not in the structure).
+
+        A site maps to (chain, site + offset) unless `site_map` gives its
+        (chain, resi) explicitly.
+        """
+        out = []
+        for site in sites:
+            site = int(site)
+            ch, resi = site_map[site] if site_map and site in site_map else (chain, site + offset)
+            out.append(self._lookup.get((ch, int(resi), ""), -1))
+        return np.asarray(out, dtype=np.int64)
+
+    def residue_values(self, res_rows: np.ndarray, values: Sequence[float], missing: float = 0.0) -> np.ndarray:
+        """Per-atom B-factors from one value per site (unmapped sites and NaN / inf values -> missing)."""
+        per_res = np.full(len(self.residues), missing, dtype=float)
+        values = np.asarray(values, dtype=float)
+        ok = (res_rows >= 0) & np.isfinite(values)
+        per_res[res_rows[ok]] = values[ok]
+        return per_res[self.res_idx]
+
+    def write(self, path: str | Path, bfactors: np.ndarray) -> Path:
+        """Copy of the parsed file with the B-factor field of every atom replaced."""
+        if self.fmt == "pdb":
+            # 6.2f field (columns 61-66)
+            fields = [f"{b:6.2f}" for b in np.clip(bfactors, -99.99, 999.99)]
+        else:
+            fields = [f"{b:.2f}" for b in bfactors]
+        lines = list(self._lines)
+        for i, head, field, tail in zip(self._atom_lines, self._head, fields, self._tail):
+            lines[i] = head + field + tail
+        path = Path(path)
+        with open(path, "w") as fh:
+            fh.writelines(lines)
+        return path
+
+
+def _parse_pdb(lines: List[str]):
+    atom_lines, heads, tails, keys = [], [], [], []
+    for i, line in enumerate(lines):
+        if not line.startswith(("ATOM", "HETATM")):
+            continue
+        body = line.rstrip("\r\n")
+        end = line[len(body):]
+        body = body.ljust(66)
+        try:
+            resi = int(body[22:26])
+        except ValueError:
+            continue
+        atom_lines.append(i)
+        heads.append(body[:60])
+        tails.append(body[66:] + end)
+        keys.append((body[21].strip(), resi, body[26].strip()))
+    return np.asarray(atom_lines, dtype=np.int64), heads, tails, keys
+
+
+def _parse_cif(lines: List[str], path: Path):
+    fields: List[str] = []
+    atom_lines, heads, tails, keys = [], [], [], []
+    i = 0
+    while i < len(lines):
+        if lines[i].strip() == "loop_" and i + 1 < len(lines) and lines[i + 1].startswith("_atom_site."):
+            i += 1
+            while lines[i].startswith("_atom_site."):
+                fields.append(lines[i].split()[0][len("_atom_site."):])
+                i += 1
+            break
+        i += 1
+    if not fields:
+        raise ValueError(f"{path}: no _atom_site loop")
+
+    def col(*names: str) -> int:
+        for name in names:
+            if name in fields:
+                return fields.index(name)
+        raise ValueError(f"{path}: _atom_site has none of {names}")
+
+    i_b = col("B_iso_or_equiv")
+    i_chain = col("auth_asym_id", "label_asym_id")
+    i_resi = col("auth_seq_id", "label_seq_id")
+    i_icode = fields.index("pdbx_PDB_ins_code") if "pdbx_PDB_ins_code" in fields else None
+
+    for j in range(i, len(lines)):
+        line = lines[j]
+        if line.startswith(("_", "loop_", "#", "data_")):
+            break
+        tokens = list(_CIF_TOKEN.finditer(line))
+        if len(tokens) != len(fields):
+            raise ValueError(f"{path}:{j + 1}: expected {len(fields)} _atom_site values, got {len(tokens)}")
+        b = tokens[i_b]
+        icode = tokens[i_icode].group() if i_icode is not None else "?"
+        atom_lines.append(j)
+        heads.append(line[:b.start()])
+        tails.append(line[b.end():])
+        keys.append((tokens[i_chain].group(), int(tokens[i_resi].group()), "" if icode in ("?", ".") else icode))
+    return np.asarray(atom_lines, dtype=np.int64), heads, tails, keys
+
+
+# ------------------------------------------------------------------------
+# Per-site values
+# ------------------------------------------------------------------------
+def calc_dG(logkobs, logkadd, temp_K=298.15):
+    """dG (kcal/mol) of opening from ln(kobs) and ln(kadd), as in the notebook (vectorized)."""
+    KKp1 = np.exp(np.asarray(logkobs, dtype=float) - np.asarray(logkadd, dtype=float))  # K / (K+1)
+    with np.errstate(divide="ignore"):
+        # the site that sets log_kadd has K = inf (dG = -inf); it is written as --missing
+        K = KKp1 / (1 - KKp1)
+        return -R_KCAL * np.asarray(temp_K, dtype=float) * np.log(K)
+
+
+def keep_higher_r2(df: pd.DataFrame, keys: Sequence[str] = ("nt_site",)) -> pd.DataFrame:
+    """One row per `keys` (the duplicate RT run with the higher r2)."""
+    return df.sort_values("r2", ascending=False, kind="stable").drop_duplicates(list(keys)).sort_index()
+
+
+def fetch_site_dG(db_path: str | Path, rg_ids: Sequence[int], fit_kind: str = "round3_constrained",
+                  rt_protocol: str = "MRT", bases: Sequence[str] = ("A", "C"), min_r2: float = 0.5
+                  ) -> pd.DataFrame:
+    """
+    dG per (construct_name, temperature, buffer_id, nt_site) of the fits of `rg_ids`.
+
+    log_kadd is the largest log_kobs of each base at each temperature over all
+    fetched reaction groups (the notebook's `max_logkobs`); duplicate RT runs
+    are reduced with `keep_higher_r2`, then sites with r2 <= min_r2 dropped.
+    """
+    placeholders = ", ".join("?" * len(rg_ids))
+    conn = sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        df = pd.read_sql_query(
+            f"""
+            SELECT rg_id, construct_name, temperature, buffer_id, nt_site, nt_base, log_kobs, r2
+            FROM probe_tc_fits_view
+            WHERE fit_kind = ? AND rt_protocol = ? AND rg_id IN ({placeholders})
+            """,
+            conn,
+            params=[fit_kind, rt_protocol, *rg_ids],
+        )
+    finally:
+        conn.close()
+
+    log_kadd = df.groupby(["temperature", "nt_base"])["log_kobs"].transform("max")
+    df["dG"] = calc_dG(df["log_kobs"], log_kadd, df["temperature"] + KELVIN)
+    df = keep_higher_r2(df, keys=[*CONDITION_KEYS, "nt_site"])
+    df = df[df["nt_base"].isin(bases) & (df["r2"] > min_r2)]
+    return df.reset_index(drop=True)
+
+
+def condition_label(key: Tuple) -> str:
+    construct, temp, buffer_id = key
+    return f"{construct}_{float(temp):g}C_buffer{buffer_id}"
+
+
+def db_conditions(df: pd.DataFrame, ddg_ref: Optional[Tuple[str, str]] = None
+                  ) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """
+    (sites, {label: values}) of every dG condition, plus one ddG (dG - dG_ref)
+    condition per dG condition that has a reference: the same condition with
+    `ddg_ref` = (key, value), e.g. ("buffer_id", "2") or ("construct_name", "p4p6_wt").
+    """
+    wide = df.pivot_table(index="nt_site", columns=list(CONDITION_KEYS), values="dG", aggfunc="first")
+    sites = wide.index.to_numpy()
+    out = {f"{condition_label(key)}_dG": wide[key].to_numpy(dtype=float) for key in wide.columns}
+    if ddg_ref:
+        k = CONDITION_KEYS.index(ddg_ref[0])
+        for key in wide.columns:
+            ref_value = type(key[k])(ddg_ref[1])
+            if key[k] == ref_value:
+                continue
+            ref = key[:k] + (ref_value,) + key[k + 1:]
+            if ref in wide.columns:
+                out[f"{condition_label(key)}_ddG"] = (wide[key] - wide[ref]).to_numpy(dtype=float)
+    return sites, out
+
+
+def table_conditions(path: str | Path, site_col: str, columns: Optional[Sequence[str]] = None
+                     ) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """(sites, {column: values}) of a table with one value column per condition (-999 = no data)."""
+    df = pd.read_csv(path, sep="\t" if Path(path).suffix in (".tsv", ".txt") else ",")
+    columns = list(columns) if columns else [c for c in df.columns if c != site_col]
+    values = df[columns].apply(pd.to_numeric, errors="coerce").replace(-999, np.nan)
+    return df[site_col].to_numpy(), {c: values[c].to_numpy(dtype=float) for c in columns}
+
+
+def annotate(atoms: AtomTable, sites: np.ndarray, conditions: Dict[str, np.ndarray], out_dir: str | Path,
+             chain: str = "A", offset: int = 0, missing: float = 0.0) -> List[Tuple[str, int, Path]]:
+    """Write one annotated copy of `atoms` per condition; returns (label, mapped sites, path)."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    res_rows = atoms.site_index(sites, chain=chain, offset=offset)
+    written = []
+    for label, values in conditions.items():
+        b = atoms.residue_values(res_rows, values, missing=missing)
+        path = atoms.write(out_dir / f"{atoms.path.stem}_{label}{atoms.path.suffix}", b)
+        written.append((label, int(((res_rows >= 0) & np.isfinite(values)).sum()), path))
+    return written
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Write per-residue values of many conditions into B-factor columns.")
+    ap.add_argument("structure", type=Path, help="PDB (.pdb / .ent) or mmCIF (.cif) file")
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("--db", type=Path, help="nerd.sqlite: dG from probe_tc_fits_view")
+    src.add_argument("--values", type=Path, help="CSV / TSV with a site column and one column per condition")
+    ap.add_argument("--rg-ids", type=int, nargs="+", help="Reaction groups to fetch (--db)")
+    ap.add_argument("--fit-kind", default="round3_constrained")
+    ap.add_argument("--rt-protocol", default="MRT")
+    ap.add_argument("--bases", nargs="+", default=["A", "C"], help="Bases to color (--db)")
+    ap.add_argument("--min-r2", type=float, default=0.5, help="Drop fits with r2 <= this (--db)")
+    ap.add_argument("--ddg-ref", help="Also write ddG vs the condition with KEY=VALUE, KEY in "
+                                      f"{', '.join(CONDITION_KEYS)} (--db)")
+    ap.add_argument("--site-col", default="nt_site", help="Site column (--values)")
+    ap.add_argument("--columns", nargs="+", help="Condition columns (--values; default: all but the site column)")
+    ap.add_argument("--chain", default="A", help="Chain the sites belong to")
+    ap.add_argument("--offset", type=int, default=0, help="Residue number = site + offset")
+    ap.add_argument("--missing", type=float, default=0.0, help="B-factor of residues without a value")
+    ap.add_argument("--out-dir", type=Path, help="Output directory (default: next to the structure)")
+    args = ap.parse_args()
+
+    ddg_ref = None
+    if args.db:
+        if not args.rg_ids:
+            ap.error("--db needs --rg-ids")
+        if args.ddg_ref:
+            key, _, value = args.ddg_ref.partition("=")
+            if key not in CONDITION_KEYS or not value:
+                ap.error(f"--ddg-ref must be KEY=VALUE with KEY in {CONDITION_KEYS}")
+            ddg_ref = (key, value)
+
+    t0 = time.perf_counter()
+    atoms = AtomTable.read(args.structure)
+    print(f"{args.structure}: {atoms.n_atoms} atoms, {len(atoms.residues)} residues "
+          f"({time.perf_counter() - t0:.2f} s)")
+
+    if args.db:
+        sites, conditions = db_conditions(
+            fetch_site_dG(args.db, args.rg_ids, args.fit_kind, args.rt_protocol, args.bases, args.min_r2), ddg_ref
+        )
+    else:
+        sites, conditions = table_conditions(args.values, args.site_col, args.columns)
+
+    t0 = time.perf_counter()
+    written = annotate(atoms, sites, conditions, args.out_dir or args.structure.parent,
+                       chain=args.chain, offset=args.offset, missing=args.missing)
+    for label, n_sites, path in written:
+        print(f"{label}: {n_sites} sites -> {path}")
+    print(f"wrote {len(written)} structures in {time.perf_counter() - t0:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Core_nerd_analysis/04_run_mutcounts/mutcount_queue.py against the fake ShapeMapper in tests/stubs.
+
+Run with: python -m pytest -q tests
+"""
+
+import csv
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO = Path(__file__).resolve().parents[1]
+SCRIPT = REPO / "Core_nerd_analysis" / "04_run_mutcounts" / "mutcount_queue.py"
+STUB = REPO / "tests" / "stubs" / "shapemapper"
+
+RUN = "mut_count___cfg-abc1234"
+TARGET = "GGAAACCUUUCC"
+
+
+def write_sheet(path, rows):
+    fields = ("reaction_group", "sample_name", "r1", "r2", "target", "run_dir")
+    with open(path, "w", newline="") as fh:
+        writer = csv.DictWriter(fh, fieldnames=fields, delimiter="\t")
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({"r1": "in_R1.fastq.gz", "r2": "", "target": TARGET, "run_dir": "", **row})
+
+
+@pytest.fixture
+def workdir(tmp_path):
+    """Two reaction groups, their configs, a relative ./bin/shapemapper and a slurm log for group 1 only."""
+    (tmp_path / "bin").mkdir()
+    shutil.copy(STUB, tmp_path / "bin" / "shapemapper")
+    (tmp_path / "configs").mkdir()
+    for group in ("1", "2"):
+        (tmp_path / "configs" / f"mutcount_{group}.yaml").write_text(
+            f"mut_count:\n  reaction_group: '{group}'\n  params:\n    dms_mode: true\n    n_proc: 1\n"
+        )
+    (tmp_path / "mut_count" / RUN).mkdir(parents=True)
+    (tmp_path / "slurm_logs").mkdir()
+    (tmp_path / "slurm_logs" / "mutcount_1.100.out").write_text(f"... output_dir: mut_count/{RUN} ...\n")
+    (tmp_path / "groups.txt").write_text("1\n2\n")
+    return tmp_path
+
+
+def run_queue(workdir, *extra, env=None):
+    cmd = [
+        sys.executable, str(SCRIPT), "groups.txt", "--samples", "samples.tsv", "--configs", "configs",
+        "--mut-count", "mut_count", "--slurm-logs", "slurm_logs", "--bin", "./bin/shapemapper", "--cores", "2",
+        *extra,
+    ]
+    return subprocess.run(cmd, cwd=workdir, capture_output=True, text=True, env=env)
+
+
+def queue_log(workdir):
+    with open(workdir / "mut_count" / "queue_log.tsv", newline="") as fh:
+        return list(csv.DictReader(fh, delimiter="\t"))
+
+
+def test_run_resume_and_new_samples(workdir):
+    write_sheet(workdir / "samples.tsv", [
+        {"reaction_group": "1", "sample_name": "s1", "run_dir": RUN},
+        {"reaction_group": "1", "sample_name": "s2", "run_dir": RUN},
+        {"reaction_group": "2", "sample_name": "s3", "run_dir": "mut_count___cfg-def5678"},
+    ])
+    proc = run_queue(workdir)
+    assert proc.returncode == 0, proc.stdout + proc.stderr
+    assert "3 queued" in proc.stdout
+    assert [r["status"] for r in queue_log(workdir)] == ["done"] * 3
+    profile = workdir / "mut_count" / RUN / "artifacts" / "s1" / "s1_s1_profile.txtga"
+    assert len(profile.read_text().splitlines()) == len(TARGET) + 1
+
+    # complete samples are not requeued
+    proc = run_queue(workdir)
+    assert proc.returncode == 0 and "3 complete, 0 queued" in proc.stdout
+
+    # a new sequencing run: sample without run_dir goes to the group's run directory from the slurm logs
+    write_sheet(workdir / "samples.tsv", [
+        {"reaction_group": "1", "sample_name": "s1", "run_dir": RUN},
+        {"reaction_group": "1", "sample_name": "s2", "run_dir": RUN},
+        {"reaction_group": "1", "sample_name": "s4"},
+        {"reaction_group": "2", "sample_name": "s3", "run_dir": "mut_count___cfg-def5678"},
+    ])
+    proc = run_queue(workdir)
+    assert proc.returncode == 0, proc.stdout + proc.stderr
+    assert "3 complete, 1 queued" in proc.stdout
+    assert (workdir / "mut_count" / RUN / "artifacts" / "s4" / "s4_s4_profile.txt").exists()
+    assert len(queue_log(workdir)) == 4
+
+
+def test_missing_run_dir_is_an_error(workdir):
+    write_sheet(workdir / "samples.tsv", [{"reaction_group": "2", "sample_name": "s3"}])
+    proc = run_queue(workdir)
+    assert proc.returncode != 0
+    assert "No run directory for reaction group(s) 2" in proc.stderr
+
+
+def test_failed_sample_is_logged_and_retried(workdir):
+    write_sheet(workdir / "samples.tsv", [
+        {"reaction_group": "1", "sample_name": "s1", "run_dir": RUN},
+        {"reaction_group": "1", "sample_name": "s2", "run_dir": RUN},
+    ])
+    env = {**os.environ, "FAKE_SHAPEMAPPER_FAIL": "s2"}
+    proc = run_queue(workdir, env=env)
+    assert proc.returncode != 0 and "Failed samples" in proc.stderr
+    status = {r["sample_name"]: (r["status"], r["returncode"]) for r in queue_log(workdir)}
+    assert status == {"s1": ("done", "0"), "s2": ("failed", "1")}
+
+    proc = run_queue(workdir)
+    assert proc.returncode == 0 and "1 complete, 1 queued" in proc.stdout
@@ -0,0 +1,108 @@
+"""
+Figure_analysis/Figure3_EnergyValidation/4U_Energy_Correlations/NNensemble/partition_approach.py
+against the fake RNAstructure `partition` / `EnsembleEnergy` in tests/stubs.
+
+Run with: python -m pytest -q tests
+"""
+
+import csv
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO = Path(__file__).resolve().parents[1]
+SCRIPT = REPO / "Figure_analysis" / "Figure3_EnergyValidation" / "4U_Energy_Correlations" / "NNensemble" / "partition_approach.py"
+STUBS = REPO / "tests" / "stubs"
+
+SEQUENCE = "GGACAUCCGAAGCAC"
+AC_SITES = [i for i, base in enumerate(SEQUENCE, start=1) if base in "AC"]
+
+
+@pytest.fixture
+def workdir(tmp_path):
+    """A FASTA, a copy under another name, an empty --tmp-dir and the stub log / state paths."""
+    (tmp_path / "hp.fasta").write_text(f">hp\n{SEQUENCE[:8]}\n{SEQUENCE[8:]}\n")
+    (tmp_path / "hp_copy.fasta").write_text(f">hp copy\n{SEQUENCE}\n")
+    (tmp_path / "tmp").mkdir()
+    (tmp_path / "state").mkdir()
+    return tmp_path
+
+
+def run_partition(workdir, *args, fail=None):
+    env = {
+        **os.environ,
+        "PATH": f"{STUBS}{os.pathsep}{os.environ['PATH']}",
+        "FAKE_RNASTRUCTURE_LOG": str(workdir / "calls.log"),
+        "FAKE_RNASTRUCTURE_STATE": str(workdir / "state"),
+    }
+    if fail:
+        env["FAKE_RNASTRUCTURE_FAIL"] = fail
+    cmd = [sys.executable, str(SCRIPT), *args, "--tmp-dir", "tmp", "--cache", "cache.sqlite", "-j", "4"]
+    return subprocess.run(cmd, cwd=workdir, capture_output=True, text=True, env=env)
+
+
+def partition_calls(workdir):
+    log = workdir / "calls.log"
+    return log.read_text().splitlines() if log.exists() else []
+
+
+def read_csv(path):
+    with open(path, newline="") as fh:
+        return list(csv.DictReader(fh))
+
+
+def test_csv_in_sequence_order_and_cache_reuse(workdir):
+    proc = run_partition(workdir, "-i", "hp.fasta", "-t", "298.15", "-o", "out.csv")
+    assert proc.returncode == 0, proc.stdout + proc.stderr
+    rows = read_csv(workdir / "out.csv")
+    assert [int(r["site"]) for r in rows] == AC_SITES
+    assert [r["base"] for r in rows] == [SEQUENCE[i - 1] for i in AC_SITES]
+    assert [float(r["dG"]) for r in rows] == [round(i / 10, 2) for i in AC_SITES]
+    assert len(partition_calls(workdir)) == len(AC_SITES) + 1
+    assert not list((workdir / "tmp").iterdir())
+
+    # a re-run is served from the cache, also for a renamed FASTA of the same sequence
+    for fasta in ("hp.fasta", "hp_copy.fasta"):
+        proc = run_partition(workdir, "-i", fasta, "-t", "298.15", "-o", "again.csv")
+        assert proc.returncode == 0, proc.stdout + proc.stderr
+        assert "0 to run" in proc.stdout
+        assert read_csv(workdir / "again.csv") == rows
+    assert len(partition_calls(workdir)) == len(AC_SITES) + 1
+
+    # a new temperature only runs that temperature
+    proc = run_partition(workdir, "-i", "hp.fasta", "hp_copy.fasta", "-t", "298.15", "310.15", "-o", "sweep.csv")
+    assert proc.returncode == 0, proc.stdout + proc.stderr
+    assert f"{len(AC_SITES) + 1} to run" in proc.stdout
+    assert len(partition_calls(workdir)) == 2 * (len(AC_SITES) + 1)
+    sweep = read_csv(workdir / "sweep.csv")
+    assert [(r["name"], float(r["temperature"]), int(r["site"])) for r in sweep] == [
+        (name, t, site) for name in ("hp", "hp_copy") for t in (298.15, 310.15) for site in AC_SITES
+    ]
+    assert [float(r["dG"]) for r in sweep if r["temperature"] == "310.15"][:2] == [
+        round(i / 10 + 0.12, 2) for i in AC_SITES[:2]
+    ]
+
+
+@pytest.mark.parametrize("fail", ["partition", "EnsembleEnergy"])
+def test_failed_calls_are_retried(workdir, fail):
+    proc = run_partition(workdir, "-i", "hp.fasta", "-t", "298.15", "-o", "out.csv", "--retries", "1", fail=fail)
+    assert proc.returncode == 0, proc.stdout + proc.stderr
+    assert proc.stdout.count("Retrying position") == len(AC_SITES) + 1
+    assert [float(r["dG"]) for r in read_csv(workdir / "out.csv")] == [round(i / 10, 2) for i in AC_SITES]
+    assert len(partition_calls(workdir)) == 2 * (len(AC_SITES) + 1)
+    assert not list((workdir / "tmp").iterdir())
+
+
+def test_exhausted_retries_fail_without_csv(workdir):
+    proc = run_partition(workdir, "-i", "hp.fasta", "-t", "298.15", "-o", "out.csv", "--retries", "0", fail="partition")
+    assert proc.returncode != 0
+    assert "RNAstructure failed for position" in proc.stderr
+    assert not (workdir / "out.csv").exists()
+
+    # the markers now let every run through; nothing was cached by the failed sweep
+    proc = run_partition(workdir, "-i", "hp.fasta", "-t", "298.15", "-o", "out.csv", "--retries", "0", fail="partition")
+    assert proc.returncode == 0, proc.stdout + proc.stderr
+    assert f"0 cached, {len(AC_SITES) + 1} to run" in proc.stdout